@@ -0,0 +1,106 @@
+import os
+import random
+import tempfile
+import time
+from argparse import ArgumentParser
+
+from common import setup_django, write_results, summarize
+from fake_bot_api import make_message, make_user, start_server, server_url
+
+TOKEN = "123456:bench"
+BOT_ID = 123456
+
+
+def database_size(connection) -> int:
+    with connection.cursor() as cursor:
+        cursor.execute("VACUUM")
+        cursor.execute("PRAGMA page_count")
+        page_count = cursor.fetchone()[0]
+        cursor.execute("PRAGMA page_size")
+        return page_count * cursor.fetchone()[0]
+
+
+def directory_size(path: str) -> int:
+    return sum(os.path.getsize(os.path.join(root, name)) for root, _, files in os.walk(path) for name in files)
+
+
+def measure(func, requests: list[tuple[int, int]]) -> dict:
+    latencies = []
+    start = time.perf_counter()
+    for chat_id, before in requests:
+        request_start = time.perf_counter()
+        func(chat_id, before)
+        latencies.append(time.perf_counter() - request_start)
+    return summarize(latencies, time.perf_counter() - start)
+
+
+def main() -> None:
+    parser = ArgumentParser(description="Deep-history reads and database size before and after archiving.")
+    parser.add_argument("--chats", type=int, default=20, help="Chats to seed")
+    parser.add_argument("--messages", type=int, default=20000, help="Messages per chat")
+    parser.add_argument("--recent", type=int, default=500, help="Messages per chat newer than the archive threshold")
+    parser.add_argument("--reads", type=int, default=500, help="getMessages requests per measurement")
+    parser.add_argument("--limit", type=int, default=100, help="getMessages limit")
+    parser.add_argument("--output", help="Write results as JSON to this file")
+    args = parser.parse_args()
+
+    archive_dir = tempfile.mkdtemp(prefix="tg_proxy_archive_")
+    os.environ["ARCHIVE_DIR"] = archive_dir
+    server = start_server()
+    database = setup_django(api_url=server_url(server))
+
+    from django.db import connection
+    from django.test import Client
+    from proxy.archive import archive, archive_messages
+    from proxy.models import Message
+
+    now = int(time.time())
+    user = make_user(BOT_ID)
+
+    def seed_message(message_id: int, chat_id: int) -> Message:
+        message = make_message(message_id, chat_id, user, f"message {message_id} " * random.randint(1, 20))
+        message["date"] = now - (args.messages - message_id) * 60
+        if message_id <= args.messages - args.recent:
+            message["date"] -= 86400 * 30
+        return Message(message_id=message_id, **Message.fields_from_dict(BOT_ID, message))
+
+    for chat_index in range(args.chats):
+        chat_id = -1000000000000 - chat_index
+        for start in range(1, args.messages + 1, 1000):
+            Message.objects.bulk_create([seed_message(message_id, chat_id)
+                                         for message_id in range(start, min(start + 1000, args.messages + 1))])
+    chat_ids = [-1000000000000 - i for i in range(args.chats)]
+    deep = [(random.choice(chat_ids), random.randint(args.limit + 1, args.messages - args.recent))
+            for _ in range(args.reads)]
+
+    def read_hot(chat_id: int, before: int) -> list:
+        return list(Message.objects.filter(bot_id=BOT_ID, chat_id=chat_id, message_id__lt=before)
+                    .order_by("-message_id").values_list("serialized_message", flat=True)[:args.limit])
+
+    def read_archive(chat_id: int, before: int) -> list:
+        return archive.range(BOT_ID, chat_id, before, 0, args.limit)
+
+    client = Client()
+
+    def view(chat_id: int, before: int) -> None:
+        response = client.get(f"/bot{TOKEN}/getMessages?chat_id={chat_id}&before={before}&limit={args.limit}")
+        assert len(response.json()["result"]) == args.limit
+
+    results = {"database": database, "chats": args.chats, "messages_per_chat": args.messages,
+               "recent_per_chat": args.recent, "limit": args.limit}
+    results["before"] = {"database_bytes": database_size(connection), "deep_read": measure(read_hot, deep),
+                         "deep_view": measure(view, deep)}
+
+    start = time.perf_counter()
+    stats = archive_messages(7)
+    results["archive"] = {**stats, "elapsed_s": time.perf_counter() - start}
+
+    results["after"] = {"database_bytes": database_size(connection), "archive_bytes": directory_size(archive_dir),
+                        "deep_read": measure(read_archive, deep), "deep_view": measure(view, deep)}
+
+    server.shutdown()
+    write_results("archive", results, args.output)
+
+
+if __name__ == "__main__":
+    main()
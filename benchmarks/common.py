@@ -0,0 +1,82 @@
+import json
+import os
+import platform
+import subprocess
+import sys
+import tempfile
+import time
+from pathlib import Path
+from typing import Optional
+
+ROOT = Path(__file__).resolve().parent.parent
+PROJECT_DIR = ROOT / "tg_proxy"
+
+
+def setup_django(api_url: Optional[str] = None, database: Optional[str] = None,
+                 settings_overrides: Optional[dict] = None) -> str:
+    if str(PROJECT_DIR) not in sys.path:
+        sys.path.insert(0, str(PROJECT_DIR))
+    os.environ.setdefault("DJANGO_SETTINGS_MODULE", "tg_proxy.settings")
+    if api_url is not None:
+        os.environ["API_URL"] = api_url
+
+    if database is None:
+        database = temp_database()
+    os.environ["DATABASE_PATH"] = database
+
+    import django
+    from django.conf import settings
+    from django.core.management import call_command
+
+    settings.DEBUG = False
+    settings.ALLOWED_HOSTS = ["*"]
+    for name, value in (settings_overrides or {}).items():
+        setattr(settings, name, value)
+    django.setup()
+    call_command("migrate", verbosity=0)
+    return database
+
+
+def temp_database() -> str:
+    return os.path.join(tempfile.mkdtemp(prefix="tg_proxy_bench_"), "db.sqlite3")
+
+
+def percentile(values: list[float], pct: float) -> float:
+    if not values:
+        return 0.0
+    values = sorted(values)
+    return values[min(len(values) - 1, int(round(pct / 100 * (len(values) - 1))))]
+
+
+def summarize(latencies: list[float], elapsed: float) -> dict:
+    return {
+        "count": len(latencies),
+        "elapsed_s": elapsed,
+        "throughput_rps": len(latencies) / elapsed if elapsed else 0.0,
+        "mean_ms": sum(latencies) / len(latencies) * 1000 if latencies else 0.0,
+        "p50_ms": percentile(latencies, 50) * 1000,
+        "p99_ms": percentile(latencies, 99) * 1000,
+    }
+
+
+def _git_revision() -> Optional[str]:
+    try:
+        return subprocess.check_output(["git", "rev-parse", "HEAD"], cwd=ROOT, stderr=subprocess.DEVNULL,
+                                       text=True).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def write_results(benchmark: str, results: dict, output: Optional[str]) -> None:
+    report = {
+        "benchmark": benchmark,
+        "timestamp": time.time(),
+        "git_revision": _git_revision(),
+        "python": sys.version.split()[0],
+        "platform": platform.platform(),
+        "results": results,
+    }
+    text = json.dumps(report, indent=2)
+    print(text)
+    if output:
+        Path(output).write_text(text)
@@ -0,0 +1,146 @@
+import json
+import time
+from argparse import ArgumentParser
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from itertools import count
+from threading import Thread, Lock
+from urllib.parse import urlparse, parse_qs
+
+BOT = {"id": 123456, "is_bot": True, "first_name": "Bot", "username": "bench_bot"}
+
+
+def make_user(user_id: int) -> dict:
+    return {"id": user_id, "is_bot": False, "first_name": f"User {user_id}", "last_name": "Bench",
+            "username": f"user{user_id}", "language_code": "en"}
+
+
+def make_chat(chat_id: int) -> dict:
+    if chat_id > 0:
+        return {"id": chat_id, "type": "private", "first_name": f"User {chat_id}", "username": f"user{chat_id}"}
+    return {"id": chat_id, "type": "supergroup", "title": f"Group {-chat_id}", "username": f"group{-chat_id}"}
+
+
+def make_message(message_id: int, chat_id: int, from_user: dict, text: str) -> dict:
+    return {
+        "message_id": message_id,
+        "from": from_user,
+        "chat": make_chat(chat_id),
+        "date": int(time.time()),
+        "text": text,
+        "entities": [{"type": "bold", "offset": 0, "length": min(len(text), 5)}],
+    }
+
+
+class FakeBotApi:
+    def __init__(self, latency: float = 0.0, updates: int = 100, chats: int = 20):
+        self.latency = latency
+        self.updates = updates
+        self.chats = chats
+        self._message_ids = count(1)
+        self._update_ids = count(1)
+        self._lock = Lock()
+
+    def _next_message_id(self) -> int:
+        with self._lock:
+            return next(self._message_ids)
+
+    def _chat_id(self, n: int) -> int:
+        return 1000 + n if n % 2 else -(1000 + n)
+
+    def getMe(self, params: dict) -> dict:
+        return BOT
+
+    def getUpdates(self, params: dict) -> list:
+        limit = min(int(params.get("limit", self.updates)), self.updates)
+        result = []
+        for i in range(limit):
+            chat_id = self._chat_id(i % self.chats)
+            with self._lock:
+                update_id = next(self._update_ids)
+            message = make_message(self._next_message_id(), chat_id, make_user(abs(chat_id)), f"update {update_id}")
+            if i % 5 == 0:
+                message["reply_to_message"] = make_message(max(message["message_id"] - 1, 1), chat_id, BOT, "reply")
+            result.append({"update_id": update_id, "message": message})
+        return result
+
+    def sendMessage(self, params: dict) -> dict:
+        return make_message(self._next_message_id(), int(params.get("chat_id", 1)), BOT, params.get("text", "test"))
+
+    def getChat(self, params: dict) -> dict:
+        chat = make_chat(int(params.get("chat_id", 1)))
+        chat["description"] = "Fake chat returned by the benchmark server"
+        return chat
+
+    def handle(self, method: str, params: dict) -> tuple[int, dict]:
+        if self.latency:
+            time.sleep(self.latency)
+        if (func := getattr(self, method, None)) is None or method.startswith("_"):
+            return 404, {"ok": False, "error_code": 404, "description": "Not Found"}
+        return 200, {"ok": True, "result": func(params)}
+
+
+def make_handler(api: FakeBotApi) -> type:
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"
+        disable_nagle_algorithm = True
+
+        def _respond(self) -> None:
+            url = urlparse(self.path)
+            params = {key: value[-1] for key, value in parse_qs(url.query).items()}
+            if length := int(self.headers.get("Content-Length") or 0):
+                body = self.rfile.read(length)
+                if self.headers.get("Content-Type", "").startswith("application/json"):
+                    params.update(json.loads(body or b"{}"))
+                else:
+                    params.update({key: value[-1] for key, value in parse_qs(body.decode()).items()})
+            parts = url.path.strip("/").split("/")
+            if len(parts) != 2 or not parts[0].startswith("bot"):
+                status, response = 404, {"ok": False, "error_code": 404, "description": "Not Found"}
+            else:
+                status, response = api.handle(parts[1], params)
+            body = json.dumps(response).encode()
+            self.send_response(status)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        do_GET = _respond
+        do_POST = _respond
+
+        def log_message(self, format: str, *args) -> None:
+            pass
+
+    return Handler
+
+
+def start_server(host: str = "127.0.0.1", port: int = 0, **kwargs) -> ThreadingHTTPServer:
+    server = ThreadingHTTPServer((host, port), make_handler(FakeBotApi(**kwargs)))
+    server.daemon_threads = True
+    Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+def server_url(server: ThreadingHTTPServer) -> str:
+    host, port = server.server_address[:2]
+    return f"http://{host}:{port}"
+
+
+def main() -> None:
+    parser = ArgumentParser(description="Local fake Telegram Bot API server for benchmarks.")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8081)
+    parser.add_argument("--latency", type=float, default=0.0, help="Artificial latency per request, in milliseconds")
+    parser.add_argument("--updates", type=int, default=100, help="Updates returned by getUpdates")
+    parser.add_argument("--chats", type=int, default=20, help="Number of distinct chats in generated updates")
+    args = parser.parse_args()
+
+    server = ThreadingHTTPServer((args.host, args.port), make_handler(
+        FakeBotApi(latency=args.latency / 1000, updates=args.updates, chats=args.chats)
+    ))
+    print(f"Fake Bot API listening on http://{args.host}:{args.port}, use API_URL=http://{args.host}:{args.port}")
+    server.serve_forever()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,74 @@
+import json
+import os
+import random
+import subprocess
+import sys
+import tempfile
+import time
+from argparse import ArgumentParser
+from contextlib import nullcontext
+
+from common import setup_django, write_results
+from fake_bot_api import make_message, make_user
+
+BOT_ID = 123456
+MODES = ("default", "defer_indexes")
+
+
+def write_dump(path: str, updates: int, chats: int, users: int) -> None:
+    random.seed(1)
+    user_dicts = [make_user(1000 + i) for i in range(users)]
+    message_ids = [0] * chats
+    with open(path, "w") as file:
+        for update_id in range(updates):
+            chat_index = random.randrange(chats)
+            message_ids[chat_index] += 1
+            message = make_message(message_ids[chat_index], -1000000000000 - chat_index, random.choice(user_dicts),
+                                   f"message {update_id} " * random.randint(1, 10))
+            file.write(json.dumps({"update_id": update_id, "message": message}) + "\n")
+
+
+def run_mode(args) -> dict:
+    setup_django()
+
+    from proxy.importer import HistoryImporter, deferred_message_indexes
+
+    importer = HistoryImporter(BOT_ID, args.batch_size, workers=args.workers)
+    start = time.perf_counter()
+    with deferred_message_indexes(BOT_ID) if args.mode == "defer_indexes" else nullcontext():
+        stats = importer.import_file(args.dump)
+    elapsed = time.perf_counter() - start
+    return {**stats, "elapsed_s": elapsed, "messages_per_s": stats["messages"] / elapsed}
+
+
+def main() -> None:
+    parser = ArgumentParser(description="importhistory throughput on a generated Bot API update dump.")
+    parser.add_argument("--mode", choices=MODES, help="Run a single configuration (default: compare all)")
+    parser.add_argument("--updates", type=int, default=500000, help="Updates (messages) in the dump")
+    parser.add_argument("--chats", type=int, default=200, help="Chats to spread messages over")
+    parser.add_argument("--users", type=int, default=2000, help="Distinct senders")
+    parser.add_argument("--batch-size", type=int, default=20000, help="Items written per transaction")
+    parser.add_argument("--workers", type=int, default=1, help="Parsing processes")
+    parser.add_argument("--dump", help="Existing dump to import instead of generating one")
+    parser.add_argument("--output", help="Write results as JSON to this file")
+    args = parser.parse_args()
+
+    if args.mode is not None:
+        print(json.dumps(run_mode(args)))
+        return
+
+    if args.dump is None:
+        args.dump = os.path.join(tempfile.mkdtemp(prefix="tg_proxy_import_"), "updates.jsonl")
+        write_dump(args.dump, args.updates, args.chats, args.users)
+    results = {"updates": args.updates, "batch_size": args.batch_size, "workers": args.workers,
+               "cpus": os.cpu_count()}
+    for mode in MODES:
+        # Each configuration imports into a fresh process and database
+        output = subprocess.check_output([sys.executable, __file__, *sys.argv[1:], "--mode", mode, "--dump",
+                                          args.dump], text=True)
+        results[mode] = json.loads(output.strip().splitlines()[-1])
+    write_results("importer", results, args.output)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,126 @@
+import asyncio
+import os
+import random
+import shutil
+import subprocess
+import sys
+import time
+from argparse import ArgumentParser
+from typing import Optional
+
+import httpx
+
+from common import PROJECT_DIR, summarize, temp_database, write_results
+from fake_bot_api import start_server, server_url
+
+TOKEN = "123456:bench"
+SERVERS = {
+    "wsgi": ["gunicorn", "tg_proxy.wsgi:application", "--workers", "{workers}", "--threads", "8",
+             "--bind", "127.0.0.1:{port}"],
+    "asgi": ["uvicorn", "tg_proxy.asgi:application", "--workers", "{workers}", "--port", "{port}",
+             "--log-level", "warning"],
+    "runserver": [sys.executable, "manage.py", "runserver", "--noreload", "127.0.0.1:{port}"],
+}
+MIX = (("getMessages", 40), ("getMessage", 30), ("sendMessage", 20), ("getChats", 10))
+
+
+def start_proxy(kind: str, port: int, workers: int, env: dict) -> subprocess.Popen:
+    command = [part.format(port=port, workers=workers) for part in SERVERS[kind]]
+    if shutil.which(command[0]) is None:
+        raise SystemExit(f"{command[0]} is not installed, can't benchmark the {kind} deployment")
+    subprocess.run([sys.executable, "manage.py", "migrate", "--verbosity", "0"], cwd=PROJECT_DIR, env=env, check=True)
+    return subprocess.Popen(command, cwd=PROJECT_DIR, env=env, stdout=subprocess.DEVNULL)
+
+
+def wait_ready(target: str, timeout: float = 30) -> None:
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        try:
+            httpx.get(f"{target}/metrics", timeout=1)
+            return
+        except httpx.HTTPError:
+            time.sleep(0.2)
+    raise SystemExit(f"Server at {target} did not start in {timeout} seconds")
+
+
+def make_url(method: str, chats: int, max_message_id: int) -> str:
+    chat_id = 1000 + random.randrange(chats)
+    if method == "getMessages":
+        return f"/bot{TOKEN}/getMessages?chat_id={chat_id}&limit=50"
+    if method == "getMessage":
+        return f"/bot{TOKEN}/getMessage?message_id={random.randint(1, max_message_id)}"
+    if method == "sendMessage":
+        return f"/bot{TOKEN}/sendMessage?chat_id={chat_id}&text=load"
+    return f"/bot{TOKEN}/getChats?limit=100"
+
+
+async def run_load(target: str, concurrency: int, duration: float, chats: int, seed: int) -> dict:
+    per_method: dict[str, list[float]] = {method: [] for method, _ in MIX}
+    statuses: dict[int, int] = {}
+    methods, weights = zip(*MIX)
+    limits = httpx.Limits(max_connections=concurrency, max_keepalive_connections=concurrency)
+
+    async with httpx.AsyncClient(base_url=target, limits=limits, timeout=60) as client:
+        for i in range(seed):
+            await client.get(f"/bot{TOKEN}/sendMessage?chat_id={1000 + i % chats}&text=seed")
+
+        deadline = time.monotonic() + duration
+
+        async def worker() -> None:
+            while time.monotonic() < deadline:
+                method = random.choices(methods, weights)[0]
+                start = time.perf_counter()
+                try:
+                    resp = await client.get(make_url(method, chats, seed))
+                    statuses[resp.status_code] = statuses.get(resp.status_code, 0) + 1
+                except httpx.HTTPError:
+                    statuses[0] = statuses.get(0, 0) + 1
+                per_method[method].append(time.perf_counter() - start)
+
+        start = time.monotonic()
+        await asyncio.gather(*[worker() for _ in range(concurrency)])
+        elapsed = time.monotonic() - start
+
+    results = summarize([latency for values in per_method.values() for latency in values], elapsed)
+    results["statuses"] = {str(status): count for status, count in statuses.items()}
+    results["methods"] = {method: summarize(values, elapsed) for method, values in per_method.items()}
+    return results
+
+
+def main() -> None:
+    parser = ArgumentParser(description="Load generator for tg_proxy deployments.")
+    parser.add_argument("--server", choices=[*SERVERS, "external"], default="wsgi",
+                        help="Deployment to start, or 'external' to use an already running server at --target")
+    parser.add_argument("--target", default=None, help="Url of the server under test (for --server external)")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--workers", type=int, default=4)
+    parser.add_argument("--concurrency", type=int, default=32)
+    parser.add_argument("--duration", type=float, default=30, help="Load duration in seconds")
+    parser.add_argument("--latency", type=float, default=50, help="Fake Bot API latency in milliseconds")
+    parser.add_argument("--chats", type=int, default=20)
+    parser.add_argument("--seed", type=int, default=200, help="Messages sent before the measurement")
+    parser.add_argument("--output", help="Write results as JSON to this file")
+    args = parser.parse_args()
+
+    upstream = start_server(latency=args.latency / 1000)
+    proxy: Optional[subprocess.Popen] = None
+    target = args.target or f"http://127.0.0.1:{args.port}"
+    if args.server != "external":
+        env = dict(os.environ, API_URL=server_url(upstream), DATABASE_PATH=temp_database())
+        proxy = start_proxy(args.server, args.port, args.workers, env)
+    try:
+        wait_ready(target)
+        results = asyncio.run(run_load(target, args.concurrency, args.duration, args.chats, args.seed))
+    finally:
+        if proxy is not None:
+            proxy.terminate()
+            proxy.wait()
+        upstream.shutdown()
+
+    results.update({"server": args.server, "workers": args.workers, "concurrency": args.concurrency,
+                    "upstream_latency_ms": args.latency})
+    write_results(f"load-{args.server}", results, args.output)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,118 @@
+import re
+import time
+from argparse import ArgumentParser
+from datetime import datetime
+
+from common import setup_django, write_results
+from fake_bot_api import FakeBotApi, start_server, server_url
+
+TOKEN = "123456:bench"
+BOT_ID = 123456
+UPSERTS_REGEX = re.compile(r'^tg_proxy_upserts_total\{model="(\w+)",result="(\w+)"} (\S+)$')
+
+
+def bench(func, number: int, repeat: int = 5) -> dict:
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        for _ in range(number):
+            func()
+        timings.append((time.perf_counter() - start) / number)
+    return {"number": number, "repeat": repeat, "best_us": min(timings) * 1e6,
+            "mean_us": sum(timings) / len(timings) * 1e6}
+
+
+def upsert_counts() -> dict:
+    from proxy.metrics import registry
+
+    counts = {}
+    for line in registry.render().splitlines():
+        if match := UPSERTS_REGEX.match(line):
+            counts[(match.group(1), match.group(2))] = float(match.group(3))
+    return counts
+
+
+def make_pyrogram_message(message_id: int):
+    from pyrogram import enums, types
+
+    chat = types.Chat(id=777000, type=enums.ChatType.PRIVATE, first_name="Telegram", username="telegram")
+    user = types.User(id=BOT_ID, is_bot=True, first_name="Bot", username="bench_bot")
+    document = types.Document(file_id="BQACAgIAAxkDAAI", file_unique_id="AgAD", file_name="file.bin",
+                              mime_type="application/octet-stream", file_size=200 * 1024 * 1024)
+    return types.Message(id=message_id, from_user=user, chat=chat, date=datetime.now(), caption="caption",
+                         document=document, media=enums.MessageMediaType.DOCUMENT)
+
+
+def main() -> None:
+    parser = ArgumentParser(description="Microbenchmarks of tg_proxy hot paths.")
+    parser.add_argument("--number", type=int, default=200, help="Iterations per repeat")
+    parser.add_argument("--updates", type=int, default=100, help="Updates per getUpdates payload")
+    parser.add_argument("--payloads", type=int, default=20, help="getUpdates payloads for the upsert skip ratio")
+    parser.add_argument("--output", help="Write results as JSON to this file")
+    args = parser.parse_args()
+
+    server = start_server(updates=args.updates)
+    database = setup_django(api_url=server_url(server))
+
+    from django.test import Client
+    from proxy import pydantic_models
+    from proxy.models import Message, Chat, User
+    from proxy.mtproto import MessageUtils
+    from proxy.utils import find_dict
+
+    api = FakeBotApi(updates=args.updates)
+    payload = {"ok": True, "result": api.getUpdates({})}
+    results = {"database": database, "updates_per_payload": args.updates}
+
+    def extract() -> dict:
+        found = {}
+        find_dict(payload, found, pydantic_models.Message, pydantic_models.Chat, pydantic_models.User)
+        return found
+
+    results["find_dict"] = bench(extract, max(args.number // 10, 1))
+    found = extract()
+
+    def upsert() -> None:
+        for model, pydantic_model, id_field in ((Message, pydantic_models.Message, "message_id"),
+                                                (Chat, pydantic_models.Chat, "id"), (User, pydantic_models.User, "id")):
+            model.update_or_create_objects(id_field, BOT_ID, found[pydantic_model],
+                                           lambda d: model.fields_from_dict(BOT_ID, d))
+
+    results["update_or_create_objects"] = bench(upsert, max(args.number // 20, 1))
+    results["update_or_create_objects"]["rows"] = sum(len(dicts) for dicts in found.values())
+
+    # Fresh getUpdates payloads: new messages from a recurring set of group chats and users
+    before = upsert_counts()
+    for _ in range(args.payloads):
+        payload = {"ok": True, "result": api.getUpdates({})}
+        found = extract()
+        upsert()
+    counts = {}
+    for (model, result), count in upsert_counts().items():
+        counts.setdefault(model, {})[result] = count - before.get((model, result), 0)
+    results["upsert_skip"] = {"payloads": args.payloads}
+    for model, model_counts in counts.items():
+        total = sum(model_counts.values())
+        results["upsert_skip"][model] = {**model_counts,
+                                         "skip_ratio": (total - model_counts.get("written", 0)) / total if total else 0}
+
+    client = Client()
+    message = Message.objects.filter(bot_id=BOT_ID).first()
+    user = User.objects.first()
+    for name, url in (
+            ("getMessage", f"/bot{TOKEN}/getMessage?message_id={message.message_id}"),
+            ("getMessages", f"/bot{TOKEN}/getMessages?chat_id={message.chat_id}"),
+            ("getChats", f"/bot{TOKEN}/getChats"),
+            ("getUser", f"/bot{TOKEN}/getUser?user_id={user.id}"),
+    ):
+        results[f"view_{name}"] = bench(lambda: client.get(url), args.number)
+
+    message = make_pyrogram_message(1)
+    results["MessageUtils.to_json"] = bench(lambda: MessageUtils(message).to_json("document"), args.number * 10)
+
+    server.shutdown()
+    write_results("micro", results, args.output)
+
+
+if __name__ == "__main__":
+    main()
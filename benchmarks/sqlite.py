@@ -0,0 +1,113 @@
+import json
+import os
+import random
+import subprocess
+import sys
+import threading
+import time
+from argparse import ArgumentParser
+
+from common import setup_django, write_results, summarize
+from fake_bot_api import make_message, make_user
+
+BOT_ID = 123456
+MODES = ("default", "production")
+
+
+def run_mode(args) -> dict:
+    overrides = {}
+    if args.mode == "default":
+        # The configuration before the SQLite production settings were introduced
+        os.environ["CONN_MAX_AGE"] = "0"
+        os.environ["SERIALIZED_WRITES"] = "false"
+        overrides["TG_SQLITE_PRAGMAS"] = {}
+    database = setup_django(settings_overrides=overrides)
+
+    from django.db import close_old_connections, connection
+    from proxy.models import Message
+
+    chat_ids = [-1000000000000 - i for i in range(args.chats)]
+    user = make_user(BOT_ID)
+    next_message_id = {chat_id: args.seed + 1 for chat_id in chat_ids}
+    lock = threading.Lock()
+    for chat_id in chat_ids:
+        Message.update_or_create_objects("message_id", BOT_ID,
+                                         [make_message(i, chat_id, user, "seed") for i in range(1, args.seed + 1)],
+                                         lambda d: Message.fields_from_dict(BOT_ID, d))
+
+    def read() -> None:
+        list(Message.objects.filter(bot_id=BOT_ID, chat_id=random.choice(chat_ids))
+             .order_by("-message_id").values_list("serialized_message", flat=True)[:100])
+
+    def write() -> None:
+        chat_id = random.choice(chat_ids)
+        with lock:
+            message_id = next_message_id[chat_id]
+            next_message_id[chat_id] += 1
+        # A new message and an edit of an existing one, like a typical getUpdates payload
+        messages = [make_message(message_id, chat_id, user, "new"),
+                    make_message(random.randint(1, message_id), chat_id, user, "edited")]
+        Message.update_or_create_objects("message_id", BOT_ID, messages,
+                                         lambda d: Message.fields_from_dict(BOT_ID, d))
+
+    latencies = {"read": [], "write": []}
+    errors = {"read": 0, "write": 0}
+    deadline = time.perf_counter() + args.duration
+
+    def worker(kind: str, func) -> None:
+        while time.perf_counter() < deadline:
+            start = time.perf_counter()
+            try:
+                func()
+            except Exception:
+                errors[kind] += 1
+            else:
+                latencies[kind].append(time.perf_counter() - start)
+            # End of a "request", closes or keeps the connection according to CONN_MAX_AGE
+            close_old_connections()
+
+    threads = [threading.Thread(target=worker, args=("read", read)) for _ in range(args.readers)] + \
+              [threading.Thread(target=worker, args=("write", write)) for _ in range(args.writers)]
+    start = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = time.perf_counter() - start
+
+    with connection.cursor() as cursor:
+        cursor.execute("PRAGMA journal_mode")
+        journal_mode = cursor.fetchone()[0]
+    return {
+        "database": database,
+        "journal_mode": journal_mode,
+        "read": {**summarize(latencies["read"], elapsed), "errors": errors["read"]},
+        "write": {**summarize(latencies["write"], elapsed), "errors": errors["write"]},
+    }
+
+
+def main() -> None:
+    parser = ArgumentParser(description="Concurrent read/write throughput of the SQLite cache.")
+    parser.add_argument("--mode", choices=MODES, help="Run a single configuration (default: compare both)")
+    parser.add_argument("--readers", type=int, default=8, help="Reader threads")
+    parser.add_argument("--writers", type=int, default=8, help="Writer threads")
+    parser.add_argument("--duration", type=float, default=10, help="Seconds to run each configuration")
+    parser.add_argument("--chats", type=int, default=20, help="Chats to spread messages over")
+    parser.add_argument("--seed", type=int, default=500, help="Messages per chat before the run")
+    parser.add_argument("--output", help="Write results as JSON to this file")
+    args = parser.parse_args()
+
+    if args.mode is not None:
+        print(json.dumps(run_mode(args)))
+        return
+
+    results = {"readers": args.readers, "writers": args.writers, "duration_s": args.duration}
+    for mode in MODES:
+        # Each configuration runs in a fresh process and database
+        output = subprocess.check_output([sys.executable, __file__, "--mode", mode, *sys.argv[1:]], text=True)
+        results[mode] = json.loads(output.strip().splitlines()[-1])
+    write_results("sqlite", results, args.output)
+
+
+if __name__ == "__main__":
+    main()
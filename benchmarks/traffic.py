@@ -0,0 +1,123 @@
+import asyncio
+import json
+import time
+from argparse import ArgumentParser
+from base64 import b64encode, b64decode
+from io import BytesIO
+from threading import Lock
+from wsgiref.simple_server import make_server, WSGIServer
+from socketserver import ThreadingMixIn
+
+import httpx
+
+from common import setup_django, summarize, write_results
+
+
+class RecordingMiddleware:
+    def __init__(self, app, output: str):
+        self.app = app
+        self._file = open(output, "a", buffering=1)
+        self._lock = Lock()
+        self._start = time.monotonic()
+
+    def __call__(self, environ: dict, start_response):
+        length = int(environ.get("CONTENT_LENGTH") or 0)
+        body = environ["wsgi.input"].read(length) if length else b""
+        environ["wsgi.input"] = BytesIO(body)
+        record = {
+            "t": time.monotonic() - self._start,
+            "method": environ["REQUEST_METHOD"],
+            "path": environ.get("PATH_INFO", "/"),
+            "query": environ.get("QUERY_STRING", ""),
+            "content_type": environ.get("CONTENT_TYPE", ""),
+            "body": b64encode(body).decode(),
+        }
+        with self._lock:
+            self._file.write(json.dumps(record) + "\n")
+        return self.app(environ, start_response)
+
+
+class ThreadingWSGIServer(ThreadingMixIn, WSGIServer):
+    daemon_threads = True
+
+
+def record(args) -> None:
+    setup_django(api_url=args.api_url, database=args.database)
+    from django.urls import get_resolver
+    from tg_proxy.wsgi import application
+
+    get_resolver().url_patterns  # Import views in the main thread, pyrogram needs an event loop on import
+    server = make_server(args.host, args.port, RecordingMiddleware(application, args.output),
+                         server_class=ThreadingWSGIServer)
+    print(f"Recording traffic to {args.output}, proxy listening on http://{args.host}:{args.port}")
+    server.serve_forever()
+
+
+async def replay_requests(records: list[dict], target: str, concurrency: int, speed: float) -> tuple[list, int, float]:
+    latencies = []
+    errors = 0
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def send(client: httpx.AsyncClient, rec: dict, start: float) -> None:
+        nonlocal errors
+        if speed > 0:
+            await asyncio.sleep(max(0.0, start + rec["t"] / speed - time.monotonic()))
+        async with semaphore:
+            req_start = time.perf_counter()
+            try:
+                resp = await client.request(
+                    rec["method"], f"{target}{rec['path']}" + (f"?{rec['query']}" if rec["query"] else ""),
+                    content=b64decode(rec["body"]),
+                    headers={"Content-Type": rec["content_type"]} if rec["content_type"] else None,
+                )
+                if resp.status_code >= 500:
+                    errors += 1
+            except httpx.HTTPError:
+                errors += 1
+            latencies.append(time.perf_counter() - req_start)
+
+    limits = httpx.Limits(max_connections=concurrency, max_keepalive_connections=concurrency)
+    async with httpx.AsyncClient(limits=limits, timeout=60) as client:
+        start = time.monotonic()
+        await asyncio.gather(*[send(client, rec, start) for rec in records])
+        return latencies, errors, time.monotonic() - start
+
+
+def replay(args) -> None:
+    with open(args.input) as f:
+        records = [json.loads(line) for line in f if line.strip()]
+    records.sort(key=lambda rec: rec["t"])
+    latencies, errors, elapsed = asyncio.run(replay_requests(records, args.target.rstrip("/"), args.concurrency,
+                                                             args.speed))
+    results = summarize(latencies, elapsed)
+    results.update({"target": args.target, "errors": errors, "speed": args.speed, "concurrency": args.concurrency})
+    write_results("replay", results, args.output)
+
+
+def main() -> None:
+    parser = ArgumentParser(description="Record tg_proxy traffic to JSONL and replay it.")
+    sub = parser.add_subparsers(dest="command", required=True)
+
+    rec = sub.add_parser("record", help="Run the proxy behind a recording WSGI server")
+    rec.add_argument("--host", default="127.0.0.1")
+    rec.add_argument("--port", type=int, default=8000)
+    rec.add_argument("--api-url", default=None, help="Upstream Bot API url (defaults to settings.TG_API_URL)")
+    rec.add_argument("--database", default=None, help="SQLite database path (defaults to a temporary database)")
+    rec.add_argument("--output", default="traffic.jsonl")
+    rec.set_defaults(func=record)
+
+    rep = sub.add_parser("replay", help="Replay recorded traffic against a running server")
+    rep.add_argument("--input", default="traffic.jsonl")
+    rep.add_argument("--target", default="http://127.0.0.1:8000")
+    rep.add_argument("--concurrency", type=int, default=32)
+    rep.add_argument("--speed", type=float, default=0.0,
+                     help="Replay speed relative to the recording, 0 sends requests as fast as possible")
+    rep.add_argument("--output", help="Write results as JSON to this file")
+    rep.set_defaults(func=replay)
+
+    args = parser.parse_args()
+    args.func(args)
+
+
+if __name__ == "__main__":
+    main()
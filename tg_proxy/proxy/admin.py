@@ -1,9 +1,30 @@
 from django.contrib import admin
+from django.utils.html import format_html
 
-from .models import User, Message, Chat, Webhook, BotSession
+from .models import User, Message, Chat, Webhook, BotSession, BotShard, ProfilingSettings, RequestProfile
 
 admin.site.register(User)
 admin.site.register(Message)
 admin.site.register(Chat)
 admin.site.register(Webhook)
 admin.site.register(BotSession)
+admin.site.register(ProfilingSettings)
+
+
+@admin.register(BotShard)
+class BotShardAdmin(admin.ModelAdmin):
+    # Placements are changed with the "rebalancebot" command, which also moves the data
+    list_display = ("bot_id", "database")
+    readonly_fields = ("bot_id", "database")
+
+
+@admin.register(RequestProfile)
+class RequestProfileAdmin(admin.ModelAdmin):
+    list_display = ("id", "created_at", "bot_id", "method", "duration_ms", "downloads")
+    list_filter = ("method",)
+    exclude = ("samples",)
+
+    @admin.display(description="Download")
+    def downloads(self, obj: RequestProfile) -> str:
+        return format_html('<a href="/profiles/{0}.speedscope">speedscope</a> | <a href="/profiles/{0}.pstats">pstats</a>'
+                           ' | <a href="/profiles/{0}.queries">queries</a>', obj.id)
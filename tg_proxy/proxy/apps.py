@@ -1,6 +1,18 @@
 from django.apps import AppConfig
+from django.conf import settings
 
 
 class ProxyConfig(AppConfig):
     default_auto_field = "django.db.models.BigAutoField"
     name = "proxy"
+
+    def ready(self) -> None:
+        from django.db.backends.signals import connection_created
+        from .db import configure_sqlite, install_query_observer
+
+        connection_created.connect(configure_sqlite)
+        connection_created.connect(install_query_observer)
+        if interval := getattr(settings, "TG_COMPACTION_INTERVAL", None):
+            from .maintenance import start_compaction_scheduler
+
+            start_compaction_scheduler(interval)
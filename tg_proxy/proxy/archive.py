@@ -0,0 +1,291 @@
+"""
+The MIT License (MIT)
+
+Copyright (c) 2023-present RuslanUC
+
+Permission is hereby granted, free of charge, to any person obtaining a
+copy of this software and associated documentation files (the "Software"),
+to deal in the Software without restriction, including without limitation
+the rights to use, copy, modify, merge, publish, distribute, sublicense,
+and/or sell copies of the Software, and to permit persons to whom the
+Software is furnished to do so, subject to the following conditions:
+
+The above copyright notice and this permission notice shall be included in
+all copies or substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS
+OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING
+FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER
+DEALINGS IN THE SOFTWARE.
+"""
+
+# Segment file layout:
+#   blocks:  zlib-compressed runs of records, each record is <message_id: q><length: I><serialized message>
+#   index:   one <first_id: q><last_id: q><offset: Q><length: I> entry per block
+#   footer:  <index_offset: Q><block_count: I><MAGIC>
+
+import heapq
+import mmap
+import os
+import zlib
+from bisect import bisect_right
+from collections import OrderedDict
+from functools import lru_cache
+from json import loads
+from pathlib import Path
+from struct import Struct
+from threading import Lock
+from time import time, time_ns
+from typing import Callable, Iterator, Optional, Iterable
+
+from django.conf import settings
+from django.db import transaction
+
+from proxy.models import Message
+
+MAGIC = b"TGSEG1\n"
+RECORD = Struct("<qI")
+INDEX_ENTRY = Struct("<qqQI")
+FOOTER = Struct("<QI")
+BLOCK_SIZE = 64 * 1024
+
+
+def archive_dir() -> Path:
+    return Path(getattr(settings, "TG_ARCHIVE_DIR", settings.BASE_DIR / "archive"))
+
+
+def segment_path(chat_dir: Path, dates: list[int]) -> Path:
+    # Names only have to be unique, the date range lets retention skip segments without reading them
+    return chat_dir / f"{min(dates)}-{max(dates)}-{time_ns()}.seg"
+
+
+def segment_dates(path: Path) -> Optional[tuple[int, int]]:
+    parts = path.stem.split("-")
+    if len(parts) != 3:
+        return None
+    return int(parts[0]), int(parts[1])
+
+
+def message_date(data: str) -> int:
+    return loads(data).get("date") or 0
+
+
+class Segment:
+    def __init__(self, path: Path):
+        self.path = path
+        with open(path, "rb") as f:
+            self._mmap = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        footer_start = len(self._mmap) - FOOTER.size - len(MAGIC)
+        if self._mmap[footer_start + FOOTER.size:] != MAGIC:
+            raise ValueError(f"{path} is not a message segment file")
+        index_offset, block_count = FOOTER.unpack_from(self._mmap, footer_start)
+        self.index = [INDEX_ENTRY.unpack_from(self._mmap, index_offset + i * INDEX_ENTRY.size)
+                      for i in range(block_count)]
+        self._first_ids = [entry[0] for entry in self.index]
+        self.first_id = self.index[0][0] if self.index else 0
+        self.last_id = self.index[-1][1] if self.index else -1
+
+    def _block(self, idx: int) -> list[tuple[int, str]]:
+        return _read_block(self, idx)
+
+    def get(self, message_id: int) -> Optional[str]:
+        idx = bisect_right(self._first_ids, message_id) - 1
+        if idx < 0 or message_id > self.index[idx][1]:
+            return
+        for record_id, data in self._block(idx):
+            if record_id == message_id:
+                return data
+
+    def iterate(self, after: int) -> Iterator[tuple[int, str]]:
+        # Yields messages with message_id > after, oldest first
+        for idx in range(max(bisect_right(self._first_ids, after) - 1, 0), len(self.index)):
+            for record_id, data in self._block(idx):
+                if record_id > after:
+                    yield record_id, data
+
+    def range(self, before: int, after: int) -> Iterator[tuple[int, str]]:
+        # Yields messages with after < message_id < before, newest first
+        idx = bisect_right(self._first_ids, before - 1) - 1
+        while idx >= 0 and self.index[idx][1] > after:
+            for record_id, data in reversed(self._block(idx)):
+                if after < record_id < before:
+                    yield record_id, data
+            idx -= 1
+
+
+@lru_cache(maxsize=256)
+def _read_block(segment: Segment, idx: int) -> list[tuple[int, str]]:
+    _, _, offset, length = segment.index[idx]
+    raw = zlib.decompress(segment._mmap[offset:offset + length])
+    records = []
+    pos = 0
+    while pos < len(raw):
+        message_id, size = RECORD.unpack_from(raw, pos)
+        pos += RECORD.size
+        records.append((message_id, raw[pos:pos + size].decode("utf8")))
+        pos += size
+    return records
+
+
+def write_segment(path: Path, messages: Iterable[tuple[int, str]]) -> int:
+    path.parent.mkdir(parents=True, exist_ok=True)
+    tmp_path = path.with_suffix(".tmp")
+    index = []
+    count = 0
+    with open(tmp_path, "wb") as f:
+        block = bytearray()
+        first_id = last_id = None
+
+        def flush() -> None:
+            compressed = zlib.compress(bytes(block), 6)
+            index.append((first_id, last_id, f.tell(), len(compressed)))
+            f.write(compressed)
+            block.clear()
+
+        for message_id, data in messages:
+            encoded = data.encode("utf8")
+            if not block:
+                first_id = message_id
+            block += RECORD.pack(message_id, len(encoded)) + encoded
+            last_id = message_id
+            count += 1
+            if len(block) >= BLOCK_SIZE:
+                flush()
+        if block:
+            flush()
+        index_offset = f.tell()
+        for entry in index:
+            f.write(INDEX_ENTRY.pack(*entry))
+        f.write(FOOTER.pack(index_offset, len(index)) + MAGIC)
+        f.flush()
+        os.fsync(f.fileno())
+    if count:
+        os.replace(tmp_path, path)
+    else:
+        tmp_path.unlink()
+    return count
+
+
+class Archive:
+    def __init__(self, root: Path, max_chats: int = 1024):
+        self.root = root
+        self.max_chats = max_chats
+        # Segments of the most recently read chats, the others are unmapped
+        self._segments: OrderedDict[tuple[int, int], tuple[float, list[Segment]]] = OrderedDict()
+        self._lock = Lock()
+
+    def chat_dir(self, bot_id: int, chat_id: int) -> Path:
+        return self.root / str(bot_id) / str(chat_id)
+
+    def bots(self) -> list[int]:
+        return [int(path.name) for path in self.root.iterdir()] if self.root.is_dir() else []
+
+    def chats(self, bot_id: int) -> list[int]:
+        bot_dir = self.root / str(bot_id)
+        return [int(path.name) for path in bot_dir.iterdir()] if bot_dir.is_dir() else []
+
+    def segments(self, bot_id: int, chat_id: int) -> list[Segment]:
+        path = self.chat_dir(bot_id, chat_id)
+        try:
+            mtime = path.stat().st_mtime
+        except FileNotFoundError:
+            return []
+        with self._lock:
+            cached = self._segments.get((bot_id, chat_id))
+            if cached is None or cached[0] != mtime:
+                segments = sorted((Segment(file) for file in path.glob("*.seg")), key=lambda s: s.first_id)
+                cached = self._segments[(bot_id, chat_id)] = (mtime, segments)
+            self._segments.move_to_end((bot_id, chat_id))
+            if len(self._segments) > self.max_chats:
+                self._segments.popitem(last=False)
+        return cached[1]
+
+    def get(self, bot_id: int, chat_id: int, message_id: int) -> Optional[str]:
+        for segment in reversed(self.segments(bot_id, chat_id)):
+            if segment.first_id <= message_id <= segment.last_id and (data := segment.get(message_id)) is not None:
+                return data
+
+    def prune(self, bot_id: int, chat_id: int, keep: Callable[[int, str], bool],
+              skip: Callable[[Segment], bool] = lambda segment: False) -> list[tuple[int, str]]:
+        # Rewrites the segments holding messages that are not kept, returns the removed messages
+        removed = []
+        for segment in self.segments(bot_id, chat_id):
+            if skip(segment):
+                continue
+            kept = []
+            segment_removed = []
+            for record in segment.iterate(segment.first_id - 1):
+                (kept if keep(*record) else segment_removed).append(record)
+            if not segment_removed:
+                continue
+            if kept:
+                write_segment(segment_path(segment.path.parent, [message_date(data) for _, data in kept]), kept)
+            segment.path.unlink()
+            removed.extend(segment_removed)
+        return removed
+
+    def iterate(self, bot_id: int, chat_id: int, after: int = 0) -> Iterator[tuple[int, str]]:
+        # Messages of all segments in message_id order, a message in several segments is returned once
+        last = None
+        segments = [segment.iterate(after) for segment in self.segments(bot_id, chat_id) if segment.last_id > after]
+        for message_id, data in heapq.merge(*segments, key=lambda record: record[0]):
+            if message_id != last:
+                last = message_id
+                yield message_id, data
+
+    def range(self, bot_id: int, chat_id: int, before: int, after: int, limit: int) -> list[str]:
+        found: dict[int, str] = {}
+        for segment in self.segments(bot_id, chat_id):
+            if segment.last_id <= after or segment.first_id >= before:
+                continue
+            for count, (message_id, data) in enumerate(segment.range(before, after)):
+                if count >= limit:
+                    break
+                found[message_id] = data
+        return [found[message_id] for message_id in sorted(found, reverse=True)[:limit]]
+
+
+archive = Archive(archive_dir(), getattr(settings, "TG_ARCHIVE_OPEN_CHATS", 1024))
+
+
+def archive_messages(older_than_days: int, batch_size: int = 1000, using: str = "default") -> dict:
+    cutoff = time() - older_than_days * 86400
+    old_messages = Message.objects.using(using).filter(date__lt=cutoff)
+    stats = {"chats": 0, "messages": 0, "bytes": 0}
+    for bot_id, chat_id in list(old_messages.values_list("bot_id", "chat_id").distinct().order_by()):
+        rows = old_messages.filter(bot_id=bot_id, chat_id=chat_id).order_by("message_id") \
+            .values_list("id", "message_id", "date", "serialized_message", "digest").iterator(chunk_size=batch_size)
+        archived = {}
+        dates = []
+
+        def records() -> Iterator[tuple[int, str]]:
+            for row_id, message_id, date, serialized_message, digest in rows:
+                archived[row_id] = (message_id, digest)
+                dates.append(date or 0)
+                yield message_id, serialized_message
+
+        # The date range is only known once the segment is written, readers only look at .seg files
+        written_path = archive.chat_dir(bot_id, chat_id) / f"{time_ns()}.written"
+        count = write_segment(written_path, records())
+        if not count:
+            continue
+        path = segment_path(written_path.parent, dates)
+        os.replace(written_path, path)
+        # Rows are only deleted once the segment is fsynced, a crash in between leaves duplicates which
+        # readers resolve in favor of the hot table. Rows changed since they were archived are kept the same way.
+        ids = list(archived)
+        for i in range(0, len(ids), batch_size):
+            with transaction.atomic(using=using):
+                current = Message.objects.using(using).select_for_update().filter(id__in=ids[i:i + batch_size]) \
+                    .values_list("id", "digest")
+                Message.objects.using(using).filter(id__in=[
+                    row_id for row_id, digest in current if digest == archived[row_id][1]
+                ]).delete()
+        Message.forget_digests(using, bot_id, ((message_id, chat_id) for message_id, _ in archived.values()))
+        stats["chats"] += 1
+        stats["messages"] += count
+        stats["bytes"] += path.stat().st_size
+    return stats
@@ -0,0 +1,176 @@
+"""
+The MIT License (MIT)
+
+Copyright (c) 2023-present RuslanUC
+
+Permission is hereby granted, free of charge, to any person obtaining a
+copy of this software and associated documentation files (the "Software"),
+to deal in the Software without restriction, including without limitation
+the rights to use, copy, modify, merge, publish, distribute, sublicense,
+and/or sell copies of the Software, and to permit persons to whom the
+Software is furnished to do so, subject to the following conditions:
+
+The above copyright notice and this permission notice shall be included in
+all copies or substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS
+OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING
+FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER
+DEALINGS IN THE SOFTWARE.
+"""
+
+import asyncio
+import re
+from typing import AsyncIterator, Callable, Optional, Any, Union
+
+from asgiref.sync import sync_to_async
+from django.db import close_old_connections
+from django.http import HttpResponse, JsonResponse, QueryDict
+
+from .changes import Change, change_feed, load_changes
+from .exceptions import ChangeLogTrimmedException
+from .params import GetChangesParams
+from .utils import check_token
+
+CHANGES_PATH_REGEX = re.compile(r"^/bot([^/]+)/getChanges$")
+KEEPALIVE_INTERVAL = 15
+BATCH_SIZE = 500
+
+
+def _with_connections(func: Callable, *args) -> Any:
+    close_old_connections()
+    try:
+        return func(*args)
+    finally:
+        close_old_connections()
+
+
+async def _run_sync(func: Callable, *args) -> Any:
+    return await sync_to_async(_with_connections, thread_sensitive=False)(func, *args)
+
+
+async def _wait_for_disconnect(receive: Callable, disconnect_type: str) -> None:
+    while (await receive())["type"] != disconnect_type:
+        pass
+
+
+async def _open(bot_token: str, query_string: bytes, last_event_id: Optional[str]) -> Union[HttpResponse, tuple]:
+    try:
+        args = GetChangesParams(QueryDict(query_string))
+        if last_event_id is not None:
+            args.after = int(last_event_id)
+    except ValueError:
+        return JsonResponse({"ok": False, "error_code": 400, "description": f"Bad Request: invalid parameters"}, status=400)
+    if (resp := await _run_sync(check_token, bot_token)) is not None:
+        return resp
+    bot_id = int(bot_token.split(":")[0])
+    try:
+        after = await _run_sync(change_feed.subscribe, bot_id, args.after)
+    except ChangeLogTrimmedException as e:
+        return JsonResponse({"ok": False, "error_code": e.code, "description": e.message}, status=e.code)
+    return bot_id, args, after
+
+
+async def _changes(bot_id: int, args: GetChangesParams, after: int,
+                   disconnected: asyncio.Future) -> AsyncIterator[list[Change]]:
+    # Yields batches of changes as they are written and an empty batch every KEEPALIVE_INTERVAL seconds without any
+    while True:
+        # Registered before reading, so changes polled in between wake this subscriber up
+        waiter = change_feed.wait(bot_id)
+        start = change_feed.start(bot_id)
+        changes = change_feed.read(bot_id, after, args.chat_id, args.types, BATCH_SIZE)
+        if changes is None:
+            changes = await _run_sync(load_changes, bot_id, after, args.chat_id, args.types, BATCH_SIZE)
+            if len(changes) < BATCH_SIZE and start is not None:
+                # Everything up to the start of the buffer was committed before loading, continue from the buffer
+                after = max(after, start)
+        if changes:
+            change_feed.cancel_wait(bot_id, waiter)
+            after = max(after, changes[-1].seq)
+            yield changes
+            continue
+        done, _ = await asyncio.wait((waiter, disconnected), timeout=KEEPALIVE_INTERVAL,
+                                     return_when=asyncio.FIRST_COMPLETED)
+        change_feed.cancel_wait(bot_id, waiter)
+        if disconnected in done:
+            return
+        if not done:
+            yield []
+
+
+async def _send_response(send: Callable, response: HttpResponse) -> None:
+    await send({
+        "type": "http.response.start", "status": response.status_code,
+        "headers": [(name.encode("latin1"), value.encode("latin1")) for name, value in response.items()],
+    })
+    await send({"type": "http.response.body", "body": response.content})
+
+
+async def _serve_events(scope: dict, receive: Callable, send: Callable, bot_token: str) -> None:
+    headers = dict(scope["headers"])
+    last_event_id = headers.get(b"last-event-id")
+    opened = await _open(bot_token, scope["query_string"], last_event_id.decode() if last_event_id else None)
+    if isinstance(opened, HttpResponse):
+        return await _send_response(send, opened)
+    bot_id, args, after = opened
+    disconnected = asyncio.ensure_future(_wait_for_disconnect(receive, "http.disconnect"))
+    try:
+        await send({
+            "type": "http.response.start", "status": 200,
+            "headers": [(b"content-type", b"text/event-stream"), (b"cache-control", b"no-cache"),
+                        (b"x-accel-buffering", b"no")],
+        })
+        async for changes in _changes(bot_id, args, after, disconnected):
+            if changes:
+                body = "".join(f"id: {change.seq}\nevent: {change.type}\ndata: {change.to_json()}\n\n"
+                               for change in changes)
+            else:
+                body = ": keepalive\n\n"
+            await send({"type": "http.response.body", "body": body.encode("utf8"), "more_body": True})
+    except OSError:
+        pass
+    finally:
+        disconnected.cancel()
+        change_feed.unsubscribe()
+
+
+async def _serve_websocket(scope: dict, receive: Callable, send: Callable, bot_token: str) -> None:
+    if (await receive())["type"] != "websocket.connect":
+        return
+    await send({"type": "websocket.accept"})
+    opened = await _open(bot_token, scope["query_string"], None)
+    if isinstance(opened, HttpResponse):
+        await send({"type": "websocket.send", "text": opened.content.decode("utf8")})
+        return await send({"type": "websocket.close", "code": 4000 + opened.status_code})
+    bot_id, args, after = opened
+    disconnected = asyncio.ensure_future(_wait_for_disconnect(receive, "websocket.disconnect"))
+    try:
+        async for changes in _changes(bot_id, args, after, disconnected):
+            for change in changes:
+                await send({"type": "websocket.send", "text": change.to_json()})
+    except OSError:
+        pass
+    finally:
+        disconnected.cancel()
+        change_feed.unsubscribe()
+
+
+class ChangeFeedApplication:
+    # Serves the change feed (getChanges over server-sent events or WebSocket) before Django, a subscriber only
+    # holds its connection and a future while waiting for changes.
+
+    def __init__(self, application: Callable):
+        self.application = application
+
+    async def __call__(self, scope: dict, receive: Callable, send: Callable) -> None:
+        if scope["type"] in ("http", "websocket") and (match := CHANGES_PATH_REGEX.match(scope["path"])):
+            if scope["type"] == "websocket":
+                return await _serve_websocket(scope, receive, send, match.group(1))
+            if b"text/event-stream" in dict(scope["headers"]).get(b"accept", b""):
+                return await _serve_events(scope, receive, send, match.group(1))
+        if scope["type"] == "websocket":
+            return await send({"type": "websocket.close"})
+        return await self.application(scope, receive, send)
@@ -0,0 +1,358 @@
+"""
+The MIT License (MIT)
+
+Copyright (c) 2023-present RuslanUC
+
+Permission is hereby granted, free of charge, to any person obtaining a
+copy of this software and associated documentation files (the "Software"),
+to deal in the Software without restriction, including without limitation
+the rights to use, copy, modify, merge, publish, distribute, sublicense,
+and/or sell copies of the Software, and to permit persons to whom the
+Software is furnished to do so, subject to the following conditions:
+
+The above copyright notice and this permission notice shall be included in
+all copies or substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS
+OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING
+FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER
+DEALINGS IN THE SOFTWARE.
+"""
+
+import logging
+from concurrent.futures import ThreadPoolExecutor
+from json import dumps, loads
+from os import getpid
+from socket import gethostname
+from threading import Event, Lock, Thread
+from time import monotonic, time
+from typing import Any, Iterable, Optional
+
+import httpx
+from django.conf import settings
+from django.db import connections, transaction
+from django.db.models import F
+
+from proxy import pydantic_models
+from proxy.db import serialized_write
+from proxy.delivery import record_send_error
+from proxy.metrics import registry
+from proxy.models import Broadcast, BroadcastTarget, Chat, Message, UndeliverableChat
+from proxy.routers import database_for, shards
+from proxy.utils import find_dict, upstream
+
+log = logging.getLogger(__name__)
+
+INSERT_BATCH_SIZE = 10000
+MAX_ATTEMPTS = 5
+# Targets sent between two checkpoints (which also notice cancellation), about 5 seconds worth at the broadcast's rate
+MAX_BATCH_SIZE = 200
+CHECKPOINT_SECONDS = 5
+
+
+class BroadcastAborted(Exception):
+    pass
+
+
+class RateLimiter:
+    # Spaces sends evenly, pause() holds everyone back after a flood wait
+
+    def __init__(self, rate: float):
+        self.interval = 1 / rate
+        self.next = monotonic()
+        self.lock = Lock()
+
+    def acquire(self, stop: Event) -> None:
+        with self.lock:
+            now = monotonic()
+            at = max(self.next, now)
+            self.next = at + self.interval
+        if at > now:
+            stop.wait(at - now)
+
+    def pause(self, seconds: float) -> None:
+        with self.lock:
+            self.next = max(self.next, monotonic() + seconds)
+
+
+def _insert_private_chats(using: str, bot_id: int, broadcast_id: int) -> None:
+    connection = connections[using]
+    quote = connection.ops.quote_name
+    with connection.cursor() as cursor:
+        cursor.execute(
+            f"INSERT INTO {quote(BroadcastTarget._meta.db_table)} (broadcast_id, bot_id, chat_id, status) "
+            f"SELECT %s, bot_id, id, %s FROM {quote(Chat._meta.db_table)} WHERE bot_id = %s AND type = 'private'",
+            (broadcast_id, BroadcastTarget.PENDING, bot_id)
+        )
+
+
+def _message_id(result: Any) -> Optional[int]:
+    # sendMediaGroup returns a list of messages, copyMessage only a MessageId
+    if isinstance(result, list):
+        result = result[0] if result else None
+    return result.get("message_id") if isinstance(result, dict) else None
+
+
+def create_broadcast(bot_id: int, token: str, method: str, params: dict, chat_ids: Optional[Iterable[int]],
+                     all_private_chats: bool, concurrency: int, rate: float) -> Broadcast:
+    using = database_for(Broadcast, bot_id)
+    lease = getattr(settings, "TG_BROADCAST_LEASE", 120)
+    # Leased by nobody until all targets are inserted, so no scheduler starts it early
+    broadcast = serialized_write(lambda: Broadcast.objects.using(using).create(
+        bot_id=bot_id, token=token, method=method, params=dumps(params), concurrency=concurrency, rate=rate,
+        created_at=int(time()), lease_expires_at=time() + lease,
+    ), using)
+    if all_private_chats:
+        serialized_write(lambda: _insert_private_chats(using, bot_id, broadcast.id), using)
+    chat_ids = list(dict.fromkeys(chat_ids or ()))
+    for start in range(0, len(chat_ids), INSERT_BATCH_SIZE):
+        targets = [BroadcastTarget(broadcast_id=broadcast.id, bot_id=bot_id, chat_id=chat_id)
+                   for chat_id in chat_ids[start:start + INSERT_BATCH_SIZE]]
+        serialized_write(lambda: BroadcastTarget.objects.using(using).bulk_create(targets, ignore_conflicts=True),
+                         using)
+    broadcast.total = BroadcastTarget.objects.using(using).filter(broadcast_id=broadcast.id).count()
+    broadcast.lease_expires_at = 0
+    serialized_write(lambda: broadcast.save(using=using, update_fields=("total", "lease_expires_at")), using)
+    broadcast_scheduler.kick.set()
+    return broadcast
+
+
+def cancel_broadcast(bot_id: int, broadcast_id: int) -> Optional[Broadcast]:
+    using = database_for(Broadcast, bot_id)
+    # The lease is kept so the running job can still checkpoint the batch it was sending
+    serialized_write(lambda: Broadcast.objects.using(using).filter(
+        id=broadcast_id, bot_id=bot_id, status__in=(Broadcast.PENDING, Broadcast.RUNNING)
+    ).update(status=Broadcast.CANCELLED, finished_at=int(time()), token=""), using)
+    return Broadcast.objects.using(using).filter(id=broadcast_id, bot_id=bot_id).first()
+
+
+class BroadcastJob:
+    def __init__(self, using: str, broadcast_id: int, owner: str):
+        self.using = using
+        self.broadcast_id = broadcast_id
+        self.owner = owner
+        self.lease = getattr(settings, "TG_BROADCAST_LEASE", 120)
+        # Set when the lease could not be renewed (cancelled or taken over), sends stop right away
+        self.stopped = Event()
+
+    def run(self) -> None:
+        heartbeat = Thread(target=self._heartbeat, name=f"broadcast-{self.broadcast_id}-lease", daemon=True)
+        heartbeat.start()
+        try:
+            self._run()
+        except Exception:
+            # The lease runs out and the broadcast is resumed by the next scheduler pass
+            log.exception("Broadcast %s failed", self.broadcast_id)
+        finally:
+            self.stopped.set()
+            heartbeat.join()
+            connections.close_all()
+
+    def _heartbeat(self) -> None:
+        # Flood waits can hold a batch back for longer than the lease, it is renewed independently of checkpoints
+        try:
+            while not self.stopped.wait(self.lease / 3):
+                try:
+                    if not self._renew_lease():
+                        self.stopped.set()
+                except Exception:
+                    log.exception("Renewing the lease of broadcast %s failed", self.broadcast_id)
+        finally:
+            connections.close_all()
+
+    def _renew_lease(self) -> bool:
+        return serialized_write(lambda: Broadcast.objects.using(self.using).filter(
+            id=self.broadcast_id, status=Broadcast.RUNNING, lease_owner=self.owner
+        ).update(lease_expires_at=time() + self.lease), self.using) == 1
+
+    def _run(self) -> None:
+        broadcast = Broadcast.objects.using(self.using).get(id=self.broadcast_id)
+        self.bot_id = broadcast.bot_id
+        self.method = broadcast.method
+        self.url = f"{settings.TG_API_URL}/bot{broadcast.token}/{broadcast.method}"
+        self.params = loads(broadcast.params)
+        self.limiter = RateLimiter(broadcast.rate)
+        self.bot_limiter = broadcast_scheduler.limiter(self.bot_id)
+        if broadcast.started_at is None:
+            serialized_write(lambda: Broadcast.objects.using(self.using).filter(id=self.broadcast_id).update(
+                started_at=int(time())
+            ), self.using)
+        batch_size = max(1, min(MAX_BATCH_SIZE, int(broadcast.rate * CHECKPOINT_SECONDS)))
+        pending = BroadcastTarget.objects.using(self.using).filter(
+            broadcast_id=self.broadcast_id, status=BroadcastTarget.PENDING
+        ).order_by("id").values_list("id", "chat_id")
+        log.info("Sending broadcast %s of bot %s", self.broadcast_id, self.bot_id)
+        with ThreadPoolExecutor(broadcast.concurrency, thread_name_prefix=f"broadcast-{self.broadcast_id}") \
+                as executor:
+            while batch := list(pending[:batch_size]):
+                start = monotonic()
+                # Chats already known to be undeliverable fail without a call
+                known = dict(UndeliverableChat.objects.using(self.using).filter(
+                    bot_id=self.bot_id, chat_id__in=[chat_id for _, chat_id in batch], expires_at__gt=time()
+                ).values_list("chat_id", "error_code"))
+                to_send = [(target_id, chat_id) for target_id, chat_id in batch if chat_id not in known]
+                results, aborted = [], None
+                for future in [executor.submit(self._send, chat_id) for _, chat_id in to_send]:
+                    try:
+                        results.append(future.result())
+                    except BroadcastAborted as e:
+                        # The target stays pending, the sends finished before are still checkpointed
+                        results.append(None)
+                        aborted = e
+                targets = [BroadcastTarget(id=target_id, status=BroadcastTarget.FAILED, error_code=known[chat_id])
+                           for target_id, chat_id in batch if chat_id in known]
+                sent = [(target, result) for target, result in zip(to_send, results) if result is not None]
+                for (target_id, chat_id), (result, error) in sent:
+                    if result is not None:
+                        targets.append(BroadcastTarget(id=target_id, status=BroadcastTarget.DELIVERED,
+                                                       message_id=_message_id(result)))
+                    else:
+                        record_send_error(self.bot_id, chat_id, self.method, error)
+                        targets.append(BroadcastTarget(id=target_id, status=BroadcastTarget.FAILED,
+                                                       error_code=error.get("error_code") if error else None))
+                if not self._checkpoint(targets, monotonic() - start):
+                    log.info("Broadcast %s was cancelled or taken over", self.broadcast_id)
+                    return
+                self._cache_messages([result for _, (result, _) in sent if result is not None])
+                if aborted is not None:
+                    self._finish(Broadcast.FAILED, str(aborted))
+                    return
+        self._finish(Broadcast.DONE)
+
+    def _send(self, chat_id: int) -> Optional[tuple[Any, Optional[dict]]]:
+        # None when the lease was lost before the message was sent, the target stays pending
+        error = None
+        for attempt in range(MAX_ATTEMPTS):
+            self.limiter.acquire(self.stopped)
+            self.bot_limiter.acquire(self.stopped)
+            if self.stopped.is_set():
+                return None
+            try:
+                resp = upstream.post(self.url, json={**self.params, "chat_id": chat_id})
+                data = resp.json()
+            except (httpx.HTTPError, ValueError) as e:
+                error = {"ok": False, "error_code": 502, "description": f"Failed to make request to origin server: {e}"}
+                self.stopped.wait(2 ** attempt)
+                continue
+            if not isinstance(data, dict):
+                data = {"ok": False, "error_code": resp.status_code, "description": "Invalid response"}
+            if data.get("ok"):
+                return data.get("result"), None
+            error = data
+            error_code = data.get("error_code", resp.status_code)
+            if error_code == 429:
+                self.bot_limiter.pause((data.get("parameters") or {}).get("retry_after", 1))
+            elif error_code == 401:
+                raise BroadcastAborted(data.get("description", "Unauthorized"))
+            elif error_code >= 500:
+                self.stopped.wait(2 ** attempt)
+            else:
+                break
+        return None, error
+
+    def _checkpoint(self, targets: list[BroadcastTarget], seconds: float) -> bool:
+        delivered = sum(target.status == BroadcastTarget.DELIVERED for target in targets)
+        failed = len(targets) - delivered
+
+        def write() -> Optional[str]:
+            with transaction.atomic(using=self.using):
+                # The lease is checked (and its row locked) first, a job that lost it must not record anything
+                if not Broadcast.objects.using(self.using).filter(
+                        id=self.broadcast_id, status__in=(Broadcast.RUNNING, Broadcast.CANCELLED),
+                        lease_owner=self.owner
+                ).update(lease_expires_at=time() + self.lease):
+                    return None
+                BroadcastTarget.objects.using(self.using).bulk_update(targets, ("status", "message_id", "error_code"))
+                Broadcast.objects.using(self.using).filter(id=self.broadcast_id).update(
+                    delivered=F("delivered") + delivered, failed=F("failed") + failed,
+                    sending_seconds=F("sending_seconds") + seconds,
+                )
+                return Broadcast.objects.using(self.using).values_list("status", flat=True).get(id=self.broadcast_id)
+
+        if (status := serialized_write(write, self.using)) is None:
+            return False
+        registry.inc("tg_proxy_broadcast_sends_total", delivered, result="delivered")
+        registry.inc("tg_proxy_broadcast_sends_total", failed, result="failed")
+        return status == Broadcast.RUNNING
+
+    def _cache_messages(self, results: list) -> None:
+        found = {}
+        find_dict(results, found, pydantic_models.Message)
+        if messages := found.get(pydantic_models.Message):
+            Message.update_or_create_objects("message_id", self.bot_id, messages,
+                                             lambda d: Message.fields_from_dict(self.bot_id, d))
+
+    def _finish(self, status: str, error: str = "") -> None:
+        serialized_write(lambda: Broadcast.objects.using(self.using).filter(
+            id=self.broadcast_id, status=Broadcast.RUNNING, lease_owner=self.owner
+        ).update(
+            status=status, error=error, finished_at=int(time()), token="", lease_owner="", lease_expires_at=0
+        ), self.using)
+        log.info("Broadcast %s finished: %s", self.broadcast_id, status)
+
+
+class BroadcastScheduler:
+    # Claims unleased broadcasts of all shards and sends each of them on its own thread
+
+    def __init__(self):
+        self.kick = Event()
+        self.jobs: dict[tuple[str, int], Thread] = {}
+        # Telegram limits the sends of a bot, not of a broadcast, so all jobs of a bot share one limiter as well
+        self.limiters: dict[int, RateLimiter] = {}
+        self._thread: Optional[Thread] = None
+        self._lock = Lock()
+
+    @property
+    def owner(self) -> str:
+        # Forked workers each get their own
+        return f"{gethostname()}:{getpid()}"
+
+    def limiter(self, bot_id: int) -> RateLimiter:
+        with self._lock:
+            if (limiter := self.limiters.get(bot_id)) is None:
+                limiter = self.limiters[bot_id] = RateLimiter(getattr(settings, "TG_BROADCAST_MAX_RATE", 30))
+            return limiter
+
+    def start(self) -> None:
+        with self._lock:
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = Thread(target=self.run_forever, name="broadcasts", daemon=True)
+                self._thread.start()
+
+    def run_forever(self) -> None:
+        while True:
+            try:
+                self.claim()
+            except Exception:
+                log.exception("Claiming broadcasts failed")
+            connections.close_all()
+            self.kick.wait(getattr(settings, "TG_BROADCAST_POLL_INTERVAL", 5))
+            self.kick.clear()
+
+    def claim(self) -> int:
+        claimed = 0
+        lease = getattr(settings, "TG_BROADCAST_LEASE", 120)
+        for using in shards():
+            now = time()
+            candidates = Broadcast.objects.using(using).filter(
+                status__in=(Broadcast.PENDING, Broadcast.RUNNING), lease_expires_at__lt=now
+            ).values_list("id", flat=True)
+            for broadcast_id in candidates:
+                if (job := self.jobs.get((using, broadcast_id))) is not None and job.is_alive():
+                    continue
+                if not serialized_write(lambda: Broadcast.objects.using(using).filter(
+                        id=broadcast_id, status__in=(Broadcast.PENDING, Broadcast.RUNNING), lease_expires_at__lt=now
+                ).update(status=Broadcast.RUNNING, lease_owner=self.owner, lease_expires_at=time() + lease), using):
+                    continue
+                job = Thread(target=BroadcastJob(using, broadcast_id, self.owner).run,
+                             name=f"broadcast-{broadcast_id}", daemon=True)
+                self.jobs[(using, broadcast_id)] = job
+                job.start()
+                claimed += 1
+        return claimed
+
+
+broadcast_scheduler = BroadcastScheduler()
@@ -0,0 +1,264 @@
+"""
+The MIT License (MIT)
+
+Copyright (c) 2023-present RuslanUC
+
+Permission is hereby granted, free of charge, to any person obtaining a
+copy of this software and associated documentation files (the "Software"),
+to deal in the Software without restriction, including without limitation
+the rights to use, copy, modify, merge, publish, distribute, sublicense,
+and/or sell copies of the Software, and to permit persons to whom the
+Software is furnished to do so, subject to the following conditions:
+
+The above copyright notice and this permission notice shall be included in
+all copies or substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS
+OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING
+FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER
+DEALINGS IN THE SOFTWARE.
+"""
+
+# Models import this module, they are imported lazily here.
+
+import asyncio
+import logging
+from bisect import bisect_right
+from collections import defaultdict
+from itertools import islice
+from json import dumps
+from threading import Thread, Lock, Event
+from time import time
+from typing import Optional, NamedTuple, Collection
+
+from django.conf import settings
+from django.db import DatabaseError
+from django.db.models import Max, Min
+
+from .exceptions import ChangeLogTrimmedException
+from .routers import shards, shard_for_bot
+
+log = logging.getLogger(__name__)
+
+TRIM_EVERY = 1000
+POLL_BATCH_SIZE = 1000
+
+
+class Change(NamedTuple):
+    seq: int
+    bot_id: int
+    type: str
+    chat_id: Optional[int]
+    entity_id: int
+    payload: str
+
+    def matches(self, bot_id: int, chat_id: Optional[int], types: Optional[Collection[str]]) -> bool:
+        return self.bot_id == bot_id and (chat_id is None or self.chat_id == chat_id) \
+            and (types is None or self.type in types)
+
+    def to_json(self) -> str:
+        # The payload is stored serialized already
+        return f'{{"seq": {self.seq}, "type": "{self.type}", "chat_id": {dumps(self.chat_id)}, ' \
+               f'"id": {self.entity_id}, "data": {self.payload}}}'
+
+
+_recorded: defaultdict[str, int] = defaultdict(int)
+
+
+def record_changes(using: str, bot_id: int, change_type: str, changes: list[tuple[Optional[int], int, str]]) -> None:
+    # Called in the transaction writing the changed rows, every shard has its own change log
+    if not (size := getattr(settings, "TG_CHANGE_LOG_SIZE", 0)):
+        return
+    from .models import ChangeLog
+
+    log_entries = ChangeLog.objects.using(using)
+    created_at = time()
+    log_entries.bulk_create([
+        ChangeLog(bot_id=bot_id, type=change_type, chat_id=chat_id, entity_id=entity_id, payload=payload,
+                  created_at=created_at)
+        for chat_id, entity_id, payload in changes
+    ])
+    _recorded[using] += len(changes)
+    if _recorded[using] >= TRIM_EVERY:
+        _recorded[using] = 0
+        if (last_seq := log_entries.aggregate(seq=Max("seq"))["seq"]) is not None:
+            log_entries.filter(seq__lte=last_seq - size).delete()
+
+
+def _commit_cutoff() -> float:
+    return time() - getattr(settings, "TG_CHANGE_LOG_COMMIT_WINDOW", 5)
+
+
+def settled_seq(using: str) -> int:
+    # Sequence numbers are taken before commit, so a change can become visible after a later one. Changes are only
+    # returned up to the first missing sequence number, which is waited for while the change after it is younger than
+    # TG_CHANGE_LOG_COMMIT_WINDOW seconds (after that its transaction is assumed to be rolled back).
+    from .models import ChangeLog
+
+    cutoff = _commit_cutoff()
+    settled = upper = None
+    for seq, created_at in ChangeLog.objects.using(using).order_by("-seq").values_list("seq", "created_at") \
+            .iterator(chunk_size=POLL_BATCH_SIZE):
+        if upper is None or (seq != upper[0] - 1 and upper[1] >= cutoff):
+            settled = seq
+        if created_at < cutoff:
+            break
+        upper = (seq, created_at)
+    return settled or 0
+
+
+def check_cursor(bot_id: int, after: int) -> None:
+    from .models import ChangeLog
+
+    bounds = ChangeLog.objects.using(shard_for_bot(bot_id)).aggregate(first=Min("seq"), last=Max("seq"))
+    if bounds["first"] is not None and after + 1 < bounds["first"]:
+        raise ChangeLogTrimmedException(410, f"Gone: changes after {after} were removed from the change log")
+    # Cursors of the shard the bot was moved away from
+    if after > (bounds["last"] or 0):
+        raise ChangeLogTrimmedException(410, f"Gone: changes after {after} are not in the change log")
+
+
+def load_changes(bot_id: int, after: int, chat_id: Optional[int], types: Optional[Collection[str]],
+                 limit: int) -> list[Change]:
+    from .models import ChangeLog
+
+    using = shard_for_bot(bot_id)
+    entries = ChangeLog.objects.using(using).filter(bot_id=bot_id, seq__gt=after)
+    if chat_id is not None:
+        entries = entries.filter(chat_id=chat_id)
+    if types is not None:
+        entries = entries.filter(type__in=types)
+    entries = list(entries.order_by("seq").values_list(*Change._fields, "created_at")[:limit])
+    # Changes older than the commit window can not be preceded by one that is still being committed
+    if entries and entries[-1][-1] >= _commit_cutoff():
+        settled = settled_seq(using)
+        entries = [entry for entry in entries if entry[0] <= settled]
+    return [Change(*entry[:-1]) for entry in entries]
+
+
+def _wake(future: asyncio.Future) -> None:
+    if not future.done():
+        future.set_result(None)
+
+
+class ChangeFeed:
+    # While anyone in the process is subscribed, one thread reads changes written by all processes from the change
+    # logs of all shards (immediately after a write of this process, otherwise every poll interval) and keeps the most
+    # recent ones in memory. Subscribers wait on a future and are only woken up for changes of their bot, so idle ones
+    # cost nothing but the connection.
+
+    def __init__(self, buffer_size: int, poll_interval: float):
+        self.buffer_size = buffer_size
+        self.poll_interval = poll_interval
+        self.buffers: dict[str, list[Change]] = {}
+        # The buffer of a shard has every change after its start
+        self.starts: dict[str, int] = {}
+        self.last_seqs: dict[str, int] = {}
+        self.subscribers = 0
+        self.kick = Event()
+        self._lock = Lock()
+        self._waiters: defaultdict[int, set[tuple[asyncio.AbstractEventLoop, asyncio.Future]]] = defaultdict(set)
+        self._thread: Optional[Thread] = None
+
+    def subscribe(self, bot_id: int, after: Optional[int]) -> int:
+        if after is not None:
+            check_cursor(bot_id, after)
+        with self._lock:
+            if not self.subscribers:
+                # Changes were not polled while nobody was subscribed
+                self.starts = {using: settled_seq(using) for using in shards()}
+                self.last_seqs = dict(self.starts)
+                self.buffers = {using: [] for using in shards()}
+            self.subscribers += 1
+            if self._thread is None:
+                self._thread = Thread(target=self._run, name="change-feed", daemon=True)
+                self._thread.start()
+        return self.last_seqs[shard_for_bot(bot_id)] if after is None else after
+
+    def unsubscribe(self) -> None:
+        with self._lock:
+            self.subscribers -= 1
+
+    def start(self, bot_id: int) -> Optional[int]:
+        return self.starts.get(shard_for_bot(bot_id))
+
+    def _run(self) -> None:
+        while True:
+            self.kick.wait(self.poll_interval)
+            self.kick.clear()
+            if not self.subscribers:
+                continue
+            for using in list(self.last_seqs):
+                try:
+                    while self.poll(using):
+                        pass
+                except DatabaseError:
+                    log.exception("Reading the change log of %r failed", using)
+
+    def poll(self, using: str) -> bool:
+        from .models import ChangeLog
+
+        entries = ChangeLog.objects.using(using).filter(seq__gt=self.last_seqs[using]).order_by("seq") \
+            .values_list(*Change._fields, "created_at")[:POLL_BATCH_SIZE]
+        # Stops at a missing sequence number until it is committed or the commit window has passed (see settled_seq)
+        cutoff = _commit_cutoff()
+        changes = []
+        expected = self.last_seqs[using] + 1
+        for *fields, created_at in entries:
+            if fields[0] != expected and created_at >= cutoff:
+                break
+            changes.append(Change(*fields))
+            expected = fields[0] + 1
+        if not changes:
+            return False
+        with self._lock:
+            buffer = self.buffers[using]
+            buffer.extend(changes)
+            self.last_seqs[using] = changes[-1].seq
+            if len(buffer) > 2 * self.buffer_size:
+                dropped = len(buffer) - self.buffer_size
+                self.starts[using] = buffer[dropped - 1].seq
+                del buffer[:dropped]
+            waiters = [waiter for bot_id in {change.bot_id for change in changes}
+                       for waiter in self._waiters.pop(bot_id, ())]
+        for loop, future in waiters:
+            loop.call_soon_threadsafe(_wake, future)
+        return len(changes) == POLL_BATCH_SIZE
+
+    def read(self, bot_id: int, after: int, chat_id: Optional[int], types: Optional[Collection[str]],
+             limit: int) -> Optional[list[Change]]:
+        # None if the changes are older than the buffer and have to be loaded from the change log
+        using = shard_for_bot(bot_id)
+        with self._lock:
+            if (start := self.starts.get(using)) is None or after < start:
+                return None
+            buffer = self.buffers[using]
+            changes = []
+            for change in islice(buffer, bisect_right(buffer, after, key=lambda c: c.seq), None):
+                if change.matches(bot_id, chat_id, types):
+                    changes.append(change)
+                    if len(changes) == limit:
+                        break
+            return changes
+
+    def wait(self, bot_id: int) -> asyncio.Future:
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        with self._lock:
+            self._waiters[bot_id].add((loop, future))
+        return future
+
+    def cancel_wait(self, bot_id: int, future: asyncio.Future) -> None:
+        with self._lock:
+            waiters = self._waiters.get(bot_id)
+            if waiters is not None:
+                waiters.discard((asyncio.get_running_loop(), future))
+                if not waiters:
+                    del self._waiters[bot_id]
+
+
+change_feed = ChangeFeed(getattr(settings, "TG_CHANGE_FEED_BUFFER_SIZE", 10000),
+                         getattr(settings, "TG_CHANGE_FEED_POLL_INTERVAL", 1.0))
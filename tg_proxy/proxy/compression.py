@@ -0,0 +1,207 @@
+"""
+The MIT License (MIT)
+
+Copyright (c) 2023-present RuslanUC
+
+Permission is hereby granted, free of charge, to any person obtaining a
+copy of this software and associated documentation files (the "Software"),
+to deal in the Software without restriction, including without limitation
+the rights to use, copy, modify, merge, publish, distribute, sublicense,
+and/or sell copies of the Software, and to permit persons to whom the
+Software is furnished to do so, subject to the following conditions:
+
+The above copyright notice and this permission notice shall be included in
+all copies or substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS
+OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING
+FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER
+DEALINGS IN THE SOFTWARE.
+"""
+
+import zlib
+from collections import OrderedDict
+from threading import Lock
+from typing import Iterable, Iterator, Optional
+
+from django.conf import settings
+from django.http import HttpRequest, HttpResponse, StreamingHttpResponse
+from django.utils.cache import patch_vary_headers
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+# Preferred first, when the client accepts several
+ENCODINGS = tuple(encoding for encoding, available in (("br", brotli), ("zstd", zstandard), ("gzip", zlib))
+                  if available is not None)
+# Streams are compressed on every request so they use fast levels, cached bodies are compressed once
+STREAM_LEVELS = {"br": 4, "zstd": 3, "gzip": 6}
+CACHED_LEVELS = {"br": 9, "zstd": 12, "gzip": 9}
+FLUSH_SIZE = 64 * 1024
+
+
+def parse_accept_encoding(accept_encoding: str) -> dict[str, float]:
+    accepted = {}
+    for value in accept_encoding.split(","):
+        encoding, *params = value.split(";")
+        quality = 1.0
+        for param in params:
+            name, _, param_value = param.strip().partition("=")
+            if name == "q":
+                try:
+                    quality = float(param_value)
+                except ValueError:
+                    quality = 0.0
+        if encoding := encoding.strip().lower():
+            accepted[encoding] = quality
+    return accepted
+
+
+def choose_encoding(accept_encoding: str) -> Optional[str]:
+    accepted = parse_accept_encoding(accept_encoding)
+    for encoding in ENCODINGS:
+        if accepted.get(encoding, accepted.get("*", 0)) > 0:
+            return encoding
+
+
+class _BrotliCompressor:
+    def __init__(self, quality: int):
+        self.compressor = brotli.Compressor(quality=quality)
+
+    def compress(self, data: bytes) -> bytes:
+        return self.compressor.process(data)
+
+    def flush(self) -> bytes:
+        return self.compressor.finish()
+
+
+def compressobj(encoding: str, level: Optional[int] = None):
+    level = STREAM_LEVELS[encoding] if level is None else level
+    if encoding == "br":
+        return _BrotliCompressor(level)
+    if encoding == "zstd":
+        return zstandard.ZstdCompressor(level).compressobj()
+    return zlib.compressobj(level, zlib.DEFLATED, 31)
+
+
+def compress(data: bytes, encoding: str, level: Optional[int] = None) -> bytes:
+    compressor = compressobj(encoding, level)
+    return compressor.compress(data) + compressor.flush()
+
+
+def compress_stream(chunks: Iterable[bytes], encoding: Optional[str]) -> Iterator[bytes]:
+    compressor = compressobj(encoding) if encoding is not None else None
+    buffer = []
+    size = 0
+    for chunk in chunks:
+        buffer.append(chunk)
+        size += len(chunk)
+        if size >= FLUSH_SIZE:
+            data = b"".join(buffer)
+            buffer.clear()
+            size = 0
+            if compressor is not None:
+                data = compressor.compress(data)
+            if data:
+                yield data
+    data = b"".join(buffer)
+    if compressor is not None:
+        data = compressor.compress(data) + compressor.flush()
+    if data:
+        yield data
+
+
+def decompress(data: bytes, encoding: str) -> bytes:
+    try:
+        if encoding == "br" and brotli is not None:
+            return brotli.decompress(data)
+        if encoding == "zstd" and zstandard is not None:
+            return zstandard.ZstdDecompressor().decompressobj().decompress(data)
+        if encoding == "gzip":
+            return zlib.decompress(data, 31)
+        if encoding == "deflate":
+            return zlib.decompress(data)
+    except Exception as e:
+        raise ValueError(f"Invalid {encoding} data") from e
+    raise ValueError(f"Unsupported encoding {encoding}")
+
+
+class CompressedCache:
+    # LRU of compressed response bodies keyed by the uncompressed body, so a changed entity never hits a stale
+    # entry. Sizes count both the key and the compressed value.
+
+    def __init__(self, max_size: int):
+        self.max_size = max_size
+        self.size = 0
+        self.entries: OrderedDict[tuple[str, bytes], bytes] = OrderedDict()
+        self.lock = Lock()
+
+    def get(self, body: bytes, encoding: str) -> bytes:
+        key = (encoding, body)
+        with self.lock:
+            if (compressed := self.entries.get(key)) is not None:
+                self.entries.move_to_end(key)
+                return compressed
+        compressed = compress(body, encoding, CACHED_LEVELS[encoding])
+        entry_size = len(body) + len(compressed)
+        if entry_size > self.max_size:
+            return compressed
+        with self.lock:
+            if key not in self.entries:
+                self.entries[key] = compressed
+                self.size += entry_size
+            while self.size > self.max_size:
+                (_, old_body), old_compressed = self.entries.popitem(last=False)
+                self.size -= len(old_body) + len(old_compressed)
+        return compressed
+
+    def clear(self) -> None:
+        with self.lock:
+            self.entries.clear()
+            self.size = 0
+
+
+compressed_cache = CompressedCache(getattr(settings, "TG_COMPRESSED_CACHE_SIZE", 32 * 1024 * 1024))
+
+
+def _min_size() -> int:
+    return getattr(settings, "TG_COMPRESSION_MIN_SIZE", 512)
+
+
+def json_response(request: HttpRequest, body: bytes, status: int = 200) -> HttpResponse:
+    # Bodies of single cached entities, compressed once and then served from compressed_cache
+    encoding = choose_encoding(request.headers.get("Accept-Encoding", ""))
+    if encoding is None or len(body) < _min_size():
+        response = HttpResponse(body, content_type="application/json", status=status)
+    else:
+        response = HttpResponse(compressed_cache.get(body, encoding), content_type="application/json", status=status)
+        response["Content-Encoding"] = encoding
+    patch_vary_headers(response, ("Accept-Encoding",))
+    return response
+
+
+def json_list_response(request: HttpRequest, items: list[str], prefix: str = '{"ok": true, "result": [',
+                       suffix: str = "]}") -> HttpResponse:
+    # Pages of serialized entities, joined without decoding them and compressed while being sent
+    chunks = [prefix.encode("utf8")]
+    for index, item in enumerate(items):
+        chunks.append((", " + item if index else item).encode("utf8"))
+    chunks.append(suffix.encode("utf8"))
+    encoding = choose_encoding(request.headers.get("Accept-Encoding", ""))
+    if encoding is None or sum(len(chunk) for chunk in chunks) < _min_size():
+        response = HttpResponse(b"".join(chunks), content_type="application/json")
+    else:
+        response = StreamingHttpResponse(compress_stream(chunks, encoding), content_type="application/json")
+        response["Content-Encoding"] = encoding
+    patch_vary_headers(response, ("Accept-Encoding",))
+    return response
@@ -0,0 +1,187 @@
+"""
+The MIT License (MIT)
+
+Copyright (c) 2023-present RuslanUC
+
+Permission is hereby granted, free of charge, to any person obtaining a
+copy of this software and associated documentation files (the "Software"),
+to deal in the Software without restriction, including without limitation
+the rights to use, copy, modify, merge, publish, distribute, sublicense,
+and/or sell copies of the Software, and to permit persons to whom the
+Software is furnished to do so, subject to the following conditions:
+
+The above copyright notice and this permission notice shall be included in
+all copies or substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS
+OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING
+FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER
+DEALINGS IN THE SOFTWARE.
+"""
+
+import logging
+from collections import OrderedDict
+from concurrent.futures import Future
+from contextlib import contextmanager
+from contextvars import ContextVar, copy_context
+from functools import partial
+from queue import SimpleQueue, Empty
+from threading import Thread, Lock, current_thread
+from time import perf_counter
+from typing import Callable, Any, Optional, Iterator
+
+from django.conf import settings
+from django.db import connections, transaction, close_old_connections
+
+log = logging.getLogger(__name__)
+
+# Called with the sql and duration of every query run on any database while the caller is inside
+# observe_queries, including the writes it hands to a Writer
+_query_observers: ContextVar[tuple[Callable[[str, float], None], ...]] = ContextVar("query_observers", default=())
+
+
+@contextmanager
+def observe_queries(observer: Callable[[str, float], None]) -> Iterator[None]:
+    token = _query_observers.set((*_query_observers.get(), observer))
+    try:
+        yield
+    finally:
+        _query_observers.reset(token)
+
+
+def _observe_query(execute, sql, params, many, context):
+    if not (observers := _query_observers.get()):
+        return execute(sql, params, many, context)
+    start = perf_counter()
+    try:
+        return execute(sql, params, many, context)
+    finally:
+        duration = perf_counter() - start
+        for observer in observers:
+            observer(sql, duration)
+
+
+def install_query_observer(sender, connection, **kwargs) -> None:
+    if _observe_query not in connection.execute_wrappers:
+        connection.execute_wrappers.insert(0, _observe_query)
+
+
+def configure_sqlite(sender, connection, **kwargs) -> None:
+    if connection.vendor != "sqlite":
+        return
+    with connection.cursor() as cursor:
+        for name, value in getattr(settings, "TG_SQLITE_PRAGMAS", {}).items():
+            cursor.execute(f"PRAGMA {name} = {value}")
+
+
+class Writer:
+    # Runs all cache writes of the process to one database on one thread and connection. Writes queued
+    # while a transaction is running are committed together in the next one, each in its own savepoint
+    # so a failing write does not roll back the others. Callers are woken up after the commit.
+
+    def __init__(self, using: str, batch_size: int = 256):
+        self.using = using
+        self.batch_size = batch_size
+        self._queue: SimpleQueue[tuple[Future, Callable[[], Any]]] = SimpleQueue()
+        self._thread: Optional[Thread] = None
+        self._lock = Lock()
+
+    def _start(self) -> None:
+        with self._lock:
+            if self._thread is None:
+                self._thread = Thread(target=self._run, name=f"db-writer-{self.using}", daemon=True)
+                self._thread.start()
+
+    def submit(self, func: Callable[[], Any]) -> Future:
+        if self._thread is None:
+            self._start()
+        future = Future()
+        # The write runs in the caller's context so its queries are seen by the caller's observers
+        self._queue.put((future, partial(copy_context().run, func)))
+        return future
+
+    def run(self, func: Callable[[], Any]) -> Any:
+        if current_thread() is self._thread or connections[self.using].in_atomic_block:
+            return func()
+        return self.submit(func).result()
+
+    def _take_batch(self) -> list[tuple[Future, Callable[[], Any]]]:
+        batch = [self._queue.get()]
+        while len(batch) < self.batch_size:
+            try:
+                batch.append(self._queue.get_nowait())
+            except Empty:
+                break
+        return batch
+
+    def _run(self) -> None:
+        while True:
+            batch = self._take_batch()
+            close_old_connections()
+            done = []
+            try:
+                with transaction.atomic(using=self.using):
+                    for future, func in batch:
+                        if not future.set_running_or_notify_cancel():
+                            continue
+                        try:
+                            with transaction.atomic(using=self.using):
+                                done.append((future, func()))
+                        except Exception as e:
+                            future.set_exception(e)
+            except Exception as e:
+                log.exception("Failed to commit %d writes", len(done))
+                for future, _ in done:
+                    future.set_exception(e)
+            else:
+                for future, result in done:
+                    future.set_result(result)
+
+
+_writers: dict[str, Writer] = {}
+_writers_lock = Lock()
+
+
+def get_writer(using: str) -> Writer:
+    if (writer := _writers.get(using)) is None:
+        with _writers_lock:
+            writer = _writers.setdefault(using, Writer(using))
+    return writer
+
+
+def serialized_write(func: Callable[[], Any], using: str = "default") -> Any:
+    if getattr(settings, "TG_SERIALIZED_WRITES", False):
+        return get_writer(using).run(func)
+    return func()
+
+
+class DigestCache:
+    # Least recently used mapping of row keys to the content digest last written or read for them
+
+    def __init__(self, size: int):
+        self.size = size
+        self._items: OrderedDict[tuple, int] = OrderedDict()
+        self._lock = Lock()
+
+    def get(self, key: tuple) -> Optional[int]:
+        with self._lock:
+            if (digest := self._items.get(key)) is not None:
+                self._items.move_to_end(key)
+            return digest
+
+    def put(self, key: tuple, digest: int) -> None:
+        with self._lock:
+            self._items[key] = digest
+            self._items.move_to_end(key)
+            if len(self._items) > self.size:
+                self._items.popitem(last=False)
+
+    def discard(self, key: tuple) -> None:
+        with self._lock:
+            self._items.pop(key, None)
+
+
+digest_cache = DigestCache(getattr(settings, "TG_DIGEST_CACHE_SIZE", 100000))
@@ -0,0 +1,124 @@
+"""
+The MIT License (MIT)
+
+Copyright (c) 2023-present RuslanUC
+
+Permission is hereby granted, free of charge, to any person obtaining a
+copy of this software and associated documentation files (the "Software"),
+to deal in the Software without restriction, including without limitation
+the rights to use, copy, modify, merge, publish, distribute, sublicense,
+and/or sell copies of the Software, and to permit persons to whom the
+Software is furnished to do so, subject to the following conditions:
+
+The above copyright notice and this permission notice shall be included in
+all copies or substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS
+OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING
+FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER
+DEALINGS IN THE SOFTWARE.
+"""
+
+from json import loads
+from time import time
+from typing import Any, Optional
+
+from django.conf import settings
+from django.http import HttpRequest, HttpResponse, JsonResponse
+
+from proxy.db import serialized_write
+from proxy.metrics import registry
+from proxy.models import UndeliverableChat
+from proxy.routers import database_for, note_write, read_database_for_bot
+
+# Methods sending something to the chat in their chat_id parameter
+SEND_METHOD_PREFIXES = ("send", "forwardMessage", "copyMessage")
+# Errors that repeat for every send to the chat until the user or the chat does something
+UNDELIVERABLE_ERRORS = (
+    (403, "bot was blocked by the user"),
+    (403, "user is deactivated"),
+    (403, "bot was kicked from"),
+    (403, "bot is not a member of"),
+    (403, "bot can't initiate conversation with a user"),
+)
+# forwardMessage and copyMessage also answer "chat not found" for their from_chat_id, only sends record it
+SEND_ONLY_ERRORS = ((400, "chat not found"),)
+MEMBER_STATUSES = ("member", "administrator", "creator")
+
+
+def request_chat_id(request: HttpRequest) -> Optional[int]:
+    value = request.GET.get("chat_id")
+    if value is None and request.method == "POST":
+        # The body is read first so it is still available for forwarding after the form is parsed
+        body = request.body
+        if request.content_type == "application/json":
+            try:
+                value = loads(body).get("chat_id")
+            except (ValueError, AttributeError):
+                return None
+        else:
+            value = request.POST.get("chat_id")
+    try:
+        return int(value)
+    except (TypeError, ValueError):
+        return None
+
+
+def undeliverable_entry(bot_id: int, chat_id: int) -> Optional[tuple[int, str]]:
+    return UndeliverableChat.objects.using(read_database_for_bot(bot_id)).filter(
+        bot_id=bot_id, chat_id=chat_id, expires_at__gt=time()
+    ).values_list("error_code", "description").first()
+
+
+def undeliverable_response(entry: tuple[int, str]) -> HttpResponse:
+    error_code, description = entry
+    registry.inc("tg_proxy_undeliverable_total", result="rejected")
+    return JsonResponse({"ok": False, "error_code": error_code, "description": description}, status=error_code)
+
+
+def record_send_error(bot_id: int, chat_id: int, method: str, data: Any) -> bool:
+    if not (ttl := getattr(settings, "TG_UNDELIVERABLE_TTL", 0)) or not isinstance(data, dict):
+        return False
+    errors = UNDELIVERABLE_ERRORS + SEND_ONLY_ERRORS if method.startswith("send") else UNDELIVERABLE_ERRORS
+    error_code, description = data.get("error_code"), data.get("description")
+    if not isinstance(description, str) or not any(error_code == code and text in description
+                                                   for code, text in errors):
+        return False
+    using = database_for(UndeliverableChat, bot_id)
+    now = int(time())
+    serialized_write(lambda: UndeliverableChat.objects.using(using).update_or_create(
+        bot_id=bot_id, chat_id=chat_id,
+        defaults={"error_code": error_code, "description": description, "date": now, "expires_at": now + ttl},
+    ), using)
+    note_write(bot_id)
+    registry.inc("tg_proxy_undeliverable_total", result="recorded")
+    return True
+
+
+def clear_unblocked(bot_id: int, data: Any) -> int:
+    # my_chat_member updates of getUpdates responses, the bot was unblocked or added to the chat again
+    if not isinstance(data, dict) or not isinstance(data.get("result"), list):
+        return 0
+    chat_ids = set()
+    for update in data["result"]:
+        if isinstance(update, dict) and isinstance(member := update.get("my_chat_member"), dict) \
+                and member.get("new_chat_member", {}).get("status") in MEMBER_STATUSES:
+            chat_ids.add(member["chat"]["id"])
+    if not chat_ids:
+        return 0
+    deleted = delete_undeliverable(bot_id, list(chat_ids))
+    registry.inc("tg_proxy_undeliverable_total", deleted, result="cleared")
+    return deleted
+
+
+def delete_undeliverable(bot_id: int, chat_ids: Optional[list[int]] = None) -> int:
+    using = database_for(UndeliverableChat, bot_id)
+    entries = UndeliverableChat.objects.using(using).filter(
+        bot_id=bot_id, **{"chat_id__in": chat_ids} if chat_ids is not None else {}
+    )
+    deleted, _ = serialized_write(entries.delete, using)
+    note_write(bot_id)
+    return deleted
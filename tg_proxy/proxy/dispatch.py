@@ -0,0 +1,50 @@
+"""
+The MIT License (MIT)
+
+Copyright (c) 2023-present RuslanUC
+
+Permission is hereby granted, free of charge, to any person obtaining a
+copy of this software and associated documentation files (the "Software"),
+to deal in the Software without restriction, including without limitation
+the rights to use, copy, modify, merge, publish, distribute, sublicense,
+and/or sell copies of the Software, and to permit persons to whom the
+Software is furnished to do so, subject to the following conditions:
+
+The above copyright notice and this permission notice shall be included in
+all copies or substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS
+OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING
+FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER
+DEALINGS IN THE SOFTWARE.
+"""
+
+import re
+from typing import Callable
+
+from django.http import HttpRequest, HttpResponse
+
+from proxy.urls import BOT_API_VIEWS, BOT_API_PROXY_VIEW
+
+BOT_PATH_REGEX = re.compile(r"^/bot([^/]+)/([^/]+)$")
+
+
+class BotApiDispatcherMiddleware:
+    # Bot api requests are dispatched here directly, skipping url resolution and the rest of the middleware
+    # stack (sessions, auth, messages, clickjacking), which only the admin panel needs.
+
+    def __init__(self, get_response: Callable[[HttpRequest], HttpResponse]):
+        self.get_response = get_response
+
+    def __call__(self, request: HttpRequest) -> HttpResponse:
+        if (match := BOT_PATH_REGEX.match(request.path_info)) is None:
+            return self.get_response(request)
+        # CommonMiddleware is skipped as well, the Host header is still checked against ALLOWED_HOSTS
+        request.get_host()
+        bot_token, method = match.groups()
+        if (view := BOT_API_VIEWS.get(method)) is not None:
+            return view(request, bot_token)
+        return BOT_API_PROXY_VIEW(request, bot_token, method)
@@ -13,3 +13,11 @@ class RequestEntityTooLargeException(BaseProxyException):
 
 class NoMediaException(BaseProxyException):
     pass
+
+
+class BadRequestException(BaseProxyException):
+    pass
+
+
+class ChangeLogTrimmedException(BaseProxyException):
+    pass
@@ -0,0 +1,82 @@
+"""
+The MIT License (MIT)
+
+Copyright (c) 2023-present RuslanUC
+
+Permission is hereby granted, free of charge, to any person obtaining a
+copy of this software and associated documentation files (the "Software"),
+to deal in the Software without restriction, including without limitation
+the rights to use, copy, modify, merge, publish, distribute, sublicense,
+and/or sell copies of the Software, and to permit persons to whom the
+Software is furnished to do so, subject to the following conditions:
+
+The above copyright notice and this permission notice shall be included in
+all copies or substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS
+OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING
+FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER
+DEALINGS IN THE SOFTWARE.
+"""
+
+import heapq
+from typing import Iterator, Optional
+
+from proxy.archive import archive
+from proxy.compression import compress_stream
+from proxy.models import Message
+
+
+def _hot_messages(bot_id: int, chat_id: int, after: int, using: str, page_size: int,
+                  chunk_size: int) -> Iterator[tuple[int, str]]:
+    # Keyset pages keep every query (and on SQLite, every read transaction) short, rows of a page are streamed
+    # from the cursor in chunks.
+    messages = Message.objects.using(using).filter(bot_id=bot_id, chat_id=chat_id).order_by("message_id")
+    while True:
+        count = 0
+        page = messages.filter(message_id__gt=after).values_list("message_id", "serialized_message")[:page_size]
+        for message_id, serialized_message in page.iterator(chunk_size=chunk_size):
+            count += 1
+            after = message_id
+            yield message_id, serialized_message
+        if count < page_size:
+            return
+
+
+def _chat_messages(bot_id: int, chat_id: int, after: int, using: str, page_size: int,
+                   chunk_size: int) -> Iterator[str]:
+    # Archived messages are older than the hot ones, but a message can be in both after an interrupted archiving
+    last = None
+    for message_id, _, data in heapq.merge(
+            ((message_id, 0, data) for message_id, data in _hot_messages(bot_id, chat_id, after, using, page_size,
+                                                                         chunk_size)),
+            ((message_id, 1, data) for message_id, data in archive.iterate(bot_id, chat_id, after)),
+    ):
+        if message_id != last:
+            last = message_id
+            yield data
+
+
+def export_messages(bot_id: int, chat_id: Optional[int] = None, cursor: Optional[tuple[int, int]] = None,
+                    using: str = "default", page_size: int = 10000, chunk_size: int = 1000) -> Iterator[str]:
+    if chat_id is not None:
+        chat_ids = [chat_id]
+    else:
+        chat_ids = set(Message.objects.using(using).filter(bot_id=bot_id).values_list("chat_id", flat=True)
+                       .distinct().order_by())
+        chat_ids = sorted(chat_ids.union(archive.chats(bot_id)))
+    for current_chat_id in chat_ids:
+        after = 0
+        if cursor is not None:
+            if current_chat_id < cursor[0]:
+                continue
+            if current_chat_id == cursor[0]:
+                after = cursor[1]
+        yield from _chat_messages(bot_id, current_chat_id, after, using, page_size, chunk_size)
+
+
+def encode_ndjson(messages: Iterator[str], encoding: Optional[str] = None) -> Iterator[bytes]:
+    return compress_stream((message.encode("utf8") + b"\n" for message in messages), encoding)
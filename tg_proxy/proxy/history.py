@@ -0,0 +1,146 @@
+"""
+The MIT License (MIT)
+
+Copyright (c) 2023-present RuslanUC
+
+Permission is hereby granted, free of charge, to any person obtaining a
+copy of this software and associated documentation files (the "Software"),
+to deal in the Software without restriction, including without limitation
+the rights to use, copy, modify, merge, publish, distribute, sublicense,
+and/or sell copies of the Software, and to permit persons to whom the
+Software is furnished to do so, subject to the following conditions:
+
+The above copyright notice and this permission notice shall be included in
+all copies or substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS
+OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING
+FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER
+DEALINGS IN THE SOFTWARE.
+"""
+
+# Models import this module, they are imported lazily here.
+
+from json import dumps, loads
+from typing import Any, Optional
+
+SNAPSHOT_EVERY = 10
+# Strings shorter than this are replaced as a whole instead of being spliced
+MIN_SPLICE_LENGTH = 32
+
+
+def diff(old: Any, new: Any, path: tuple = ()) -> list:
+    # Operations turning old into new: ["=", path, value] sets, ["-", path] removes a key and
+    # ["~", path, start, end, text] replaces old[start:len(old) - end] of a string with text. Lists are set as a whole.
+    if isinstance(old, dict) and isinstance(new, dict):
+        ops = [["-", [*path, key]] for key in old if key not in new]
+        for key, value in new.items():
+            if key not in old:
+                ops.append(["=", [*path, key], value])
+            elif old[key] != value:
+                ops.extend(diff(old[key], value, (*path, key)))
+        return ops
+    if isinstance(old, str) and isinstance(new, str) and min(len(old), len(new)) >= MIN_SPLICE_LENGTH:
+        start = 0
+        limit = min(len(old), len(new))
+        while start < limit and old[start] == new[start]:
+            start += 1
+        end = 0
+        while end < limit - start and old[len(old) - end - 1] == new[len(new) - end - 1]:
+            end += 1
+        return [["~", list(path), start, end, new[start:len(new) - end]]]
+    return [["=", list(path), new]]
+
+
+def patch(document: Any, ops: list) -> Any:
+    # Changes the document in place where possible, the result has to be used for operations on the root
+    for op, path, *args in ops:
+        if not path:
+            document = args[0] if op == "=" else document[:args[0]] + args[2] + document[len(document) - args[1]:]
+            continue
+        parent = document
+        for key in path[:-1]:
+            parent = parent[key]
+        key = path[-1]
+        if op == "=":
+            parent[key] = args[0]
+        elif op == "-":
+            del parent[key]
+        else:
+            value = parent[key]
+            parent[key] = value[:args[0]] + args[2] + value[len(value) - args[1]:]
+    return document
+
+
+def find_edits(using: str, bot_id: int, rows: dict) -> list[tuple[int, int, int, str, str]]:
+    # Cached versions of the messages in rows that are being replaced by a new edit: (chat id, message id,
+    # digest, old serialized message, new serialized message)
+    from .models import Message
+
+    edited = {row_key: defaults["serialized_message"] for row_key, (_, defaults) in rows.items()
+              if '"edit_date"' in defaults["serialized_message"]}
+    if not edited:
+        return []
+    stored = Message.objects.using(using).filter(
+        bot_id=bot_id, message_id__in={message_id for message_id, _ in edited}
+    ).values_list("message_id", "chat_id", "digest", "serialized_message")
+    edits = []
+    for message_id, chat_id, digest, old in stored:
+        if (new := edited.get((message_id, chat_id))) is None or new == old:
+            continue
+        # Partial copies of messages (e.g. in reply_to_message) change the row too, only edits are versions
+        if (edit_date := loads(new).get("edit_date")) is None or edit_date == loads(old).get("edit_date"):
+            continue
+        edits.append((chat_id, message_id, digest, old, new))
+    return edits
+
+
+def record_edits(using: str, bot_id: int, edits: list[tuple[int, int, int, str, str]]) -> None:
+    from .models import MessageEdit, content_digest
+
+    entries = []
+    for chat_id, message_id, digest, old, new in edits:
+        old_message, new_message = loads(old), loads(new)
+        last = MessageEdit.objects.using(using).filter(bot_id=bot_id, chat_id=chat_id, message_id=message_id) \
+            .order_by("-version").values_list("version", "digest").first()
+        version = 0 if last is None else last[0] + 1
+        if last is None or last[1] != digest:
+            # The first edit, or the cached message was changed without being recorded: the chain restarts from it
+            entries.append(MessageEdit(bot_id=bot_id, chat_id=chat_id, message_id=message_id, version=version,
+                                       date=old_message.get("date") or 0, snapshot=True, data=old, digest=digest,
+                                       edit_date=old_message.get("edit_date") or old_message.get("date") or 0))
+            version += 1
+        snapshot = version % SNAPSHOT_EVERY == 0
+        entries.append(MessageEdit(bot_id=bot_id, chat_id=chat_id, message_id=message_id, version=version,
+                                   date=old_message.get("date") or 0, snapshot=snapshot,
+                                   data=new if snapshot else dumps(diff(old_message, new_message)),
+                                   digest=content_digest(new), edit_date=new_message["edit_date"]))
+    MessageEdit.objects.using(using).bulk_create(entries)
+
+
+def get_message_history(using: str, bot_id: int, chat_id: int, message_id: int, after: int = -1,
+                        limit: int = 100, version: Optional[int] = None) -> list[dict]:
+    # Versions are rebuilt from the snapshot at or before the first requested one
+    from .models import MessageEdit
+
+    first, last = (version, version) if version is not None else (after + 1, after + limit)
+    entries = MessageEdit.objects.using(using).filter(
+        bot_id=bot_id, chat_id=chat_id, message_id=message_id,
+        version__gte=first - first % SNAPSHOT_EVERY, version__lte=last,
+    ).order_by("version").values_list("version", "edit_date", "snapshot", "data")
+    result = []
+    message = None
+    for entry_version, edit_date, snapshot, data in entries:
+        if snapshot:
+            message = loads(data)
+        elif message is None:
+            # Versions before it were deleted
+            continue
+        else:
+            message = patch(message, loads(data))
+        if entry_version >= first:
+            result.append({"version": entry_version, "edit_date": edit_date, "message": loads(dumps(message))})
+    return result
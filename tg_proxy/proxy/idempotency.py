@@ -0,0 +1,181 @@
+"""
+The MIT License (MIT)
+
+Copyright (c) 2023-present RuslanUC
+
+Permission is hereby granted, free of charge, to any person obtaining a
+copy of this software and associated documentation files (the "Software"),
+to deal in the Software without restriction, including without limitation
+the rights to use, copy, modify, merge, publish, distribute, sublicense,
+and/or sell copies of the Software, and to permit persons to whom the
+Software is furnished to do so, subject to the following conditions:
+
+The above copyright notice and this permission notice shall be included in
+all copies or substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS
+OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING
+FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER
+DEALINGS IN THE SOFTWARE.
+"""
+
+from functools import wraps
+from hashlib import blake2b
+from time import time, monotonic, sleep
+from typing import Optional
+
+from django.conf import settings
+from django.db import IntegrityError, transaction
+from django.http import HttpRequest, HttpResponse, JsonResponse
+
+from proxy.compression import decompress
+from proxy.db import serialized_write
+from proxy.metrics import registry
+from proxy.models import IdempotencyKey
+from proxy.routers import database_for
+from proxy.utils import token_bot_id, invalid_token_response
+
+MAX_KEY_LENGTH = 255
+TRIM_EVERY = 1000
+
+_inserted = 0
+
+
+def request_fingerprint(request: HttpRequest, bot_token: str, method: str) -> str:
+    # The token is part of the fingerprint so a key can not be used to replay a response with another token
+    fingerprint = blake2b(f"{bot_token}\0{method}\0{request.method}\0".encode(), digest_size=16)
+    for name, values in sorted(request.GET.lists()):
+        fingerprint.update(f"{name}={values!r}\0".encode())
+    body = request.body
+    if request.content_type != "multipart/form-data":
+        fingerprint.update(body)
+        return fingerprint.hexdigest()
+    # Multipart boundaries are random, so retries of the same upload only have the same fields and files
+    for name, values in sorted(request.POST.lists()):
+        fingerprint.update(f"{name}={values!r}\0".encode())
+    for name, files in sorted(request.FILES.lists()):
+        for file in files:
+            fingerprint.update(f"{name}={file.name!r}:{file.size}\0".encode())
+            for chunk in file.chunks():
+                fingerprint.update(chunk)
+            file.seek(0)
+    return fingerprint.hexdigest()
+
+
+def _insert(using: str, bot_id: int, key: str, fingerprint: str, now: float) -> Optional[int]:
+    def write() -> Optional[int]:
+        global _inserted
+        try:
+            with transaction.atomic(using=using):
+                entry = IdempotencyKey.objects.using(using).create(
+                    bot_id=bot_id, key=key, fingerprint=fingerprint, created_at=now,
+                    locked_until=now + getattr(settings, "TG_IDEMPOTENCY_LOCK", 600),
+                    expires_at=now + getattr(settings, "TG_IDEMPOTENCY_TTL", 86400),
+                )
+        except IntegrityError:
+            return None
+        _inserted += 1
+        if _inserted >= TRIM_EVERY:
+            _inserted = 0
+            IdempotencyKey.objects.using(using).filter(expires_at__lte=now).delete()
+        return entry.pk
+
+    return serialized_write(write, using)
+
+
+def _take_over(using: str, entry: IdempotencyKey, fingerprint: str, now: float) -> bool:
+    # Conditional on the entry being unchanged, so only one of the requests finding it expired gets it
+    return serialized_write(lambda: IdempotencyKey.objects.using(using).filter(
+        pk=entry.pk, locked_until=entry.locked_until, expires_at=entry.expires_at
+    ).update(
+        fingerprint=fingerprint, status_code=None, content_type="", body=b"", created_at=now,
+        locked_until=now + getattr(settings, "TG_IDEMPOTENCY_LOCK", 600),
+        expires_at=now + getattr(settings, "TG_IDEMPOTENCY_TTL", 86400),
+    ), using) == 1
+
+
+def _error(code: int, description: str) -> JsonResponse:
+    return JsonResponse({"ok": False, "error_code": code, "description": description}, status=code)
+
+
+def acquire(bot_id: int, key: str, fingerprint: str) -> tuple[Optional[int], Optional[HttpResponse]]:
+    # Returns the id of the claimed entry, or the response to send instead of executing the request
+    using = database_for(IdempotencyKey, bot_id)
+    deadline = monotonic() + getattr(settings, "TG_IDEMPOTENCY_WAIT", 60)
+    delay = 0.05
+    while True:
+        now = time()
+        if (entry_id := _insert(using, bot_id, key, fingerprint, now)) is not None:
+            return entry_id, None
+        entry = IdempotencyKey.objects.using(using).filter(bot_id=bot_id, key=key).first()
+        if entry is None:
+            continue
+        # Expired entries and entries of requests that died while running are reused
+        if entry.expires_at <= now or (entry.status_code is None and entry.locked_until <= now):
+            if _take_over(using, entry, fingerprint, now):
+                return entry.pk, None
+            continue
+        if entry.fingerprint != fingerprint:
+            registry.inc("tg_proxy_idempotency_total", result="mismatch")
+            return None, _error(422, "Unprocessable Entity: idempotency key was used with different parameters")
+        if entry.status_code is not None:
+            registry.inc("tg_proxy_idempotency_total", result="replayed")
+            response = HttpResponse(bytes(entry.body), status=entry.status_code, content_type=entry.content_type)
+            response["Idempotent-Replayed"] = "true"
+            return None, response
+        if monotonic() >= deadline:
+            registry.inc("tg_proxy_idempotency_total", result="conflict")
+            return None, _error(409, "Conflict: a request with this idempotency key is still in progress")
+        sleep(delay)
+        delay = min(delay * 2, 0.5)
+
+
+def release(bot_id: int, entry_id: int, response: Optional[HttpResponse]) -> None:
+    using = database_for(IdempotencyKey, bot_id)
+    entries = IdempotencyKey.objects.using(using).filter(pk=entry_id, status_code=None)
+    # Server errors and flood waits are not stored, a retry with the same key executes the request again
+    if response is None or response.streaming or response.status_code >= 500 or response.status_code == 429:
+        serialized_write(lambda: entries.delete(), using)
+        return
+    body = response.content
+    if (encoding := response.get("Content-Encoding", "identity").lower()) != "identity":
+        try:
+            body = decompress(body, encoding)
+        except ValueError:
+            serialized_write(lambda: entries.delete(), using)
+            return
+    serialized_write(lambda: entries.update(
+        status_code=response.status_code, content_type=response.get("Content-Type", ""), body=body,
+        expires_at=time() + getattr(settings, "TG_IDEMPOTENCY_TTL", 86400),
+    ), using)
+
+
+def idempotent(view):
+    @wraps(view)
+    def wrapper(request: HttpRequest, bot_token: str, method: str) -> HttpResponse:
+        key = request.headers.get("Idempotency-Key")
+        if "idempotency_key" in request.GET:
+            # The parameter is not forwarded to the Bot API
+            key = key or request.GET["idempotency_key"]
+            request.GET = request.GET.copy()
+            del request.GET["idempotency_key"]
+        if not key or not getattr(settings, "TG_IDEMPOTENCY_TTL", 0):
+            return view(request, bot_token, method)
+        if (bot_id := token_bot_id(bot_token)) is None:
+            return invalid_token_response()
+        if len(key) > MAX_KEY_LENGTH:
+            return _error(400, "Bad Request: invalid idempotency key")
+        entry_id, response = acquire(bot_id, key, request_fingerprint(request, bot_token, method))
+        if response is not None:
+            return response
+        try:
+            response = view(request, bot_token, method)
+        finally:
+            release(bot_id, entry_id, response)
+        registry.inc("tg_proxy_idempotency_total", result="executed")
+        return response
+
+    return wrapper
@@ -0,0 +1,473 @@
+"""
+The MIT License (MIT)
+
+Copyright (c) 2023-present RuslanUC
+
+Permission is hereby granted, free of charge, to any person obtaining a
+copy of this software and associated documentation files (the "Software"),
+to deal in the Software without restriction, including without limitation
+the rights to use, copy, modify, merge, publish, distribute, sublicense,
+and/or sell copies of the Software, and to permit persons to whom the
+Software is furnished to do so, subject to the following conditions:
+
+The above copyright notice and this permission notice shall be included in
+all copies or substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS
+OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING
+FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER
+DEALINGS IN THE SOFTWARE.
+"""
+
+import gzip
+import os
+import re
+from contextlib import contextmanager
+from json import JSONDecoder, JSONDecodeError, dumps, loads
+from multiprocessing import Pool
+from time import perf_counter
+from typing import Any, Callable, Iterator, Optional, TextIO
+
+from django.db import connections, transaction
+
+from proxy import pydantic_models
+from proxy.models import Message, Chat, User, CacheVersion
+from proxy.routers import database_for
+from proxy.utils import required_keys
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+WHITESPACE_REGEX = re.compile(r"[ \t\n\r]*")
+
+# Entities are recognized by the required keys of the models proxy_view validates responses with. Dumps come from
+# Telegram, so their content is not validated, which would cost more than everything else together.
+ENTITY_KEYS = ((required_keys(pydantic_models.Message), Message), (required_keys(pydantic_models.Chat), Chat),
+               (required_keys(pydantic_models.User), User))
+IMPORTED_MODELS = {
+    # Model: (id field, unique fields, fields written)
+    Message: ("message_id", ("bot_id", "chat_id", "message_id"),
+              ("message_id", "chat_id", "bot_id", "message_thread_id", "reply_to_message_id", "from_peer", "date",
+               "serialized_message", "digest")),
+    Chat: ("id", ("id", "bot_id"), ("id", "bot_id", "type", "serialized_chat", "digest")),
+    User: ("id", ("id",), ("id", "username", "first_name", "last_name", "serialized_user", "digest")),
+}
+
+DESKTOP_CHAT_TYPES = {
+    "personal_chat": "private", "bot_chat": "private", "saved_messages": "private", "private_group": "group",
+    "private_supergroup": "supergroup", "public_supergroup": "supergroup", "private_channel": "channel",
+    "public_channel": "channel",
+}
+
+
+class StreamReader:
+    # Incremental reader of a JSON document. Objects and arrays on the way to the imported items are walked token
+    # by token, the items and everything else are decoded whole by the C decoder.
+
+    def __init__(self, file: TextIO, chunk_size: int = 1 << 20):
+        self.file = file
+        self.chunk_size = chunk_size
+        self.buffer = ""
+        self.pos = 0
+        self.eof = False
+        self._decoder = JSONDecoder()
+
+    def _fill(self, size: int) -> bool:
+        data = self.file.read(size)
+        if not data:
+            self.eof = True
+            return False
+        self.buffer = self.buffer[self.pos:] + data
+        self.pos = 0
+        return True
+
+    def peek(self) -> str:
+        while True:
+            self.pos = WHITESPACE_REGEX.match(self.buffer, self.pos).end()
+            if self.pos < len(self.buffer):
+                return self.buffer[self.pos]
+            if not self._fill(self.chunk_size):
+                return ""
+
+    def expect(self, chars: str) -> str:
+        if (char := self.peek()) == "" or char not in chars:
+            raise ValueError(f"Expected one of {chars!r} but found {char!r}")
+        self.pos += 1
+        return char
+
+    def value(self) -> Any:
+        self.peek()
+        size = self.chunk_size
+        while True:
+            try:
+                value, end = self._decoder.raw_decode(self.buffer, self.pos)
+                # A number at the end of the buffer may continue in the next chunk
+                if end < len(self.buffer) or self.eof or self.buffer[end - 1] in "\"]}el":
+                    self.pos = end
+                    return value
+            except JSONDecodeError:
+                if self.eof:
+                    raise
+            # Values larger than the buffer are read in growing chunks so decoding them is not quadratic
+            self._fill(size)
+            size *= 2
+
+    def array_items(self) -> Iterator[None]:
+        # The caller reads every item
+        self.expect("[")
+        if self.peek() == "]":
+            self.pos += 1
+            return
+        while True:
+            yield
+            if self.expect(",]") == "]":
+                return
+
+    def object_keys(self) -> Iterator[str]:
+        # The caller reads the value of every key
+        self.expect("{")
+        if self.peek() == "}":
+            self.pos += 1
+            return
+        while True:
+            key = self.value()
+            self.expect(":")
+            yield key
+            if self.expect(",}") == "}":
+                return
+
+
+def _desktop_items(reader: StreamReader, chat: dict) -> Iterator[tuple[dict, dict]]:
+    # Single chat exports are a chat object, full exports have them in chats.list and left_chats.list. The name,
+    # type and id of a chat come before its messages.
+    for key in reader.object_keys():
+        char = reader.peek()
+        if key == "messages" and char == "[":
+            chat = dict(chat)
+            for _ in reader.array_items():
+                yield chat, reader.value()
+        elif key in ("chats", "left_chats") and char == "{":
+            yield from _desktop_items(reader, {})
+        elif key == "list" and char == "[":
+            for _ in reader.array_items():
+                if reader.peek() == "{":
+                    yield from _desktop_items(reader, {})
+                else:
+                    reader.value()
+        else:
+            chat[key] = reader.value()
+
+
+def _desktop_text(text: Any) -> str:
+    if isinstance(text, list):
+        return "".join(part if isinstance(part, str) else part.get("text", "") for part in text)
+    return text or ""
+
+
+def _desktop_peer_id(peer_type: str, peer_id: int) -> int:
+    if peer_type in ("supergroup", "channel"):
+        return int(f"-100{peer_id}")
+    if peer_type == "group":
+        return -peer_id
+    return peer_id
+
+
+def desktop_message(chat: dict, message: dict) -> Optional[dict]:
+    # Telegram Desktop export message in the Bot API format. Service messages are skipped, media is not
+    # included (exports do not have file ids) and replied messages only have their id and chat.
+    if message.get("type") != "message" or "id" not in chat:
+        return None
+    chat_type = DESKTOP_CHAT_TYPES.get(chat.get("type"), "private")
+    name_field = "first_name" if chat_type == "private" else "title"
+    result = {
+        "message_id": message["id"],
+        "date": int(message["date_unixtime"]) if "date_unixtime" in message else 0,
+        "chat": {"id": _desktop_peer_id(chat_type, chat["id"]), "type": chat_type, name_field: chat.get("name") or ""},
+    }
+    from_id = message.get("from_id") or ""
+    if from_id.startswith("user"):
+        result["from"] = {"id": int(from_id[4:]), "is_bot": False, "first_name": message.get("from") or ""}
+    elif from_id.startswith("channel"):
+        result["sender_chat"] = {"id": _desktop_peer_id("channel", int(from_id[7:])), "type": "channel",
+                                 "title": message.get("from") or ""}
+    if "edited_unixtime" in message:
+        result["edit_date"] = int(message["edited_unixtime"])
+    if "forwarded_from" in message:
+        result["forward_sender_name"] = message["forwarded_from"]
+    if "reply_to_message_id" in message:
+        result["reply_to_message"] = {"message_id": message["reply_to_message_id"], "chat": result["chat"]}
+    if text := _desktop_text(message.get("text")):
+        result["caption" if "photo" in message or "file" in message else "text"] = text
+    return result
+
+
+def _find_entities(d: Any, found: dict) -> None:
+    if isinstance(d, dict):
+        keys = d.keys()
+        for required, model in ENTITY_KEYS:
+            if required <= keys:
+                found[model].append(d)
+        for value in d.values():
+            if isinstance(value, (dict, list)):
+                _find_entities(value, found)
+    elif isinstance(d, list):
+        for item in d:
+            _find_entities(item, found)
+
+
+def _collect(item: Any, entities: dict) -> None:
+    # Entities repeated in the batch (chats and senders of every message) are only converted once, the last
+    # version wins like with consecutive proxy_view writes
+    found = {Message: [], Chat: [], User: []}
+    _find_entities(item, found)
+    for d in found[Message]:
+        entities[Message][(d["chat"]["id"], d["message_id"])] = d
+    for d in found[Chat]:
+        entities[Chat][d["id"]] = d
+    for d in found[User]:
+        entities[User][d["id"]] = d
+
+
+def _convert(bot_id: int, entities: dict) -> dict:
+    rows = {}
+    for model, dicts in entities.items():
+        id_field, unique_fields, fields = IMPORTED_MODELS[model]
+        model_rows = rows[model] = {}
+        for d in dicts.values():
+            values = model.fields_from_dict(bot_id, d)
+            values[id_field] = d[id_field]
+            model_rows[tuple(values[field] for field in unique_fields)] = tuple(values[field] for field in fields)
+    return rows
+
+
+def _collect_lines(lines: list[bytes], entities: dict) -> None:
+    for line in lines:
+        _collect(orjson.loads(line) if orjson is not None else loads(line), entities)
+
+
+def _convert_chunk(args: tuple[int, list[bytes]]) -> tuple[int, dict]:
+    bot_id, lines = args
+    entities = {Message: {}, Chat: {}, User: {}}
+    _collect_lines(lines, entities)
+    return len(lines), _convert(bot_id, entities)
+
+
+def _open(path: str) -> TextIO:
+    if path.endswith(".gz"):
+        return gzip.open(path, "rt", encoding="utf8")
+    return open(path, encoding="utf8")
+
+
+def detect_format(path: str) -> str:
+    name = path[:-3] if path.endswith(".gz") else path
+    if name.endswith((".jsonl", ".ndjson")):
+        return "lines"
+    with _open(path) as file:
+        reader = StreamReader(file, 64 * 1024)
+        if reader.peek() != "{":
+            return "updates"
+        for key in reader.object_keys():
+            if key in ("messages", "chats", "left_chats", "personal_information"):
+                return "desktop"
+            if key == "result":
+                return "updates"
+            reader.value()
+    return "updates"
+
+
+def _json_items(path: str, input_format: str) -> Iterator[Any]:
+    with _open(path) as file:
+        reader = StreamReader(file)
+        if input_format == "desktop":
+            for chat, message in _desktop_items(reader, {}):
+                yield desktop_message(chat, message)
+            return
+        # Updates: an array of updates, a getUpdates response or a single update
+        if reader.peek() == "[":
+            for _ in reader.array_items():
+                yield reader.value()
+        elif reader.peek() == "{":
+            rest = {}
+            response = False
+            for key in reader.object_keys():
+                if key == "result" and reader.peek() == "[":
+                    response = True
+                    for _ in reader.array_items():
+                        yield reader.value()
+                else:
+                    rest[key] = reader.value()
+            if not response:
+                yield rest
+
+
+def _line_chunks(path: str, skip: int, chunk_size: int) -> Iterator[list[bytes]]:
+    opener = gzip.open if path.endswith(".gz") else open
+    with opener(path, "rb") as file:
+        chunk = []
+        for line in file:
+            if not line.strip():
+                continue
+            if skip:
+                skip -= 1
+                continue
+            chunk.append(line)
+            if len(chunk) == chunk_size:
+                yield chunk
+                chunk = []
+        if chunk:
+            yield chunk
+
+
+def _insert_sql(model: type, connection, overwrite: bool) -> str:
+    _, unique_fields, fields = IMPORTED_MODELS[model]
+    quote = connection.ops.quote_name
+    columns = [model._meta.get_field(field).column for field in fields]
+    unique_columns = [model._meta.get_field(field).column for field in unique_fields]
+    sql = f"INSERT INTO {quote(model._meta.db_table)} ({', '.join(map(quote, columns))}) " \
+          f"VALUES ({', '.join(['%s'] * len(columns))}) ON CONFLICT ({', '.join(map(quote, unique_columns))}) "
+    if not overwrite:
+        return sql + "DO NOTHING"
+    return sql + "DO UPDATE SET " + ", ".join(
+        f"{quote(column)} = excluded.{quote(column)}" for column in columns if column not in unique_columns
+    )
+
+
+def _missing_message_indexes(using: str) -> list:
+    connection = connections[using]
+    with connection.cursor() as cursor:
+        existing = connection.introspection.get_constraints(cursor, Message._meta.db_table)
+    return [index for index in Message._meta.indexes if index.name not in existing]
+
+
+@contextmanager
+def deferred_message_indexes(bot_id: int) -> Iterator[None]:
+    # Secondary indexes of messages halve the insert rate, they are dropped during the import and built once after it
+    # (also when a previous import with deferred indexes was interrupted)
+    using = database_for(Message, bot_id)
+    missing = _missing_message_indexes(using)
+    with connections[using].schema_editor() as editor:
+        for index in Message._meta.indexes:
+            if index not in missing:
+                editor.remove_index(Message, index)
+    try:
+        yield
+    finally:
+        with connections[using].schema_editor() as editor:
+            for index in _missing_message_indexes(using):
+                editor.add_index(Message, index)
+
+
+class HistoryImporter:
+    # Writes entities of the imported items in batches, one transaction per database and batch. Without overwrite
+    # rows already in the cache are kept: they are newer than the history.
+
+    def __init__(self, bot_id: int, batch_size: int = 20000, overwrite: bool = False, workers: int = 1,
+                 checkpoint: Optional[str] = None, progress: Optional[Callable[[dict], None]] = None):
+        self.bot_id = bot_id
+        self.batch_size = batch_size
+        self.overwrite = overwrite
+        self.workers = workers
+        self.checkpoint = checkpoint
+        self.progress = progress
+        self.positions = {}
+        if checkpoint is not None and os.path.exists(checkpoint):
+            with open(checkpoint) as file:
+                self.positions = loads(file.read())
+        self.stats = {"items": 0, "skipped_items": 0, "messages": 0, "chats": 0, "users": 0, "seconds": 0.0}
+        self._rows = {Message: {}, Chat: {}, User: {}}
+        self._entities = {Message: {}, Chat: {}, User: {}}
+        self._start = None
+
+    def _save_checkpoint(self) -> None:
+        if self.checkpoint is None:
+            return
+        with open(f"{self.checkpoint}.tmp", "w") as file:
+            file.write(dumps(self.positions))
+        os.replace(f"{self.checkpoint}.tmp", self.checkpoint)
+
+    def _merge(self, rows: dict) -> None:
+        for model, model_rows in rows.items():
+            self._rows[model].update(model_rows)
+
+    def _flush(self, path: str, position: int) -> None:
+        self._merge(_convert(self.bot_id, self._entities))
+        self._entities = {Message: {}, Chat: {}, User: {}}
+        statements = {}
+        for model, model_rows in self._rows.items():
+            if model_rows:
+                using = database_for(model, self.bot_id)
+                statements.setdefault(using, []).append((model, list(model_rows.values())))
+        for using, model_rows in statements.items():
+            connection = connections[using]
+            with transaction.atomic(using=using), connection.cursor() as cursor:
+                for model, rows in model_rows:
+                    cursor.executemany(_insert_sql(model, connection, self.overwrite), rows)
+                    if model is Message:
+                        CacheVersion.bump(using, self.bot_id, {chat_id for _, chat_id, *_ in rows})
+                    elif model is Chat:
+                        CacheVersion.bump(using, self.bot_id, [CacheVersion.BOT_CHATS])
+        self.stats["messages"] += len(self._rows[Message])
+        self.stats["chats"] += len(self._rows[Chat])
+        self.stats["users"] += len(self._rows[User])
+        self._rows = {Message: {}, Chat: {}, User: {}}
+        self.positions[path] = position
+        self._save_checkpoint()
+        self.stats["seconds"] = perf_counter() - self._start
+        if self.progress is not None:
+            self.progress(self.stats)
+
+    def import_file(self, path: str, input_format: Optional[str] = None) -> dict:
+        if self._start is None:
+            self._start = perf_counter()
+        input_format = input_format or detect_format(path)
+        path_key = os.path.abspath(path)
+        position = self.positions.get(path_key, 0)
+        self.stats["skipped_items"] += position
+        if input_format == "lines":
+            self._import_lines(path_key, position)
+        else:
+            self._import_json(path_key, input_format, position)
+        return self.stats
+
+    def _import_lines(self, path: str, position: int) -> None:
+        chunks = _line_chunks(path, position, 1000)
+        pending = 0
+        if self.workers > 1:
+            # Forked workers must not share the connections of this process
+            connections.close_all()
+            with Pool(self.workers) as pool:
+                for count, rows in pool.imap(_convert_chunk, ((self.bot_id, chunk) for chunk in chunks)):
+                    self._merge(rows)
+                    position, pending = self._advance(path, position, pending, count)
+        else:
+            for chunk in chunks:
+                _collect_lines(chunk, self._entities)
+                position, pending = self._advance(path, position, pending, len(chunk))
+        if pending:
+            self._flush(path, position)
+
+    def _advance(self, path: str, position: int, pending: int, count: int) -> tuple[int, int]:
+        position += count
+        pending += count
+        self.stats["items"] += count
+        if pending >= self.batch_size:
+            self._flush(path, position)
+            pending = 0
+        return position, pending
+
+    def _import_json(self, path: str, input_format: str, position: int) -> None:
+        pending = 0
+        for index, item in enumerate(_json_items(path, input_format)):
+            if index < position:
+                continue
+            if item is not None:
+                _collect(item, self._entities)
+            position, pending = self._advance(path, position, pending, 1)
+        if pending:
+            self._flush(path, position)
+
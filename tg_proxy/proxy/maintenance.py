@@ -0,0 +1,452 @@
+"""
+The MIT License (MIT)
+
+Copyright (c) 2023-present RuslanUC
+
+Permission is hereby granted, free of charge, to any person obtaining a
+copy of this software and associated documentation files (the "Software"),
+to deal in the Software without restriction, including without limitation
+the rights to use, copy, modify, merge, publish, distribute, sublicense,
+and/or sell copies of the Software, and to permit persons to whom the
+Software is furnished to do so, subject to the following conditions:
+
+The above copyright notice and this permission notice shall be included in
+all copies or substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS
+OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING
+FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER
+DEALINGS IN THE SOFTWARE.
+"""
+
+import logging
+from threading import Thread
+from time import sleep, time
+from typing import Optional
+
+from django.conf import settings
+from django.db import connections, transaction
+from django.db.models import Sum
+from django.db.models.functions import Length
+
+from proxy.archive import archive, archive_messages, message_date, segment_dates
+from proxy.models import Message, Chat, ChatMember, Webhook, BotSession, BotShard, CacheVersion, UndeliverableChat, \
+    Broadcast, BroadcastTarget, IdempotencyKey, MessageEdit, ChangeLog
+from proxy.routers import GLOBAL_DATABASE, shards, shard_for_bot, forget_placement
+from proxy.stats import STATS_MODELS, rebuild_chat_stats, forget_messages, archived_message
+
+log = logging.getLogger(__name__)
+
+MESSAGE_TABLE = "proxy_message"
+MESSAGE_KEY = ("bot_id", "chat_id", "message_id")
+MESSAGE_KEY_INDEX = "unique_message_bot_chat"
+
+
+def _sqlite_cluster_messages(using: str, batch_size: int) -> int:
+    # SQLite stores rows in rowid order, so the table is rewritten with ids assigned in
+    # (bot_id, chat_id, message_id) order. Rows are copied in small keyset batches, each in its own
+    # transaction, and only the final catch-up of concurrent changes and the table swap hold the write lock.
+    connection = connections[using]
+    new_table = f"{MESSAGE_TABLE}__clustered"
+    key = ", ".join(MESSAGE_KEY)
+    key_desc = ", ".join(f"{field} DESC" for field in MESSAGE_KEY)
+    with connection.cursor() as cursor:
+        cursor.execute("SELECT sql FROM sqlite_master WHERE type = 'table' AND name = %s", [MESSAGE_TABLE])
+        table_sql = cursor.fetchone()[0]
+        cursor.execute("SELECT sql FROM sqlite_master WHERE type = 'index' AND tbl_name = %s AND sql IS NOT NULL",
+                       [MESSAGE_TABLE])
+        index_sqls = [row[0] for row in cursor.fetchall()]
+        columns = [col.name for col in connection.introspection.get_table_description(cursor, MESSAGE_TABLE)
+                   if col.name != "id"]
+        column_list = ", ".join(f'"{column}"' for column in columns)
+
+        cursor.execute(f'DROP TABLE IF EXISTS "{new_table}"')
+        cursor.execute(table_sql.replace(f'"{MESSAGE_TABLE}"', f'"{new_table}"', 1))
+
+    copied = 0
+    last = None
+    while True:
+        with transaction.atomic(using=using), connection.cursor() as cursor:
+            where = f"WHERE ({key}) > (%s, %s, %s)" if last is not None else ""
+            cursor.execute(
+                f'INSERT INTO "{new_table}" ({column_list}) SELECT {column_list} FROM "{MESSAGE_TABLE}" {where} '
+                f"ORDER BY {key} LIMIT %s", [*(last or ()), batch_size]
+            )
+            if cursor.rowcount <= 0:
+                break
+            copied += cursor.rowcount
+            cursor.execute(f'SELECT {key} FROM "{new_table}" ORDER BY {key_desc} LIMIT 1')
+            last = cursor.fetchone()
+
+    match = " AND ".join(f"n.{field} = o.{field}" for field in MESSAGE_KEY)
+    with transaction.atomic(using=using), connection.cursor() as cursor:
+        cursor.execute(f'DELETE FROM "{new_table}" AS n WHERE NOT EXISTS '
+                       f'(SELECT 1 FROM "{MESSAGE_TABLE}" AS o WHERE {match})')
+        cursor.execute(f'INSERT OR REPLACE INTO "{new_table}" ({column_list}) SELECT {column_list} '
+                       f'FROM "{MESSAGE_TABLE}" AS o WHERE NOT EXISTS (SELECT 1 FROM "{new_table}" AS n '
+                       f"WHERE {match} AND n.serialized_message = o.serialized_message) ORDER BY {key}")
+        cursor.execute(f'DROP TABLE "{MESSAGE_TABLE}"')
+        cursor.execute(f'ALTER TABLE "{new_table}" RENAME TO "{MESSAGE_TABLE}"')
+        for index_sql in index_sqls:
+            cursor.execute(index_sql)
+    return copied
+
+
+def cluster_messages(using: str = "default", batch_size: int = 10000) -> int:
+    connection = connections[using]
+    if connection.vendor == "sqlite":
+        return _sqlite_cluster_messages(using, batch_size)
+    if connection.vendor == "postgresql":
+        with connection.cursor() as cursor:
+            cursor.execute(f'CLUSTER "{MESSAGE_TABLE}" USING "{MESSAGE_KEY_INDEX}"')
+            cursor.execute(f'ANALYZE "{MESSAGE_TABLE}"')
+            cursor.execute(f'SELECT COUNT(*) FROM "{MESSAGE_TABLE}"')
+            return cursor.fetchone()[0]
+    return 0
+
+
+def get_retention_policy(bot_id: int, chat_type: Optional[str] = None) -> dict:
+    retention = getattr(settings, "TG_RETENTION", {})
+    return {
+        **retention.get("default", {}),
+        **(retention.get("chat_types", {}).get(chat_type, {}) if chat_type is not None else {}),
+        **retention.get("bots", {}).get(bot_id, {}),
+    }
+
+
+def _delete_in_batches(queryset, using: str, batch_size: int, pause: float) -> int:
+    deleted = 0
+    while pks := list(queryset.values_list("pk", flat=True)[:batch_size]):
+        with transaction.atomic(using=using):
+            queryset.model.objects.using(using).filter(pk__in=pks).delete()
+        deleted += len(pks)
+        sleep(pause)
+    return deleted
+
+
+STATS_FIELDS = ("id", "message_id", "chat_id", "from_peer", "date", "serialized_message")
+
+
+def _delete_messages(bot_id: int, queryset, using: str, batch_size: int, pause: float) -> int:
+    # Deleted messages are taken out of the chat statistics in the same transaction
+    deleted = 0
+    while batch := list(queryset.values(*STATS_FIELDS)[:batch_size]):
+        with transaction.atomic(using=using):
+            Message.objects.using(using).filter(pk__in=[message["id"] for message in batch]).delete()
+            forget_messages(using, bot_id, batch)
+        deleted += len(batch)
+        sleep(pause)
+    return deleted
+
+
+def _enforce_bytes_quota(bot_id: int, max_bytes: int, using: str, batch_size: int, pause: float) -> int:
+    messages = Message.objects.using(using).filter(bot_id=bot_id)
+    total = messages.aggregate(size=Sum(Length("serialized_message")))["size"] or 0
+    deleted = 0
+    while total > max_bytes:
+        oldest = list(messages.order_by("date", "id").annotate(size=Length("serialized_message"))
+                      .values(*STATS_FIELDS, "size")[:batch_size])
+        if not oldest:
+            break
+        removed = []
+        chats = {}
+        for message in oldest:
+            if total <= max_bytes:
+                break
+            removed.append(message)
+            chats.setdefault(message["chat_id"], []).append(message["message_id"])
+            total -= message["size"]
+        with transaction.atomic(using=using):
+            Message.objects.using(using).filter(id__in=[message["id"] for message in removed]).delete()
+            for chat_id, message_ids in chats.items():
+                MessageEdit.objects.using(using).filter(bot_id=bot_id, chat_id=chat_id,
+                                                        message_id__in=message_ids).delete()
+            CacheVersion.bump(using, bot_id, chats)
+            forget_messages(using, bot_id, removed)
+        deleted += len(removed)
+        sleep(pause)
+    return deleted
+
+
+def apply_retention(using: str = "default", batch_size: int = 1000, pause: float = 0.01) -> dict:
+    stats = {"max_age": 0, "max_messages_per_chat": 0, "max_bytes": 0}
+    messages = Message.objects.using(using)
+    for bot_id in messages.values_list("bot_id", flat=True).distinct().order_by():
+        chat_types = dict(Chat.objects.using(using).filter(bot_id=bot_id).values_list("id", "type"))
+        for chat_id in messages.filter(bot_id=bot_id).values_list("chat_id", flat=True).distinct().order_by():
+            policy = get_retention_policy(bot_id, chat_types.get(chat_id))
+            chat_messages = messages.filter(bot_id=bot_id, chat_id=chat_id)
+            # Edit history of the deleted messages goes with them
+            chat_edits = MessageEdit.objects.using(using).filter(bot_id=bot_id, chat_id=chat_id)
+            deleted = 0
+            if max_age_days := policy.get("max_age_days"):
+                deleted += _delete_messages(
+                    bot_id, chat_messages.filter(date__lt=time() - max_age_days * 86400), using, batch_size, pause
+                )
+                _delete_in_batches(chat_edits.filter(date__lt=time() - max_age_days * 86400), using, batch_size,
+                                   pause)
+                stats["max_age"] += deleted
+            if max_messages := policy.get("max_messages_per_chat"):
+                newest = chat_messages.order_by("-message_id").values_list("message_id", flat=True)
+                if cutoff := newest[max_messages:max_messages + 1]:
+                    _delete_in_batches(chat_edits.filter(message_id__lte=cutoff[0]), using, batch_size, pause)
+                    count = _delete_messages(
+                        bot_id, chat_messages.filter(message_id__lte=cutoff[0]), using, batch_size, pause
+                    )
+                    stats["max_messages_per_chat"] += count
+                    deleted += count
+            if deleted:
+                CacheVersion.bump(using, bot_id, [chat_id])
+        if max_bytes := get_retention_policy(bot_id).get("max_bytes"):
+            stats["max_bytes"] += _enforce_bytes_quota(bot_id, max_bytes, using, batch_size, pause)
+    return stats
+
+
+def _prune_archived_chat(bot_id: int, chat_id: int, policy: dict, using: str) -> dict:
+    stats = {"max_age": 0, "max_messages_per_chat": 0}
+    removed = []
+    if max_age_days := policy.get("max_age_days"):
+        cutoff = time() - max_age_days * 86400
+        pruned = archive.prune(bot_id, chat_id, lambda message_id, data: message_date(data) >= cutoff,
+                               lambda segment: (dates := segment_dates(segment.path)) is not None
+                               and dates[0] >= cutoff)
+        stats["max_age"] += len(pruned)
+        removed.extend(pruned)
+    if max_messages := policy.get("max_messages_per_chat"):
+        # Archived messages are older than the ones in the database, they get what the database leaves of the limit
+        keep = max_messages - Message.objects.using(using).filter(bot_id=bot_id, chat_id=chat_id).count()
+        message_ids = [message_id for message_id, _ in archive.iterate(bot_id, chat_id)]
+        if len(message_ids) > max(keep, 0):
+            cutoff_id = message_ids[len(message_ids) - max(keep, 0) - 1]
+            pruned = archive.prune(bot_id, chat_id, lambda message_id, data: message_id > cutoff_id,
+                                   lambda segment: segment.first_id > cutoff_id)
+            stats["max_messages_per_chat"] += len(pruned)
+            removed.extend(pruned)
+    message_ids = [message_id for message_id, _ in removed]
+    with transaction.atomic(using=using):
+        for i in range(0, len(message_ids), 1000):
+            MessageEdit.objects.using(using).filter(bot_id=bot_id, chat_id=chat_id,
+                                                    message_id__in=message_ids[i:i + 1000]).delete()
+        if removed:
+            forget_messages(using, bot_id, [archived_message(chat_id, message_id, data)
+                                            for message_id, data in removed])
+    return stats
+
+
+def apply_archive_retention(using: str = "default") -> dict:
+    # The archive is shared by all shards, each shard prunes the chats of its bots
+    stats = {"max_age": 0, "max_messages_per_chat": 0}
+    for bot_id in archive.bots():
+        if shard_for_bot(bot_id) != using:
+            continue
+        chat_types = dict(Chat.objects.using(using).filter(bot_id=bot_id).values_list("id", "type"))
+        for chat_id in archive.chats(bot_id):
+            for key, count in _prune_archived_chat(bot_id, chat_id, get_retention_policy(
+                    bot_id, chat_types.get(chat_id)), using).items():
+                stats[key] += count
+    return stats
+
+
+def _database_file_size(using: str) -> int:
+    connection = connections[using]
+    with connection.cursor() as cursor:
+        if connection.vendor == "sqlite":
+            cursor.execute("PRAGMA page_count")
+            page_count = cursor.fetchone()[0]
+            cursor.execute("PRAGMA page_size")
+            return page_count * cursor.fetchone()[0]
+        if connection.vendor == "postgresql":
+            cursor.execute("SELECT pg_total_relation_size(%s)", [MESSAGE_TABLE])
+            return cursor.fetchone()[0]
+    return 0
+
+
+def reclaim_space(using: str = "default", vacuum_pages: int = 1000, full_vacuum: bool = False,
+                  pause: float = 0.01) -> dict:
+    connection = connections[using]
+    size_before = _database_file_size(using)
+    with connection.cursor() as cursor:
+        if connection.vendor == "sqlite":
+            cursor.execute("PRAGMA auto_vacuum")
+            if cursor.fetchone()[0] != 2 and full_vacuum:
+                # Incremental vacuum only works on databases with auto_vacuum=INCREMENTAL, switching
+                # the mode requires one full VACUUM.
+                cursor.execute("PRAGMA auto_vacuum = INCREMENTAL")
+                cursor.execute("VACUUM")
+            cursor.execute("PRAGMA auto_vacuum")
+            if cursor.fetchone()[0] == 2:
+                while True:
+                    cursor.execute("PRAGMA freelist_count")
+                    if cursor.fetchone()[0] == 0:
+                        break
+                    cursor.execute(f"PRAGMA incremental_vacuum({int(vacuum_pages)})")
+                    cursor.fetchall()
+                    sleep(pause)
+            cursor.execute("PRAGMA optimize")
+        elif connection.vendor == "postgresql":
+            cursor.execute(f'VACUUM ANALYZE "{MESSAGE_TABLE}"')
+    size_after = _database_file_size(using)
+    return {"size_before": size_before, "size_after": size_after, "reclaimed": size_before - size_after}
+
+
+def compact(using: str = "default", batch_size: int = 1000, pause: float = 0.01, vacuum_pages: int = 1000,
+            full_vacuum: bool = False, vacuum: bool = True) -> dict:
+    result = {}
+    # Retention first, so messages past it are deleted instead of being archived
+    result["deleted"] = apply_retention(using, batch_size, pause)
+    result["deleted_archived"] = apply_archive_retention(using)
+    if archive_after_days := getattr(settings, "TG_ARCHIVE_AFTER_DAYS", None):
+        result["archived"] = archive_messages(archive_after_days, batch_size, using)
+    result["expired_undeliverable_chats"], _ = UndeliverableChat.objects.using(using).filter(
+        expires_at__lte=time()
+    ).delete()
+    result["expired_idempotency_keys"], _ = IdempotencyKey.objects.using(using).filter(expires_at__lte=time()).delete()
+    finished = Broadcast.objects.using(using).filter(
+        finished_at__lt=time() - getattr(settings, "TG_BROADCAST_KEEP_DAYS", 7) * 86400
+    ).values_list("id", flat=True)
+    result["broadcast_targets"] = _delete_in_batches(
+        BroadcastTarget.objects.using(using).filter(broadcast_id__in=list(finished)), using, batch_size, pause
+    )
+    if vacuum:
+        result.update(reclaim_space(using, vacuum_pages, full_vacuum, pause))
+    return result
+
+
+# Sharded models and the fields identifying a row across databases, rows of models without a natural key are
+# replaced as a whole.
+REBALANCED_MODELS = (
+    (Message, ("bot_id", "chat_id", "message_id")),
+    (Chat, ("bot_id", "id")),
+    (Webhook, ("bot_id",)),
+    (BotSession, ("bot_id",)),
+    (ChatMember, None),
+    (UndeliverableChat, ("bot_id", "chat_id")),
+    (MessageEdit, ("bot_id", "chat_id", "message_id", "version")),
+    (IdempotencyKey, ("bot_id", "key")),
+)
+
+
+def _copy_bot(model, unique_fields: Optional[tuple], bot_id: int, source: str, target: str,
+              batch_size: int) -> int:
+    pk = model._meta.pk
+    auto_pk = pk.get_internal_type() in ("AutoField", "BigAutoField")
+    fields = [field.attname for field in model._meta.concrete_fields if not (auto_pk and field.primary_key)]
+    rows = model.objects.using(source).filter(bot_id=bot_id).order_by(pk.attname)
+    if unique_fields is None:
+        with transaction.atomic(using=target):
+            model.objects.using(target).filter(bot_id=bot_id).delete()
+    copied = 0
+    last = None
+    while batch := list(rows.filter(**{f"{pk.attname}__gt": last} if last is not None else {})[:batch_size]):
+        last = getattr(batch[-1], pk.attname)
+        objects = [model(**{field: getattr(row, field) for field in fields}) for row in batch]
+        with transaction.atomic(using=target):
+            if unique_fields is None:
+                model.objects.using(target).bulk_create(objects)
+            else:
+                update_fields = [field for field in fields if field not in unique_fields and field != pk.attname]
+                model.objects.using(target).bulk_create(objects, update_conflicts=bool(update_fields),
+                                                        ignore_conflicts=not update_fields,
+                                                        unique_fields=unique_fields if update_fields else None,
+                                                        update_fields=update_fields or None)
+        copied += len(batch)
+    return copied
+
+
+def _merge_versions(bot_id: int, source: str, target: str) -> int:
+    # Both shards may have handed out versions while the bot was moving, continue after the higher of them
+    versions = dict(CacheVersion.objects.using(target).filter(bot_id=bot_id).values_list("chat_id", "version"))
+    for chat_id, version in CacheVersion.objects.using(source).filter(bot_id=bot_id).values_list("chat_id", "version"):
+        versions[chat_id] = max(versions.get(chat_id, 0), version)
+    with transaction.atomic(using=target):
+        CacheVersion.objects.using(target).bulk_create(
+            [CacheVersion(bot_id=bot_id, chat_id=chat_id, version=version + 1)
+             for chat_id, version in versions.items()],
+            update_conflicts=True, unique_fields=("bot_id", "chat_id"), update_fields=("version",)
+        )
+    CacheVersion.objects.using(source).filter(bot_id=bot_id).delete()
+    return len(versions)
+
+
+def _copy_broadcasts(bot_id: int, source: str, target: str, batch_size: int) -> int:
+    # Broadcast ids are only unique per shard, the broadcasts get new ids on the target
+    fields = [field.attname for field in Broadcast._meta.concrete_fields if not field.primary_key]
+    target_fields = [field.attname for field in BroadcastTarget._meta.concrete_fields
+                     if not field.primary_key and field.attname != "broadcast_id"]
+    copied = 0
+    for broadcast in Broadcast.objects.using(source).filter(bot_id=bot_id).order_by("id"):
+        copy = Broadcast(**{field: getattr(broadcast, field) for field in fields})
+        # Jobs still sending it on the source lose their lease, the target's scheduler resumes it
+        copy.lease_owner, copy.lease_expires_at = "", 0
+        with transaction.atomic(using=target):
+            copy.save(using=target, force_insert=True)
+        rows = BroadcastTarget.objects.using(source).filter(broadcast_id=broadcast.id).order_by("id")
+        last = 0
+        while batch := list(rows.filter(id__gt=last)[:batch_size]):
+            last = batch[-1].id
+            with transaction.atomic(using=target):
+                BroadcastTarget.objects.using(target).bulk_create([
+                    BroadcastTarget(broadcast_id=copy.id, **{field: getattr(row, field) for field in target_fields})
+                    for row in batch
+                ])
+        copied += 1
+    return copied
+
+
+def move_bot(bot_id: int, target: str, batch_size: int = 1000) -> dict:
+    source = shard_for_bot(bot_id)
+    if source == target:
+        return {}
+    if Broadcast.objects.using(source).filter(
+            bot_id=bot_id, status__in=(Broadcast.PENDING, Broadcast.RUNNING)
+    ).exists():
+        raise ValueError(f"Bot {bot_id} has pending or running broadcasts, cancel them or wait until they finish")
+    stats = {model._meta.model_name: _copy_bot(model, unique_fields, bot_id, source, target, batch_size)
+             for model, unique_fields in REBALANCED_MODELS}
+    BotShard.objects.using(GLOBAL_DATABASE).update_or_create(bot_id=bot_id, defaults={"database": target})
+    forget_placement(bot_id)
+    # Other processes keep writing to the old shard until their cached placement expires, copy those writes too
+    sleep(getattr(settings, "TG_SHARD_CACHE_TTL", 5) + 1)
+    for model, unique_fields in REBALANCED_MODELS:
+        _copy_bot(model, unique_fields, bot_id, source, target, batch_size)
+    stats["cacheversion"] = _merge_versions(bot_id, source, target)
+    # Broadcasts have no natural key and are copied once, after writes stopped reaching the old shard
+    stats["broadcast"] = _copy_broadcasts(bot_id, source, target, batch_size)
+    broadcasts = Broadcast.objects.using(source).filter(bot_id=bot_id)
+    _delete_in_batches(BroadcastTarget.objects.using(source).filter(broadcast_id__in=list(
+        broadcasts.values_list("id", flat=True)
+    )), source, batch_size, 0)
+    _delete_in_batches(broadcasts, source, batch_size, 0)
+    # Counters incremented on both shards while the bot was moving can not be merged, they are recomputed
+    stats["chatstats"] = rebuild_chat_stats(bot_id, batch_size=batch_size)["chats"]
+    for model in STATS_MODELS:
+        _delete_in_batches(model.objects.using(source).filter(bot_id=bot_id), source, batch_size, 0)
+    for model, _ in REBALANCED_MODELS:
+        _delete_in_batches(model.objects.using(source).filter(bot_id=bot_id), source, batch_size, 0)
+    # Sequence numbers are per shard, the bot's changes start over on the target
+    _delete_in_batches(ChangeLog.objects.using(source).filter(bot_id=bot_id), source, batch_size, 0)
+    return stats
+
+
+_scheduler: Optional[Thread] = None
+
+
+def _run_scheduler(interval: int) -> None:
+    while True:
+        sleep(interval)
+        for using in shards():
+            try:
+                log.info("Compaction of %r finished: %s", using, compact(using))
+            except Exception:
+                log.exception("Compaction of %r failed", using)
+        connections.close_all()
+
+
+def start_compaction_scheduler(interval: int) -> None:
+    global _scheduler
+    if _scheduler is None:
+        _scheduler = Thread(target=_run_scheduler, args=(interval,), name="compaction", daemon=True)
+        _scheduler.start()
@@ -0,0 +1,26 @@
+from time import perf_counter
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from proxy.archive import archive_messages
+
+
+class Command(BaseCommand):
+    help = "Move messages older than the given age out of the database into compressed archive segments."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--older-than-days", type=int, default=getattr(settings, "TG_ARCHIVE_AFTER_DAYS", None),
+                            help="Archive messages older than this many days (default: TG_ARCHIVE_AFTER_DAYS)")
+        parser.add_argument("--database", default="default", help="Database alias to archive from")
+        parser.add_argument("--batch-size", type=int, default=1000, help="Messages read and deleted per batch")
+
+    def handle(self, *args, **options):
+        if options["older_than_days"] is None:
+            raise CommandError("--older-than-days is required when TG_ARCHIVE_AFTER_DAYS is not set")
+        start = perf_counter()
+        stats = archive_messages(options["older_than_days"], options["batch_size"], options["database"])
+        self.stdout.write(self.style.SUCCESS(
+            f"Archived {stats['messages']} messages from {stats['chats']} chats into {stats['bytes']} bytes "
+            f"of segments in {perf_counter() - start:.1f}s"
+        ))
@@ -0,0 +1,18 @@
+from time import perf_counter
+
+from django.core.management.base import BaseCommand
+
+from proxy.maintenance import cluster_messages
+
+
+class Command(BaseCommand):
+    help = "Rewrite the message table in (bot_id, chat_id, message_id) order so chat history reads are sequential."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--database", default="default", help="Database alias to cluster")
+        parser.add_argument("--batch-size", type=int, default=10000, help="Rows copied per transaction")
+
+    def handle(self, *args, **options):
+        start = perf_counter()
+        count = cluster_messages(options["database"], options["batch_size"])
+        self.stdout.write(self.style.SUCCESS(f"Clustered {count} messages in {perf_counter() - start:.1f}s"))
@@ -0,0 +1,34 @@
+from django.core.management.base import BaseCommand
+
+from proxy.maintenance import compact
+
+
+class Command(BaseCommand):
+    help = "Delete messages outside of the configured retention policies and reclaim the freed space."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--database", default="default", help="Database alias to compact")
+        parser.add_argument("--batch-size", type=int, default=1000, help="Messages deleted per transaction")
+        parser.add_argument("--pause", type=float, default=0.01, help="Seconds to sleep between batches")
+        parser.add_argument("--vacuum-pages", type=int, default=1000,
+                            help="Pages freed per incremental vacuum step (SQLite)")
+        parser.add_argument("--full-vacuum", action="store_true",
+                            help="Switch SQLite to incremental auto vacuum with one full VACUUM if needed")
+        parser.add_argument("--no-vacuum", action="store_true", help="Only delete messages")
+
+    def handle(self, *args, **options):
+        result = compact(options["database"], options["batch_size"], options["pause"], options["vacuum_pages"],
+                         options["full_vacuum"], not options["no_vacuum"])
+        if "archived" in result:
+            self.stdout.write(f"Archived {result['archived']['messages']} messages "
+                              f"from {result['archived']['chats']} chats")
+        deleted = result["deleted"]
+        self.stdout.write(f"Deleted {sum(deleted.values())} messages (max age: {deleted['max_age']}, "
+                          f"max messages per chat: {deleted['max_messages_per_chat']}, "
+                          f"max bytes: {deleted['max_bytes']})")
+        deleted = result["deleted_archived"]
+        self.stdout.write(f"Deleted {sum(deleted.values())} archived messages (max age: {deleted['max_age']}, "
+                          f"max messages per chat: {deleted['max_messages_per_chat']})")
+        if "reclaimed" in result:
+            self.stdout.write(f"Database size: {result['size_before']} -> {result['size_after']} bytes, "
+                              f"reclaimed {result['reclaimed']} bytes")
@@ -0,0 +1,33 @@
+import sys
+
+from django.core.management.base import BaseCommand, CommandError
+
+from proxy.compression import zstandard
+from proxy.export import export_messages, encode_ndjson
+from proxy.params import parse_cursor
+from proxy.routers import shard_for_bot
+
+
+class Command(BaseCommand):
+    help = "Export cached messages of a bot or one of its chats as NDJSON in (chat_id, message_id) order."
+
+    def add_arguments(self, parser):
+        parser.add_argument("bot_id", type=int, help="Id of the bot to export")
+        parser.add_argument("--chat-id", type=int, help="Only export this chat")
+        parser.add_argument("--cursor", type=parse_cursor,
+                            help="Resume after this \"<chat_id>:<message_id>\" (the last exported message)")
+        parser.add_argument("--output", help="Write to this file instead of stdout")
+        parser.add_argument("--compress", choices=("gzip", "zstd"), help="Compress the output")
+
+    def handle(self, *args, **options):
+        if options["compress"] == "zstd" and zstandard is None:
+            raise CommandError("zstd compression requires the zstandard package")
+        messages = export_messages(options["bot_id"], options["chat_id"], options["cursor"],
+                                   shard_for_bot(options["bot_id"]))
+        output = open(options["output"], "wb") if options["output"] else sys.stdout.buffer
+        try:
+            for chunk in encode_ndjson(messages, options["compress"]):
+                output.write(chunk)
+        finally:
+            if output is not sys.stdout.buffer:
+                output.close()
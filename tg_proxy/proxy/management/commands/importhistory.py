@@ -0,0 +1,56 @@
+from contextlib import nullcontext
+
+from django.core.management.base import BaseCommand, CommandError
+
+from proxy.importer import HistoryImporter, deferred_message_indexes
+
+
+class Command(BaseCommand):
+    help = "Import messages, chats and users from Bot API update dumps or Telegram Desktop exports."
+
+    def add_arguments(self, parser):
+        parser.add_argument("bot_id", type=int, help="Bot whose cache the history is imported into")
+        parser.add_argument("paths", nargs="+", help="JSON/JSONL files, optionally gzip-compressed (.gz)")
+        parser.add_argument("--format", choices=("lines", "updates", "desktop"), default=None,
+                            help="lines: one update (or any Bot API response) per line, updates: JSON array of "
+                                 "updates or getUpdates response, desktop: Telegram Desktop export (result.json). "
+                                 "Detected by default")
+        parser.add_argument("--batch-size", type=int, default=20000, help="Items written per transaction")
+        parser.add_argument("--workers", type=int, default=1,
+                            help="Processes parsing line-based files (other formats are parsed by one process)")
+        parser.add_argument("--checkpoint", default=None,
+                            help="File storing the progress of every input, an interrupted import started with the "
+                                 "same checkpoint continues after the last written batch")
+        parser.add_argument("--overwrite", action="store_true",
+                            help="Replace entities already in the cache (by default cached ones are kept). Only for "
+                                 "offline imports: running servers keep skipping rows they wrote before, restart them "
+                                 "afterwards")
+        parser.add_argument("--defer-indexes", action="store_true",
+                            help="Drop the secondary message indexes during the import and build them at the end, "
+                                 "about twice as fast on SQLite but queries using them are slow until it finishes")
+
+    def handle(self, *args, **options):
+        if options["batch_size"] < 1 or options["workers"] < 1:
+            raise CommandError("--batch-size and --workers must be positive")
+
+        def progress(stats: dict) -> None:
+            self.stdout.write(f"{stats['items']} items, {stats['messages']} messages, {stats['chats']} chats, "
+                              f"{stats['users']} users, {stats['messages'] / max(stats['seconds'], 1e-9):.0f} "
+                              f"messages/s")
+
+        importer = HistoryImporter(options["bot_id"], options["batch_size"], options["overwrite"],
+                                   options["workers"], options["checkpoint"], progress if options["verbosity"] > 1
+                                   else None)
+        with deferred_message_indexes(options["bot_id"]) if options["defer_indexes"] else nullcontext():
+            for path in options["paths"]:
+                try:
+                    stats = importer.import_file(path, options["format"])
+                except (OSError, ValueError) as e:
+                    raise CommandError(f"Importing {path} failed: {e}")
+        rows = stats["messages"] + stats["chats"] + stats["users"]
+        self.stdout.write(self.style.SUCCESS(
+            f"Imported {stats['messages']} messages, {stats['chats']} chats and {stats['users']} users from "
+            f"{stats['items']} items ({stats['skipped_items']} skipped from the checkpoint) in "
+            f"{stats['seconds']:.1f}s: {stats['messages'] / max(stats['seconds'], 1e-9):.0f} messages/s, "
+            f"{rows / max(stats['seconds'], 1e-9):.0f} rows/s"
+        ))
@@ -0,0 +1,54 @@
+import os
+import re
+import subprocess
+import sys
+from collections import defaultdict
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+IMPORT_TIME_REGEX = re.compile(r"^import time:\s+(\d+) \|\s+(\d+) \|( +)(\S+)$")
+
+
+class Command(BaseCommand):
+    help = "Report the import time of a worker (python -X importtime) by package or module."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--module", default=settings.ROOT_URLCONF,
+                            help="Module imported after django.setup() (default: the url conf, which imports the views "
+                                 "and everything they use)")
+        parser.add_argument("--group-by", choices=("package", "module"), default="package",
+                            help="Sum the self time of modules by top-level package or report every module")
+        parser.add_argument("--top", type=int, default=20, help="Number of entries to print")
+        parser.add_argument("--budget-ms", type=float, default=None,
+                            help="Fail if the total import time is above this many milliseconds")
+
+    def handle(self, *args, **options):
+        # A fresh interpreter, this one has imported everything already
+        env = {**os.environ, "DJANGO_SETTINGS_MODULE": os.environ.get("DJANGO_SETTINGS_MODULE", "tg_proxy.settings")}
+        result = subprocess.run(
+            [sys.executable, "-X", "importtime", "-c", f"import django; django.setup(); import {options['module']}"],
+            capture_output=True, text=True, env=env, cwd=settings.BASE_DIR,
+        )
+        if result.returncode != 0:
+            raise CommandError(f"Importing {options['module']} failed:\n{result.stderr[-2000:]}")
+
+        self_times = defaultdict(int)
+        total = 0
+        for line in result.stderr.splitlines():
+            if (match := IMPORT_TIME_REGEX.match(line)) is None:
+                continue
+            self_us, cumulative_us, indent, name = match.groups()
+            if options["group_by"] == "package":
+                name = name.split(".")[0]
+            self_times[name] += int(self_us)
+            if len(indent) == 1:
+                total += int(cumulative_us)
+
+        self.stdout.write(f"{'self ms':>9}  {'%':>5}  {options['group_by']}")
+        for name, self_us in sorted(self_times.items(), key=lambda item: item[1], reverse=True)[:options["top"]]:
+            self.stdout.write(f"{self_us / 1000:>9.1f}  {self_us / total * 100:>5.1f}  {name}")
+        self.stdout.write(f"Total: {total / 1000:.1f}ms importing {options['module']} "
+                          f"({len(self_times)} {options['group_by']}s)")
+        if options["budget_ms"] is not None and total / 1000 > options["budget_ms"]:
+            raise CommandError(f"Import time {total / 1000:.1f}ms is above the budget of {options['budget_ms']}ms")
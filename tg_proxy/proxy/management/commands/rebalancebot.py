@@ -0,0 +1,32 @@
+from time import perf_counter
+
+from django.core.management.base import BaseCommand, CommandError
+
+from proxy.maintenance import move_bot
+from proxy.routers import shards, shard_for_bot
+
+
+class Command(BaseCommand):
+    help = "Move the cached data of a bot to another shard database."
+
+    def add_arguments(self, parser):
+        parser.add_argument("bot_id", type=int, help="Id of the bot to move")
+        parser.add_argument("shard", help="Database alias of the target shard (one of TG_SHARDS)")
+        parser.add_argument("--batch-size", type=int, default=1000, help="Rows copied and deleted per transaction")
+
+    def handle(self, *args, **options):
+        if options["shard"] not in shards():
+            raise CommandError(f"Unknown shard {options['shard']!r}, available shards: {', '.join(shards())}")
+        source = shard_for_bot(options["bot_id"])
+        start = perf_counter()
+        try:
+            copied = move_bot(options["bot_id"], options["shard"], options["batch_size"])
+        except ValueError as e:
+            raise CommandError(str(e))
+        if not copied:
+            self.stdout.write(f"Bot {options['bot_id']} is already on {options['shard']!r}")
+            return
+        self.stdout.write(self.style.SUCCESS(
+            f"Moved bot {options['bot_id']} from {source!r} to {options['shard']!r} in {perf_counter() - start:.1f}s: "
+            + ", ".join(f"{count} {model}" for model, count in copied.items())
+        ))
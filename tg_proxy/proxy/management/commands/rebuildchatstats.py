@@ -0,0 +1,22 @@
+from time import perf_counter
+
+from django.core.management.base import BaseCommand
+
+from proxy.stats import rebuild_chat_stats
+
+
+class Command(BaseCommand):
+    help = "Recompute the chat statistics of a bot from its cached messages."
+
+    def add_arguments(self, parser):
+        parser.add_argument("bot_id", type=int, help="Id of the bot")
+        parser.add_argument("--chat-id", type=int, help="Only rebuild the statistics of this chat")
+        parser.add_argument("--batch-size", type=int, default=5000, help="Messages read per query")
+
+    def handle(self, *args, **options):
+        start = perf_counter()
+        result = rebuild_chat_stats(options["bot_id"], options["chat_id"], options["batch_size"])
+        self.stdout.write(self.style.SUCCESS(
+            f"Rebuilt statistics of {result['chats']} chats from {result['messages']} messages "
+            f"in {perf_counter() - start:.1f}s"
+        ))
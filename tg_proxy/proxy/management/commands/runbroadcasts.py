@@ -0,0 +1,10 @@
+from django.core.management.base import BaseCommand
+
+from proxy.broadcasts import broadcast_scheduler
+
+
+class Command(BaseCommand):
+    help = "Send pending broadcasts and resume interrupted ones, in the foreground."
+
+    def handle(self, *args, **options):
+        broadcast_scheduler.run_forever()
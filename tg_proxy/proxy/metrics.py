@@ -0,0 +1,188 @@
+"""
+The MIT License (MIT)
+
+Copyright (c) 2023-present RuslanUC
+
+Permission is hereby granted, free of charge, to any person obtaining a
+copy of this software and associated documentation files (the "Software"),
+to deal in the Software without restriction, including without limitation
+the rights to use, copy, modify, merge, publish, distribute, sublicense,
+and/or sell copies of the Software, and to permit persons to whom the
+Software is furnished to do so, subject to the following conditions:
+
+The above copyright notice and this permission notice shall be included in
+all copies or substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS
+OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING
+FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER
+DEALINGS IN THE SOFTWARE.
+"""
+
+import re
+from bisect import bisect_left
+from contextlib import contextmanager
+from contextvars import ContextVar
+from threading import Lock
+from time import perf_counter
+from typing import Iterator, Callable
+
+from django.http import HttpRequest, HttpResponse
+
+from proxy.db import observe_queries
+
+LATENCY_BUCKETS = (.0005, .001, .0025, .005, .01, .025, .05, .1, .25, .5, 1, 2.5, 5, 10, 30)
+COUNT_BUCKETS = (0, 1, 2, 5, 10, 20, 50, 100, 200)
+MAX_METHODS = 256
+METHOD_REGEX = re.compile(r"^/bot[^/]+/([A-Za-z0-9_]{1,64})$")
+
+_current_method: ContextVar[str] = ContextVar("current_method", default="other")
+
+
+class Histogram:
+    __slots__ = ("buckets", "counts", "sum", "count")
+
+    def __init__(self, buckets: tuple):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value: float) -> None:
+        self.counts[bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+
+class Registry:
+    def __init__(self):
+        self._lock = Lock()
+        self._help: dict[str, tuple[str, str]] = {}
+        self._counters: dict[tuple[str, tuple], float] = {}
+        self._histograms: dict[tuple[str, tuple], Histogram] = {}
+        self._buckets: dict[str, tuple] = {}
+        self._methods: set[str] = set()
+
+    def counter(self, name: str, description: str) -> None:
+        self._help[name] = ("counter", description)
+
+    def histogram(self, name: str, description: str, buckets: tuple = LATENCY_BUCKETS) -> None:
+        self._help[name] = ("histogram", description)
+        self._buckets[name] = buckets
+
+    def method_label(self, method: str) -> str:
+        if method in self._methods:
+            return method
+        with self._lock:
+            if len(self._methods) >= MAX_METHODS:
+                return "other"
+            self._methods.add(method)
+        return method
+
+    def inc(self, name: str, value: float = 1, **labels: str) -> None:
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            self._counters[key] = self._counters.get(key, 0) + value
+
+    def observe(self, name: str, value: float, **labels: str) -> None:
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            if (hist := self._histograms.get(key)) is None:
+                hist = self._histograms[key] = Histogram(self._buckets[name])
+            hist.observe(value)
+
+    def render(self) -> str:
+        with self._lock:
+            counters = dict(self._counters)
+            histograms = {key: (list(hist.counts), hist.sum, hist.count) for key, hist in self._histograms.items()}
+        lines = []
+        for name, (kind, description) in self._help.items():
+            lines.append(f"# HELP {name} {description}")
+            lines.append(f"# TYPE {name} {kind}")
+            if kind == "counter":
+                for (metric, labels), value in counters.items():
+                    if metric == name:
+                        lines.append(f"{name}{_format_labels(labels)} {value:g}")
+                continue
+            for (metric, labels), (counts, total, count) in histograms.items():
+                if metric != name:
+                    continue
+                cumulative = 0
+                for bound, bucket_count in zip(self._buckets[name] + ("+Inf",), counts):
+                    cumulative += bucket_count
+                    lines.append(f"{name}_bucket{_format_labels(labels + (('le', bound),))} {cumulative}")
+                lines.append(f"{name}_sum{_format_labels(labels)} {total:g}")
+                lines.append(f"{name}_count{_format_labels(labels)} {count}")
+        return "\n".join(lines) + "\n"
+
+
+def _format_labels(labels: tuple) -> str:
+    if not labels:
+        return ""
+    return "{" + ",".join(f'{key}="{value}"' for key, value in labels) + "}"
+
+
+registry = Registry()
+registry.counter("tg_proxy_requests_total", "Requests processed, by bot api method and status code.")
+registry.histogram("tg_proxy_request_duration_seconds", "Total request latency, by bot api method.")
+registry.histogram("tg_proxy_stage_duration_seconds", "Latency of request processing stages, by method and stage.")
+registry.counter("tg_proxy_cache_requests_total", "Cached read requests, by method and result (hit or miss).")
+registry.histogram("tg_proxy_db_queries", "Database queries executed per request, by method.", COUNT_BUCKETS)
+registry.counter("tg_proxy_db_queries_total", "Database queries executed, by method.")
+registry.counter("tg_proxy_request_bytes_total", "Request body bytes received, by method.")
+registry.counter("tg_proxy_response_bytes_total", "Response body bytes sent, by method.")
+registry.counter("tg_proxy_upserts_total", "Cached rows seen in responses, by model and result (written, "
+                                           "skipped_cache or skipped_db when unchanged, duplicate in one response).")
+registry.counter("tg_proxy_undeliverable_total", "Sends to undeliverable chats, by result (rejected locally, "
+                                                 "recorded after a Bot API error, cleared by an update).")
+registry.counter("tg_proxy_idempotency_total", "Proxied requests with an idempotency key, by result (executed, "
+                                               "replayed, conflict or mismatch).")
+registry.counter("tg_proxy_broadcast_sends_total", "Broadcast messages sent by this process, by result (delivered "
+                                                   "or failed).")
+
+
+@contextmanager
+def stage(name: str) -> Iterator[None]:
+    start = perf_counter()
+    try:
+        yield
+    finally:
+        registry.observe("tg_proxy_stage_duration_seconds", perf_counter() - start, method=_current_method.get(),
+                         stage=name)
+
+
+def cache_result(hit: bool) -> None:
+    registry.inc("tg_proxy_cache_requests_total", method=_current_method.get(), result="hit" if hit else "miss")
+
+
+class MetricsMiddleware:
+    def __init__(self, get_response: Callable[[HttpRequest], HttpResponse]):
+        self.get_response = get_response
+
+    def __call__(self, request: HttpRequest) -> HttpResponse:
+        if (match := METHOD_REGEX.match(request.path_info)) is None:
+            return self.get_response(request)
+
+        method = registry.method_label(match.group(1))
+        token = _current_method.set(method)
+        durations = []
+
+        start = perf_counter()
+        try:
+            with observe_queries(lambda sql, duration: durations.append(duration)):
+                response = self.get_response(request)
+        finally:
+            _current_method.reset(token)
+        queries = len(durations)
+
+        registry.observe("tg_proxy_request_duration_seconds", perf_counter() - start, method=method)
+        registry.inc("tg_proxy_requests_total", method=method, status=str(response.status_code))
+        registry.observe("tg_proxy_db_queries", queries, method=method)
+        registry.inc("tg_proxy_db_queries_total", queries, method=method)
+        registry.inc("tg_proxy_request_bytes_total", int(request.META.get("CONTENT_LENGTH") or 0), method=method)
+        if not response.streaming:
+            registry.inc("tg_proxy_response_bytes_total", len(response.content), method=method)
+        return response
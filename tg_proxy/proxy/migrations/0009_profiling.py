@@ -0,0 +1,42 @@
+# Generated by Django 4.2.30 on 2026-10-18 23:23
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('proxy', '0008_chat__id_alter_chat_id_chat_unique_chat_bot'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ProfilingSettings',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('enabled', models.BooleanField(default=False)),
+                ('sample_rate', models.FloatField(default=0.01)),
+                ('bot_id', models.BigIntegerField(blank=True, default=None, null=True)),
+                ('method', models.CharField(blank=True, default='', max_length=64)),
+                ('threshold_ms', models.IntegerField(default=500)),
+            ],
+            options={
+                'verbose_name_plural': 'profiling settings',
+            },
+        ),
+        migrations.CreateModel(
+            name='RequestProfile',
+            fields=[
+                ('id', models.BigAutoField(primary_key=True, serialize=False)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('bot_id', models.BigIntegerField()),
+                ('method', models.CharField(max_length=64)),
+                ('duration_ms', models.FloatField()),
+                ('queries', models.TextField()),
+                ('samples', models.TextField()),
+            ],
+            options={
+                'abstract': False,
+            },
+        ),
+    ]
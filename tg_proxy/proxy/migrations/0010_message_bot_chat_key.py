@@ -0,0 +1,23 @@
+# Generated by Django 4.2.30 on 2026-10-18 23:30
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ("proxy", "0009_profiling"),
+    ]
+
+    operations = [
+        migrations.RemoveConstraint(
+            model_name="message",
+            name="unique_message_bot",
+        ),
+        migrations.AddConstraint(
+            model_name="message",
+            constraint=models.UniqueConstraint(
+                fields=("bot_id", "chat_id", "message_id"),
+                name="unique_message_bot_chat",
+            ),
+        ),
+    ]
@@ -0,0 +1,53 @@
+from django.db import migrations
+
+# The table rewrite as it was when the key changed, proxy.maintenance.cluster_messages may change later
+
+
+def cluster_messages(apps, schema_editor):
+    connection = schema_editor.connection
+    table = apps.get_model("proxy", "Message")._meta.db_table
+    key = "bot_id, chat_id, message_id"
+    with connection.cursor() as cursor:
+        if connection.vendor == "postgresql":
+            cursor.execute(f'CLUSTER "{table}" USING "unique_message_bot_chat"')
+            cursor.execute(f'ANALYZE "{table}"')
+            return
+        if connection.vendor != "sqlite":
+            return
+        # SQLite stores rows in rowid order, the table is rewritten with ids assigned in key order
+        cursor.execute(
+            "SELECT sql FROM sqlite_master WHERE type = 'table' AND name = %s", [table]
+        )
+        table_sql = cursor.fetchone()[0]
+        cursor.execute(
+            "SELECT sql FROM sqlite_master WHERE type = 'index' AND tbl_name = %s AND sql IS NOT NULL",
+            [table],
+        )
+        index_sqls = [row[0] for row in cursor.fetchall()]
+        columns = ", ".join(
+            f'"{column.name}"'
+            for column in connection.introspection.get_table_description(cursor, table)
+            if column.name != "id"
+        )
+        new_table = f"{table}__clustered"
+        cursor.execute(f'DROP TABLE IF EXISTS "{new_table}"')
+        cursor.execute(table_sql.replace(f'"{table}"', f'"{new_table}"', 1))
+        cursor.execute(
+            f'INSERT INTO "{new_table}" ({columns}) SELECT {columns} FROM "{table}" ORDER BY {key}'
+        )
+        cursor.execute(f'DROP TABLE "{table}"')
+        cursor.execute(f'ALTER TABLE "{new_table}" RENAME TO "{table}"')
+        for index_sql in index_sqls:
+            cursor.execute(index_sql)
+
+
+class Migration(migrations.Migration):
+    atomic = False
+
+    dependencies = [
+        ("proxy", "0010_message_bot_chat_key"),
+    ]
+
+    operations = [
+        migrations.RunPython(cluster_messages, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,39 @@
+# Generated by Django 4.2.30 on 2026-10-18 23:32
+
+from json import loads
+
+from django.db import migrations, models
+
+
+def backfill_message_date(apps, schema_editor):
+    connection = schema_editor.connection
+    with connection.cursor() as cursor:
+        if connection.vendor == "sqlite":
+            cursor.execute("UPDATE proxy_message SET date = json_extract(serialized_message, '$.date')")
+            return
+        if connection.vendor == "postgresql":
+            cursor.execute("UPDATE proxy_message SET date = (serialized_message::jsonb ->> 'date')::bigint")
+            return
+    Message = apps.get_model("proxy", "Message")
+    messages = Message.objects.using(connection.alias)
+    for message in messages.filter(date=None).only("id", "serialized_message").iterator(chunk_size=1000):
+        messages.filter(id=message.id).update(date=loads(message.serialized_message).get("date"))
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ("proxy", "0011_cluster_messages"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="message",
+            name="date",
+            field=models.BigIntegerField(default=None, null=True),
+        ),
+        migrations.AddIndex(
+            model_name="message",
+            index=models.Index(fields=["bot_id", "date"], name="message_bot_date"),
+        ),
+        migrations.RunPython(backfill_message_date, migrations.RunPython.noop),
+    ]
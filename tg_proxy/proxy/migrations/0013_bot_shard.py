@@ -0,0 +1,38 @@
+# Generated by Django 4.2.30 on 2026-10-18 23:41
+
+from django.db import migrations, models
+
+
+def place_existing_bots(apps, schema_editor):
+    # Bots cached before sharding keep their data where it is
+    alias = schema_editor.connection.alias
+    tables = schema_editor.connection.introspection.table_names()
+    bot_ids = set()
+    for model_name in ("Message", "Chat", "ChatMember", "Webhook", "BotSession"):
+        model = apps.get_model("proxy", model_name)
+        if model._meta.db_table in tables:
+            bot_ids.update(model.objects.using(alias).values_list("bot_id", flat=True).distinct().order_by())
+    BotShard = apps.get_model("proxy", "BotShard")
+    BotShard.objects.using(alias).bulk_create(
+        [BotShard(bot_id=bot_id, database=alias) for bot_id in bot_ids], ignore_conflicts=True
+    )
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ("proxy", "0012_message_date"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="BotShard",
+            fields=[
+                ("bot_id", models.BigIntegerField(primary_key=True, serialize=False)),
+                ("database", models.CharField(max_length=64)),
+            ],
+            options={
+                "abstract": False,
+            },
+        ),
+        migrations.RunPython(place_existing_bots, migrations.RunPython.noop, hints={"model_name": "botshard"}),
+    ]
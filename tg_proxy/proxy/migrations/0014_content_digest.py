@@ -0,0 +1,27 @@
+# Generated by Django 4.2.30 on 2026-10-18 23:44
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ("proxy", "0013_bot_shard"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="chat",
+            name="digest",
+            field=models.BigIntegerField(default=None, null=True),
+        ),
+        migrations.AddField(
+            model_name="message",
+            name="digest",
+            field=models.BigIntegerField(default=None, null=True),
+        ),
+        migrations.AddField(
+            model_name="user",
+            name="digest",
+            field=models.BigIntegerField(default=None, null=True),
+        ),
+    ]
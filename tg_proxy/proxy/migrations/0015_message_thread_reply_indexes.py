@@ -0,0 +1,26 @@
+# Generated by Django 4.2.30 on 2026-10-18 23:53
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ("proxy", "0014_content_digest"),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name="message",
+            index=models.Index(
+                fields=["bot_id", "chat_id", "message_thread_id", "message_id"],
+                name="message_thread",
+            ),
+        ),
+        migrations.AddIndex(
+            model_name="message",
+            index=models.Index(
+                fields=["bot_id", "chat_id", "reply_to_message_id"],
+                name="message_reply_to",
+            ),
+        ),
+    ]
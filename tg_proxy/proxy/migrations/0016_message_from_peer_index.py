@@ -0,0 +1,18 @@
+# Generated by Django 4.2.30 on 2026-10-18 23:55
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ("proxy", "0015_message_thread_reply_indexes"),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name="message",
+            index=models.Index(
+                fields=["bot_id", "from_peer", "message_id"], name="message_from_peer"
+            ),
+        ),
+    ]
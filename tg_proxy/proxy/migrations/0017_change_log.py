@@ -0,0 +1,29 @@
+# Generated by Django 4.2.30 on 2026-10-19 00:00
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ("proxy", "0016_message_from_peer_index"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="ChangeLog",
+            fields=[
+                ("seq", models.BigAutoField(primary_key=True, serialize=False)),
+                ("bot_id", models.BigIntegerField()),
+                ("type", models.CharField(max_length=16)),
+                ("chat_id", models.BigIntegerField(default=None, null=True)),
+                ("entity_id", models.BigIntegerField()),
+                ("payload", models.TextField()),
+                ("created_at", models.FloatField(default=0)),
+            ],
+            options={
+                "indexes": [
+                    models.Index(fields=["bot_id", "seq"], name="changelog_bot_seq")
+                ],
+            },
+        ),
+    ]
@@ -0,0 +1,35 @@
+# Generated by Django 4.2.30 on 2026-10-19 00:19
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ("proxy", "0017_change_log"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="CacheVersion",
+            fields=[
+                (
+                    "id",
+                    models.BigAutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                ("bot_id", models.BigIntegerField()),
+                ("chat_id", models.BigIntegerField()),
+                ("version", models.BigIntegerField(default=0)),
+            ],
+        ),
+        migrations.AddConstraint(
+            model_name="cacheversion",
+            constraint=models.UniqueConstraint(
+                fields=("bot_id", "chat_id"), name="unique_cacheversion_bot_chat"
+            ),
+        ),
+    ]
@@ -0,0 +1,38 @@
+# Generated by Django 4.2.30 on 2026-10-19 00:21
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ("proxy", "0018_cache_version"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="UndeliverableChat",
+            fields=[
+                (
+                    "id",
+                    models.BigAutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                ("bot_id", models.BigIntegerField()),
+                ("chat_id", models.BigIntegerField()),
+                ("error_code", models.IntegerField()),
+                ("description", models.TextField()),
+                ("date", models.BigIntegerField()),
+                ("expires_at", models.BigIntegerField()),
+            ],
+        ),
+        migrations.AddConstraint(
+            model_name="undeliverablechat",
+            constraint=models.UniqueConstraint(
+                fields=("bot_id", "chat_id"), name="unique_undeliverablechat_bot_chat"
+            ),
+        ),
+    ]
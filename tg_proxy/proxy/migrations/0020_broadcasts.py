@@ -0,0 +1,70 @@
+# Generated by Django 4.2.30 on 2026-10-19 00:25
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ("proxy", "0019_undeliverable_chat"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="Broadcast",
+            fields=[
+                ("id", models.BigAutoField(primary_key=True, serialize=False)),
+                ("bot_id", models.BigIntegerField()),
+                ("token", models.CharField(max_length=128)),
+                ("method", models.CharField(max_length=64)),
+                ("params", models.TextField()),
+                ("status", models.CharField(default="pending", max_length=16)),
+                ("concurrency", models.IntegerField()),
+                ("rate", models.FloatField()),
+                ("total", models.BigIntegerField(default=0)),
+                ("delivered", models.BigIntegerField(default=0)),
+                ("failed", models.BigIntegerField(default=0)),
+                ("sending_seconds", models.FloatField(default=0)),
+                ("error", models.TextField(blank=True, default="")),
+                ("created_at", models.BigIntegerField()),
+                ("started_at", models.BigIntegerField(default=None, null=True)),
+                ("finished_at", models.BigIntegerField(default=None, null=True)),
+                (
+                    "lease_owner",
+                    models.CharField(blank=True, default="", max_length=64),
+                ),
+                ("lease_expires_at", models.FloatField(default=0)),
+            ],
+        ),
+        migrations.CreateModel(
+            name="BroadcastTarget",
+            fields=[
+                ("id", models.BigAutoField(primary_key=True, serialize=False)),
+                ("broadcast_id", models.BigIntegerField()),
+                ("bot_id", models.BigIntegerField()),
+                ("chat_id", models.BigIntegerField()),
+                ("status", models.SmallIntegerField(default=0)),
+                ("message_id", models.BigIntegerField(default=None, null=True)),
+                ("error_code", models.IntegerField(default=None, null=True)),
+            ],
+            options={
+                "indexes": [
+                    models.Index(
+                        fields=["broadcast_id", "status", "id"],
+                        name="broadcasttarget_pending",
+                    )
+                ],
+            },
+        ),
+        migrations.AddConstraint(
+            model_name="broadcasttarget",
+            constraint=models.UniqueConstraint(
+                fields=("broadcast_id", "chat_id"), name="unique_broadcasttarget_chat"
+            ),
+        ),
+        migrations.AddIndex(
+            model_name="broadcast",
+            index=models.Index(
+                fields=["status", "lease_expires_at"], name="broadcast_status_lease"
+            ),
+        ),
+    ]
@@ -0,0 +1,49 @@
+# Generated by Django 4.2.30 on 2026-10-19 00:28
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ("proxy", "0020_broadcasts"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="IdempotencyKey",
+            fields=[
+                (
+                    "id",
+                    models.BigAutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                ("bot_id", models.BigIntegerField()),
+                ("key", models.CharField(max_length=255)),
+                ("fingerprint", models.CharField(max_length=32)),
+                ("status_code", models.IntegerField(default=None, null=True)),
+                (
+                    "content_type",
+                    models.CharField(blank=True, default="", max_length=128),
+                ),
+                ("body", models.BinaryField(default=b"")),
+                ("created_at", models.FloatField()),
+                ("locked_until", models.FloatField()),
+                ("expires_at", models.FloatField()),
+            ],
+            options={
+                "indexes": [
+                    models.Index(fields=["expires_at"], name="idempotencykey_expires")
+                ],
+            },
+        ),
+        migrations.AddConstraint(
+            model_name="idempotencykey",
+            constraint=models.UniqueConstraint(
+                fields=("bot_id", "key"), name="unique_idempotencykey_bot_key"
+            ),
+        ),
+    ]
@@ -0,0 +1,100 @@
+# Generated by Django 4.2.30 on 2026-10-19 00:31
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ("proxy", "0021_idempotency_keys"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="ChatStats",
+            fields=[
+                (
+                    "id",
+                    models.BigAutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                ("bot_id", models.BigIntegerField()),
+                ("chat_id", models.BigIntegerField()),
+                ("message_count", models.BigIntegerField(default=0)),
+                ("media_count", models.BigIntegerField(default=0)),
+                ("user_count", models.BigIntegerField(default=0)),
+                ("first_message_id", models.BigIntegerField()),
+                ("first_date", models.BigIntegerField()),
+                ("last_message_id", models.BigIntegerField()),
+                ("last_date", models.BigIntegerField()),
+            ],
+        ),
+        migrations.CreateModel(
+            name="ChatStatsDay",
+            fields=[
+                (
+                    "id",
+                    models.BigAutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                ("bot_id", models.BigIntegerField()),
+                ("chat_id", models.BigIntegerField()),
+                ("day", models.BigIntegerField()),
+                ("message_count", models.BigIntegerField(default=0)),
+                ("media_count", models.BigIntegerField(default=0)),
+            ],
+        ),
+        migrations.CreateModel(
+            name="ChatStatsUser",
+            fields=[
+                (
+                    "id",
+                    models.BigAutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                ("bot_id", models.BigIntegerField()),
+                ("chat_id", models.BigIntegerField()),
+                ("user_id", models.BigIntegerField()),
+                ("last_date", models.BigIntegerField()),
+            ],
+            options={
+                "indexes": [
+                    models.Index(
+                        fields=["bot_id", "chat_id", "last_date"],
+                        name="chatstatsuser_last_date",
+                    )
+                ],
+            },
+        ),
+        migrations.AddConstraint(
+            model_name="chatstatsuser",
+            constraint=models.UniqueConstraint(
+                fields=("bot_id", "chat_id", "user_id"),
+                name="unique_chatstatsuser_bot_chat_user",
+            ),
+        ),
+        migrations.AddConstraint(
+            model_name="chatstatsday",
+            constraint=models.UniqueConstraint(
+                fields=("bot_id", "chat_id", "day"),
+                name="unique_chatstatsday_bot_chat_day",
+            ),
+        ),
+        migrations.AddConstraint(
+            model_name="chatstats",
+            constraint=models.UniqueConstraint(
+                fields=("bot_id", "chat_id"), name="unique_chatstats_bot_chat"
+            ),
+        ),
+    ]
@@ -0,0 +1,42 @@
+# Generated by Django 4.2.30 on 2026-10-19 00:33
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ("proxy", "0022_chat_stats"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="MessageEdit",
+            fields=[
+                (
+                    "id",
+                    models.BigAutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                ("bot_id", models.BigIntegerField()),
+                ("chat_id", models.BigIntegerField()),
+                ("message_id", models.BigIntegerField()),
+                ("version", models.IntegerField()),
+                ("date", models.BigIntegerField()),
+                ("edit_date", models.BigIntegerField()),
+                ("snapshot", models.BooleanField()),
+                ("data", models.TextField()),
+                ("digest", models.BigIntegerField(default=None, null=True)),
+            ],
+        ),
+        migrations.AddConstraint(
+            model_name="messageedit",
+            constraint=models.UniqueConstraint(
+                fields=("bot_id", "chat_id", "message_id", "version"),
+                name="unique_messageedit_bot_chat_version",
+            ),
+        ),
+    ]
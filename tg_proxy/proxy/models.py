@@ -22,14 +22,51 @@ FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER
 DEALINGS IN THE SOFTWARE.
 """
 
-from django.db import models
+from hashlib import blake2b
+from json import dumps, loads
+from typing import Iterable, Optional
+
+from django.db import connections, models, transaction
+from django.db.models import F
+
+from .changes import record_changes, change_feed
+from .history import find_edits, record_edits
+from .db import serialized_write, digest_cache
+from .metrics import registry
+from .routers import database_for, note_write
+
+
+def content_digest(serialized: str) -> int:
+    return int.from_bytes(blake2b(serialized.encode("utf8"), digest_size=8).digest(), "big", signed=True)
+
 
 class BaseModel(models.Model):
     objects = models.Manager()
+    key_fields: tuple[str, ...] = ()
+    has_digest: bool = False
+    change_type: Optional[str] = None
+    versioned: bool = False
+    has_chat_stats: bool = False
+    has_edit_history: bool = False
 
     class Meta:
         abstract = True
 
+    def __init_subclass__(cls, **kwargs) -> None:
+        super().__init_subclass__(**kwargs)
+        # Written changes are built by change_from_fields(entity id, fields) -> (chat id, entity id, payload), bumped
+        # versions by version_chat_id(fields) -> chat id
+        if cls.change_type is not None and not hasattr(cls, "change_from_fields"):
+            raise TypeError(f"{cls.__name__} has a change_type but no change_from_fields")
+        if cls.versioned and not hasattr(cls, "version_chat_id"):
+            raise TypeError(f"{cls.__name__} is versioned but has no version_chat_id")
+
+    @classmethod
+    def forget_digests(cls, using: str, bot_id: int, row_keys: Iterable[tuple]) -> None:
+        # Rows deleted outside of the upserts are written again when they come back unchanged
+        for row_key in row_keys:
+            digest_cache.discard((using, cls._meta.model_name, bot_id, *row_key))
+
     def __str__(self) -> str:
         return repr(self)
 
@@ -38,8 +75,79 @@ class BaseModel(models.Model):
         search_q = {"bot_id": bot_id} \
             if "bot_id" in [f.name for f in cls._meta.get_fields()] and id_field_name != "bot_id" \
             else {}
+
+        using = database_for(cls, bot_id)
+        model = cls._meta.model_name
+        rows = {}
         for obj in objects:
-            cls.objects.update_or_create(**{id_field_name: obj[id_field_name]}, **search_q, defaults=defaults_func(obj))
+            defaults = defaults_func(obj)
+            key = {field: defaults.pop(field) for field in cls.key_fields}
+            rows[(obj[id_field_name], *key.values())] = (key, defaults)
+        if duplicates := len(objects) - len(rows):
+            registry.inc("tg_proxy_upserts_total", duplicates, model=model, result="duplicate")
+
+        if cls.has_digest:
+            # Rows whose payload is unchanged are not written, the digest of the last written payload is looked up
+            # in the process-local cache first and in the database for the rest.
+            cache_prefix = (using, model, *search_q.values())
+            unchanged = [row_key for row_key, (_, defaults) in rows.items()
+                         if digest_cache.get((*cache_prefix, *row_key)) == defaults["digest"]]
+            for row_key in unchanged:
+                del rows[row_key]
+            registry.inc("tg_proxy_upserts_total", len(unchanged), model=model, result="skipped_cache")
+            if rows:
+                stored = cls.objects.using(using).filter(
+                    **search_q, **{f"{id_field_name}__in": [row_key[0] for row_key in rows]}
+                ).values_list(id_field_name, *cls.key_fields, "digest")
+                skipped = 0
+                for *row_key, digest in stored:
+                    row_key = tuple(row_key)
+                    if row_key in rows and rows[row_key][1]["digest"] == digest:
+                        del rows[row_key]
+                        digest_cache.put((*cache_prefix, *row_key), digest)
+                        skipped += 1
+                registry.inc("tg_proxy_upserts_total", skipped, model=model, result="skipped_db")
+        registry.inc("tg_proxy_upserts_total", len(rows), model=model, result="written")
+        if not rows:
+            return
+        changes = None
+        if cls.change_type is not None:
+            changes = [cls.change_from_fields(row_key[0], {**key, **defaults})
+                       for row_key, (key, defaults) in rows.items()]
+        # Changes go to the log of the bot's shard, in the same transaction unless the model is not sharded
+        log_database = database_for(ChangeLog, bot_id) if changes else None
+
+        def write() -> None:
+            with transaction.atomic(using=using):
+                edits = find_edits(using, bot_id, rows) if cls.has_edit_history else None
+                created = []
+                for row_key, (key, defaults) in rows.items():
+                    _, is_created = cls.objects.using(using).update_or_create(
+                        **{id_field_name: row_key[0]}, **search_q, **key, defaults=defaults
+                    )
+                    if is_created:
+                        created.append({id_field_name: row_key[0], **key, **defaults})
+                # Only new rows are counted, so statistics are updated in the same transaction
+                if cls.has_chat_stats and created:
+                    ChatStats.record(using, bot_id, aggregate_chat_stats(created))
+                if edits:
+                    record_edits(using, bot_id, edits)
+                if changes and log_database == using:
+                    record_changes(using, bot_id, cls.change_type, changes)
+                if cls.versioned:
+                    CacheVersion.bump(using, bot_id, {cls.version_chat_id({**key, **defaults})
+                                                      for key, defaults in rows.values()})
+
+        serialized_write(write, using)
+        note_write(bot_id)
+        if cls.has_digest:
+            for row_key, (_, defaults) in rows.items():
+                digest_cache.put((*cache_prefix, *row_key), defaults["digest"])
+        if changes:
+            if log_database != using:
+                serialized_write(lambda: record_changes(log_database, bot_id, cls.change_type, changes), log_database)
+            change_feed.kick.set()
+
 
 class Message(BaseModel):
     id: int = models.BigAutoField(primary_key=True)
@@ -49,26 +157,101 @@ class Message(BaseModel):
     message_thread_id: int = models.BigIntegerField(default=None, null=True)
     reply_to_message_id: int = models.BigIntegerField(default=None, null=True)
     from_peer: int = models.BigIntegerField(default=None, null=True)
+    date: int = models.BigIntegerField(default=None, null=True)
     serialized_message: str = models.TextField()
+    digest: int = models.BigIntegerField(default=None, null=True)
+
+    key_fields = ("chat_id",)
+    has_digest = True
+    change_type = "message"
+    versioned = True
+    has_chat_stats = True
+    has_edit_history = True
 
     class Meta:
         constraints = [
             models.UniqueConstraint(
-                fields=["message_id", "bot_id"], name="unique_message_bot"
+                fields=["bot_id", "chat_id", "message_id"], name="unique_message_bot_chat"
             )
         ]
+        indexes = [
+            models.Index(fields=["bot_id", "date"], name="message_bot_date"),
+            models.Index(fields=["bot_id", "chat_id", "message_thread_id", "message_id"], name="message_thread"),
+            models.Index(fields=["bot_id", "chat_id", "reply_to_message_id"], name="message_reply_to"),
+            models.Index(fields=["bot_id", "from_peer", "message_id"], name="message_from_peer"),
+        ]
+
+    @staticmethod
+    def fields_from_dict(bot_id: int, d: dict) -> dict:
+        serialized = dumps(d)
+        return {
+            "chat_id": d["chat"]["id"], "bot_id": bot_id,
+            "message_thread_id": d.get("message_thread_id", None),
+            "reply_to_message_id": d.get("reply_to_message", {}).get("message_id"),
+            "from_peer": d.get("from", {}).get("id"), "date": d.get("date"), "serialized_message": serialized,
+            "digest": content_digest(serialized),
+        }
+
+    @staticmethod
+    def change_from_fields(entity_id: int, fields: dict) -> tuple[Optional[int], int, str]:
+        return fields["chat_id"], entity_id, fields["serialized_message"]
+
+    @staticmethod
+    def version_chat_id(fields: dict) -> int:
+        return fields["chat_id"]
 
     def __repr__(self) -> str:
         return f"Message(message_id={self.message_id!r}, bot_id={self.bot_id!r}, chat_id={self.chat_id!r}, " \
                f"from_id={self.from_peer!r})"
 
 
+class MessageEdit(BaseModel):
+    # Versions of edited messages, a full copy every history.SNAPSHOT_EVERY versions and a diff against the previous
+    # version in between
+    bot_id: int = models.BigIntegerField()
+    chat_id: int = models.BigIntegerField()
+    message_id: int = models.BigIntegerField()
+    version: int = models.IntegerField()
+    date: int = models.BigIntegerField()
+    edit_date: int = models.BigIntegerField()
+    snapshot: bool = models.BooleanField()
+    data: str = models.TextField()
+    digest: int = models.BigIntegerField(default=None, null=True)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(
+                fields=["bot_id", "chat_id", "message_id", "version"], name="unique_messageedit_bot_chat_version"
+            )
+        ]
+
+    def __repr__(self) -> str:
+        return f"MessageEdit(bot_id={self.bot_id!r}, chat_id={self.chat_id!r}, message_id={self.message_id!r}, " \
+               f"version={self.version!r})"
+
+
 class User(BaseModel):
     id: int = models.BigIntegerField(primary_key=True)
     username: str = models.CharField(max_length=128, default=None, null=True)
     first_name: str = models.CharField(max_length=128)
     last_name: str = models.CharField(max_length=128, default=None, null=True)
     serialized_user: str = models.TextField()
+    digest: int = models.BigIntegerField(default=None, null=True)
+
+    has_digest = True
+    change_type = "user"
+
+    @staticmethod
+    def fields_from_dict(bot_id: int, d: dict) -> dict:
+        serialized = dumps(d)
+        return {
+            "username": d.get("username", None), "first_name": d["first_name"],
+            "last_name": d.get("last_name", None), "serialized_user": serialized, "digest": content_digest(serialized),
+        }
+
+    @staticmethod
+    def change_from_fields(entity_id: int, fields: dict) -> tuple[Optional[int], int, str]:
+        return None, entity_id, fields["serialized_user"]
 
     def __repr__(self) -> str:
         return f"User(id={self.id!r}, username={self.username!r}, first_name={self.first_name!r}, " \
@@ -81,6 +264,12 @@ class Chat(BaseModel):
     bot_id: int = models.BigIntegerField()
     type: str = models.CharField(max_length=16)
     serialized_chat: str = models.TextField()
+    digest: int = models.BigIntegerField(default=None, null=True)
+
+    has_digest = True
+    change_type = "chat"
+    versioned = True
+
     class Meta:
         constraints = [
             models.UniqueConstraint(
@@ -88,6 +277,21 @@ class Chat(BaseModel):
             )
         ]
 
+    @staticmethod
+    def fields_from_dict(bot_id: int, d: dict) -> dict:
+        serialized = dumps(d)
+        return {
+            "bot_id": bot_id, "type": d["type"], "serialized_chat": serialized, "digest": content_digest(serialized),
+        }
+
+    @staticmethod
+    def change_from_fields(entity_id: int, fields: dict) -> tuple[Optional[int], int, str]:
+        return entity_id, entity_id, fields["serialized_chat"]
+
+    @staticmethod
+    def version_chat_id(fields: dict) -> int:
+        return CacheVersion.BOT_CHATS
+
     def __repr__(self) -> str:
         return f"Chat(id={self.id!r}, bot_id={self.bot_id!r}, type={self.type!r})"
 
@@ -116,3 +320,383 @@ class BotSession(BaseModel):
 
     def __repr__(self) -> str:
         return f"BotSession(bot_id={self.bot_id!r}"
+
+
+class BotShard(BaseModel):
+    bot_id: int = models.BigIntegerField(primary_key=True)
+    database: str = models.CharField(max_length=64)
+
+    def __repr__(self) -> str:
+        return f"BotShard(bot_id={self.bot_id!r}, database={self.database!r})"
+
+
+class ChangeLog(BaseModel):
+    seq: int = models.BigAutoField(primary_key=True)
+    bot_id: int = models.BigIntegerField()
+    type: str = models.CharField(max_length=16)
+    chat_id: int = models.BigIntegerField(default=None, null=True)
+    entity_id: int = models.BigIntegerField()
+    payload: str = models.TextField()
+    created_at: float = models.FloatField(default=0)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=["bot_id", "seq"], name="changelog_bot_seq"),
+        ]
+
+    def __repr__(self) -> str:
+        return f"ChangeLog(seq={self.seq!r}, bot_id={self.bot_id!r}, type={self.type!r}, chat_id={self.chat_id!r}, " \
+               f"entity_id={self.entity_id!r})"
+
+
+class CacheVersion(BaseModel):
+    # Bumped by every write of messages of a chat, chat_id BOT_CHATS is bumped by writes of the bot's chats
+    BOT_CHATS = 0
+
+    bot_id: int = models.BigIntegerField()
+    chat_id: int = models.BigIntegerField()
+    version: int = models.BigIntegerField(default=0)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(
+                fields=["bot_id", "chat_id"], name="unique_cacheversion_bot_chat"
+            )
+        ]
+
+    @classmethod
+    def bump(cls, using: str, bot_id: int, chat_ids: Iterable[int]) -> None:
+        connection = connections[using]
+        table = connection.ops.quote_name(cls._meta.db_table)
+        with connection.cursor() as cursor:
+            cursor.executemany(
+                f"INSERT INTO {table} (bot_id, chat_id, version) VALUES (%s, %s, 1) "
+                f"ON CONFLICT (bot_id, chat_id) DO UPDATE SET version = {table}.version + 1",
+                [(bot_id, chat_id) for chat_id in chat_ids]
+            )
+
+    @classmethod
+    def current(cls, using: str, bot_id: int, chat_id: int) -> int:
+        return cls.objects.using(using).filter(bot_id=bot_id, chat_id=chat_id).values_list("version", flat=True) \
+            .first() or 0
+
+    def __repr__(self) -> str:
+        return f"CacheVersion(bot_id={self.bot_id!r}, chat_id={self.chat_id!r}, version={self.version!r})"
+
+
+MEDIA_KEYS = frozenset(("photo", "video", "document", "audio", "voice", "video_note", "animation", "sticker"))
+
+
+def aggregate_chat_stats(messages: Iterable[dict], chats: Optional[dict] = None) -> dict:
+    # Per chat: [message count, media count, (first message id, date), (last message id, date), {day: [message count,
+    # media count]}, {user id: last date}]
+    chats = {} if chats is None else chats
+    for message in messages:
+        message_id, date = message["message_id"], message["date"] or 0
+        media = not MEDIA_KEYS.isdisjoint(loads(message["serialized_message"]))
+        if (chat := chats.get(message["chat_id"])) is None:
+            chat = chats[message["chat_id"]] = [0, 0, (message_id, date), (message_id, date), {}, {}]
+        chat[0] += 1
+        chat[1] += media
+        chat[2] = min(chat[2], (message_id, date))
+        chat[3] = max(chat[3], (message_id, date))
+        day = chat[4].setdefault(date // 86400, [0, 0])
+        day[0] += 1
+        day[1] += media
+        if (user_id := message["from_peer"]) is not None and chat[5].get(user_id, -1) < date:
+            chat[5][user_id] = date
+    return chats
+
+
+class ChatStats(BaseModel):
+    bot_id: int = models.BigIntegerField()
+    chat_id: int = models.BigIntegerField()
+    message_count: int = models.BigIntegerField(default=0)
+    media_count: int = models.BigIntegerField(default=0)
+    user_count: int = models.BigIntegerField(default=0)
+    first_message_id: int = models.BigIntegerField()
+    first_date: int = models.BigIntegerField()
+    last_message_id: int = models.BigIntegerField()
+    last_date: int = models.BigIntegerField()
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(
+                fields=["bot_id", "chat_id"], name="unique_chatstats_bot_chat"
+            )
+        ]
+
+    @classmethod
+    def record(cls, using: str, bot_id: int, chats: dict) -> None:
+        # Counters are incremented in SQL so concurrent writers of other processes are not lost
+        connection = connections[using]
+        quote = connection.ops.quote_name
+        table, day_table, user_table = (quote(model._meta.db_table) for model in (cls, ChatStatsDay, ChatStatsUser))
+        rows = []
+        with connection.cursor() as cursor:
+            for chat_id, (message_count, media_count, first, last, days, users) in chats.items():
+                new_users = 0
+                users = list(users.items())
+                for i in range(0, len(users), 100):
+                    chunk = users[i:i + 100]
+                    cursor.execute(
+                        f"INSERT INTO {user_table} (bot_id, chat_id, user_id, last_date) VALUES "
+                        f"{', '.join(['(%s, %s, %s, %s)'] * len(chunk))} ON CONFLICT (bot_id, chat_id, user_id) "
+                        f"DO NOTHING",
+                        [value for user_id, date in chunk for value in (bot_id, chat_id, user_id, date)]
+                    )
+                    new_users += cursor.rowcount
+                cursor.executemany(
+                    f"UPDATE {user_table} SET last_date = %s "
+                    f"WHERE bot_id = %s AND chat_id = %s AND user_id = %s AND last_date < %s",
+                    [(date, bot_id, chat_id, user_id, date) for user_id, date in users]
+                )
+                cursor.executemany(
+                    f"INSERT INTO {day_table} (bot_id, chat_id, day, message_count, media_count) "
+                    f"VALUES (%s, %s, %s, %s, %s) ON CONFLICT (bot_id, chat_id, day) DO UPDATE SET "
+                    f"message_count = {day_table}.message_count + excluded.message_count, "
+                    f"media_count = {day_table}.media_count + excluded.media_count",
+                    [(bot_id, chat_id, day, *counts) for day, counts in days.items()]
+                )
+                rows.append((bot_id, chat_id, message_count, media_count, new_users, *first, *last))
+            cursor.executemany(
+                f"INSERT INTO {table} (bot_id, chat_id, message_count, media_count, user_count, first_message_id, "
+                f"first_date, last_message_id, last_date) VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s) "
+                f"ON CONFLICT (bot_id, chat_id) DO UPDATE SET "
+                f"message_count = {table}.message_count + excluded.message_count, "
+                f"media_count = {table}.media_count + excluded.media_count, "
+                f"user_count = {table}.user_count + excluded.user_count, "
+                f"first_date = CASE WHEN excluded.first_message_id < {table}.first_message_id "
+                f"THEN excluded.first_date ELSE {table}.first_date END, "
+                f"first_message_id = CASE WHEN excluded.first_message_id < {table}.first_message_id "
+                f"THEN excluded.first_message_id ELSE {table}.first_message_id END, "
+                f"last_date = CASE WHEN excluded.last_message_id > {table}.last_message_id "
+                f"THEN excluded.last_date ELSE {table}.last_date END, "
+                f"last_message_id = CASE WHEN excluded.last_message_id > {table}.last_message_id "
+                f"THEN excluded.last_message_id ELSE {table}.last_message_id END",
+                rows
+            )
+
+    @classmethod
+    def forget(cls, using: str, bot_id: int, chats: dict, bounds: dict) -> None:
+        # Takes deleted messages out of the statistics, bounds has the first and last (message id, date) of the
+        # messages left in each chat. Messages are deleted oldest first, so users without a message since the first
+        # one left have none left.
+        for chat_id, (message_count, media_count, _, _, days, _) in chats.items():
+            if (bound := bounds.get(chat_id)) is None:
+                for model in (cls, ChatStatsDay, ChatStatsUser):
+                    model.objects.using(using).filter(bot_id=bot_id, chat_id=chat_id).delete()
+                continue
+            (first_message_id, first_date), (last_message_id, last_date) = bound
+            for day, (day_count, day_media_count) in days.items():
+                ChatStatsDay.objects.using(using).filter(bot_id=bot_id, chat_id=chat_id, day=day).update(
+                    message_count=F("message_count") - day_count, media_count=F("media_count") - day_media_count
+                )
+            ChatStatsDay.objects.using(using).filter(bot_id=bot_id, chat_id=chat_id, message_count__lte=0).delete()
+            users, _ = ChatStatsUser.objects.using(using).filter(
+                bot_id=bot_id, chat_id=chat_id, last_date__lt=first_date
+            ).delete()
+            cls.objects.using(using).filter(bot_id=bot_id, chat_id=chat_id).update(
+                message_count=F("message_count") - message_count, media_count=F("media_count") - media_count,
+                user_count=F("user_count") - users, first_message_id=first_message_id, first_date=first_date,
+                last_message_id=last_message_id, last_date=last_date,
+            )
+
+    def to_json(self) -> dict:
+        return {
+            "chat_id": self.chat_id, "message_count": self.message_count, "media_count": self.media_count,
+            "user_count": self.user_count, "first_message_id": self.first_message_id, "first_date": self.first_date,
+            "last_message_id": self.last_message_id, "last_date": self.last_date,
+        }
+
+    def __repr__(self) -> str:
+        return f"ChatStats(bot_id={self.bot_id!r}, chat_id={self.chat_id!r}, message_count={self.message_count!r})"
+
+
+class ChatStatsDay(BaseModel):
+    bot_id: int = models.BigIntegerField()
+    chat_id: int = models.BigIntegerField()
+    # Days since the epoch (UTC)
+    day: int = models.BigIntegerField()
+    message_count: int = models.BigIntegerField(default=0)
+    media_count: int = models.BigIntegerField(default=0)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(
+                fields=["bot_id", "chat_id", "day"], name="unique_chatstatsday_bot_chat_day"
+            )
+        ]
+
+    def __repr__(self) -> str:
+        return f"ChatStatsDay(bot_id={self.bot_id!r}, chat_id={self.chat_id!r}, day={self.day!r})"
+
+
+class ChatStatsUser(BaseModel):
+    bot_id: int = models.BigIntegerField()
+    chat_id: int = models.BigIntegerField()
+    user_id: int = models.BigIntegerField()
+    last_date: int = models.BigIntegerField()
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(
+                fields=["bot_id", "chat_id", "user_id"], name="unique_chatstatsuser_bot_chat_user"
+            )
+        ]
+        indexes = [
+            models.Index(fields=["bot_id", "chat_id", "last_date"], name="chatstatsuser_last_date"),
+        ]
+
+    def __repr__(self) -> str:
+        return f"ChatStatsUser(bot_id={self.bot_id!r}, chat_id={self.chat_id!r}, user_id={self.user_id!r})"
+
+
+class UndeliverableChat(BaseModel):
+    bot_id: int = models.BigIntegerField()
+    chat_id: int = models.BigIntegerField()
+    error_code: int = models.IntegerField()
+    description: str = models.TextField()
+    date: int = models.BigIntegerField()
+    expires_at: int = models.BigIntegerField()
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(
+                fields=["bot_id", "chat_id"], name="unique_undeliverablechat_bot_chat"
+            )
+        ]
+
+    def __repr__(self) -> str:
+        return f"UndeliverableChat(bot_id={self.bot_id!r}, chat_id={self.chat_id!r}, " \
+               f"error_code={self.error_code!r}, description={self.description!r})"
+
+
+class IdempotencyKey(BaseModel):
+    bot_id: int = models.BigIntegerField()
+    key: str = models.CharField(max_length=255)
+    fingerprint: str = models.CharField(max_length=32)
+    # None while the first request is running
+    status_code: int = models.IntegerField(default=None, null=True)
+    content_type: str = models.CharField(max_length=128, default="", blank=True)
+    body: bytes = models.BinaryField(default=b"")
+    created_at: float = models.FloatField()
+    locked_until: float = models.FloatField()
+    expires_at: float = models.FloatField()
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(
+                fields=["bot_id", "key"], name="unique_idempotencykey_bot_key"
+            )
+        ]
+        indexes = [
+            models.Index(fields=["expires_at"], name="idempotencykey_expires"),
+        ]
+
+    def __repr__(self) -> str:
+        return f"IdempotencyKey(bot_id={self.bot_id!r}, key={self.key!r}, status_code={self.status_code!r})"
+
+
+class Broadcast(BaseModel):
+    PENDING = "pending"
+    RUNNING = "running"
+    DONE = "done"
+    CANCELLED = "cancelled"
+    FAILED = "failed"
+
+    id: int = models.BigAutoField(primary_key=True)
+    bot_id: int = models.BigIntegerField()
+    # Needed to resume the broadcast in another process, cleared when it finishes or is cancelled
+    token: str = models.CharField(max_length=128)
+    method: str = models.CharField(max_length=64)
+    params: str = models.TextField()
+    status: str = models.CharField(max_length=16, default=PENDING)
+    concurrency: int = models.IntegerField()
+    rate: float = models.FloatField()
+    total: int = models.BigIntegerField(default=0)
+    delivered: int = models.BigIntegerField(default=0)
+    failed: int = models.BigIntegerField(default=0)
+    sending_seconds: float = models.FloatField(default=0)
+    error: str = models.TextField(default="", blank=True)
+    created_at: int = models.BigIntegerField()
+    started_at: int = models.BigIntegerField(default=None, null=True)
+    finished_at: int = models.BigIntegerField(default=None, null=True)
+    lease_owner: str = models.CharField(max_length=64, default="", blank=True)
+    lease_expires_at: float = models.FloatField(default=0)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=["status", "lease_expires_at"], name="broadcast_status_lease"),
+        ]
+
+    def to_json(self) -> dict:
+        return {
+            "broadcast_id": self.id, "method": self.method, "status": self.status, "total": self.total,
+            "delivered": self.delivered, "failed": self.failed,
+            "pending": self.total - self.delivered - self.failed, "created_at": self.created_at,
+            "started_at": self.started_at, "finished_at": self.finished_at,
+            "messages_per_second": round((self.delivered + self.failed) / self.sending_seconds, 2)
+            if self.sending_seconds else 0,
+            "error": self.error or None,
+        }
+
+    def __repr__(self) -> str:
+        return f"Broadcast(id={self.id!r}, bot_id={self.bot_id!r}, method={self.method!r}, status={self.status!r})"
+
+
+class BroadcastTarget(BaseModel):
+    PENDING = 0
+    DELIVERED = 1
+    FAILED = 2
+
+    id: int = models.BigAutoField(primary_key=True)
+    broadcast_id: int = models.BigIntegerField()
+    bot_id: int = models.BigIntegerField()
+    chat_id: int = models.BigIntegerField()
+    status: int = models.SmallIntegerField(default=PENDING)
+    message_id: int = models.BigIntegerField(default=None, null=True)
+    error_code: int = models.IntegerField(default=None, null=True)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(
+                fields=["broadcast_id", "chat_id"], name="unique_broadcasttarget_chat"
+            )
+        ]
+        indexes = [
+            models.Index(fields=["broadcast_id", "status", "id"], name="broadcasttarget_pending"),
+        ]
+
+    def __repr__(self) -> str:
+        return f"BroadcastTarget(broadcast_id={self.broadcast_id!r}, chat_id={self.chat_id!r}, " \
+               f"status={self.status!r})"
+
+
+class ProfilingSettings(BaseModel):
+    enabled: bool = models.BooleanField(default=False)
+    sample_rate: float = models.FloatField(default=0.01)
+    bot_id: int = models.BigIntegerField(default=None, null=True, blank=True)
+    method: str = models.CharField(max_length=64, default="", blank=True)
+    threshold_ms: int = models.IntegerField(default=500)
+
+    class Meta:
+        verbose_name_plural = "profiling settings"
+
+    def __repr__(self) -> str:
+        return f"ProfilingSettings(enabled={self.enabled!r}, sample_rate={self.sample_rate!r}, " \
+               f"bot_id={self.bot_id!r}, method={self.method!r}, threshold_ms={self.threshold_ms!r})"
+
+
+class RequestProfile(BaseModel):
+    id: int = models.BigAutoField(primary_key=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+    bot_id: int = models.BigIntegerField()
+    method: str = models.CharField(max_length=64)
+    duration_ms: float = models.FloatField()
+    queries: str = models.TextField()
+    samples: str = models.TextField()
+
+    def __repr__(self) -> str:
+        return f"RequestProfile(id={self.id!r}, bot_id={self.bot_id!r}, method={self.method!r}, " \
+               f"duration_ms={self.duration_ms!r})"
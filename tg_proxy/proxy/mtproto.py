@@ -0,0 +1,487 @@
+"""
+The MIT License (MIT)
+
+Copyright (c) 2023-present RuslanUC
+
+Permission is hereby granted, free of charge, to any person obtaining a
+copy of this software and associated documentation files (the "Software"),
+to deal in the Software without restriction, including without limitation
+the rights to use, copy, modify, merge, publish, distribute, sublicense,
+and/or sell copies of the Software, and to permit persons to whom the
+Software is furnished to do so, subject to the following conditions:
+
+The above copyright notice and this permission notice shall be included in
+all copies or substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS
+OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING
+FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER
+DEALINGS IN THE SOFTWARE.
+"""
+
+import asyncio
+import html
+import re
+from contextlib import contextmanager
+from io import BytesIO
+from json import JSONDecodeError, loads
+from typing import Optional, Any, Union, Iterator
+
+from django.http import HttpRequest
+
+try:
+    asyncio.get_event_loop()
+except RuntimeError:
+    # Pyrogram gets the current event loop on import, request threads other than the main one have none
+    asyncio.set_event_loop(asyncio.new_event_loop())
+
+from pyrogram import Client, raw, enums
+from pyrogram.file_id import FileType
+from pyrogram.types import Message, Document, Audio, Thumbnail, Photo, Video, VideoNote, Voice, Animation
+from pyrogram.utils import get_input_media_from_file_id, parse_messages
+
+from proxy.exceptions import NoMediaException, BadRequestException
+from proxy.models import BotSession
+from proxy.routers import shard_for_bot
+from proxy.utils import get_file, get_input_file
+
+
+class MessageUtils:
+    def __init__(self, message: Message):
+        self._message = message
+        self._result: dict = None
+
+    def _set_base_data(self) -> None:
+        message = self._message
+        self._result: dict = {
+            "message_id": message.id,
+            "date": int(message.date.timestamp()),
+            "raw_message": loads(str(message))
+        }
+        if message.chat.type.value == "private":
+            self._result["chat"] = {
+                "id": message.chat.id,
+                "first_name": message.chat.first_name,
+                "username": message.chat.username,
+                "type": "private",
+            }
+        elif message.chat.type.value in ("group", "supergroup", "channel"):
+            self._result["chat"] = {
+                "id": message.chat.id,
+                "title": message.chat.title,
+                "type": message.chat.type.value,
+            }
+            if message.chat.username:
+                self._result["chat"]["username"] = message.chat.username
+
+        if message.from_user:
+            self._result["from"] = {
+                "id": message.from_user.id,
+                "is_bot": message.from_user.is_bot,
+                "first_name": message.from_user.first_name,
+                "username": message.from_user.username
+            }
+        if message.sender_chat:
+            self._result["sender_chat"] = self._result["chat"]
+        if message.media_group_id:
+            self._result["media_group_id"] = str(message.media_group_id)
+        if message.caption:
+            self._result["caption"] = message.caption
+
+    def _set_thumb(self, thumb: Union[Thumbnail, Photo]) -> dict:
+        return {
+            "file_id": thumb.file_id,
+            "file_unique_id": thumb.file_unique_id,
+            "width": thumb.width,
+            "height": thumb.height,
+            "file_size": thumb.file_size,
+        }
+
+    def _set_document(self, document: Union[Document, Audio, Photo, Video, VideoNote, Voice, Animation],
+                      base: dict=None) -> None:
+        if base is None:
+            base = self._result["document"]
+        if document.file_name: base["file_name"] = document.file_name
+        if document.file_size: base["file_size"] = document.file_size
+        if document.mime_type: base["mime_type"] = document.mime_type
+        if document.thumbs: base["thumbnail"] = self._set_thumb(document.thumbs[0])
+
+    def _set_audio(self, audio: Audio) -> None:
+        self._result["audio"]["duration"] = audio.duration
+        self._set_document(audio, self._result["audio"])
+
+    def _set_photo(self, photo: Photo) -> None:
+        self._result["photo"] = []
+        for ph in [photo] + (photo.thumbs if photo.thumbs else []):
+            self._result["photo"].append(self._set_thumb(ph))
+
+    def _set_video(self, video: Video) -> None:
+        self._result["video"]["width"] = video.width
+        self._result["video"]["height"] = video.height
+        self._result["video"]["duration"] = video.duration
+        self._set_document(video, self._result["video"])
+
+    def _set_video_note(self, video_note: VideoNote) -> None:
+        self._result["video_note"]["length"] = video_note.length
+        self._result["video_note"]["duration"] = video_note.duration
+        self._set_document(video_note, self._result["video_note"])
+
+    def _set_voice(self, voice: Voice) -> None:
+        self._result["voice"]["duration"] = voice.duration
+        self._set_document(voice, self._result["voice"])
+
+    def _set_animation(self, animation: Animation) -> None:
+        self._result["animation"]["width"] = animation.width
+        self._result["animation"]["height"] = animation.height
+        self._result["animation"]["duration"] = animation.duration
+        self._set_document(animation, self._result["animation"])
+
+    def to_json(self, media: str) -> Optional[dict]:
+        if self._result is not None: return self._result
+        self._set_base_data()
+        if self._result is None: return
+        message = self._message
+        if not (m := getattr(message, media)) or media not in ("document", "photo", "audio", "video", "video_note",
+                                                               "voice", "animation"):
+            return self._result
+
+        self._result[media] = {
+            "file_id": m.file_id,
+            "file_unique_id": m.file_unique_id
+        }
+        func = getattr(self, f"_set_{media}")
+        func(m)
+
+        return self._result
+
+
+MEDIA_GROUP_TYPES = {
+    "photo": FileType.PHOTO,
+    "video": FileType.VIDEO,
+    "audio": FileType.AUDIO,
+    "document": FileType.DOCUMENT,
+}
+PARSE_MODES = {
+    "": enums.ParseMode.DISABLED,
+    "html": enums.ParseMode.HTML,
+}
+# Pyrogram's markdown is another syntax (**bold**, no escaping), Bot API markdown captions are converted to HTML
+MARKDOWN_VERSIONS = {"markdown": 1, "markdownv2": 2}
+MARKDOWN_TAGS = {
+    1: {"*": "b", "_": "i"},
+    2: {"||": "spoiler", "__": "u", "*": "b", "_": "i", "~": "s"},
+}
+MARKDOWN_V2_RESERVED = "_*[]()~`>#+-=|{}.!\\"
+
+
+def _entity_error(text: str, offset: int) -> BadRequestException:
+    return BadRequestException(400, "Bad Request: can't parse entities: Can't find end of the entity starting at "
+                                    f"byte offset {len(text[:offset].encode())}")
+
+
+def markdown_to_html(text: str, version: int) -> str:
+    tags = MARKDOWN_TAGS[version]
+
+    def read(start: int, end: str, entity: int) -> tuple[str, int]:
+        # Code and urls only escape "`", ")" and "\\" in MarkdownV2 and nothing in Markdown
+        chars, i = [], start
+        while i < len(text):
+            if version == 2 and text[i] == "\\" and i + 1 < len(text):
+                chars.append(text[i + 1])
+                i += 2
+            elif text.startswith(end, i):
+                return "".join(chars), i + len(end)
+            else:
+                chars.append(text[i])
+                i += 1
+        raise _entity_error(text, entity)
+
+    result, opened, i = [], [], 0
+    while i < len(text):
+        marker = next((marker for marker in tags if text.startswith(marker, i)), None)
+        if version == 1 and opened and not text.startswith("]" if opened[-1][0] == "[" else opened[-1][0], i):
+            # Markdown entities do not nest
+            result.append(html.escape(text[i]))
+            i += 1
+        elif text[i] == "\\" and i + 1 < len(text) and (version == 2 or text[i + 1] in "_*`["):
+            result.append(html.escape(text[i + 1]))
+            i += 2
+        elif text.startswith("```", i):
+            code, i = read(i + 3, "```", i)
+            language, newline, rest = code.partition("\n")
+            if newline and language and not any(char.isspace() for char in language):
+                result.append(f'<pre language="{html.escape(language)}">{html.escape(rest)}</pre>')
+            else:
+                result.append(f"<pre>{html.escape(code)}</pre>")
+        elif text[i] == "`":
+            code, i = read(i + 1, "`", i)
+            result.append(f"<code>{html.escape(code)}</code>")
+        elif text[i] == "]" and opened and opened[-1][0] in ("[", "!["):
+            link, index, start = opened.pop()
+            if not text.startswith("(", i + 1):
+                raise _entity_error(text, start)
+            url, i = read(i + 2, ")", start)
+            if link == "![":
+                if not (emoji := re.fullmatch(r"tg://emoji\?id=(\d+)", url)):
+                    raise BadRequestException(400, "Bad Request: can't parse entities: Custom emoji entity must "
+                                                   "contain a tg://emoji URL")
+                result.insert(index, f'<emoji id="{emoji[1]}">')
+                result.append("</emoji>")
+            else:
+                result.insert(index, f'<a href="{html.escape(url)}">')
+                result.append("</a>")
+        elif (link := "[" if text[i] == "[" else "![" if version == 2 and text.startswith("![", i) else None) \
+                and not any(entity[0] in ("[", "![") for entity in opened):
+            opened.append((link, len(result), i))
+            i += len(link)
+        elif marker is not None:
+            if marker in (entity[0] for entity in opened):
+                opened.pop(next(index for index, entity in enumerate(opened) if entity[0] == marker))
+                result.append(f"</{tags[marker]}>")
+            else:
+                opened.append((marker, len(result), i))
+                result.append(f"<{tags[marker]}>")
+            i += len(marker)
+        elif version == 2 and text[i] in MARKDOWN_V2_RESERVED:
+            raise BadRequestException(400, f"Bad Request: can't parse entities: Character '{text[i]}' is reserved and "
+                                           "must be escaped with the preceding '\\'")
+        else:
+            result.append(html.escape(text[i]))
+            i += 1
+    if opened:
+        raise _entity_error(text, opened[0][2])
+    return "".join(result)
+
+
+class PyrogramBot:
+    def __init__(self, token: str, api_id: int, api_hash: str):
+        self._token = token
+        self._api_id = api_id
+        self._api_hash = api_hash
+
+    @contextmanager
+    def _client(self) -> Iterator[Client]:
+        asyncio.set_event_loop(asyncio.new_event_loop())
+        bot_id = int(self._token.split(":")[0])
+        client_args = {
+            "bot_token": self._token,
+            "api_id": self._api_id,
+            "api_hash": self._api_hash,
+            "no_updates": True,
+            "name": bot_id,
+            "in_memory": True,
+        }
+        bot_session = BotSession.objects.using(shard_for_bot(bot_id)).filter(bot_id=bot_id).first()
+        create_session = True
+        if bot_session is not None:
+            create_session = False
+            client_args["session_string"] = bot_session.session_string
+        with Client(**client_args) as bot:
+            if create_session:
+                BotSession.update_or_create_objects("bot_id", bot_id,
+                    [{"bot_id": bot_id, "session_string": bot.export_session_string()}],
+                    lambda d: d
+                )
+            yield bot
+
+    def _upload(self, media: str, args: dict) -> Optional[dict]:
+        with self._client() as bot:
+            func = getattr(bot, f"send_{media}")
+            message: Message = func(**args)
+            return MessageUtils(message).to_json(media)
+
+    async def _upload_group_item(self, bot: Client, peer: Any, item: dict) -> raw.types.InputSingleMedia:
+        media = item["media"]
+        if not isinstance(media, BytesIO):
+            # A file_id, decoded when the request was checked
+            input_media = media
+        elif item["type"] == "photo":
+            uploaded = await bot.invoke(raw.functions.messages.UploadMedia(
+                peer=peer, media=raw.types.InputMediaUploadedPhoto(file=await bot.save_file(media),
+                                                                    spoiler=item.get("has_spoiler"))
+            ))
+            input_media = raw.types.InputMediaPhoto(
+                id=raw.types.InputPhoto(id=uploaded.photo.id, access_hash=uploaded.photo.access_hash,
+                                        file_reference=uploaded.photo.file_reference),
+                spoiler=item.get("has_spoiler")
+            )
+        else:
+            attributes = [raw.types.DocumentAttributeFilename(file_name=media.name)]
+            if item["type"] == "video":
+                attributes.append(raw.types.DocumentAttributeVideo(
+                    duration=int(item.get("duration") or 0), w=int(item.get("width") or 0),
+                    h=int(item.get("height") or 0), supports_streaming=item.get("supports_streaming") or None
+                ))
+            elif item["type"] == "audio":
+                attributes.append(raw.types.DocumentAttributeAudio(
+                    duration=int(item.get("duration") or 0), performer=item.get("performer"), title=item.get("title")
+                ))
+            uploaded = await bot.invoke(raw.functions.messages.UploadMedia(
+                peer=peer, media=raw.types.InputMediaUploadedDocument(
+                    file=await bot.save_file(media), thumb=await bot.save_file(item.get("thumbnail")),
+                    mime_type=bot.guess_mime_type(media.name) or "application/octet-stream",
+                    attributes=attributes, spoiler=item.get("has_spoiler")
+                )
+            ))
+            input_media = raw.types.InputMediaDocument(
+                id=raw.types.InputDocument(id=uploaded.document.id, access_hash=uploaded.document.access_hash,
+                                           file_reference=uploaded.document.file_reference),
+                spoiler=item.get("has_spoiler")
+            )
+        caption = await bot.parser.parse(item.get("caption"), PARSE_MODES[item["parse_mode"]])
+        return raw.types.InputSingleMedia(media=input_media, random_id=bot.rnd_id(), **caption)
+
+    async def _send_media_group(self, bot: Client, args: dict, media: list[dict]) -> list[Message]:
+        peer = await bot.resolve_peer(args["chat_id"])
+        multi_media = await asyncio.gather(*[self._upload_group_item(bot, peer, item) for item in media])
+        reply_to = args["reply_to_message_id"]
+        r = await bot.invoke(raw.functions.messages.SendMultiMedia(
+            peer=peer, multi_media=list(multi_media),
+            silent=args["disable_notification"] in ("true", "True", "1") or None,
+            reply_to_msg_id=int(reply_to) if reply_to else None,
+            noforwards=args["protect_content"] in ("true", "True", "1") or None
+        ), sleep_threshold=60)
+        return await parse_messages(bot, raw.types.messages.Messages(
+            messages=[u.message for u in r.updates
+                      if isinstance(u, (raw.types.UpdateNewMessage, raw.types.UpdateNewChannelMessage))],
+            users=r.users, chats=r.chats
+        ))
+
+    def _upload_media_group(self, args: dict, media: list[dict]) -> list[dict]:
+        with self._client() as bot:
+            messages = asyncio.get_event_loop().run_until_complete(self._send_media_group(bot, args, media))
+            return [MessageUtils(message).to_json(message.media.value if message.media else "")
+                    for message in messages]
+
+    def _req_to_json(self, request: HttpRequest) -> dict:
+        return {
+            "chat_id": int(request.GET.get("chat_id")),
+            "disable_notification": request.GET.get("disable_notification", None),
+            "reply_to_message_id": request.GET.get("message_thread_id", request.GET.get("reply_to_message_id", None)),
+            "schedule_date": None,
+            "protect_content": request.GET.get("protect_content", None),
+            "reply_markup": loads(request.GET.get("reply_markup", None)) if request.GET.get("reply_markup",
+                                                                                            None) else None,
+        }
+
+    def sendDocument(self, request: HttpRequest) -> Optional[dict]:
+        if not (document := get_file(request, "document")):
+            raise NoMediaException(400, "Bad Request: there is no document in the request")
+        thumb = get_file(request, "thumbnail")
+        args = self._req_to_json(request)
+        args["document"] = document
+        args["thumb"] = thumb
+        args["caption"] = request.GET.get("caption", None)
+        args["parse_mode"] = request.GET.get("parse_mode", None)
+        return self._upload("document", args)
+
+    def sendAudio(self, request: HttpRequest) -> Optional[dict]:
+        if not (audio := get_file(request, "audio")):
+            raise NoMediaException(400, "Bad Request: there is no audio in the request")
+        thumb = get_file(request, "thumbnail")
+        args = self._req_to_json(request)
+        args["audio"] = audio
+        args["thumb"] = thumb
+        args["caption"] = request.GET.get("caption", None)
+        args["parse_mode"] = request.GET.get("parse_mode", None)
+        args["duration"] = request.GET.get("duration", None)
+        args["performer"] = request.GET.get("performer", None)
+        args["title"] = request.GET.get("title", None)
+        return self._upload("audio", args)
+
+    def sendPhoto(self, request: HttpRequest) -> Optional[dict]:
+        if not (photo := get_file(request, "photo")):
+            raise NoMediaException(400, "Bad Request: there is no photo in the request")
+        args = self._req_to_json(request)
+        args["photo"] = photo
+        args["caption"] = request.GET.get("caption", None)
+        args["parse_mode"] = request.GET.get("parse_mode", None)
+        args["has_spoiler"] = request.GET.get("has_spoiler", None)
+        return self._upload("photo", args)
+
+    def sendVideo(self, request: HttpRequest) -> Optional[dict]:
+        if not (video := get_file(request, "video")):
+            raise NoMediaException(400, "Bad Request: there is no video in the request")
+        thumb = get_file(request, "thumbnail")
+        args = self._req_to_json(request)
+        args["video"] = video
+        args["thumb"] = thumb
+        args["caption"] = request.GET.get("caption", None)
+        args["parse_mode"] = request.GET.get("parse_mode", None)
+        args["duration"] = request.GET.get("duration", None)
+        args["width"] = request.GET.get("width", None)
+        args["height"] = request.GET.get("height", None)
+        args["title"] = request.GET.get("title", None)
+        args["has_spoiler"] = request.GET.get("has_spoiler", None)
+        return self._upload("video", args)
+
+    def sendVideoNote(self, request: HttpRequest) -> Optional[dict]:
+        if not (video_note := get_file(request, "video_note")):
+            raise NoMediaException(400, "Bad Request: there is no video_note in the request")
+        thumb = get_file(request, "thumbnail")
+        args = self._req_to_json(request)
+        args["video_note"] = video_note
+        args["thumb"] = thumb
+        args["duration"] = request.GET.get("duration", None)
+        args["length"] = request.GET.get("length", None)
+        return self._upload("video_note", args)
+
+    def sendVoice(self, request: HttpRequest) -> Optional[dict]:
+        if not (voice := get_file(request, "voice")):
+            raise NoMediaException(400, "Bad Request: there is no voice in the request")
+        args = self._req_to_json(request)
+        args["voice"] = voice
+        args["caption"] = request.GET.get("caption", None)
+        args["parse_mode"] = request.GET.get("parse_mode", None)
+        args["duration"] = request.GET.get("duration", None)
+        return self._upload("voice", args)
+
+    def sendAnimation(self, request: HttpRequest) -> Optional[dict]:
+        if not (animation := get_file(request, "animation")):
+            raise NoMediaException(400, "Bad Request: there is no animation in the request")
+        thumb = get_file(request, "thumbnail")
+        args = self._req_to_json(request)
+        args["animation"] = animation
+        args["thumb"] = thumb
+        args["caption"] = request.GET.get("caption", None)
+        args["parse_mode"] = request.GET.get("parse_mode", None)
+        args["duration"] = request.GET.get("duration", None)
+        args["width"] = request.GET.get("width", None)
+        args["height"] = request.GET.get("height", None)
+        args["has_spoiler"] = request.GET.get("has_spoiler", None)
+        return self._upload("animation", args)
+
+    def sendMediaGroup(self, request: HttpRequest) -> Optional[list[dict]]:
+        try:
+            media = loads(request.GET.get("media", "[]"))
+        except JSONDecodeError:
+            raise BadRequestException(400, "Bad Request: can't parse media JSON object")
+        if not isinstance(media, list) or not media:
+            raise NoMediaException(400, "Bad Request: there is no media in the request")
+        if not 2 <= len(media) <= 10:
+            raise BadRequestException(400, "Bad Request: wrong number of media items, must include 2-10 items")
+        for item in media:
+            if not isinstance(item, dict) or item.get("type") not in MEDIA_GROUP_TYPES:
+                raise BadRequestException(400, "Bad Request: unsupported media type in the media group")
+            if not (file := get_input_file(request, item.get("media"))):
+                raise NoMediaException(400, f"Bad Request: there is no {item['type']} in the request")
+            if isinstance(file, str):
+                try:
+                    file = get_input_media_from_file_id(file, MEDIA_GROUP_TYPES[item["type"]])
+                except ValueError:
+                    raise BadRequestException(400, "Bad Request: wrong file identifier/HTTP URL specified")
+            item["media"] = file
+            parse_mode = (item.get("parse_mode") or "").lower()
+            if parse_mode in MARKDOWN_VERSIONS:
+                item["caption"] = markdown_to_html(item.get("caption") or "", MARKDOWN_VERSIONS[parse_mode])
+                parse_mode = "html"
+            elif parse_mode not in PARSE_MODES:
+                raise BadRequestException(400, "Bad Request: unsupported parse_mode")
+            item["parse_mode"] = parse_mode
+            thumb = get_input_file(request, item.get("thumbnail"))
+            item["thumbnail"] = thumb if isinstance(thumb, BytesIO) else None
+        args = self._req_to_json(request)
+        return self._upload_media_group(args, media)
@@ -0,0 +1,328 @@
+"""
+The MIT License (MIT)
+
+Copyright (c) 2023-present RuslanUC
+
+Permission is hereby granted, free of charge, to any person obtaining a
+copy of this software and associated documentation files (the "Software"),
+to deal in the Software without restriction, including without limitation
+the rights to use, copy, modify, merge, publish, distribute, sublicense,
+and/or sell copies of the Software, and to permit persons to whom the
+Software is furnished to do so, subject to the following conditions:
+
+The above copyright notice and this permission notice shall be included in
+all copies or substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS
+OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING
+FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER
+DEALINGS IN THE SOFTWARE.
+"""
+
+from json import loads
+from typing import Any, Callable
+
+from django.conf import settings
+
+from proxy.delivery import SEND_METHOD_PREFIXES
+
+REQUIRED = object()
+
+
+class Params:
+    __slots__ = ()
+    fields: tuple[tuple[str, Callable[[str], Any], Any], ...] = ()
+
+    def __init__(self, query: dict):
+        for name, convert, default in self.fields:
+            value = query.get(name)
+            if value is None:
+                if default is REQUIRED:
+                    raise ValueError(f"Missing required parameter {name!r}")
+                value = default
+            else:
+                value = convert(value)
+            setattr(self, name, value)
+        self.validate()
+
+    def validate(self) -> None:
+        pass
+
+
+MAX_BATCH_SIZE = 200
+
+
+def json_list(value: Any) -> list:
+    # Lists are accepted as JSON bodies or, like in the Bot API, as JSON-serialized query/form parameters
+    if isinstance(value, str):
+        value = loads(value)
+    if not isinstance(value, list) or len(value) > MAX_BATCH_SIZE:
+        raise ValueError(f"Expected a list of at most {MAX_BATCH_SIZE} items")
+    return value
+
+
+def id_list(value: Any) -> list[int]:
+    try:
+        return [int(item) for item in json_list(value)]
+    except TypeError:
+        raise ValueError("Invalid id")
+
+
+def message_key_list(value: Any) -> list[tuple[int, int]]:
+    # Items are {"chat_id": ..., "message_id": ...} objects or [chat_id, message_id] pairs
+    keys = []
+    try:
+        for item in json_list(value):
+            if isinstance(item, dict):
+                item = (item["chat_id"], item["message_id"])
+            chat_id, message_id = item
+            keys.append((int(chat_id), int(message_id)))
+    except (KeyError, TypeError):
+        raise ValueError("Invalid message key")
+    return keys
+
+
+MAX_BROADCAST_TARGETS = 1000000
+
+
+def broadcast_targets(value: Any) -> list[int]:
+    if isinstance(value, str):
+        value = loads(value)
+    if not isinstance(value, list) or len(value) > MAX_BROADCAST_TARGETS:
+        raise ValueError(f"Expected a list of at most {MAX_BROADCAST_TARGETS} ids")
+    try:
+        return [int(item) for item in value]
+    except TypeError:
+        raise ValueError("Invalid id")
+
+
+def json_object(value: Any) -> dict:
+    if isinstance(value, str):
+        value = loads(value)
+    if not isinstance(value, dict):
+        raise ValueError("Expected a JSON object")
+    return value
+
+
+def boolean(value: Any) -> bool:
+    if isinstance(value, bool):
+        return value
+    return str(value).lower() in ("1", "true", "yes")
+
+
+def clamp_limit(value: int) -> int:
+    if value > 100: value = 100
+    if value < 1: value = 1
+    return value
+
+
+CHANGE_TYPES = frozenset(("message", "chat", "user"))
+
+
+def change_types(value: str) -> frozenset[str]:
+    types = frozenset(value.split(","))
+    if not types <= CHANGE_TYPES:
+        raise ValueError(f"Invalid change types {value!r}")
+    return types
+
+
+def parse_cursor(value: str) -> tuple[int, int]:
+    # Cursors are "<chat_id>:<message_id>" of the last exported message
+    chat_id, message_id = value.split(":")
+    return int(chat_id), int(message_id)
+
+
+class GetMessageParams(Params):
+    __slots__ = ("message_id", "chat_id")
+    fields = (
+        ("message_id", int, REQUIRED),
+        ("chat_id", int, None),
+    )
+
+
+class GetMessagesParams(Params):
+    __slots__ = ("chat_id", "limit", "before", "after")
+    fields = (
+        ("chat_id", int, REQUIRED),
+        ("limit", int, 100),
+        ("before", int, 2 ** 63 - 1),
+        ("after", int, 0),
+    )
+
+    def validate(self) -> None:
+        self.limit = clamp_limit(self.limit)
+
+
+class GetChatsParams(Params):
+    __slots__ = ("limit", "before", "after", "type")
+    fields = (
+        ("limit", int, 100),
+        ("before", int, 2 ** 63 - 1),
+        ("after", int, -(2 ** 63)),
+        ("type", str, ""),
+    )
+
+    def validate(self) -> None:
+        self.limit = clamp_limit(self.limit)
+        if self.type not in ("", "private", "group", "supergroup", "channel"):
+            self.type = ""
+
+
+class GetUserParams(Params):
+    __slots__ = ("user_id",)
+    fields = (("user_id", int, REQUIRED),)
+
+
+class GetThreadParams(Params):
+    __slots__ = ("chat_id", "message_thread_id", "limit", "before", "after")
+    fields = (
+        ("chat_id", int, REQUIRED),
+        ("message_thread_id", int, REQUIRED),
+        ("limit", int, 100),
+        ("before", int, 2 ** 63 - 1),
+        ("after", int, 0),
+    )
+
+    def validate(self) -> None:
+        self.limit = clamp_limit(self.limit)
+
+
+class GetUserMessagesParams(Params):
+    __slots__ = ("user_id", "chat_id", "limit", "before", "after")
+    fields = (
+        ("user_id", int, REQUIRED),
+        ("chat_id", int, None),
+        ("limit", int, 100),
+        ("before", int, 2 ** 63 - 1),
+        ("after", int, 0),
+    )
+
+    def validate(self) -> None:
+        self.limit = clamp_limit(self.limit)
+
+
+class GetRepliesParams(Params):
+    __slots__ = ("chat_id", "message_id", "direction", "depth", "limit")
+    fields = (
+        ("chat_id", int, REQUIRED),
+        ("message_id", int, REQUIRED),
+        ("direction", str, "tree"),
+        ("depth", int, 10),
+        ("limit", int, 100),
+    )
+
+    def validate(self) -> None:
+        self.limit = clamp_limit(self.limit)
+        if self.direction not in ("tree", "chain"):
+            raise ValueError(f"Invalid direction {self.direction!r}")
+        if self.depth > 50: self.depth = 50
+        if self.depth < 1: self.depth = 1
+
+
+class GetMessagesBatchParams(Params):
+    __slots__ = ("messages",)
+    fields = (("messages", message_key_list, REQUIRED),)
+
+
+class GetUsersParams(Params):
+    __slots__ = ("user_ids",)
+    fields = (("user_ids", id_list, REQUIRED),)
+
+
+class GetChatsByIdParams(Params):
+    __slots__ = ("chat_ids",)
+    fields = (("chat_ids", id_list, REQUIRED),)
+
+
+class ExportMessagesParams(Params):
+    __slots__ = ("chat_id", "cursor")
+    fields = (
+        ("chat_id", int, None),
+        ("cursor", parse_cursor, None),
+    )
+
+
+class GetChangesParams(Params):
+    __slots__ = ("after", "chat_id", "types", "limit")
+    fields = (
+        ("after", int, None),
+        ("chat_id", int, None),
+        ("types", change_types, None),
+        ("limit", int, 100),
+    )
+
+    def validate(self) -> None:
+        self.limit = clamp_limit(self.limit)
+
+
+class GetMessageHistoryParams(Params):
+    __slots__ = ("chat_id", "message_id", "version", "after", "limit")
+    fields = (
+        ("chat_id", int, REQUIRED),
+        ("message_id", int, REQUIRED),
+        ("version", int, None),
+        ("after", int, -1),
+        ("limit", int, 100),
+    )
+
+    def validate(self) -> None:
+        self.limit = clamp_limit(self.limit)
+        if self.version is not None and self.version < 0:
+            raise ValueError(f"Invalid version {self.version!r}")
+
+
+class GetChatStatsParams(Params):
+    __slots__ = ("chat_id", "days")
+    fields = (
+        ("chat_id", int, REQUIRED),
+        ("days", int, 30),
+    )
+
+    def validate(self) -> None:
+        if self.days > 366: self.days = 366
+        if self.days < 1: self.days = 1
+
+
+class GetUndeliverableChatsParams(Params):
+    __slots__ = ("after", "limit")
+    fields = (
+        ("after", int, None),
+        ("limit", int, 100),
+    )
+
+    def validate(self) -> None:
+        self.limit = clamp_limit(self.limit)
+
+
+class DeleteUndeliverableChatsParams(Params):
+    __slots__ = ("chat_ids",)
+    fields = (("chat_ids", id_list, None),)
+
+
+class CreateBroadcastParams(Params):
+    __slots__ = ("method", "params", "chat_ids", "all_private_chats", "concurrency", "rate")
+    fields = (
+        ("method", str, "sendMessage"),
+        ("params", json_object, REQUIRED),
+        ("chat_ids", broadcast_targets, None),
+        ("all_private_chats", boolean, False),
+        ("concurrency", int, 8),
+        ("rate", float, 25.0),
+    )
+
+    def validate(self) -> None:
+        if not self.method.startswith(SEND_METHOD_PREFIXES) or "chat_id" in self.params:
+            raise ValueError("Invalid broadcast method or params")
+        if not self.chat_ids and not self.all_private_chats:
+            raise ValueError("No broadcast targets")
+        self.concurrency = min(max(self.concurrency, 1), getattr(settings, "TG_BROADCAST_MAX_CONCURRENCY", 32))
+        if not 0 < self.rate <= getattr(settings, "TG_BROADCAST_MAX_RATE", 30):
+            self.rate = getattr(settings, "TG_BROADCAST_MAX_RATE", 30)
+
+
+class BroadcastParams(Params):
+    __slots__ = ("broadcast_id",)
+    fields = (("broadcast_id", int, REQUIRED),)
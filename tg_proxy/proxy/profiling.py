@@ -0,0 +1,174 @@
+"""
+The MIT License (MIT)
+
+Copyright (c) 2023-present RuslanUC
+
+Permission is hereby granted, free of charge, to any person obtaining a
+copy of this software and associated documentation files (the "Software"),
+to deal in the Software without restriction, including without limitation
+the rights to use, copy, modify, merge, publish, distribute, sublicense,
+and/or sell copies of the Software, and to permit persons to whom the
+Software is furnished to do so, subject to the following conditions:
+
+The above copyright notice and this permission notice shall be included in
+all copies or substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS
+OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING
+FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER
+DEALINGS IN THE SOFTWARE.
+"""
+
+import marshal
+import re
+import sys
+from json import dumps, loads
+from random import random
+from threading import Thread, Event, get_ident
+from time import perf_counter, monotonic
+from typing import Callable, Optional
+
+from django.conf import settings
+from django.http import HttpRequest, HttpResponse
+
+from proxy.db import serialized_write, observe_queries
+from proxy.models import ProfilingSettings, RequestProfile
+
+BOT_PATH_REGEX = re.compile(r"^/bot(\d+):[^/]+/([A-Za-z0-9_]{1,64})$")
+SETTINGS_REFRESH_INTERVAL = 5
+MAX_QUERIES = 500
+
+
+class StackSampler:
+    def __init__(self, thread_id: int, interval: float):
+        self._thread_id = thread_id
+        self._interval = interval
+        self._stop = Event()
+        self._thread = Thread(target=self._run, daemon=True)
+        self.frames: list[tuple[str, int, str]] = []
+        self.samples: list[list[int]] = []
+        self._frame_ids: dict[tuple[str, int, str], int] = {}
+
+    def _frame_id(self, key: tuple[str, int, str]) -> int:
+        if (idx := self._frame_ids.get(key)) is None:
+            idx = self._frame_ids[key] = len(self.frames)
+            self.frames.append(key)
+        return idx
+
+    def _run(self) -> None:
+        while not self._stop.wait(self._interval):
+            if (frame := sys._current_frames().get(self._thread_id)) is None:
+                continue
+            stack = []
+            while frame is not None:
+                code = frame.f_code
+                stack.append(self._frame_id((code.co_filename, code.co_firstlineno, code.co_name)))
+                frame = frame.f_back
+            stack.reverse()
+            self.samples.append(stack)
+
+    def start(self) -> None:
+        self._thread.start()
+
+    def stop(self) -> None:
+        self._stop.set()
+        self._thread.join()
+
+
+def to_speedscope(profile: RequestProfile) -> dict:
+    data = loads(profile.samples)
+    interval = data["interval"]
+    return {
+        "$schema": "https://www.speedscope.app/file-format-schema.json",
+        "shared": {"frames": [{"name": name, "file": file, "line": line} for file, line, name in data["frames"]]},
+        "profiles": [{
+            "type": "sampled",
+            "name": f"{profile.method} (bot {profile.bot_id}, {profile.duration_ms:.1f} ms)",
+            "unit": "seconds",
+            "startValue": 0,
+            "endValue": len(data["samples"]) * interval,
+            "samples": data["samples"],
+            "weights": [interval] * len(data["samples"]),
+        }],
+        "exporter": "tg_proxy",
+    }
+
+
+def to_pstats(profile: RequestProfile) -> bytes:
+    data = loads(profile.samples)
+    interval = data["interval"]
+    frames = [tuple(frame) for frame in data["frames"]]
+    stats: dict[tuple, list] = {}
+    for stack in data["samples"]:
+        seen = set()
+        for depth, idx in enumerate(stack):
+            entry = stats.setdefault(frames[idx], [0, 0, 0.0, 0.0, {}])
+            if idx not in seen:
+                entry[0] += 1
+                entry[1] += 1
+                entry[3] += interval
+                seen.add(idx)
+            if depth == len(stack) - 1:
+                entry[2] += interval
+            if depth > 0:
+                callers = entry[4]
+                caller = frames[stack[depth - 1]]
+                cc, nc, tt, ct = callers.get(caller, (0, 0, 0.0, 0.0))
+                callers[caller] = (cc + 1, nc + 1, tt, ct + interval)
+    return marshal.dumps({key: tuple(value) for key, value in stats.items()})
+
+
+class ProfilingMiddleware:
+    def __init__(self, get_response: Callable[[HttpRequest], HttpResponse]):
+        self.get_response = get_response
+        self._settings: Optional[ProfilingSettings] = None
+        self._settings_loaded_at = float("-inf")
+
+    def _get_settings(self) -> Optional[ProfilingSettings]:
+        if monotonic() - self._settings_loaded_at > SETTINGS_REFRESH_INTERVAL:
+            self._settings = ProfilingSettings.objects.filter(enabled=True).first()
+            self._settings_loaded_at = monotonic()
+        return self._settings
+
+    @staticmethod
+    def _save_profile(**fields) -> None:
+        RequestProfile.objects.create(**fields)
+        buffer_size = getattr(settings, "TG_PROFILING_BUFFER_SIZE", 100)
+        stale = RequestProfile.objects.order_by("-id").values_list("id", flat=True)[buffer_size:buffer_size + 1]
+        if stale:
+            RequestProfile.objects.filter(id__lte=stale[0]).delete()
+
+    def __call__(self, request: HttpRequest) -> HttpResponse:
+        if (match := BOT_PATH_REGEX.match(request.path_info)) is None or (conf := self._get_settings()) is None:
+            return self.get_response(request)
+        bot_id, method = int(match.group(1)), match.group(2)
+        if (conf.bot_id is not None and conf.bot_id != bot_id) or (conf.method and conf.method != method) \
+                or random() >= conf.sample_rate:
+            return self.get_response(request)
+
+        queries = []
+
+        def record_query(sql: str, duration: float) -> None:
+            if len(queries) < MAX_QUERIES:
+                queries.append({"sql": sql, "duration_ms": duration * 1000})
+
+        interval = getattr(settings, "TG_PROFILING_INTERVAL", 0.001)
+        sampler = StackSampler(get_ident(), interval)
+        start = perf_counter()
+        sampler.start()
+        try:
+            with observe_queries(record_query):
+                response = self.get_response(request)
+        finally:
+            sampler.stop()
+        duration_ms = (perf_counter() - start) * 1000
+
+        if duration_ms >= conf.threshold_ms:
+            serialized_write(lambda: self._save_profile(
+                bot_id=bot_id, method=method, duration_ms=duration_ms, queries=dumps(queries),
+                samples=dumps({"interval": interval, "frames": sampler.frames, "samples": sampler.samples}),
+            ))
+        return response
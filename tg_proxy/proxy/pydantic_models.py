@@ -25,7 +25,7 @@ DEALINGS IN THE SOFTWARE.
 from __future__ import annotations
 from typing import Optional
 
-from pydantic import BaseModel, validator
+from pydantic import BaseModel
 from pydantic.fields import Field
 
 
@@ -149,43 +149,3 @@ class Message(BaseModel):
 
     class Config:
         allow_population_by_field_name = True
-
-
-class GetMessageParams(BaseModel):
-    message_id: int
-
-
-class GetMessagesParams(BaseModel):
-    chat_id: int
-    limit: int = 100
-    before: int = 2**63 - 1
-    after: int = 0
-
-    @validator("limit")
-    def validate_limit(cls: GetMessagesParams, value: int) -> int:
-        if value > 100: value = 100
-        if value < 1: value = 1
-        return value
-
-
-class GetChatsParams(BaseModel):
-    limit: int = 100
-    before: int = 2 ** 63 - 1
-    after: int = -(2 ** 63)
-    type: str = ""
-
-    @validator("limit")
-    def validate_limit(cls: GetChatsParams, value: int) -> int:
-        if value > 100: value = 100
-        if value < 1: value = 1
-        return value
-
-    @validator("type")
-    def validate_type(cls: GetChatsParams, value: str) -> str:
-        if value not in ("", "private", "group", "supergroup", "channel"):
-            value = ""
-        return value
-
-
-class GetUserParams(BaseModel):
-    user_id: int
\ No newline at end of file
@@ -0,0 +1,93 @@
+"""
+The MIT License (MIT)
+
+Copyright (c) 2023-present RuslanUC
+
+Permission is hereby granted, free of charge, to any person obtaining a
+copy of this software and associated documentation files (the "Software"),
+to deal in the Software without restriction, including without limitation
+the rights to use, copy, modify, merge, publish, distribute, sublicense,
+and/or sell copies of the Software, and to permit persons to whom the
+Software is furnished to do so, subject to the following conditions:
+
+The above copyright notice and this permission notice shall be included in
+all copies or substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS
+OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING
+FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER
+DEALINGS IN THE SOFTWARE.
+"""
+
+from typing import Optional
+
+from django.db import connections
+
+from proxy.models import Message
+
+MESSAGE_TABLE = Message._meta.db_table
+
+# Messages replying to the start message, and replies to those, breadth first. The start id is seeded directly so
+# replies are found even if the start message itself is not cached.
+REPLY_TREE_SQL = f"""
+WITH RECURSIVE replies (message_id, depth) AS (
+    SELECT CAST(%(message_id)s AS BIGINT), 0
+    UNION
+    SELECT m.message_id, r.depth + 1 FROM replies AS r
+    JOIN "{MESSAGE_TABLE}" AS m
+        ON m.bot_id = %(bot_id)s AND m.chat_id = %(chat_id)s AND m.reply_to_message_id = r.message_id
+    WHERE r.depth < %(depth)s
+)
+SELECT m.serialized_message FROM replies AS r
+JOIN "{MESSAGE_TABLE}" AS m ON m.bot_id = %(bot_id)s AND m.chat_id = %(chat_id)s AND m.message_id = r.message_id
+ORDER BY r.depth, m.message_id
+LIMIT %(limit)s
+"""
+
+# The start message and the messages it (transitively) replies to, newest first
+REPLY_CHAIN_SQL = f"""
+WITH RECURSIVE chain (message_id, depth) AS (
+    SELECT CAST(%(message_id)s AS BIGINT), 0
+    UNION ALL
+    SELECT m.reply_to_message_id, c.depth + 1 FROM chain AS c
+    JOIN "{MESSAGE_TABLE}" AS m ON m.bot_id = %(bot_id)s AND m.chat_id = %(chat_id)s AND m.message_id = c.message_id
+    WHERE m.reply_to_message_id IS NOT NULL AND c.depth < %(depth)s
+)
+SELECT m.serialized_message FROM chain AS c
+JOIN "{MESSAGE_TABLE}" AS m ON m.bot_id = %(bot_id)s AND m.chat_id = %(chat_id)s AND m.message_id = c.message_id
+ORDER BY c.depth
+LIMIT %(limit)s
+"""
+
+# Messages of the user per chat. Grouping by an expression keeps SQLite from walking a (bot_id, chat_id, ...) index
+# of all the bot's messages just to get them in chat order when the table was never analyzed.
+USER_ACTIVITY_SQL = f"""
+SELECT m.chat_id + 0, COUNT(*), MIN(m.message_id), MAX(m.message_id), MIN(m.date), MAX(m.date)
+FROM "{MESSAGE_TABLE}" AS m
+WHERE m.bot_id = %(bot_id)s AND m.from_peer = %(user_id)s {{chat_filter}}
+GROUP BY 1
+ORDER BY 6 DESC, 1
+"""
+
+
+def get_replies(using: str, bot_id: int, chat_id: int, message_id: int, direction: str, depth: int,
+                limit: int) -> list[str]:
+    sql = REPLY_CHAIN_SQL if direction == "chain" else REPLY_TREE_SQL
+    with connections[using].cursor() as cursor:
+        cursor.execute(sql, {"bot_id": bot_id, "chat_id": chat_id, "message_id": message_id, "depth": depth,
+                             "limit": limit})
+        return [row[0] for row in cursor.fetchall()]
+
+
+def get_user_activity(using: str, bot_id: int, user_id: int, chat_id: Optional[int] = None) -> list[dict]:
+    sql = USER_ACTIVITY_SQL.format(chat_filter="AND m.chat_id = %(chat_id)s" if chat_id is not None else "")
+    with connections[using].cursor() as cursor:
+        cursor.execute(sql, {"bot_id": bot_id, "user_id": user_id, "chat_id": chat_id})
+        return [
+            {"chat_id": row[0], "message_count": row[1], "first_message_id": row[2], "last_message_id": row[3],
+             "first_date": row[4], "last_date": row[5]}
+            for row in cursor.fetchall()
+        ]
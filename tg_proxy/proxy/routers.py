@@ -0,0 +1,139 @@
+"""
+The MIT License (MIT)
+
+Copyright (c) 2023-present RuslanUC
+
+Permission is hereby granted, free of charge, to any person obtaining a
+copy of this software and associated documentation files (the "Software"),
+to deal in the Software without restriction, including without limitation
+the rights to use, copy, modify, merge, publish, distribute, sublicense,
+and/or sell copies of the Software, and to permit persons to whom the
+Software is furnished to do so, subject to the following conditions:
+
+The above copyright notice and this permission notice shall be included in
+all copies or substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS
+OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING
+FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER
+DEALINGS IN THE SOFTWARE.
+"""
+
+# This module is imported while the database connections are being set up, models are imported lazily.
+
+import logging
+from math import inf
+from random import choice
+from time import monotonic
+from typing import Optional
+
+from django.conf import settings
+from django.db import connections, DatabaseError
+
+log = logging.getLogger(__name__)
+
+GLOBAL_DATABASE = "default"
+SHARDED_MODELS = {"message", "chat", "chatmember", "webhook", "botsession", "cacheversion",
+                  "undeliverablechat", "broadcast", "broadcasttarget", "idempotencykey", "chatstats",
+                  "chatstatsday", "chatstatsuser", "messageedit", "changelog"}
+
+_placements: dict[int, tuple[str, float]] = {}
+_last_writes: dict[int, float] = {}
+_replica_lags: dict[str, tuple[float, float]] = {}
+
+
+def shards() -> list[str]:
+    return getattr(settings, "TG_SHARDS", [GLOBAL_DATABASE])
+
+
+def shard_for_bot(bot_id: int, create: bool = False) -> str:
+    if (cached := _placements.get(bot_id)) is not None and cached[1] > monotonic():
+        return cached[0]
+
+    from .db import serialized_write
+    from .models import BotShard
+
+    database = BotShard.objects.using(GLOBAL_DATABASE).filter(bot_id=bot_id).values_list("database", flat=True).first()
+    if database is None:
+        # New bots are placed by hash, the placement is stored so adding shards later does not move existing bots
+        database = shards()[bot_id % len(shards())]
+        if not create:
+            return database
+        database = serialized_write(lambda: BotShard.objects.using(GLOBAL_DATABASE).get_or_create(
+            bot_id=bot_id, defaults={"database": database}
+        )[0].database, GLOBAL_DATABASE)
+    _placements[bot_id] = (database, monotonic() + getattr(settings, "TG_SHARD_CACHE_TTL", 5))
+    return database
+
+
+def forget_placement(bot_id: int) -> None:
+    _placements.pop(bot_id, None)
+
+
+def database_for(model, bot_id: int) -> str:
+    if model._meta.model_name in SHARDED_MODELS:
+        return shard_for_bot(bot_id, create=True)
+    return GLOBAL_DATABASE
+
+
+def note_write(bot_id: int) -> None:
+    _last_writes[bot_id] = monotonic()
+
+
+def replica_lag(alias: str) -> float:
+    now = monotonic()
+    if (cached := _replica_lags.get(alias)) is not None and cached[1] > now:
+        return cached[0]
+    connection = connections[alias]
+    lag = 0.0
+    try:
+        if connection.vendor == "postgresql":
+            with connection.cursor() as cursor:
+                cursor.execute("SELECT CASE WHEN pg_last_wal_receive_lsn() = pg_last_wal_replay_lsn() THEN 0 "
+                               "ELSE COALESCE(EXTRACT(EPOCH FROM now() - pg_last_xact_replay_timestamp()), 0) END")
+                lag = float(cursor.fetchone()[0])
+    except DatabaseError:
+        log.warning("Failed to get replication lag of %r", alias, exc_info=True)
+        lag = inf
+    _replica_lags[alias] = (lag, now + 1)
+    return lag
+
+
+def read_database(primary: str, bot_id: Optional[int] = None) -> str:
+    if not (replicas := getattr(settings, "TG_REPLICAS", {}).get(primary)):
+        return primary
+    max_lag = getattr(settings, "TG_REPLICA_MAX_LAG", 2.0)
+    # Reads of a bot this process has just written to go to the primary so they see their own writes
+    if bot_id is not None and monotonic() - _last_writes.get(bot_id, -inf) < max_lag:
+        return primary
+    if replicas := [replica for replica in replicas if replica_lag(replica) <= max_lag]:
+        return choice(replicas)
+    return primary
+
+
+def read_database_for_bot(bot_id: int) -> str:
+    return read_database(shard_for_bot(bot_id), bot_id)
+
+
+class ShardRouter:
+    def _database(self, model, **hints) -> Optional[str]:
+        if model._meta.app_label != "proxy":
+            return None
+        if model._meta.model_name in SHARDED_MODELS:
+            if (bot_id := getattr(hints.get("instance"), "bot_id", None)) is not None:
+                return shard_for_bot(bot_id)
+            return shards()[0]
+        return GLOBAL_DATABASE
+
+    db_for_read = _database
+    db_for_write = _database
+
+    def allow_migrate(self, db: str, app_label: str, model_name: Optional[str] = None, **hints) -> bool:
+        if any(db in replicas for replicas in getattr(settings, "TG_REPLICAS", {}).values()):
+            return False
+        if app_label == "proxy" and (model_name is None or model_name in SHARDED_MODELS):
+            return db in shards()
+        return db == GLOBAL_DATABASE
@@ -0,0 +1,159 @@
+"""
+The MIT License (MIT)
+
+Copyright (c) 2023-present RuslanUC
+
+Permission is hereby granted, free of charge, to any person obtaining a
+copy of this software and associated documentation files (the "Software"),
+to deal in the Software without restriction, including without limitation
+the rights to use, copy, modify, merge, publish, distribute, sublicense,
+and/or sell copies of the Software, and to permit persons to whom the
+Software is furnished to do so, subject to the following conditions:
+
+The above copyright notice and this permission notice shall be included in
+all copies or substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS
+OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING
+FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER
+DEALINGS IN THE SOFTWARE.
+"""
+
+from json import loads
+from time import time
+from typing import Optional
+
+from django.db import transaction
+
+from proxy.archive import archive, message_date
+from proxy.db import serialized_write
+from proxy.models import Message, ChatStats, ChatStatsDay, ChatStatsUser, aggregate_chat_stats
+from proxy.routers import database_for, note_write
+
+STATS_MODELS = (ChatStats, ChatStatsDay, ChatStatsUser)
+
+
+def _replace_chat_stats(using: str, bot_id: int, chat_id: int, chat: Optional[list], batch_size: int) -> None:
+    def write() -> None:
+        with transaction.atomic(using=using):
+            for model in STATS_MODELS:
+                model.objects.using(using).filter(bot_id=bot_id, chat_id=chat_id).delete()
+            if chat is None:
+                return
+            message_count, media_count, (first_message_id, first_date), (last_message_id, last_date), days, users = chat
+            ChatStats.objects.using(using).create(
+                bot_id=bot_id, chat_id=chat_id, message_count=message_count, media_count=media_count,
+                user_count=len(users), first_message_id=first_message_id, first_date=first_date,
+                last_message_id=last_message_id, last_date=last_date,
+            )
+            ChatStatsDay.objects.using(using).bulk_create([
+                ChatStatsDay(bot_id=bot_id, chat_id=chat_id, day=day, message_count=counts[0], media_count=counts[1])
+                for day, counts in days.items()
+            ], batch_size=batch_size)
+            ChatStatsUser.objects.using(using).bulk_create([
+                ChatStatsUser(bot_id=bot_id, chat_id=chat_id, user_id=user_id, last_date=date)
+                for user_id, date in users.items()
+            ], batch_size=batch_size)
+
+    serialized_write(write, using)
+
+
+def archived_message(chat_id: int, message_id: int, data: str) -> dict:
+    # The fields aggregate_chat_stats reads, of a message from the archive
+    message = loads(data)
+    return {"message_id": message_id, "chat_id": chat_id, "from_peer": message.get("from", {}).get("id"),
+            "date": message.get("date"), "serialized_message": data}
+
+
+def _message_bounds(using: str, bot_id: int, chat_id: int) -> Optional[tuple[tuple[int, int], tuple[int, int]]]:
+    # First and last (message id, date) of the chat's messages in the database and the archive
+    bounds = []
+    messages = Message.objects.using(using).filter(bot_id=bot_id, chat_id=chat_id).values_list("message_id", "date")
+    for row in (messages.order_by("message_id").first(), messages.order_by("-message_id").first()):
+        if row is not None:
+            message_id, date = row
+            bounds.append((message_id, date or 0))
+    for segment in archive.segments(bot_id, chat_id):
+        for message_id in (segment.first_id, segment.last_id):
+            if (data := segment.get(message_id)) is not None:
+                bounds.append((message_id, message_date(data)))
+    return (min(bounds), max(bounds)) if bounds else None
+
+
+def forget_messages(using: str, bot_id: int, messages: list[dict]) -> None:
+    # Called in the transaction deleting the messages (or after removing them from the archive), with the fields
+    # aggregate_chat_stats reads
+    chats = aggregate_chat_stats(messages)
+    ChatStats.forget(using, bot_id, chats, {chat_id: _message_bounds(using, bot_id, chat_id) for chat_id in chats})
+
+
+def _aggregate_archived(messages, chat_id: int, batch: list[tuple[int, str]], chats: dict) -> int:
+    # Messages both in the archive and in the database (changed while being archived, or received again) are
+    # counted once, from the database
+    in_database = set(messages.filter(chat_id=chat_id, message_id__in=[message_id for message_id, _ in batch])
+                      .values_list("message_id", flat=True))
+    archived = [archived_message(chat_id, message_id, data) for message_id, data in batch
+                if message_id not in in_database]
+    aggregate_chat_stats(archived, chats)
+    return len(archived)
+
+
+def rebuild_chat_stats(bot_id: int, chat_id: Optional[int] = None, batch_size: int = 5000) -> dict:
+    # Messages are read in batches and aggregated per chat, the statistics of a chat are replaced in one transaction.
+    # Archived messages are counted like the ones in the database. Messages written to a chat while it is being
+    # rebuilt may be missed.
+    using = database_for(Message, bot_id)
+    messages = Message.objects.using(using).filter(bot_id=bot_id)
+    if chat_id is not None:
+        chat_ids = [chat_id]
+    else:
+        chat_ids = sorted(set(messages.values_list("chat_id", flat=True).distinct().order_by())
+                          .union(archive.chats(bot_id)))
+    result = {"chats": 0, "messages": 0}
+    for current in chat_ids:
+        chats = {}
+        batch = []
+        for archived in archive.iterate(bot_id, current):
+            batch.append(archived)
+            if len(batch) == batch_size:
+                result["messages"] += _aggregate_archived(messages, current, batch, chats)
+                batch = []
+        result["messages"] += _aggregate_archived(messages, current, batch, chats)
+        last = None
+        chat_messages = messages.filter(chat_id=current).order_by("message_id").values(
+            "message_id", "chat_id", "from_peer", "date", "serialized_message"
+        )
+        while batch := list(chat_messages.filter(**{"message_id__gt": last} if last is not None else {})[:batch_size]):
+            last = batch[-1]["message_id"]
+            aggregate_chat_stats(batch, chats)
+            result["messages"] += len(batch)
+        _replace_chat_stats(using, bot_id, current, chats.get(current), batch_size)
+        result["chats"] += 1
+    if chat_id is None:
+        # Chats without messages left
+        stale = set(ChatStats.objects.using(using).filter(bot_id=bot_id).values_list("chat_id", flat=True))
+        for stale_chat_id in stale.difference(chat_ids):
+            _replace_chat_stats(using, bot_id, stale_chat_id, None, batch_size)
+    note_write(bot_id)
+    return result
+
+
+def get_chat_stats(using: str, bot_id: int, chat_id: int, days: int) -> dict:
+    stats = ChatStats.objects.using(using).filter(bot_id=bot_id, chat_id=chat_id).first()
+    if stats is None:
+        stats = ChatStats(bot_id=bot_id, chat_id=chat_id)
+    since = int(time()) - days * 86400
+    result = stats.to_json()
+    result["active_user_count"] = ChatStatsUser.objects.using(using).filter(
+        bot_id=bot_id, chat_id=chat_id, last_date__gte=since
+    ).count()
+    result["days"] = [
+        {"date": day * 86400, "message_count": message_count, "media_count": media_count}
+        for day, message_count, media_count in ChatStatsDay.objects.using(using).filter(
+            bot_id=bot_id, chat_id=chat_id, day__gt=since // 86400
+        ).order_by("day").values_list("day", "message_count", "media_count")
+    ]
+    return result
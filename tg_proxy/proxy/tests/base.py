@@ -0,0 +1,141 @@
+import json
+from collections import OrderedDict
+from pathlib import Path
+from tempfile import TemporaryDirectory
+from typing import Optional
+from unittest import mock
+
+import httpx
+from django.db import connections
+from django.db.migrations.executor import MigrationExecutor
+from django.test import TestCase, TransactionTestCase
+
+from proxy import routers
+from proxy.archive import archive
+from proxy.compression import compress
+from proxy.db import DigestCache
+from proxy.metrics import registry
+from proxy.utils import upstream
+
+TOKEN = "123456:ABC-DEF1234ghIkl-zyx57W2v1u123ew11"
+BOT_ID = 123456
+CHAT_ID = 777
+USER_ID = 5
+DATE = 1700000000
+
+
+def message(message_id: int, chat_id: int = CHAT_ID, text: str = "hi", date: int = DATE, user_id: int = USER_ID,
+            **fields) -> dict:
+    return {
+        "message_id": message_id, "date": date, "chat": {"id": chat_id, "type": "private", "first_name": "Chat"},
+        "from": {"id": user_id, "is_bot": False, "first_name": "User"}, "text": text, **fields,
+    }
+
+
+def counter(name: str, **labels: str) -> float:
+    return registry._counters.get((name, tuple(sorted(labels.items()))), 0)
+
+
+class _Body(httpx.SyncByteStream):
+    def __init__(self, data: bytes):
+        self.data = data
+
+    def __iter__(self):
+        yield self.data
+
+
+class FakeBotApi:
+    # Answers upstream requests with responses[method], a response dict or a callable(request) returning one.
+    # "_status" of the dict is the status code, bodies are compressed with encoding if the request accepts it.
+
+    def __init__(self):
+        self.responses = {"getMe": {"ok": True, "result": {"id": BOT_ID, "is_bot": True, "first_name": "Bot"}}}
+        self.requests: list[httpx.Request] = []
+        self.encoding = None
+
+    def calls(self, method: str) -> list[httpx.Request]:
+        return [request for request in self.requests if request.url.path.rsplit("/", 1)[-1] == method]
+
+    def __call__(self, request: httpx.Request) -> httpx.Response:
+        self.requests.append(request)
+        body = self.responses.get(request.url.path.rsplit("/", 1)[-1], {"ok": True, "result": True})
+        if callable(body):
+            body = body(request)
+        body = dict(body)
+        status = body.pop("_status", 200)
+        data = json.dumps(body).encode("utf8")
+        headers = {"content-type": "application/json"}
+        if self.encoding is not None and self.encoding in request.headers.get("accept-encoding", ""):
+            data = compress(data, self.encoding)
+            headers["content-encoding"] = self.encoding
+        return httpx.Response(status, headers=headers, stream=_Body(data))
+
+
+class ProxyTestMixin:
+    def setUp(self) -> None:
+        self.api = FakeBotApi()
+        # Process-local caches outlive the test transactions, every test starts with empty ones
+        for patcher in (
+            mock.patch.object(upstream, "_transport", httpx.MockTransport(self.api)),
+            mock.patch("proxy.models.digest_cache", DigestCache(1000)),
+            mock.patch.dict(routers._placements, clear=True),
+            mock.patch.dict(routers._last_writes, clear=True),
+        ):
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+    def use_archive(self) -> Path:
+        directory = TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        for patcher in (mock.patch.object(archive, "root", Path(directory.name)),
+                        mock.patch.object(archive, "_segments", OrderedDict())):
+            patcher.start()
+            self.addCleanup(patcher.stop)
+        return archive.root
+
+    def call(self, method: str, token: str = TOKEN, **kwargs):
+        return self.client.get(f"/bot{token}/{method}", **kwargs)
+
+    def post(self, method: str, data: dict, token: str = TOKEN, **kwargs):
+        return self.client.post(f"/bot{token}/{method}", json.dumps(data), content_type="application/json",
+                                **kwargs)
+
+    def receive(self, *messages: dict, token: str = TOKEN):
+        # Messages are cached from the getUpdates response they arrive in
+        self.api.responses["getUpdates"] = {"ok": True, "result": [
+            {"update_id": update_id, "message": message} for update_id, message in enumerate(messages, 1)
+        ]}
+        response = self.call("getUpdates", token)
+        self.assertEqual(response.status_code, 200)
+        return response
+
+
+class ProxyTestCase(ProxyTestMixin, TestCase):
+    databases = "__all__"
+
+
+class ProxyTransactionTestCase(ProxyTestMixin, TransactionTestCase):
+    # For code reading on other threads, which do not see the writes of a test transaction
+    databases = "__all__"
+
+
+class MigrationTestCase(TransactionTestCase):
+    # Migrates the proxy app of the default database back to migrate_from, tests fill the tables through self.apps
+    # and call migrate() to run the migrations up to migrate_to. The database is migrated to the latest one afterwards.
+    migrate_from: str
+    migrate_to: str
+    databases = {"default"}
+
+    def _migrate(self, name: Optional[str]):
+        executor = MigrationExecutor(connections["default"])
+        target = [("proxy", name)] if name is not None else executor.loader.graph.leaf_nodes("proxy")
+        executor.migrate(target)
+        executor.loader.build_graph()
+        return executor.loader.project_state(target).apps
+
+    def setUp(self) -> None:
+        self.addCleanup(self._migrate, None)
+        self.apps = self._migrate(self.migrate_from)
+
+    def migrate(self) -> None:
+        self.apps = self._migrate(self.migrate_to)
@@ -0,0 +1,122 @@
+from json import dumps, loads
+from time import time
+from unittest import mock
+
+from django.test import override_settings
+
+from proxy.archive import Archive, Segment, archive_messages, write_segment
+from proxy.maintenance import apply_archive_retention
+from proxy.models import Message
+from proxy.tests.base import ProxyTestCase, BOT_ID, CHAT_ID, DATE, message
+
+
+class SegmentTests(ProxyTestCase):
+    def test_round_trip(self):
+        path = self.use_archive() / "chat" / "1-2-3.seg"
+        records = [(message_id, dumps(message(message_id, text="é" * message_id))) for message_id in range(2, 200, 2)]
+        # Small blocks so lookups have to pick the right one
+        with mock.patch("proxy.archive.BLOCK_SIZE", 256):
+            self.assertEqual(write_segment(path, records), len(records))
+
+        segment = Segment(path)
+        self.assertGreater(len(segment.index), 10)
+        self.assertEqual((segment.first_id, segment.last_id), (2, 198))
+        self.assertEqual(segment.get(100), records[49][1])
+        self.assertIsNone(segment.get(101))
+        self.assertIsNone(segment.get(500))
+        self.assertEqual(list(segment.iterate(190)), records[-4:])
+        self.assertEqual([message_id for message_id, _ in segment.range(11, 3)], [10, 8, 6, 4])
+
+    def test_empty_segments_are_not_written(self):
+        path = self.use_archive() / "chat" / "1-2-3.seg"
+        self.assertEqual(write_segment(path, []), 0)
+        self.assertFalse(path.exists())
+        self.assertEqual(list(path.parent.iterdir()), [])
+
+    def test_rejects_other_files(self):
+        path = self.use_archive() / "other.seg"
+        path.write_bytes(b"not a segment" * 10)
+        with self.assertRaises(ValueError):
+            Segment(path)
+
+
+class ArchiveTests(ProxyTestCase):
+    def setUp(self) -> None:
+        super().setUp()
+        self.root = self.use_archive()
+        now = int(time())
+        self.messages = [*(message(i, date=now - 30 * 86400 + i) for i in range(1, 6)),
+                         *(message(i, date=now) for i in range(6, 8))]
+        self.receive(*self.messages)
+
+    def test_archives_old_messages(self):
+        self.assertEqual(archive_messages(7, batch_size=2), {
+            "chats": 1, "messages": 5, "bytes": mock.ANY,
+        })
+
+        self.assertEqual(list(Message.objects.values_list("message_id", flat=True).order_by("message_id")), [6, 7])
+        self.assertEqual(len(list((self.root / str(BOT_ID) / str(CHAT_ID)).glob("*.seg"))), 1)
+        # A new reader finds the segments on disk
+        reader = Archive(self.root)
+        self.assertEqual(loads(reader.get(BOT_ID, CHAT_ID, 3))["message_id"], 3)
+        self.assertEqual(reader.chats(BOT_ID), [CHAT_ID])
+
+    def test_reads_fall_back_to_the_archive(self):
+        archive_messages(7)
+
+        response = self.call("getMessage", data={"chat_id": CHAT_ID, "message_id": 2})
+        self.assertEqual(response.json()["result"]["message_id"], 2)
+        # Without chat_id only the database is searched
+        self.assertEqual(self.call("getMessage", data={"message_id": 2}).status_code, 404)
+
+        response = self.call("getMessages", data={"chat_id": CHAT_ID, "limit": 4})
+        self.assertEqual([item["message_id"] for item in response.json()["result"]], [7, 6, 5, 4])
+        response = self.call("getMessages", data={"chat_id": CHAT_ID, "before": 4, "after": 1})
+        self.assertEqual([item["message_id"] for item in response.json()["result"]], [3, 2])
+
+        response = self.post("getMessagesBatch", {"messages": [[CHAT_ID, 1], [CHAT_ID, 7], [CHAT_ID, 9]]})
+        self.assertEqual([item and item["message_id"] for item in response.json()["result"]], [1, 7, None])
+
+    def test_database_rows_win_over_archived_copies(self):
+        archive_messages(7)
+        self.receive(message(3, date=DATE, text="edited"))
+
+        response = self.call("getMessage", data={"chat_id": CHAT_ID, "message_id": 3})
+        self.assertEqual(response.json()["result"]["text"], "edited")
+
+    def test_rows_changed_while_archiving_are_kept(self):
+        def write_and_edit(path, records):
+            count = write_segment(path, records)
+            self.receive(message(3, text="edited"))
+            return count
+
+        with mock.patch("proxy.archive.write_segment", write_and_edit):
+            self.assertEqual(archive_messages(7)["messages"], 5)
+
+        self.assertEqual(list(Message.objects.values_list("message_id", flat=True).order_by("message_id")), [3, 6, 7])
+        response = self.call("getMessage", data={"chat_id": CHAT_ID, "message_id": 3})
+        self.assertEqual(response.json()["result"]["text"], "edited")
+
+    def test_archived_messages_are_cached_again(self):
+        archive_messages(7)
+        # The digest of the deleted row is forgotten, the same message is not skipped as unchanged
+        self.receive(self.messages[2])
+
+        self.assertTrue(Message.objects.filter(bot_id=BOT_ID, chat_id=CHAT_ID, message_id=3).exists())
+
+    def test_retention_prunes_archived_messages(self):
+        now = int(time())
+        self.receive(*(message(i, date=now - 10 * 86400) for i in range(8, 10)))
+        archive_messages(7)
+
+        with override_settings(TG_RETENTION={"default": {"max_age_days": 20}}):
+            self.assertEqual(apply_archive_retention(), {"max_age": 5, "max_messages_per_chat": 0})
+        self.assertEqual([message_id for message_id, _ in Archive(self.root).iterate(BOT_ID, CHAT_ID)], [8, 9])
+
+        with override_settings(TG_RETENTION={"default": {"max_messages_per_chat": 3}}):
+            self.assertEqual(apply_archive_retention(), {"max_age": 0, "max_messages_per_chat": 1})
+        self.assertEqual([message_id for message_id, _ in Archive(self.root).iterate(BOT_ID, CHAT_ID)], [9])
+
+        with override_settings(TG_RETENTION={"default": {"max_messages_per_chat": 2}}):
+            apply_archive_retention()
+        self.assertEqual(list((self.root / str(BOT_ID) / str(CHAT_ID)).glob("*.seg")), [])
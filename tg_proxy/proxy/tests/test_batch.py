@@ -0,0 +1,47 @@
+import json
+
+from proxy.tests.base import ProxyTestCase, TOKEN, CHAT_ID, USER_ID, message
+
+OTHER_CHAT_ID = CHAT_ID + 1
+OTHER_USER_ID = USER_ID + 1
+
+
+class BatchTests(ProxyTestCase):
+    def setUp(self) -> None:
+        super().setUp()
+        self.receive(message(1), message(2), message(1, chat_id=OTHER_CHAT_ID, user_id=OTHER_USER_ID))
+
+    def test_get_messages_batch(self):
+        with self.assertNumQueries(1):
+            response = self.post("getMessagesBatch", {"messages": [
+                {"chat_id": OTHER_CHAT_ID, "message_id": 1}, [CHAT_ID, 2], [OTHER_CHAT_ID, 2], [CHAT_ID, 1],
+            ]})
+
+        self.assertEqual([item and (item["chat"]["id"], item["message_id"]) for item in response.json()["result"]],
+                         [(OTHER_CHAT_ID, 1), (CHAT_ID, 2), None, (CHAT_ID, 1)])
+
+    def test_get_users(self):
+        response = self.call("getUsers", data={"user_ids": json.dumps([OTHER_USER_ID, 1, USER_ID])})
+
+        self.assertEqual([item and item["id"] for item in response.json()["result"]], [OTHER_USER_ID, None, USER_ID])
+
+    def test_get_chats_by_id(self):
+        response = self.client.post(f"/bot{TOKEN}/getChatsById",
+                                    {"chat_ids": json.dumps([CHAT_ID, 1, OTHER_CHAT_ID])})
+
+        self.assertEqual([item and item["id"] for item in response.json()["result"]], [CHAT_ID, None, OTHER_CHAT_ID])
+
+    def test_invalid_batches(self):
+        for method, data in (
+                ("getMessagesBatch", {"messages": [[CHAT_ID, 1]] * 201}),
+                ("getMessagesBatch", {"messages": [[CHAT_ID]]}),
+                ("getMessagesBatch", {"messages": [{"chat_id": CHAT_ID}]}),
+                ("getUsers", {"user_ids": "not json"}),
+                ("getUsers", {"user_ids": {"id": USER_ID}}),
+                ("getChatsById", {"chat_ids": [[CHAT_ID]]}),
+                ("getChatsById", {}),
+        ):
+            with self.subTest(method=method, data=data):
+                response = self.post(method, data)
+                self.assertEqual(response.status_code, 400)
+                self.assertEqual(response.json()["description"], "Bad Request: invalid parameters")
@@ -0,0 +1,223 @@
+from json import loads
+from time import time
+from unittest import mock, skipUnless
+
+from django.conf import settings
+from django.test import override_settings
+
+from proxy import broadcasts
+from proxy.broadcasts import BroadcastJob, BroadcastScheduler, RateLimiter, cancel_broadcast, create_broadcast
+from proxy.maintenance import move_bot
+from proxy.models import Broadcast, BroadcastTarget, BotShard, Message, UndeliverableChat
+from proxy.tests.base import ProxyTestCase, BOT_ID, CHAT_ID, TOKEN, message
+
+GROUP_ID = -100
+
+
+def sent(request) -> dict:
+    data = loads(request.content)
+    return {"ok": True, "result": message(1000 + data["chat_id"], chat_id=data["chat_id"], text=data["text"])}
+
+
+@override_settings(TG_BROADCAST_MAX_RATE=1000)
+class BroadcastTestCase(ProxyTestCase):
+    def setUp(self) -> None:
+        super().setUp()
+        self.api.responses["sendMessage"] = sent
+        self.scheduler = BroadcastScheduler()
+        # Jobs are run on the test thread, the scheduler only claims them
+        for patcher in (mock.patch.object(broadcasts, "Thread"),
+                        mock.patch.dict(broadcasts.broadcast_scheduler.limiters, clear=True)):
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+    def create(self, chat_ids=(1, 2, 3), **kwargs) -> Broadcast:
+        return create_broadcast(BOT_ID, TOKEN, kwargs.pop("method", "sendMessage"), {"text": "news"}, chat_ids,
+                                kwargs.pop("all_private_chats", False), 4, 1000)
+
+    def run_job(self, broadcast: Broadcast) -> Broadcast:
+        self.assertEqual(self.scheduler.claim(), 1)
+        BroadcastJob("default", broadcast.id, self.scheduler.owner)._run()
+        broadcast.refresh_from_db()
+        return broadcast
+
+    def statuses(self, broadcast: Broadcast) -> dict[int, int]:
+        return dict(BroadcastTarget.objects.filter(broadcast_id=broadcast.id).values_list("chat_id", "status"))
+
+    def sent_to(self) -> list[int]:
+        return sorted(loads(request.content)["chat_id"] for request in self.api.calls("sendMessage"))
+
+
+class BroadcastTests(BroadcastTestCase):
+    def test_sends_to_every_target(self):
+        broadcast = self.run_job(self.create([1, 2, 3, 2]))
+
+        self.assertEqual((broadcast.status, broadcast.total, broadcast.delivered, broadcast.failed), ("done", 3, 3, 0))
+        self.assertEqual(broadcast.token, "")
+        self.assertEqual(broadcast.lease_owner, "")
+        self.assertIsNotNone(broadcast.started_at)
+        self.assertEqual(self.sent_to(), [1, 2, 3])
+        self.assertEqual(dict(BroadcastTarget.objects.values_list("chat_id", "message_id")),
+                         {1: 1001, 2: 1002, 3: 1003})
+        # Sent messages are cached
+        self.assertEqual(Message.objects.get(bot_id=BOT_ID, chat_id=2).message_id, 1002)
+        self.assertGreater(broadcast.to_json()["messages_per_second"], 0)
+        self.assertEqual(self.scheduler.claim(), 0)
+
+    def test_all_private_chats(self):
+        self.receive(message(1), message(1, chat_id=CHAT_ID + 1),
+                     message(1, chat_id=GROUP_ID, chat={"id": GROUP_ID, "type": "group", "title": "Group"}))
+        broadcast = self.run_job(self.create([5], all_private_chats=True))
+
+        self.assertEqual(broadcast.total, 3)
+        self.assertEqual(self.sent_to(), [5, CHAT_ID, CHAT_ID + 1])
+
+    def test_failures(self):
+        now = int(time())
+        UndeliverableChat.objects.create(bot_id=BOT_ID, chat_id=1, error_code=403, description="blocked", date=now,
+                                         expires_at=now + 60)
+
+        def send(request):
+            if loads(request.content)["chat_id"] == 2:
+                return {"_status": 403, "ok": False, "error_code": 403,
+                        "description": "Forbidden: bot was blocked by the user"}
+            return sent(request)
+
+        self.api.responses["sendMessage"] = send
+        broadcast = self.run_job(self.create())
+
+        self.assertEqual((broadcast.status, broadcast.delivered, broadcast.failed), ("done", 1, 2))
+        self.assertEqual(self.sent_to(), [2, 3])
+        self.assertEqual(dict(BroadcastTarget.objects.values_list("chat_id", "error_code")), {1: 403, 2: 403, 3: None})
+        # The chat is skipped by later sends
+        self.assertTrue(UndeliverableChat.objects.filter(bot_id=BOT_ID, chat_id=2).exists())
+
+    def test_flood_waits_are_retried(self):
+        responses = iter([{"_status": 429, "ok": False, "error_code": 429, "description": "Too Many Requests",
+                           "parameters": {"retry_after": 0}}])
+        self.api.responses["sendMessage"] = lambda request: next(responses, None) or sent(request)
+        broadcast = self.run_job(self.create([1]))
+
+        self.assertEqual((broadcast.status, broadcast.delivered), ("done", 1))
+        self.assertEqual(len(self.api.calls("sendMessage")), 2)
+
+    def test_invalid_tokens_abort(self):
+        self.api.responses["sendMessage"] = {"_status": 401, "ok": False, "error_code": 401,
+                                             "description": "Unauthorized"}
+        broadcast = self.run_job(self.create())
+
+        self.assertEqual((broadcast.status, broadcast.error, broadcast.token), ("failed", "Unauthorized", ""))
+        self.assertEqual(set(self.statuses(broadcast).values()), {BroadcastTarget.PENDING})
+
+    def test_sends_finished_before_an_abort_are_recorded(self):
+        self.api.responses["sendMessage"] = lambda request: sent(request) if loads(request.content)["chat_id"] != 2 \
+            else {"_status": 401, "ok": False, "error_code": 401, "description": "Unauthorized"}
+        broadcast = self.run_job(self.create())
+
+        self.assertEqual((broadcast.status, broadcast.delivered), ("failed", 2))
+        self.assertEqual(self.statuses(broadcast), {1: BroadcastTarget.DELIVERED, 2: BroadcastTarget.PENDING,
+                                                    3: BroadcastTarget.DELIVERED})
+
+    def test_results_without_messages(self):
+        self.api.responses["sendMessage"] = {"ok": True, "result": True}
+        broadcast = self.run_job(self.create())
+
+        self.assertEqual((broadcast.status, broadcast.delivered), ("done", 3))
+        self.assertFalse(Message.objects.exists())
+
+
+@mock.patch.object(broadcasts, "MAX_BATCH_SIZE", 2)
+class CheckpointTests(BroadcastTestCase):
+    def test_cancelled_broadcasts_stop_after_the_batch(self):
+        broadcast = self.create([1, 2, 3, 4, 5])
+        self.assertEqual(self.scheduler.claim(), 1)
+        cancel_broadcast(BOT_ID, broadcast.id)
+        BroadcastJob("default", broadcast.id, self.scheduler.owner)._run()
+        broadcast.refresh_from_db()
+
+        self.assertEqual((broadcast.status, broadcast.delivered, broadcast.token), ("cancelled", 2, ""))
+        self.assertEqual(self.statuses(broadcast), {1: BroadcastTarget.DELIVERED, 2: BroadcastTarget.DELIVERED,
+                                                    3: BroadcastTarget.PENDING, 4: BroadcastTarget.PENDING,
+                                                    5: BroadcastTarget.PENDING})
+        self.assertEqual(self.scheduler.claim(), 0)
+
+    def test_jobs_without_the_lease_record_nothing(self):
+        broadcast = self.create([1, 2, 3])
+        self.assertEqual(self.scheduler.claim(), 1)
+        Broadcast.objects.filter(id=broadcast.id).update(lease_owner="other:1")
+        BroadcastJob("default", broadcast.id, self.scheduler.owner)._run()
+
+        broadcast.refresh_from_db()
+        self.assertEqual((broadcast.status, broadcast.delivered), ("running", 0))
+        self.assertEqual(set(self.statuses(broadcast).values()), {BroadcastTarget.PENDING})
+
+    def test_resumes_after_the_last_checkpoint(self):
+        broadcast = self.create([1, 2, 3])
+        BroadcastTarget.objects.filter(chat_id=1).update(status=BroadcastTarget.DELIVERED)
+        Broadcast.objects.filter(id=broadcast.id).update(status=Broadcast.RUNNING, lease_owner="other:1",
+                                                          lease_expires_at=time() + 60, delivered=1)
+        self.assertEqual(self.scheduler.claim(), 0)
+
+        # The lease of the other process ran out
+        Broadcast.objects.filter(id=broadcast.id).update(lease_expires_at=time() - 1)
+        broadcast = self.run_job(broadcast)
+        self.assertEqual((broadcast.status, broadcast.delivered), ("done", 3))
+        self.assertEqual(self.sent_to(), [2, 3])
+
+
+class RateLimiterTests(ProxyTestCase):
+    def test_pause(self):
+        limiter = RateLimiter(1000)
+        stop = mock.Mock()
+        limiter.acquire(stop)
+        stop.wait.assert_not_called()
+        limiter.pause(60)
+        limiter.acquire(stop)
+        self.assertGreater(stop.wait.call_args.args[0], 59)
+
+    def test_jobs_of_a_bot_share_a_limiter(self):
+        scheduler = BroadcastScheduler()
+        self.assertIs(scheduler.limiter(BOT_ID), scheduler.limiter(BOT_ID))
+        self.assertIsNot(scheduler.limiter(BOT_ID), scheduler.limiter(BOT_ID + 1))
+
+
+class BroadcastApiTests(BroadcastTestCase):
+    def test_create_get_and_cancel(self):
+        response = self.post("createBroadcast", {"params": {"text": "news"}, "chat_ids": [1, 2], "rate": 1000})
+        result = response.json()["result"]
+        self.assertEqual((result["status"], result["total"], result["pending"]), ("pending", 2, 2))
+
+        response = self.call("getBroadcast", data={"broadcast_id": result["broadcast_id"]})
+        self.assertEqual(response.json()["result"], result)
+        response = self.post("cancelBroadcast", {"broadcast_id": result["broadcast_id"]})
+        self.assertEqual(response.json()["result"]["status"], "cancelled")
+        self.assertEqual(Broadcast.objects.get().token, "")
+        for method in ("getBroadcast", "cancelBroadcast"):
+            self.assertEqual(self.call(method, data={"broadcast_id": result["broadcast_id"] + 1}).status_code, 404)
+
+    def test_invalid_broadcasts(self):
+        for data in ({"params": {"text": "news"}}, {"params": {"text": "news", "chat_id": 1}, "chat_ids": [1]},
+                     {"method": "getMe", "params": {}, "chat_ids": [1]}, {"params": [], "chat_ids": [1]}):
+            self.assertEqual(self.post("createBroadcast", data).status_code, 400)
+        self.assertFalse(Broadcast.objects.exists())
+
+
+@skipUnless(len(settings.TG_SHARDS) > 1, "needs a second shard, set SHARD_DATABASES")
+class MovedBroadcastTests(BroadcastTestCase):
+    def test_finished_broadcasts_move_with_the_bot(self):
+        shard = settings.TG_SHARDS[1]
+        BotShard.objects.create(bot_id=BOT_ID, database="default")
+        broadcast = self.run_job(self.create())
+
+        with mock.patch("proxy.maintenance.sleep"):
+            stats = move_bot(BOT_ID, shard)
+
+        self.assertEqual(stats["broadcast"], 1)
+        self.assertFalse(Broadcast.objects.using("default").exists())
+        self.assertFalse(BroadcastTarget.objects.using("default").exists())
+        moved = Broadcast.objects.using(shard).get(bot_id=BOT_ID)
+        self.assertEqual((moved.status, moved.delivered), (broadcast.status, 3))
+        targets = BroadcastTarget.objects.using(shard).filter(broadcast_id=moved.id)
+        self.assertEqual(dict(targets.values_list("chat_id", "status")), {
+            1: BroadcastTarget.DELIVERED, 2: BroadcastTarget.DELIVERED, 3: BroadcastTarget.DELIVERED,
+        })
@@ -0,0 +1,171 @@
+import asyncio
+from json import loads
+from time import time
+from unittest import mock
+
+from asgiref.sync import sync_to_async
+from django.test import override_settings
+
+from proxy.asgi import ChangeFeedApplication
+from proxy.changes import ChangeFeed, load_changes, settled_seq
+from proxy.models import BotShard, ChangeLog
+from proxy.tests.base import ProxyTestCase, ProxyTransactionTestCase, TOKEN, BOT_ID, CHAT_ID, message
+
+OTHER_CHAT_ID = CHAT_ID + 1
+
+
+def log_entries(*entries: tuple[int, float]) -> None:
+    ChangeLog.objects.bulk_create([
+        ChangeLog(seq=seq, bot_id=BOT_ID, type="message", chat_id=CHAT_ID, entity_id=seq, payload="{}",
+                  created_at=created_at)
+        for seq, created_at in entries
+    ])
+
+
+class GetChangesTests(ProxyTestCase):
+    def changes(self, **params) -> list[tuple]:
+        response = self.call("getChanges", data=params)
+        self.assertEqual(response.status_code, 200)
+        return [(change["type"], change["chat_id"], change["id"]) for change in response.json()["result"]]
+
+    def test_changes_of_written_entities(self):
+        self.receive(message(1), message(1, chat_id=OTHER_CHAT_ID))
+        self.receive(message(1, text="edited"), message(1, chat_id=OTHER_CHAT_ID))
+
+        changes = self.changes()
+        self.assertEqual(sorted(changes), sorted([
+            ("message", CHAT_ID, 1), ("message", OTHER_CHAT_ID, 1), ("chat", CHAT_ID, CHAT_ID),
+            ("chat", OTHER_CHAT_ID, OTHER_CHAT_ID), ("user", None, 5), ("message", CHAT_ID, 1),
+        ]))
+        self.assertEqual(self.changes(types="message", chat_id=CHAT_ID), [("message", CHAT_ID, 1)] * 2)
+        seqs = [change["seq"] for change in self.call("getChanges").json()["result"]]
+        self.assertEqual(seqs, sorted(seqs))
+        self.assertEqual(self.changes(after=seqs[-2]), changes[-1:])
+        self.assertEqual(self.changes(limit=2), changes[:2])
+        response = self.call("getChanges", data={"types": "message"}).json()["result"][-1]
+        self.assertEqual(response["data"]["text"], "edited")
+
+    def test_cursors_outside_the_log(self):
+        log_entries((5, 0), (6, 0))
+        self.assertEqual(len(self.changes(after=4)), 2)
+        self.assertEqual(self.call("getChanges", data={"after": 3}).status_code, 410)
+        self.assertEqual(self.call("getChanges", data={"after": 7}).status_code, 410)
+        self.assertEqual(self.call("getChanges", data={"types": "poll"}).status_code, 400)
+
+    @override_settings(TG_CHANGE_LOG_SIZE=0)
+    def test_can_be_disabled(self):
+        self.receive(message(1))
+        self.assertFalse(ChangeLog.objects.exists())
+
+    @override_settings(TG_CHANGE_LOG_SIZE=3)
+    def test_log_is_trimmed(self):
+        with mock.patch("proxy.changes.TRIM_EVERY", 1):
+            self.receive(message(1), message(2), message(3))
+        self.assertEqual(ChangeLog.objects.count(), 3)
+
+
+@override_settings(TG_CHANGE_LOG_COMMIT_WINDOW=5)
+class CommitOrderTests(ProxyTestCase):
+    def test_changes_after_a_gap_are_held_back(self):
+        now = time()
+        log_entries((1, now), (2, now), (4, now))
+
+        self.assertEqual(settled_seq("default"), 2)
+        self.assertEqual([change.seq for change in load_changes(BOT_ID, 0, None, None, 100)], [1, 2])
+        # Until the change after the gap is older than the commit window
+        ChangeLog.objects.filter(seq=4).update(created_at=now - 10)
+        self.assertEqual(settled_seq("default"), 4)
+        self.assertEqual([change.seq for change in load_changes(BOT_ID, 0, None, None, 100)], [1, 2, 4])
+
+    def test_old_changes_are_settled(self):
+        now = time()
+        log_entries((1, now - 20), (3, now - 10), (4, now), (6, now), (7, now))
+        self.assertEqual(settled_seq("default"), 4)
+
+    def test_feed_polls_up_to_the_gap(self):
+        feed = ChangeFeed(buffer_size=2, poll_interval=1)
+        feed.starts, feed.last_seqs, feed.buffers = {"default": 0}, {"default": 0}, {"default": []}
+        now = time()
+        log_entries((1, now), (2, now), (4, now))
+
+        self.assertFalse(feed.poll("default"))
+        self.assertEqual([change.seq for change in feed.read(BOT_ID, 0, None, None, 100)], [1, 2])
+        log_entries((3, now), (5, now), (6, now))
+        feed.poll("default")
+        # Only the last buffer_size changes are kept once the buffer is twice as large
+        self.assertEqual(feed.starts["default"], 4)
+        self.assertEqual([change.seq for change in feed.read(BOT_ID, 4, None, None, 100)], [5, 6])
+        self.assertIsNone(feed.read(BOT_ID, 2, None, None, 100))
+        BotShard.objects.create(bot_id=BOT_ID + 1, database="default")
+        self.assertEqual(feed.read(BOT_ID + 1, 4, None, None, 100), [])
+
+
+class ChangeStreamTests(ProxyTransactionTestCase):
+    reset_sequences = True
+
+    async def stream(self, scope: dict, until, connect: bool = False) -> list[dict]:
+        # Runs the application until until(sent messages) is true, then disconnects
+        sent = []
+        done = asyncio.Event()
+
+        async def receive() -> dict:
+            nonlocal connect
+            if connect:
+                connect = False
+                return {"type": "websocket.connect"}
+            await done.wait()
+            return {"type": "websocket.disconnect" if scope["type"] == "websocket" else "http.disconnect"}
+
+        async def send(event: dict) -> None:
+            sent.append(event)
+            if until(sent):
+                done.set()
+
+        application = ChangeFeedApplication(None)
+        await asyncio.wait_for(application(scope, receive, send), 10)
+        return sent
+
+    def test_server_sent_events(self):
+        self.receive(message(1))
+        after = ChangeLog.objects.filter(type="message").get().seq
+
+        async def run():
+            stream = asyncio.ensure_future(self.stream({
+                "type": "http", "path": f"/bot{TOKEN}/getChanges", "query_string": f"after={after}".encode(),
+                "headers": [(b"accept", b"text/event-stream")],
+            }, lambda sent: b"event: message" in sent[-1].get("body", b"")))
+            # Written while subscribed, the feed is kicked by the write
+            await asyncio.sleep(0.5)
+            await sync_to_async(self.receive)(message(2))
+            return await stream
+
+        sent = asyncio.run(run())
+
+        self.assertEqual(sent[0]["status"], 200)
+        self.assertIn((b"content-type", b"text/event-stream"), sent[0]["headers"])
+        events = [event for chunk in sent[1:] for event in chunk["body"].decode().split("\n\n") if event]
+        self.assertTrue(all(event.startswith("id: ") for event in events))
+        changes = [loads(event.split("data: ", 1)[1]) for event in events]
+        self.assertTrue(all(change["seq"] > after for change in changes))
+        self.assertEqual([change["id"] for change in changes if change["type"] == "message"], [2])
+
+    def test_websocket(self):
+        self.receive(message(1))
+
+        sent = asyncio.run(self.stream({"type": "websocket", "path": f"/bot{TOKEN}/getChanges",
+                                        "query_string": b"after=0&types=message", "headers": []},
+                                       lambda sent: len(sent) >= 2, connect=True))
+
+        self.assertEqual(sent[0], {"type": "websocket.accept"})
+        change = loads(sent[1]["text"])
+        self.assertEqual((change["type"], change["chat_id"], change["id"]), ("message", CHAT_ID, 1))
+
+    def test_trimmed_cursors_are_rejected(self):
+        self.receive(message(1))
+
+        sent = asyncio.run(self.stream({"type": "websocket", "path": f"/bot{TOKEN}/getChanges",
+                                        "query_string": b"after=100", "headers": []},
+                                       lambda sent: False, connect=True))
+
+        self.assertEqual(loads(sent[1]["text"])["error_code"], 410)
+        self.assertEqual(sent[2], {"type": "websocket.close", "code": 4410})
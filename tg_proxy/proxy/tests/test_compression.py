@@ -0,0 +1,119 @@
+import gzip
+from json import loads
+from unittest import mock
+
+import brotli
+
+from proxy.compression import CompressedCache, FLUSH_SIZE, choose_encoding, compress, compress_stream, decompress, \
+    parse_accept_encoding
+from proxy.models import Message
+from proxy.tests.base import ProxyTestCase, BOT_ID, CHAT_ID, message
+
+LONG_TEXT = "a long message, " * 100
+
+
+class NegotiationTests(ProxyTestCase):
+    def test_parse_accept_encoding(self):
+        self.assertEqual(parse_accept_encoding("gzip, br;q=0.5, zstd;q=bad, "), {"gzip": 1.0, "br": 0.5, "zstd": 0.0})
+
+    def test_choose_encoding(self):
+        self.assertEqual(choose_encoding("gzip, deflate, br"), "br")
+        self.assertEqual(choose_encoding("gzip, br;q=0"), "gzip")
+        self.assertEqual(choose_encoding("*;q=0.1"), "br")
+        self.assertIsNone(choose_encoding("deflate, identity"))
+        self.assertIsNone(choose_encoding(""))
+
+
+class CompressionTests(ProxyTestCase):
+    def test_round_trip(self):
+        data = b'{"ok": true}' * 100
+        for encoding in ("br", "gzip"):
+            self.assertEqual(decompress(compress(data, encoding), encoding), data)
+        with self.assertRaisesMessage(ValueError, "Invalid gzip data"):
+            decompress(b"not gzip", "gzip")
+        with self.assertRaisesMessage(ValueError, "Unsupported encoding"):
+            decompress(b"", "compress")
+
+    def test_streams(self):
+        chunks = [b"x" * 1000] * (FLUSH_SIZE // 1000 * 2)
+        for encoding in ("br", "gzip"):
+            self.assertEqual(decompress(b"".join(compress_stream(chunks, encoding)), encoding), b"".join(chunks))
+        self.assertEqual([len(chunk) for chunk in compress_stream(chunks, None)], [66000, 64000])
+
+    def test_cache_keeps_recent_bodies(self):
+        cache = CompressedCache(3000)
+        bodies = [bytes([i]) * 1000 for i in range(3)]
+        for body in bodies:
+            self.assertEqual(gzip.decompress(cache.get(body, "gzip")), body)
+        self.assertEqual(list(cache.entries), [("gzip", bodies[1]), ("gzip", bodies[2])])
+        self.assertEqual(cache.size, sum(len(body) + len(value) for (_, body), value in cache.entries.items()))
+
+        cache.get(bodies[1], "gzip")
+        cache.get(bodies[0], "gzip")
+        self.assertEqual(list(cache.entries), [("gzip", bodies[1]), ("gzip", bodies[0])])
+        # Bodies larger than the cache are compressed every time
+        cache.get(b"y" * 5000, "gzip")
+        self.assertEqual(len(cache.entries), 2)
+
+
+class CompressedReadTests(ProxyTestCase):
+    def setUp(self) -> None:
+        super().setUp()
+        self.cache = CompressedCache(1 << 20)
+        patcher = mock.patch("proxy.compression.compressed_cache", self.cache)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.receive(message(1, text=LONG_TEXT), message(2))
+
+    def test_single_entities(self):
+        response = self.call("getMessage", data={"message_id": 1}, HTTP_ACCEPT_ENCODING="gzip, br")
+
+        self.assertEqual(response["Content-Encoding"], "br")
+        self.assertEqual(response["Vary"], "Accept-Encoding")
+        self.assertEqual(loads(brotli.decompress(response.content))["result"]["text"], LONG_TEXT)
+        self.assertEqual(len(self.cache.entries), 1)
+        self.call("getMessage", data={"message_id": 1}, HTTP_ACCEPT_ENCODING="br")
+        self.assertEqual(len(self.cache.entries), 1)
+
+    def test_small_and_unaccepted_bodies(self):
+        response = self.call("getMessage", data={"message_id": 2}, HTTP_ACCEPT_ENCODING="gzip")
+        self.assertNotIn("Content-Encoding", response)
+        self.assertEqual(response.json()["result"]["text"], "hi")
+
+        response = self.call("getMessage", data={"message_id": 1})
+        self.assertNotIn("Content-Encoding", response)
+        self.assertEqual(response["Vary"], "Accept-Encoding")
+        self.assertEqual(response.json()["result"]["text"], LONG_TEXT)
+
+    def test_pages(self):
+        response = self.call("getMessages", data={"chat_id": CHAT_ID}, HTTP_ACCEPT_ENCODING="gzip")
+
+        self.assertEqual(response["Content-Encoding"], "gzip")
+        self.assertIn("Accept-Encoding", response["Vary"])
+        data = loads(gzip.decompress(b"".join(response.streaming_content)))
+        self.assertEqual([item["message_id"] for item in data["result"]], [2, 1])
+        self.assertEqual(self.cache.entries, {})
+
+        plain = self.call("getMessages", data={"chat_id": CHAT_ID})
+        self.assertEqual(plain.json(), data)
+
+
+class PassthroughTests(ProxyTestCase):
+    def test_passes_compressed_responses_through(self):
+        self.api.encoding = "gzip"
+        self.api.responses["getUpdates"] = {"ok": True, "result": [{"update_id": 1, "message": message(1)}]}
+        response = self.call("getUpdates", HTTP_ACCEPT_ENCODING="gzip;q=0.5, deflate")
+
+        self.assertEqual(self.api.calls("getUpdates")[0].headers["Accept-Encoding"], "gzip")
+        self.assertEqual(response["Content-Encoding"], "gzip")
+        self.assertEqual(loads(gzip.decompress(response.content))["result"][0]["message"]["message_id"], 1)
+        # The response is still decoded here to cache its entities
+        self.assertTrue(Message.objects.filter(bot_id=BOT_ID, message_id=1).exists())
+
+    def test_asks_for_identity(self):
+        self.api.encoding = "gzip"
+        response = self.call("sendChatAction", HTTP_ACCEPT_ENCODING="deflate")
+
+        self.assertEqual(self.api.calls("sendChatAction")[0].headers["Accept-Encoding"], "identity")
+        self.assertNotIn("Content-Encoding", response)
+        self.assertEqual(response.json(), {"ok": True, "result": True})
@@ -0,0 +1,82 @@
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
+
+from proxy.models import CacheVersion, Message
+from proxy.tests.base import ProxyTestCase, BOT_ID, CHAT_ID, message
+
+OTHER_CHAT_ID = CHAT_ID + 1
+
+
+class CacheVersionTests(ProxyTestCase):
+    def test_bump(self):
+        self.assertEqual(CacheVersion.current("default", BOT_ID, CHAT_ID), 0)
+        CacheVersion.bump("default", BOT_ID, [CHAT_ID, OTHER_CHAT_ID])
+        CacheVersion.bump("default", BOT_ID, [CHAT_ID])
+
+        self.assertEqual(CacheVersion.current("default", BOT_ID, CHAT_ID), 2)
+        self.assertEqual(CacheVersion.current("default", BOT_ID, OTHER_CHAT_ID), 1)
+        self.assertEqual(CacheVersion.current("default", BOT_ID + 1, CHAT_ID), 0)
+
+
+class ConditionalGetTests(ProxyTestCase):
+    def setUp(self) -> None:
+        super().setUp()
+        self.receive(message(1), message(2))
+
+    def get(self, method: str, etag: str = None, **params):
+        headers = {"HTTP_IF_NONE_MATCH": etag} if etag is not None else {}
+        return self.call(method, data=params, **headers)
+
+    def test_not_modified(self):
+        response = self.get("getMessages", chat_id=CHAT_ID)
+        etag = response["ETag"]
+        self.assertTrue(etag.startswith('W/"'))
+
+        with CaptureQueriesContext(connection) as queries:
+            response = self.get("getMessages", etag, chat_id=CHAT_ID)
+        self.assertEqual(response.status_code, 304)
+        self.assertEqual(response.content, b"")
+        self.assertEqual((response["ETag"], response["Vary"]), (etag, "Accept-Encoding"))
+        # Only the version is read
+        self.assertFalse([query for query in queries if Message._meta.db_table in query["sql"]])
+
+    def test_etags_depend_on_the_parameters(self):
+        etag = self.get("getMessages", chat_id=CHAT_ID)["ETag"]
+
+        self.assertEqual(self.get("getMessages", etag, limit=100, chat_id=CHAT_ID).status_code, 200)
+        self.assertEqual(self.get("getMessages", etag, chat_id=CHAT_ID, limit=1).status_code, 200)
+        response = self.call("getMessages", data={"chat_id": CHAT_ID}, HTTP_IF_NONE_MATCH=etag,
+                             HTTP_ACCEPT_ENCODING="gzip")
+        self.assertEqual(response.status_code, 304)
+        # Same parameters, other bot
+        response = self.call("getMessages", token="654321:ABC-DEF1234ghIkl-zyx57W2v1u123ew11",
+                             data={"chat_id": CHAT_ID}, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+
+    def test_writes_change_the_etag(self):
+        etag = self.get("getMessages", chat_id=CHAT_ID)["ETag"]
+        other_etag = self.get("getMessages", chat_id=OTHER_CHAT_ID)["ETag"]
+        self.receive(message(3))
+
+        response = self.get("getMessages", etag, chat_id=CHAT_ID)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual([data["message_id"] for data in response.json()["result"]], [3, 2, 1])
+        self.assertNotEqual(response["ETag"], etag)
+        self.assertEqual(self.get("getMessages", other_etag, chat_id=OTHER_CHAT_ID).status_code, 304)
+
+    def test_unchanged_writes_keep_the_etag(self):
+        etag = self.get("getMessages", chat_id=CHAT_ID)["ETag"]
+        self.receive(message(1), message(2))
+
+        self.assertEqual(self.get("getMessages", etag, chat_id=CHAT_ID).status_code, 304)
+
+    def test_chats(self):
+        etag = self.get("getChats")["ETag"]
+        self.receive(message(3))
+        self.assertEqual(self.get("getChats", etag).status_code, 304)
+
+        self.receive(message(1, chat_id=OTHER_CHAT_ID))
+        response = self.get("getChats", etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual([chat["id"] for chat in response.json()["result"]], [OTHER_CHAT_ID, CHAT_ID])
+        self.assertEqual(self.get("getChats", response["ETag"]).status_code, 304)
@@ -0,0 +1,131 @@
+from time import time
+
+from django.test import override_settings
+
+from proxy.models import UndeliverableChat
+from proxy.tests.base import ProxyTestCase, BOT_ID, CHAT_ID, TOKEN, counter
+
+BLOCKED = {"_status": 403, "ok": False, "error_code": 403, "description": "Forbidden: bot was blocked by the user"}
+OTHER_CHAT_ID = CHAT_ID + 1
+
+
+def my_chat_member(chat_id: int, status: str) -> dict:
+    return {"update_id": 1, "my_chat_member": {
+        "chat": {"id": chat_id, "type": "private", "first_name": "User"},
+        "from": {"id": chat_id, "is_bot": False, "first_name": "User"}, "date": 1700000000,
+        "old_chat_member": {"status": "kicked", "user": {"id": BOT_ID, "is_bot": True, "first_name": "Bot"}},
+        "new_chat_member": {"status": status, "user": {"id": BOT_ID, "is_bot": True, "first_name": "Bot"}},
+    }}
+
+
+@override_settings(TG_UNDELIVERABLE_TTL=3600)
+class UndeliverableTests(ProxyTestCase):
+    def setUp(self) -> None:
+        super().setUp()
+        self.api.responses["sendMessage"] = lambda request: BLOCKED if f"chat_id={CHAT_ID}" in str(request.url) \
+            else {"ok": True, "result": True}
+
+    def send(self, chat_id: int = CHAT_ID):
+        return self.call("sendMessage", data={"chat_id": chat_id, "text": "hi"})
+
+    def test_fails_fast_after_an_undeliverable_error(self):
+        rejected = counter("tg_proxy_undeliverable_total", result="rejected")
+        self.assertEqual(self.send().status_code, 403)
+        entry = UndeliverableChat.objects.get(bot_id=BOT_ID, chat_id=CHAT_ID)
+        self.assertEqual((entry.error_code, entry.description), (403, BLOCKED["description"]))
+        self.assertEqual(entry.expires_at - entry.date, 3600)
+
+        response = self.send()
+        self.assertEqual(response.status_code, 403)
+        self.assertEqual(response.json(), {"ok": False, "error_code": 403, "description": BLOCKED["description"]})
+        self.assertEqual(len(self.api.calls("sendMessage")), 1)
+        self.assertEqual(counter("tg_proxy_undeliverable_total", result="rejected") - rejected, 1)
+        # Other chats and methods not sending anything are still forwarded
+        self.assertEqual(self.send(OTHER_CHAT_ID).status_code, 200)
+        self.assertEqual(self.call("getChat", data={"chat_id": CHAT_ID}).status_code, 200)
+
+    def test_json_and_form_bodies(self):
+        self.send()
+        for response in (self.post("sendPhoto", {"chat_id": CHAT_ID}),
+                         self.client.post(f"/bot{TOKEN}/copyMessage",
+                                          {"chat_id": str(CHAT_ID), "from_chat_id": "1", "message_id": "1"})):
+            self.assertEqual(response.status_code, 403)
+        self.assertEqual(self.api.calls("sendPhoto") + self.api.calls("copyMessage"), [])
+
+    def test_other_errors_are_not_recorded(self):
+        self.api.responses["sendMessage"] = {"_status": 400, "ok": False, "error_code": 400,
+                                             "description": "Bad Request: message text is empty"}
+        self.send()
+        self.api.responses["sendMessage"] = {"_status": 400, "ok": False, "error_code": 400,
+                                             "description": "Bad Request: chat not found"}
+        self.send(OTHER_CHAT_ID)
+
+        self.assertEqual(list(UndeliverableChat.objects.values_list("chat_id", flat=True)), [OTHER_CHAT_ID])
+
+    def test_forwards_only_record_terminal_errors_of_the_target(self):
+        # "chat not found" may be about from_chat_id
+        self.api.responses["forwardMessage"] = {"_status": 400, "ok": False, "error_code": 400,
+                                                "description": "Bad Request: chat not found"}
+        self.api.responses["copyMessage"] = BLOCKED
+        for method, chat_id in (("forwardMessage", CHAT_ID), ("copyMessage", OTHER_CHAT_ID)):
+            self.call(method, data={"chat_id": chat_id, "from_chat_id": 1, "message_id": 1})
+
+        self.assertEqual(list(UndeliverableChat.objects.values_list("chat_id", flat=True)), [OTHER_CHAT_ID])
+        self.assertEqual(self.call("forwardMessage", data={"chat_id": OTHER_CHAT_ID}).status_code, 403)
+        self.assertEqual(len(self.api.calls("forwardMessage")), 1)
+
+    def test_token_is_checked_before_failing_fast(self):
+        self.send()
+        rejected = counter("tg_proxy_undeliverable_total", result="rejected")
+        self.api.responses["getMe"] = {"_status": 401, "ok": False, "error_code": 401, "description": "Unauthorized"}
+
+        response = self.call("sendMessage", token=f"{BOT_ID}:wrong", data={"chat_id": CHAT_ID, "text": "hi"})
+        self.assertEqual(response.status_code, 401)
+        self.assertEqual(response.json()["description"], "Telegram Bot Api server returned an error: Unauthorized")
+        self.assertEqual(counter("tg_proxy_undeliverable_total", result="rejected"), rejected)
+
+    def test_entries_expire(self):
+        self.send()
+        UndeliverableChat.objects.update(expires_at=int(time()) - 1)
+
+        self.assertEqual(self.send().status_code, 403)
+        self.assertEqual(len(self.api.calls("sendMessage")), 2)
+        self.assertGreater(UndeliverableChat.objects.get().expires_at, time())
+
+    @override_settings(TG_UNDELIVERABLE_TTL=0)
+    def test_disabled(self):
+        self.send()
+        self.send()
+
+        self.assertEqual(len(self.api.calls("sendMessage")), 2)
+        self.assertFalse(UndeliverableChat.objects.exists())
+
+    def test_cleared_when_the_bot_is_back(self):
+        self.send()
+        self.api.responses["getUpdates"] = {"ok": True, "result": [my_chat_member(CHAT_ID, "kicked")]}
+        self.call("getUpdates")
+        self.assertTrue(UndeliverableChat.objects.exists())
+
+        self.api.responses["getUpdates"] = {"ok": True, "result": [my_chat_member(CHAT_ID, "member")]}
+        self.call("getUpdates")
+        self.assertFalse(UndeliverableChat.objects.exists())
+        self.assertEqual(self.send().status_code, 403)
+        self.assertEqual(len(self.api.calls("sendMessage")), 2)
+
+    def test_list_and_delete(self):
+        now = int(time())
+        for chat_id in (1, 2, 3):
+            UndeliverableChat.objects.create(bot_id=BOT_ID, chat_id=chat_id, error_code=403, description="blocked",
+                                             date=now, expires_at=now + 60)
+        UndeliverableChat.objects.create(bot_id=BOT_ID + 2, chat_id=1, error_code=403, description="blocked",
+                                         date=now, expires_at=now + 60)
+
+        response = self.call("getUndeliverableChats", data={"after": 1, "limit": 1})
+        self.assertEqual(response.json(), {"ok": True, "result": [
+            {"chat_id": 2, "error_code": 403, "description": "blocked", "date": now, "expires_at": now + 60}
+        ]})
+        self.assertEqual(self.post("deleteUndeliverableChats", {"chat_ids": [1, 4]}).json(), {"ok": True, "result": 1})
+        self.assertEqual([entry["chat_id"] for entry in self.call("getUndeliverableChats").json()["result"]], [2, 3])
+        self.assertEqual(self.post("deleteUndeliverableChats", {}).json(), {"ok": True, "result": 2})
+        self.assertEqual(UndeliverableChat.objects.count(), 1)
+        self.assertEqual(self.post("deleteUndeliverableChats", {"chat_ids": "bad"}).status_code, 400)
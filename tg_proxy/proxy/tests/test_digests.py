@@ -0,0 +1,75 @@
+from json import loads
+from unittest import mock
+
+from django.db import models
+
+from proxy.db import DigestCache
+from proxy.models import BaseModel, CacheVersion, ChangeLog, Message
+from proxy.tests.base import ProxyTestCase, BOT_ID, CHAT_ID, counter, message
+
+
+def upserts(result: str) -> float:
+    return counter("tg_proxy_upserts_total", model="message", result=result)
+
+
+class DigestTests(ProxyTestCase):
+    def test_unchanged_rows_are_not_written(self):
+        self.receive(message(1), message(2))
+        changes = ChangeLog.objects.count()
+        version = CacheVersion.current("default", BOT_ID, CHAT_ID)
+        skipped, written = upserts("skipped_cache"), upserts("written")
+
+        self.receive(message(1), message(2))
+
+        self.assertEqual(upserts("skipped_cache"), skipped + 2)
+        self.assertEqual(upserts("written"), written)
+        self.assertEqual(ChangeLog.objects.count(), changes)
+        self.assertEqual(CacheVersion.current("default", BOT_ID, CHAT_ID), version)
+
+    def test_digests_are_read_from_the_database_on_cache_misses(self):
+        self.receive(message(1), message(2))
+        skipped, written = upserts("skipped_db"), upserts("written")
+
+        with mock.patch("proxy.models.digest_cache", DigestCache(1000)):
+            self.receive(message(1), message(2, text="edited"))
+
+        self.assertEqual(upserts("skipped_db"), skipped + 1)
+        self.assertEqual(upserts("written"), written + 1)
+        self.assertEqual(loads(Message.objects.get(message_id=2).serialized_message)["text"], "edited")
+
+    def test_changed_rows_are_written(self):
+        self.receive(message(1))
+        self.receive(message(1, text="edited"))
+
+        response = self.call("getMessage", data={"chat_id": CHAT_ID, "message_id": 1})
+        self.assertEqual(response.json()["result"]["text"], "edited")
+
+    def test_duplicates_in_one_response_are_written_once(self):
+        duplicates, written = upserts("duplicate"), upserts("written")
+        self.receive(message(1), message(1))
+
+        self.assertEqual(upserts("duplicate"), duplicates + 1)
+        self.assertEqual(upserts("written"), written + 1)
+
+    def test_cache_evicts_least_recently_used(self):
+        cache = DigestCache(2)
+        cache.put(("a",), 1)
+        cache.put(("b",), 2)
+        cache.get(("a",))
+        cache.put(("c",), 3)
+        cache.discard(("c",))
+
+        self.assertEqual((cache.get(("a",)), cache.get(("b",)), cache.get(("c",))), (1, None, None))
+
+
+
+class BaseModelTests(ProxyTestCase):
+    def test_change_and_version_hooks_are_required(self):
+        for fields, error in (({"change_type": "message"}, "no change_from_fields"),
+                              ({"versioned": True}, "no version_chat_id")):
+            with self.subTest(error), self.assertRaisesMessage(TypeError, error):
+                type("Incomplete", (BaseModel,), {
+                    **fields, "__module__": __name__,
+                    "Meta": type("Meta", (), {"abstract": True, "app_label": "proxy"}),
+                    "value": models.IntegerField(),
+                })
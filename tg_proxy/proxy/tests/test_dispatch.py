@@ -0,0 +1,29 @@
+from django.test import override_settings
+
+from proxy.tests.base import ProxyTestCase, TOKEN, BOT_ID
+
+
+class DispatcherTests(ProxyTestCase):
+    def test_bot_routes_skip_the_middleware_stack(self):
+        response = self.call("getWebhookInfo")
+        self.assertEqual(response.status_code, 501)
+        self.assertNotIn("X-Frame-Options", response)
+
+        response = self.call("getMe")
+        self.assertEqual(response.json()["result"]["id"], BOT_ID)
+        self.assertNotIn("X-Frame-Options", response)
+
+    def test_other_paths_use_the_middleware_stack(self):
+        response = self.client.get("/admin/login/")
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response["X-Frame-Options"], "DENY")
+
+    def test_unmatched_bot_paths_fall_through(self):
+        self.assertEqual(self.client.get(f"/bot{TOKEN}/getMe/extra").status_code, 404)
+        self.assertFalse(self.api.requests)
+
+    @override_settings(ALLOWED_HOSTS=["proxy.example"])
+    def test_bot_routes_check_the_host(self):
+        self.assertEqual(self.call("getMe", HTTP_HOST="evil.example").status_code, 400)
+        self.assertFalse(self.api.requests)
+        self.assertEqual(self.call("getMe", HTTP_HOST="proxy.example").status_code, 200)
@@ -0,0 +1,69 @@
+import gzip
+from json import loads
+from pathlib import Path
+from tempfile import TemporaryDirectory
+from time import time
+
+from django.core.management import call_command
+
+from proxy.archive import archive_messages
+from proxy.export import export_messages
+from proxy.tests.base import ProxyTestCase, BOT_ID, CHAT_ID, message
+
+OTHER_CHAT_ID = CHAT_ID + 1
+
+
+def keys(lines) -> list[tuple[int, int]]:
+    return [(data["chat"]["id"], data["message_id"]) for data in map(loads, lines)]
+
+
+class ExportTests(ProxyTestCase):
+    def setUp(self) -> None:
+        super().setUp()
+        self.use_archive()
+        self.receive(*(message(i, chat_id=OTHER_CHAT_ID) for i in (3, 1, 2)), *(message(i) for i in (5, 4)))
+
+    def export(self, **params) -> list[tuple[int, int]]:
+        response = self.call("exportMessages", data=params)
+        self.assertEqual(response["Content-Type"], "application/x-ndjson")
+        return keys(b"".join(response.streaming_content).splitlines())
+
+    def test_exports_in_key_order(self):
+        self.assertEqual(self.export(), [(CHAT_ID, 4), (CHAT_ID, 5), (OTHER_CHAT_ID, 1), (OTHER_CHAT_ID, 2),
+                                         (OTHER_CHAT_ID, 3)])
+        self.assertEqual(self.export(chat_id=OTHER_CHAT_ID), [(OTHER_CHAT_ID, 1), (OTHER_CHAT_ID, 2),
+                                                              (OTHER_CHAT_ID, 3)])
+
+    def test_resumes_after_the_cursor(self):
+        self.assertEqual(self.export(cursor=f"{CHAT_ID}:5"), [(OTHER_CHAT_ID, 1), (OTHER_CHAT_ID, 2),
+                                                              (OTHER_CHAT_ID, 3)])
+        self.assertEqual(self.export(cursor=f"{OTHER_CHAT_ID}:1"), [(OTHER_CHAT_ID, 2), (OTHER_CHAT_ID, 3)])
+        self.assertEqual(self.call("exportMessages", data={"cursor": "bad"}).status_code, 400)
+
+    def test_pages(self):
+        self.assertEqual(keys(export_messages(BOT_ID, OTHER_CHAT_ID, page_size=1, chunk_size=1)),
+                         [(OTHER_CHAT_ID, 1), (OTHER_CHAT_ID, 2), (OTHER_CHAT_ID, 3)])
+
+    def test_includes_archived_messages_once(self):
+        self.receive(*(message(i, date=int(time()) - 30 * 86400) for i in (1, 2)))
+        archive_messages(7)
+        # As if archiving was interrupted before the rows were deleted
+        self.receive(message(2, date=int(time()) - 30 * 86400))
+
+        self.assertEqual(self.export(chat_id=CHAT_ID), [(CHAT_ID, 1), (CHAT_ID, 2), (CHAT_ID, 4), (CHAT_ID, 5)])
+        self.assertEqual(self.export(cursor=f"{CHAT_ID}:1")[:2], [(CHAT_ID, 2), (CHAT_ID, 4)])
+
+    def test_compressed(self):
+        response = self.call("exportMessages", data={"chat_id": CHAT_ID}, HTTP_ACCEPT_ENCODING="gzip")
+
+        self.assertEqual(response["Content-Encoding"], "gzip")
+        self.assertEqual(keys(gzip.decompress(b"".join(response.streaming_content)).splitlines()),
+                         [(CHAT_ID, 4), (CHAT_ID, 5)])
+
+    def test_command(self):
+        with TemporaryDirectory() as directory:
+            output = Path(directory) / "export.ndjson.gz"
+            call_command("exportmessages", BOT_ID, "--cursor", f"{CHAT_ID}:4", "--output", str(output),
+                         "--compress", "gzip")
+            self.assertEqual(keys(gzip.decompress(output.read_bytes()).splitlines()),
+                             [(CHAT_ID, 5), (OTHER_CHAT_ID, 1), (OTHER_CHAT_ID, 2), (OTHER_CHAT_ID, 3)])
@@ -0,0 +1,95 @@
+from json import dumps, loads
+
+from proxy.history import SNAPSHOT_EVERY, diff, patch
+from proxy.models import Message, MessageEdit, content_digest
+from proxy.tests.base import ProxyTestCase, BOT_ID, CHAT_ID, DATE, message
+
+LONG_TEXT = "A long message with a typo in the middle of it, edited a few times. " * 10
+
+
+def edited(version: int, text: str) -> dict:
+    return message(1, text=text, edit_date=DATE + version)
+
+
+class DiffTests(ProxyTestCase):
+    def test_patch_reverts_diff(self):
+        old = {"a": 1, "b": {"c": [1, 2], "d": "x"}, "text": LONG_TEXT, "gone": True}
+        new = {"a": 2, "b": {"c": [1, 2, 3], "d": "y"}, "text": LONG_TEXT.replace("typo", "fix", 1), "added": None}
+
+        self.assertEqual(patch(loads(dumps(old)), diff(old, new)), new)
+        self.assertEqual(patch(LONG_TEXT, diff(LONG_TEXT, LONG_TEXT + "!")), LONG_TEXT + "!")
+        self.assertEqual(patch([1], diff([1], {"a": 1})), {"a": 1})
+        self.assertEqual(diff(old, old), [])
+
+    def test_operations(self):
+        self.assertEqual(diff({"a": "short", "b": 1}, {"a": "other"}), [["-", ["b"]], ["=", ["a"], "other"]])
+        self.assertEqual(diff({"text": LONG_TEXT}, {"text": LONG_TEXT.replace("typo", "fix", 1)}),
+                         [["~", ["text"], 22, len(LONG_TEXT) - 26, "fix"]])
+
+
+class MessageHistoryTests(ProxyTestCase):
+    def setUp(self) -> None:
+        super().setUp()
+        self.texts = [LONG_TEXT] + [LONG_TEXT.replace("typo", f"fix {version}", 1) for version in range(1, 13)]
+        self.receive(message(1, text=self.texts[0]))
+        for version in range(1, 13):
+            self.receive(edited(version, self.texts[version]))
+
+    def history(self, **params):
+        return self.call("getMessageHistory", data={"chat_id": CHAT_ID, "message_id": 1, **params})
+
+    def test_versions(self):
+        versions = self.history().json()["result"]
+
+        self.assertEqual([version["version"] for version in versions], list(range(13)))
+        self.assertEqual([version["message"]["text"] for version in versions], self.texts)
+        self.assertEqual(versions[0]["edit_date"], DATE)
+        self.assertEqual(versions[12]["edit_date"], DATE + 12)
+        self.assertEqual(versions[12]["message"], loads(dumps(edited(12, self.texts[12]))))
+
+    def test_snapshots_and_diffs(self):
+        entries = MessageEdit.objects.filter(bot_id=BOT_ID, chat_id=CHAT_ID, message_id=1)
+        self.assertEqual(list(entries.filter(snapshot=True).values_list("version", flat=True)), [0, SNAPSHOT_EVERY])
+        diff_size = sum(len(data) for data in entries.filter(snapshot=False).values_list("data", flat=True))
+        full_size = sum(len(dumps(edited(version, text))) for version, text in enumerate(self.texts))
+        self.assertLess(diff_size, full_size / 10)
+
+    def test_single_versions_and_pages(self):
+        response = self.history(version=12)
+        self.assertEqual([version["message"]["text"] for version in response.json()["result"]], [self.texts[12]])
+        self.assertEqual(self.history(version=5).json()["result"][0]["message"]["text"], self.texts[5])
+        response = self.history(version=13)
+        self.assertEqual((response.status_code, response.json()["error_code"]), (404, 400))
+
+        versions = self.history(after=8, limit=3).json()["result"]
+        self.assertEqual([version["version"] for version in versions], [9, 10, 11])
+        self.assertEqual(versions[0]["message"]["text"], self.texts[9])
+        self.assertEqual(self.history(version=-1).status_code, 400)
+        response = self.call("getMessageHistory", data={"chat_id": CHAT_ID, "message_id": 2})
+        self.assertEqual(response.json(), {"ok": True, "result": []})
+
+    def test_only_edits_are_versions(self):
+        # Repeated updates and copies of the message without a new edit date
+        self.receive(edited(12, self.texts[12]))
+        self.receive(message(2, reply_to_message=edited(12, self.texts[12] + "!")))
+
+        self.assertEqual(MessageEdit.objects.filter(message_id=1).count(), 13)
+
+    def test_chain_restarts_after_unrecorded_changes(self):
+        text = "changed without an edit"
+        serialized = dumps(message(1, text=text, edit_date=DATE + 20))
+        Message.objects.filter(message_id=1).update(serialized_message=serialized, digest=content_digest(serialized))
+        self.receive(edited(21, "edited again"))
+
+        versions = self.history(after=11).json()["result"]
+        self.assertEqual([(version["version"], version["message"]["text"]) for version in versions],
+                         [(12, self.texts[12]), (13, text), (14, "edited again")])
+        self.assertTrue(MessageEdit.objects.get(message_id=1, version=13).snapshot)
+
+    def test_versions_without_a_snapshot_are_skipped(self):
+        # As if the oldest versions were deleted by retention
+        MessageEdit.objects.filter(version__lt=SNAPSHOT_EVERY).delete()
+
+        versions = self.history().json()["result"]
+        self.assertEqual([version["version"] for version in versions], [10, 11, 12])
+        self.assertEqual(versions[-1]["message"]["text"], self.texts[12])
@@ -0,0 +1,186 @@
+import gzip
+from json import loads
+from time import time
+from unittest import mock, skipUnless
+
+from django.conf import settings
+from django.test import RequestFactory, override_settings
+
+from proxy.idempotency import request_fingerprint
+from proxy.maintenance import move_bot
+from proxy.models import BotShard, IdempotencyKey
+from proxy.tests.base import ProxyTestCase, BOT_ID, CHAT_ID, TOKEN, counter, message
+
+
+class IdempotencyTestCase(ProxyTestCase):
+    def setUp(self) -> None:
+        super().setUp()
+        self.count = 0
+
+        def send(request):
+            self.count += 1
+            return {"ok": True, "result": message(self.count, text=loads(request.content)["text"])}
+
+        self.api.responses["sendMessage"] = send
+
+    def send(self, key: str = "key-1", text: str = "hi", token: str = TOKEN, **kwargs):
+        return self.post("sendMessage", {"chat_id": CHAT_ID, "text": text}, token, HTTP_IDEMPOTENCY_KEY=key,
+                         **kwargs)
+
+
+class IdempotencyTests(IdempotencyTestCase):
+    def test_replays_the_stored_response(self):
+        replayed = counter("tg_proxy_idempotency_total", result="replayed")
+        first = self.send()
+        second = self.send()
+
+        self.assertEqual(second.status_code, 200)
+        self.assertEqual(second.json(), first.json())
+        self.assertEqual(second["Idempotent-Replayed"], "true")
+        self.assertNotIn("Idempotent-Replayed", first)
+        self.assertEqual(len(self.api.calls("sendMessage")), 1)
+        self.assertEqual(counter("tg_proxy_idempotency_total", result="replayed") - replayed, 1)
+        # Other keys and requests without one are executed
+        self.assertEqual(self.send("key-2").json()["result"]["message_id"], 2)
+        self.post("sendMessage", {"chat_id": CHAT_ID, "text": "hi"})
+        self.assertEqual(len(self.api.calls("sendMessage")), 3)
+
+    def test_query_parameter(self):
+        self.client.post(f"/bot{TOKEN}/sendMessage?idempotency_key=key-1", {"chat_id": CHAT_ID, "text": "hi"},
+                         content_type="application/json")
+        response = self.client.post(f"/bot{TOKEN}/sendMessage?idempotency_key=key-1",
+                                    {"chat_id": CHAT_ID, "text": "hi"}, content_type="application/json")
+
+        self.assertEqual(response["Idempotent-Replayed"], "true")
+        self.assertEqual(len(self.api.calls("sendMessage")), 1)
+        # The parameter is not forwarded
+        self.assertNotIn("idempotency_key", str(self.api.calls("sendMessage")[0].url))
+        # and is the same key as the header
+        self.assertEqual(self.send()["Idempotent-Replayed"], "true")
+
+    def test_parameter_mismatch(self):
+        self.send()
+        response = self.send(text="other")
+
+        self.assertEqual(response.status_code, 422)
+        self.assertEqual(response.json()["error_code"], 422)
+        self.assertEqual(len(self.api.calls("sendMessage")), 1)
+
+    def test_keys_belong_to_a_bot(self):
+        self.send()
+        response = self.send(token="654321:ABC-DEF1234ghIkl-zyx57W2v1u123ew11")
+
+        self.assertEqual(response.status_code, 200)
+        self.assertNotIn("Idempotent-Replayed", response)
+        self.assertEqual(len(self.api.calls("sendMessage")), 2)
+
+    def test_invalid_requests(self):
+        response = self.send(token="abc:def")
+        self.assertEqual((response.status_code, response.json()["error_code"]), (401, 401))
+        self.assertEqual(self.send("k" * 256).status_code, 400)
+        self.assertEqual(self.api.calls("sendMessage"), [])
+
+    def test_errors_are_not_stored(self):
+        self.api.responses["sendMessage"] = {"_status": 429, "ok": False, "error_code": 429,
+                                             "description": "Too Many Requests", "parameters": {"retry_after": 1}}
+        self.assertEqual(self.send().status_code, 429)
+        self.assertFalse(IdempotencyKey.objects.exists())
+
+        self.api.responses["sendMessage"] = {"_status": 400, "ok": False, "error_code": 400,
+                                             "description": "Bad Request: message text is empty"}
+        self.assertEqual(self.send().status_code, 400)
+        self.assertEqual(self.send().status_code, 400)
+        self.assertEqual(len(self.api.calls("sendMessage")), 2)
+
+    def test_compressed_responses_are_stored_decoded(self):
+        self.api.encoding = "gzip"
+        first = self.send(HTTP_ACCEPT_ENCODING="gzip")
+        self.assertEqual(first["Content-Encoding"], "gzip")
+
+        second = self.send()
+        self.assertNotIn("Content-Encoding", second)
+        self.assertEqual(second.json(), loads(gzip.decompress(first.content)))
+
+    @override_settings(TG_IDEMPOTENCY_TTL=0)
+    def test_disabled(self):
+        self.send()
+        self.send()
+
+        self.assertEqual(len(self.api.calls("sendMessage")), 2)
+        self.assertFalse(IdempotencyKey.objects.exists())
+
+
+class InterruptedRequestTests(IdempotencyTestCase):
+    def running(self, locked_until: float, expires_at: float) -> None:
+        # As if the first request was still running in another worker
+        fingerprint = request_fingerprint(RequestFactory().post(
+            "/", {"chat_id": CHAT_ID, "text": "hi"}, content_type="application/json"
+        ), TOKEN, "sendMessage")
+        IdempotencyKey.objects.create(bot_id=BOT_ID, key="key-1", fingerprint=fingerprint, created_at=time(),
+                                      locked_until=locked_until, expires_at=expires_at)
+
+    @override_settings(TG_IDEMPOTENCY_WAIT=0)
+    def test_conflict(self):
+        self.running(time() + 60, time() + 60)
+        response = self.send()
+
+        self.assertEqual(response.status_code, 409)
+        self.assertEqual(self.api.calls("sendMessage"), [])
+
+    def test_waits_for_the_first_request(self):
+        self.running(time() + 60, time() + 60)
+
+        def finish(seconds):
+            IdempotencyKey.objects.update(status_code=200, content_type="application/json",
+                                          body=b'{"ok": true, "result": true}')
+
+        with mock.patch("proxy.idempotency.sleep", side_effect=finish) as sleep:
+            response = self.send()
+        sleep.assert_called_once()
+        self.assertEqual(response.json(), {"ok": True, "result": True})
+        self.assertEqual(self.api.calls("sendMessage"), [])
+
+    def test_dead_and_expired_entries_are_reused(self):
+        self.running(time() - 1, time() + 60)
+        self.assertNotIn("Idempotent-Replayed", self.send())
+        self.assertEqual(self.send()["Idempotent-Replayed"], "true")
+
+        IdempotencyKey.objects.update(expires_at=time() - 1)
+        self.assertNotIn("Idempotent-Replayed", self.send(text="other"))
+        self.assertEqual(len(self.api.calls("sendMessage")), 2)
+
+
+class FingerprintTests(ProxyTestCase):
+    def test_multipart_uploads(self):
+        factory = RequestFactory()
+
+        def upload(boundary: str, content: bytes) -> str:
+            body = (f"--{boundary}\r\nContent-Disposition: form-data; name=\"chat_id\"\r\n\r\n{CHAT_ID}\r\n"
+                    f"--{boundary}\r\nContent-Disposition: form-data; name=\"document\"; filename=\"a.txt\"\r\n"
+                    f"Content-Type: text/plain\r\n\r\n").encode() + content + f"\r\n--{boundary}--\r\n".encode()
+            request = factory.post("/", body, content_type=f"multipart/form-data; boundary={boundary}")
+            return request_fingerprint(request, TOKEN, "sendDocument")
+
+        self.assertEqual(upload("aaa", b"data"), upload("bbb", b"data"))
+        self.assertNotEqual(upload("aaa", b"data"), upload("aaa", b"other"))
+
+    def test_tokens_and_methods(self):
+        request = RequestFactory().get("/", {"chat_id": CHAT_ID})
+        fingerprint = request_fingerprint(request, TOKEN, "sendMessage")
+
+        self.assertNotEqual(fingerprint, request_fingerprint(request, TOKEN, "sendPhoto"))
+        self.assertNotEqual(fingerprint, request_fingerprint(request, "1:other", "sendMessage"))
+
+
+@skipUnless(len(settings.TG_SHARDS) > 1, "needs a second shard, set SHARD_DATABASES")
+class MovedKeyTests(IdempotencyTestCase):
+    def test_keys_move_with_the_bot(self):
+        BotShard.objects.create(bot_id=BOT_ID, database="default")
+        self.send()
+
+        with mock.patch("proxy.maintenance.sleep"):
+            move_bot(BOT_ID, settings.TG_SHARDS[1])
+
+        self.assertFalse(IdempotencyKey.objects.using("default").exists())
+        self.assertEqual(self.send()["Idempotent-Replayed"], "true")
+        self.assertEqual(len(self.api.calls("sendMessage")), 1)
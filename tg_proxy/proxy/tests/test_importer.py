@@ -0,0 +1,189 @@
+import gzip
+from io import StringIO
+from json import dumps, loads
+from pathlib import Path
+from tempfile import TemporaryDirectory
+
+from django.core.management import CommandError, call_command
+from django.db import connection
+
+from proxy.importer import HistoryImporter, StreamReader, deferred_message_indexes, desktop_message, detect_format
+from proxy.models import Chat, Message, User
+from proxy.tests.base import ProxyTestCase, ProxyTransactionTestCase, BOT_ID, CHAT_ID, USER_ID, message
+
+DESKTOP_EXPORT = {
+    "about": "Here is the data you requested",
+    "chats": {"about": "", "list": [{
+        "name": "Alice", "type": "personal_chat", "id": CHAT_ID,
+        "messages": [
+            {"id": 1, "type": "message", "date_unixtime": "1700000000", "from": "Alice", "from_id": f"user{USER_ID}",
+             "text": ["hello ", {"type": "bold", "text": "world"}]},
+            {"id": 2, "type": "service", "date_unixtime": "1700000001", "action": "pin_message"},
+            {"id": 3, "type": "message", "date_unixtime": "1700000002", "from": "Alice", "from_id": f"user{USER_ID}",
+             "text": "photo", "photo": "photos/1.jpg", "reply_to_message_id": 1, "edited_unixtime": "1700000003"},
+        ],
+    }]},
+}
+
+
+def update(update_id: int, data: dict) -> dict:
+    return {"update_id": update_id, "message": data}
+
+
+class HistoryImportTests(ProxyTestCase):
+    def setUp(self) -> None:
+        super().setUp()
+        self.dir = Path(self.enterContext(TemporaryDirectory()))
+
+    def write(self, name: str, content: str) -> str:
+        path = self.dir / name
+        if name.endswith(".gz"):
+            path.write_bytes(gzip.compress(content.encode("utf8")))
+        else:
+            path.write_text(content, encoding="utf8")
+        return str(path)
+
+    def write_lines(self, name: str, items: list) -> str:
+        return self.write(name, "".join(dumps(item) + "\n" for item in items))
+
+    def texts(self, chat_id: int = CHAT_ID) -> dict[int, str]:
+        return {message_id: loads(serialized)["text"] for message_id, serialized in Message.objects.filter(
+            bot_id=BOT_ID, chat_id=chat_id).values_list("message_id", "serialized_message")}
+
+    def test_detects_formats(self):
+        self.assertEqual(detect_format(self.write("updates.jsonl.gz", "")), "lines")
+        self.assertEqual(detect_format(self.write("updates.json", dumps([update(1, message(1))]))), "updates")
+        self.assertEqual(detect_format(self.write("response.json", dumps({"ok": True, "result": []}))), "updates")
+        self.assertEqual(detect_format(self.write("result.json", dumps(DESKTOP_EXPORT))), "desktop")
+
+    def test_imports_updates(self):
+        paths = [
+            self.write_lines("updates.jsonl.gz", [update(1, message(1)), update(2, message(2, text="two"))]),
+            self.write("response.json", dumps({"ok": True, "result": [update(3, message(3))]})),
+            self.write("update.json", dumps(update(4, message(1, chat_id=CHAT_ID + 1)))),
+        ]
+        importer = HistoryImporter(BOT_ID, batch_size=2)
+        for path in paths:
+            stats = importer.import_file(path)
+
+        self.assertEqual(self.texts(), {1: "hi", 2: "two", 3: "hi"})
+        self.assertEqual(self.texts(CHAT_ID + 1), {1: "hi"})
+        self.assertEqual(set(Chat.objects.filter(bot_id=BOT_ID).values_list("id", flat=True)), {CHAT_ID, CHAT_ID + 1})
+        self.assertTrue(User.objects.filter(id=USER_ID).exists())
+        self.assertEqual((stats["items"], stats["messages"]), (4, 4))
+
+    def test_imports_desktop_exports(self):
+        importer = HistoryImporter(BOT_ID)
+        importer.import_file(self.write("result.json", dumps(DESKTOP_EXPORT)))
+
+        rows = {message_id: loads(serialized) for message_id, serialized in Message.objects.filter(
+            bot_id=BOT_ID, chat_id=CHAT_ID).values_list("message_id", "serialized_message")}
+        self.assertEqual(set(rows), {1, 3})
+        self.assertEqual(rows[1]["text"], "hello world")
+        self.assertEqual(rows[1]["from"]["id"], USER_ID)
+        self.assertEqual((rows[3]["caption"], rows[3]["edit_date"]), ("photo", 1700000003))
+        self.assertEqual(Message.objects.get(bot_id=BOT_ID, message_id=3).reply_to_message_id, 1)
+
+    def test_desktop_peer_ids(self):
+        chat = {"id": 42, "type": "public_channel", "name": "News"}
+        data = desktop_message(chat, {"id": 1, "type": "message", "from_id": "channel42", "text": ""})
+
+        self.assertEqual(data["chat"], {"id": -10042, "type": "channel", "title": "News"})
+        self.assertEqual(data["sender_chat"]["id"], -10042)
+        self.assertNotIn("text", data)
+        group = desktop_message({"id": 5, "type": "private_group"}, {"id": 1, "type": "message"})
+        self.assertEqual(group["chat"]["id"], -5)
+
+    def test_keeps_cached_rows(self):
+        self.receive(message(1, text="cached"))
+        path = self.write_lines("updates.jsonl", [update(1, message(1, text="old")), update(2, message(2))])
+
+        HistoryImporter(BOT_ID).import_file(path)
+        self.assertEqual(self.texts(), {1: "cached", 2: "hi"})
+        HistoryImporter(BOT_ID, overwrite=True).import_file(path)
+        self.assertEqual(self.texts(), {1: "old", 2: "hi"})
+
+    def test_invalidates_cached_reads(self):
+        self.receive(message(1))
+        etag = self.call("getMessages", data={"chat_id": CHAT_ID})["ETag"]
+        HistoryImporter(BOT_ID).import_file(self.write_lines("updates.jsonl", [update(1, message(2))]))
+
+        response = self.call("getMessages", data={"chat_id": CHAT_ID}, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual([data["message_id"] for data in response.json()["result"]], [2, 1])
+
+    def test_resumes_from_the_checkpoint(self):
+        checkpoint = str(self.dir / "checkpoint")
+        path = self.write_lines("updates.jsonl", [update(i, message(i)) for i in range(1, 6)])
+        importer = HistoryImporter(BOT_ID, batch_size=2, checkpoint=checkpoint)
+        importer.import_file(path)
+        Message.objects.filter(message_id__gt=4).delete()
+        Message.objects.filter(message_id=1).delete()
+
+        # Only the items after the last written batch are read again
+        stats = HistoryImporter(BOT_ID, batch_size=2, checkpoint=checkpoint).import_file(path)
+        self.assertEqual((stats["items"], stats["skipped_items"]), (0, 5))
+        self.assertEqual(set(self.texts()), {2, 3, 4})
+
+        Path(path).write_text("".join(dumps(update(i, message(i))) + "\n" for i in range(1, 8)))
+        stats = HistoryImporter(BOT_ID, batch_size=2, checkpoint=checkpoint).import_file(path)
+        self.assertEqual((stats["items"], stats["skipped_items"]), (2, 5))
+        self.assertEqual(set(self.texts()), {2, 3, 4, 6, 7})
+
+    def test_command(self):
+        path = self.write_lines("updates.jsonl", [update(1, message(1))])
+        out = StringIO()
+        call_command("importhistory", BOT_ID, path, stdout=out)
+
+        self.assertIn("Imported 1 messages, 1 chats and 1 users from 1 items", out.getvalue())
+        with self.assertRaisesMessage(CommandError, "must be positive"):
+            call_command("importhistory", BOT_ID, path, "--batch-size", "0")
+        with self.assertRaisesMessage(CommandError, "failed"):
+            call_command("importhistory", BOT_ID, str(self.dir / "missing.json"), "--format", "updates")
+        with self.assertRaisesMessage(CommandError, "failed"):
+            call_command("importhistory", BOT_ID, self.write("broken.json", "[{\"update_id\": "))
+
+
+class StreamReaderTests(ProxyTestCase):
+    def test_values_across_chunks(self):
+        document = {"a": [1, 23456, "x" * 100, {"b": None}], "c": 1.5, "d": True}
+        reader = StreamReader(StringIO(dumps(document)), chunk_size=3)
+
+        values = {}
+        for key in reader.object_keys():
+            if key == "a":
+                values[key] = []
+                for _ in reader.array_items():
+                    values[key].append(reader.value())
+            else:
+                values[key] = reader.value()
+        self.assertEqual(values, document)
+        self.assertEqual(reader.peek(), "")
+
+    def test_invalid_documents(self):
+        with self.assertRaises(ValueError):
+            list(StreamReader(StringIO("{\"a\" 1}")).object_keys())
+        reader = StreamReader(StringIO("[1, 2"))
+        with self.assertRaises(ValueError):
+            for _ in reader.array_items():
+                reader.value()
+
+
+class ParallelImportTests(ProxyTransactionTestCase):
+    def message_indexes(self) -> set[str]:
+        with connection.cursor() as cursor:
+            constraints = connection.introspection.get_constraints(cursor, Message._meta.db_table)
+        return {index.name for index in Message._meta.indexes} & set(constraints)
+
+    def test_workers_and_deferred_indexes(self):
+        directory = self.enterContext(TemporaryDirectory())
+        path = Path(directory) / "updates.jsonl"
+        path.write_text("".join(dumps(update(i, message(i))) + "\n" for i in range(1, 2501)))
+        indexes = self.message_indexes()
+
+        with deferred_message_indexes(BOT_ID):
+            self.assertEqual(self.message_indexes(), set())
+            stats = HistoryImporter(BOT_ID, batch_size=1000, workers=2).import_file(str(path))
+        self.assertEqual(self.message_indexes(), indexes)
+        self.assertEqual((stats["items"], stats["messages"]), (2500, 2500))
+        self.assertEqual(Message.objects.filter(bot_id=BOT_ID).count(), 2500)
@@ -0,0 +1,109 @@
+import json
+from io import BytesIO
+from unittest import mock
+from urllib.parse import urlencode
+
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.test import SimpleTestCase, override_settings
+from pyrogram import raw
+from pyrogram.file_id import FileId, FileType
+
+from proxy.exceptions import BadRequestException
+from proxy.models import Message
+from proxy.mtproto import PyrogramBot, markdown_to_html
+from proxy.tests.base import ProxyTestCase, TOKEN, BOT_ID, CHAT_ID, message
+
+DOCUMENT_ID = FileId(file_type=FileType.DOCUMENT, dc_id=2, media_id=1, access_hash=2, file_reference=b"").encode()
+
+
+@override_settings(TG_API_ID=1, TG_API_HASH="hash")
+class SendMediaGroupTests(ProxyTestCase):
+    def send(self, media: list, files: dict = None, **params):
+        query = urlencode({"is_big": "true", "chat_id": CHAT_ID, "media": json.dumps(media), **params})
+        return self.client.post(f"/bot{TOKEN}/sendMediaGroup?{query}", files or {})
+
+    def test_uploads_attached_files_and_caches_messages(self):
+        sent = [{**message(10, media_group_id="1"), "raw_message": {"id": 10}},
+                {**message(11, media_group_id="1"), "raw_message": {"id": 11}}]
+        with mock.patch.object(PyrogramBot, "_upload_media_group", return_value=sent) as upload:
+            response = self.send([{"type": "photo", "media": "attach://first", "caption": "one"},
+                                  {"type": "document", "media": DOCUMENT_ID}],
+                                 {"first": SimpleUploadedFile("first.jpg", b"jpeg")}, with_raw="true")
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual([item["message_id"] for item in response.json()["result"]], [10, 11])
+        self.assertEqual(response.json()["raw"], [{"id": 10}, {"id": 11}])
+        args, media = upload.call_args.args
+        self.assertEqual(args["chat_id"], CHAT_ID)
+        self.assertIsInstance(media[0]["media"], BytesIO)
+        self.assertEqual(media[0]["media"].read(), b"jpeg")
+        self.assertIsInstance(media[1]["media"], raw.types.InputMediaDocument)
+        self.assertEqual(media[1]["media"].id.id, 1)
+        self.assertEqual(set(Message.objects.filter(bot_id=BOT_ID).values_list("message_id", flat=True)), {10, 11})
+        self.assertFalse(self.api.calls("sendMediaGroup"))
+
+    def test_rejects_invalid_groups(self):
+        cases = [
+            ([{"type": "photo", "media": "a"}], "wrong number of media items"),
+            ([{"type": "photo", "media": "a"}] * 11, "wrong number of media items"),
+            ([{"type": "sticker", "media": "a"}, {"type": "photo", "media": "b"}], "unsupported media type"),
+            ([{"type": "photo", "media": "attach://missing"}, {"type": "photo", "media": "b"}], "there is no photo"),
+            ([{"type": "photo", "media": "file-id"}, {"type": "photo", "media": "b"}], "wrong file identifier"),
+            ([{"type": "photo", "media": DOCUMENT_ID}, {"type": "document", "media": DOCUMENT_ID}],
+             "wrong file identifier"),
+            ([{"type": "document", "media": DOCUMENT_ID, "caption": "a.b", "parse_mode": "MarkdownV2"},
+              {"type": "document", "media": DOCUMENT_ID}], "Character '.' is reserved"),
+            ([{"type": "document", "media": DOCUMENT_ID, "parse_mode": "rst"},
+              {"type": "document", "media": DOCUMENT_ID}], "unsupported parse_mode"),
+        ]
+        with mock.patch.object(PyrogramBot, "_upload_media_group") as upload:
+            for media, error in cases:
+                with self.subTest(error=error, count=len(media)):
+                    response = self.send(media)
+                    self.assertEqual(response.status_code, 400)
+                    self.assertIn(error, response.json()["message"])
+            response = self.client.post(f"/bot{TOKEN}/sendMediaGroup?is_big=true&chat_id={CHAT_ID}&media=%5B")
+            self.assertIn("can't parse media", response.json()["message"])
+        upload.assert_not_called()
+
+    def test_converts_markdown_captions(self):
+        media = [{"type": "document", "media": DOCUMENT_ID, "caption": "*bold* \\.", "parse_mode": "MarkdownV2"},
+                 {"type": "document", "media": DOCUMENT_ID, "caption": "*a_b*", "parse_mode": "Markdown"},
+                 {"type": "document", "media": DOCUMENT_ID, "caption": "<b>", "parse_mode": "HTML"},
+                 {"type": "document", "media": DOCUMENT_ID, "caption": "*plain*"}]
+        with mock.patch.object(PyrogramBot, "_upload_media_group", return_value=[]) as upload:
+            self.assertEqual(self.send(media).status_code, 200)
+
+        self.assertEqual([(item["caption"], item["parse_mode"]) for item in upload.call_args.args[1]],
+                         [("<b>bold</b> .", "html"), ("<b>a_b</b>", "html"), ("<b>", "html"), ("*plain*", "")])
+
+    def test_small_groups_are_proxied(self):
+        self.api.responses["sendMediaGroup"] = {"ok": True, "result": [message(12), message(13)]}
+        with mock.patch.object(PyrogramBot, "_upload_media_group") as upload:
+            response = self.client.post(f"/bot{TOKEN}/sendMediaGroup?chat_id={CHAT_ID}")
+
+        self.assertEqual(response.status_code, 200)
+        upload.assert_not_called()
+        self.assertEqual(len(self.api.calls("sendMediaGroup")), 1)
+        self.assertEqual(Message.objects.filter(bot_id=BOT_ID).count(), 2)
+
+
+class MarkdownToHtmlTests(SimpleTestCase):
+    def test_markdown_v2(self):
+        self.assertEqual(
+            markdown_to_html("*b _bi_* __u__ ~s~ ||p|| \\(1\\) `a\\`<` [l](http://x.y/\\)) ![e](tg://emoji?id=5)", 2),
+            '<b>b <i>bi</i></b> <u>u</u> <s>s</s> <spoiler>p</spoiler> (1) <code>a`&lt;</code> '
+            '<a href="http://x.y/)">l</a> <emoji id="5">e</emoji>'
+        )
+        self.assertEqual(markdown_to_html("```python\nx = 1\n```", 2), '<pre language="python">x = 1\n</pre>')
+
+    def test_markdown(self):
+        self.assertEqual(markdown_to_html("*a_b* _i_ \\*. [l](http://x.y) ```x```", 1),
+                         '<b>a_b</b> <i>i</i> *. <a href="http://x.y">l</a> <pre>x</pre>')
+
+    def test_rejects_unparsable_entities(self):
+        for text, version, error in [("1.5", 2, "Character '.' is reserved"), ("*b", 2, "byte offset 0"),
+                                     ("é _i", 1, "byte offset 3"), ("[l] x", 2, "byte offset 0"),
+                                     ("![e](http://x.y)", 2, "tg://emoji")]:
+            with self.subTest(text=text), self.assertRaisesMessage(BadRequestException, error):
+                markdown_to_html(text, version)
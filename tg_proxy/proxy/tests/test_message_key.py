@@ -0,0 +1,45 @@
+from json import dumps
+
+from django.db import IntegrityError, connection, transaction
+
+from proxy.maintenance import cluster_messages
+from proxy.models import Message
+from proxy.tests.base import ProxyTestCase, BOT_ID, CHAT_ID, DATE, message
+
+
+class MessageKeyTests(ProxyTestCase):
+    def test_message_ids_are_per_chat(self):
+        self.receive(message(1, chat_id=CHAT_ID + 1, text="second chat", date=DATE + 1), message(1, text="first chat"))
+
+        self.assertEqual(Message.objects.filter(bot_id=BOT_ID, message_id=1).count(), 2)
+        response = self.call("getMessage", data={"chat_id": CHAT_ID, "message_id": 1})
+        self.assertEqual(response.json()["result"]["text"], "first chat")
+        # Without chat_id the newest message with the id is returned
+        response = self.call("getMessage", data={"message_id": 1})
+        self.assertEqual(response.json()["result"]["text"], "second chat")
+
+    def test_key_is_unique(self):
+        Message.objects.create(bot_id=BOT_ID, chat_id=CHAT_ID, message_id=1, serialized_message="{}")
+        with self.assertRaises(IntegrityError), transaction.atomic():
+            Message.objects.create(bot_id=BOT_ID, chat_id=CHAT_ID, message_id=1, serialized_message="{}")
+
+
+class ClusterMessagesTests(ProxyTestCase):
+    def test_rewrites_the_table_in_key_order(self):
+        keys = [(2, 5, 1), (1, 7, 3), (1, 5, 2), (2, 1, 9), (1, 5, 1)]
+        for bot_id, chat_id, message_id in keys:
+            Message.objects.create(bot_id=bot_id, chat_id=chat_id, message_id=message_id,
+                                   serialized_message=dumps(message(message_id, chat_id)))
+        with connection.cursor() as cursor:
+            cursor.execute("SELECT name FROM sqlite_master WHERE type = 'index' AND tbl_name = 'proxy_message'")
+            indexes = {row[0] for row in cursor.fetchall()}
+
+        self.assertEqual(cluster_messages(batch_size=2), len(keys))
+
+        self.assertEqual(list(Message.objects.order_by("id").values_list("bot_id", "chat_id", "message_id")),
+                         sorted(keys))
+        with connection.cursor() as cursor:
+            cursor.execute("SELECT name FROM sqlite_master WHERE type = 'index' AND tbl_name = 'proxy_message'")
+            self.assertEqual({row[0] for row in cursor.fetchall()}, indexes)
+        with self.assertRaises(IntegrityError), transaction.atomic():
+            Message.objects.create(bot_id=1, chat_id=5, message_id=1, serialized_message="{}")
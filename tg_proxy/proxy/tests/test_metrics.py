@@ -0,0 +1,75 @@
+from django.db import connections
+
+from proxy.db import Writer, observe_queries
+from proxy.metrics import Registry
+from proxy.tests.base import ProxyTestCase, CHAT_ID, counter, message
+
+
+class RegistryTests(ProxyTestCase):
+    def test_render(self):
+        metrics = Registry()
+        metrics.counter("requests_total", "Requests.")
+        metrics.histogram("latency_seconds", "Latency.", (0.1, 1))
+        metrics.inc("requests_total", method="getMe", status="200")
+        metrics.inc("requests_total", 2, method="getMe", status="200")
+        for value in (0.05, 0.5, 5):
+            metrics.observe("latency_seconds", value, method="getMe")
+
+        lines = metrics.render().splitlines()
+        self.assertIn("# TYPE requests_total counter", lines)
+        self.assertIn('requests_total{method="getMe",status="200"} 3', lines)
+        self.assertIn('latency_seconds_bucket{method="getMe",le="0.1"} 1', lines)
+        self.assertIn('latency_seconds_bucket{method="getMe",le="1"} 2', lines)
+        self.assertIn('latency_seconds_bucket{method="getMe",le="+Inf"} 3', lines)
+        self.assertIn('latency_seconds_count{method="getMe"} 3', lines)
+
+    def test_method_labels_are_bounded(self):
+        metrics = Registry()
+        for i in range(300):
+            metrics.method_label(f"method{i}")
+        self.assertEqual(metrics.method_label("method0"), "method0")
+        self.assertEqual(metrics.method_label("method299"), "other")
+
+
+class MetricsMiddlewareTests(ProxyTestCase):
+    def test_requests_are_counted(self):
+        requests = counter("tg_proxy_requests_total", method="getMessage", status="200")
+        hits = counter("tg_proxy_cache_requests_total", method="getMessage", result="hit")
+        misses = counter("tg_proxy_cache_requests_total", method="getMessage", result="miss")
+        queries = counter("tg_proxy_db_queries_total", method="getUpdates")
+        self.receive(message(1))
+
+        self.call("getMessage", data={"chat_id": CHAT_ID, "message_id": 1})
+        self.call("getMessage", data={"chat_id": CHAT_ID, "message_id": 2})
+
+        self.assertEqual(counter("tg_proxy_requests_total", method="getMessage", status="200"), requests + 1)
+        self.assertEqual(counter("tg_proxy_cache_requests_total", method="getMessage", result="hit"), hits + 1)
+        self.assertEqual(counter("tg_proxy_cache_requests_total", method="getMessage", result="miss"), misses + 1)
+        # The upserts of the cached update are counted to the request that wrote them
+        self.assertGreater(counter("tg_proxy_db_queries_total", method="getUpdates"), queries)
+
+    def test_metrics_endpoint(self):
+        self.call("getMe")
+        response = self.client.get("/metrics")
+
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response["Content-Type"].startswith("text/plain; version=0.0.4"))
+        self.assertIn('tg_proxy_requests_total{method="getMe",status="200"}', response.content.decode())
+        self.assertIn('tg_proxy_stage_duration_seconds_count{method="getMe",stage="upstream"}',
+                      response.content.decode())
+
+
+class QueryObserverTests(ProxyTestCase):
+    def test_writer_thread_queries_are_observed(self):
+        writer = Writer("default")
+        seen = []
+
+        def write():
+            with connections["default"].cursor() as cursor:
+                cursor.execute("SELECT 1")
+
+        with observe_queries(lambda sql, duration: seen.append(sql)):
+            writer.submit(write).result()
+        writer.submit(write).result()
+
+        self.assertEqual(seen.count("SELECT 1"), 1)
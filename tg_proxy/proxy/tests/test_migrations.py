@@ -0,0 +1,21 @@
+from proxy.tests.base import MigrationTestCase
+
+
+class ClusterMessagesMigrationTests(MigrationTestCase):
+    migrate_from = "0009_profiling"
+    migrate_to = "0011_cluster_messages"
+
+    def test_rekeys_and_clusters_messages(self):
+        Message = self.apps.get_model("proxy", "Message")
+        keys = [(1, 7, 3), (2, 5, 1), (1, 5, 2), (1, 6, 4)]
+        for bot_id, chat_id, message_id in keys:
+            Message.objects.create(bot_id=bot_id, chat_id=chat_id, message_id=message_id, serialized_message="{}")
+
+        self.migrate()
+
+        Message = self.apps.get_model("proxy", "Message")
+        self.assertEqual(list(Message.objects.order_by("id").values_list("bot_id", "chat_id", "message_id")),
+                         sorted(keys))
+        # The same message id in another chat of the bot was rejected by the old key
+        Message.objects.create(bot_id=1, chat_id=7, message_id=2, serialized_message="{}")
+
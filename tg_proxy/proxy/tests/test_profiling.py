@@ -0,0 +1,74 @@
+import marshal
+from json import loads
+
+from django.contrib.auth import get_user_model
+from django.test import override_settings
+
+from proxy.models import ProfilingSettings, RequestProfile
+from proxy.tests.base import ProxyTestCase, BOT_ID, CHAT_ID, message
+
+
+class ProfilingTests(ProxyTestCase):
+    def profile(self, **fields) -> None:
+        # The middleware reloads its settings every few seconds, a new client gets a new middleware
+        ProfilingSettings.objects.all().delete()
+        ProfilingSettings.objects.create(**{"enabled": True, "sample_rate": 1, "threshold_ms": 0, **fields})
+        self.client = self.client_class()
+
+    def test_captures_sampled_requests(self):
+        self.profile(method="getMessage")
+        self.receive(message(1))
+        self.call("getMessage", data={"chat_id": CHAT_ID, "message_id": 1})
+
+        profile = RequestProfile.objects.get()
+        self.assertEqual((profile.bot_id, profile.method), (BOT_ID, "getMessage"))
+        self.assertTrue(any("proxy_message" in query["sql"] for query in loads(profile.queries)))
+        self.assertEqual(set(loads(profile.samples)), {"interval", "frames", "samples"})
+
+    def test_skips_other_requests(self):
+        for fields in ({"enabled": False}, {"bot_id": BOT_ID + 1}, {"method": "getUpdates"}, {"sample_rate": 0},
+                       {"threshold_ms": 60000}):
+            with self.subTest(**fields):
+                self.profile(**fields)
+                self.call("getMe")
+                self.assertFalse(RequestProfile.objects.exists())
+
+    @override_settings(TG_PROFILING_BUFFER_SIZE=2)
+    def test_keeps_the_last_profiles(self):
+        self.profile()
+        for _ in range(3):
+            self.call("getMe")
+
+        self.assertEqual(RequestProfile.objects.count(), 2)
+
+
+class ProfileViewTests(ProxyTestCase):
+    def setUp(self) -> None:
+        super().setUp()
+        self.profile = RequestProfile.objects.create(
+            bot_id=BOT_ID, method="getMe", duration_ms=12.5, queries='[{"sql": "SELECT 1", "duration_ms": 1}]',
+            samples='{"interval": 0.001, "frames": [["views.py", 1, "view"], ["db.py", 2, "query"]], '
+                    '"samples": [[0, 1], [0, 1], [0]]}',
+        )
+
+    def test_requires_staff(self):
+        response = self.client.get(f"/profiles/{self.profile.id}.speedscope")
+        self.assertEqual(response.status_code, 302)
+
+    def test_formats(self):
+        self.client.force_login(get_user_model().objects.create_user("admin", is_staff=True))
+
+        speedscope = self.client.get(f"/profiles/{self.profile.id}.speedscope").json()
+        self.assertEqual(speedscope["profiles"][0]["samples"], [[0, 1], [0, 1], [0]])
+        self.assertEqual(speedscope["shared"]["frames"][1], {"name": "query", "file": "db.py", "line": 2})
+
+        stats = marshal.loads(self.client.get(f"/profiles/{self.profile.id}.pstats").content)
+        calls, _, total, cumulative, callers = stats[("views.py", 1, "view")]
+        self.assertEqual(calls, 3)
+        self.assertAlmostEqual(total, 0.001)
+        self.assertAlmostEqual(cumulative, 0.003)
+        self.assertEqual(stats[("db.py", 2, "query")][4][("views.py", 1, "view")][0], 2)
+
+        self.assertEqual(self.client.get(f"/profiles/{self.profile.id}.queries").json()[0]["sql"], "SELECT 1")
+        self.assertEqual(self.client.get(f"/profiles/{self.profile.id}.svg").status_code, 400)
+        self.assertEqual(self.client.get(f"/profiles/{self.profile.id + 1}.queries").status_code, 404)
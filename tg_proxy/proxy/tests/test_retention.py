@@ -0,0 +1,91 @@
+from time import time
+
+from django.test import override_settings
+
+from proxy.maintenance import apply_retention, compact, get_retention_policy
+from proxy.models import Message, CacheVersion, UndeliverableChat
+from proxy.tests.base import ProxyTestCase, BOT_ID, CHAT_ID, message
+
+GROUP_ID = -100
+
+
+def group_message(message_id: int, **fields) -> dict:
+    return message(message_id, chat_id=GROUP_ID, chat={"id": GROUP_ID, "type": "supergroup", "title": "Group"},
+                   **fields)
+
+
+class RetentionPolicyTests(ProxyTestCase):
+    @override_settings(TG_RETENTION={
+        "default": {"max_age_days": 30, "max_bytes": 1000},
+        "chat_types": {"private": {"max_age_days": 7, "max_messages_per_chat": 100}},
+        "bots": {BOT_ID: {"max_messages_per_chat": 10}},
+    })
+    def test_policies_are_merged(self):
+        self.assertEqual(get_retention_policy(BOT_ID + 1), {"max_age_days": 30, "max_bytes": 1000})
+        self.assertEqual(get_retention_policy(BOT_ID + 1, "private"),
+                         {"max_age_days": 7, "max_messages_per_chat": 100, "max_bytes": 1000})
+        self.assertEqual(get_retention_policy(BOT_ID, "private"),
+                         {"max_age_days": 7, "max_messages_per_chat": 10, "max_bytes": 1000})
+
+
+class ApplyRetentionTests(ProxyTestCase):
+    def message_ids(self, chat_id: int = CHAT_ID) -> list[int]:
+        return list(Message.objects.filter(bot_id=BOT_ID, chat_id=chat_id).order_by("message_id")
+                    .values_list("message_id", flat=True))
+
+    @override_settings(TG_RETENTION={"default": {"max_age_days": 7}})
+    def test_max_age(self):
+        now = int(time())
+        self.receive(message(1, date=now - 10 * 86400), message(2, date=now - 8 * 86400), message(3, date=now))
+        version = CacheVersion.current("default", BOT_ID, CHAT_ID)
+
+        self.assertEqual(apply_retention(pause=0)["max_age"], 2)
+        self.assertEqual(self.message_ids(), [3])
+        self.assertGreater(CacheVersion.current("default", BOT_ID, CHAT_ID), version)
+
+    @override_settings(TG_RETENTION={"default": {"max_messages_per_chat": 2},
+                                     "chat_types": {"supergroup": {"max_messages_per_chat": 1}}})
+    def test_max_messages_per_chat(self):
+        self.receive(*(message(i) for i in range(1, 5)), *(group_message(i) for i in range(1, 4)))
+
+        self.assertEqual(apply_retention(batch_size=1, pause=0)["max_messages_per_chat"], 4)
+        self.assertEqual(self.message_ids(), [3, 4])
+        self.assertEqual(self.message_ids(GROUP_ID), [3])
+
+    def test_max_bytes(self):
+        now = int(time())
+        self.receive(*(message(i, date=now - 10 + i, text="x" * 100) for i in range(1, 6)))
+        size = len(Message.objects.get(bot_id=BOT_ID, message_id=5).serialized_message)
+
+        with override_settings(TG_RETENTION={"bots": {BOT_ID: {"max_bytes": size * 2}}}):
+            self.assertEqual(apply_retention(batch_size=2, pause=0)["max_bytes"], 3)
+        self.assertEqual(self.message_ids(), [4, 5])
+
+    def test_without_policies_nothing_is_deleted(self):
+        self.receive(message(1, date=1))
+        self.assertEqual(apply_retention(pause=0), {"max_age": 0, "max_messages_per_chat": 0, "max_bytes": 0})
+        self.assertEqual(self.message_ids(), [1])
+
+
+class CompactTests(ProxyTestCase):
+    @override_settings(TG_RETENTION={"default": {"max_age_days": 7}})
+    def test_applies_retention(self):
+        self.receive(message(1, date=1))
+
+        result = compact(pause=0, vacuum=False)
+
+        self.assertEqual(result["deleted"]["max_age"], 1)
+        self.assertFalse(Message.objects.exists())
+        self.assertNotIn("reclaimed", result)
+
+    def test_expired_entries_are_deleted(self):
+        now = int(time())
+        UndeliverableChat.objects.create(bot_id=BOT_ID, chat_id=1, error_code=403, description="", date=now,
+                                         expires_at=now - 1)
+        UndeliverableChat.objects.create(bot_id=BOT_ID, chat_id=2, error_code=403, description="", date=now,
+                                         expires_at=now + 3600)
+
+        result = compact(pause=0, vacuum=False)
+
+        self.assertEqual(result["expired_undeliverable_chats"], 1)
+        self.assertEqual(list(UndeliverableChat.objects.values_list("chat_id", flat=True)), [2])
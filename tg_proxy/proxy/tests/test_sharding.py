@@ -0,0 +1,114 @@
+from unittest import mock, skipUnless
+
+from django.conf import settings
+from django.core.management import CommandError, call_command
+from django.test import override_settings
+
+from proxy.broadcasts import create_broadcast
+from proxy.maintenance import move_bot
+from proxy.models import BotShard, ChangeLog, Chat, Message, User
+from proxy.routers import ShardRouter, forget_placement, note_write, read_database, read_database_for_bot, \
+    shard_for_bot
+from proxy.tests.base import ProxyTestCase, TOKEN, BOT_ID, CHAT_ID, USER_ID, message
+
+
+class ShardPlacementTests(ProxyTestCase):
+    @override_settings(TG_SHARDS=["default", "shard_a", "shard_b"])
+    def test_new_bots_are_placed_by_hash(self):
+        self.assertEqual(shard_for_bot(3), "default")
+        self.assertEqual(shard_for_bot(4), "shard_a")
+        self.assertFalse(BotShard.objects.exists())
+        BotShard.objects.create(bot_id=4, database="shard_b")
+        self.assertEqual(shard_for_bot(4), "shard_b")
+
+    def test_placements_are_stored_and_cached(self):
+        self.assertEqual(shard_for_bot(BOT_ID, create=True), "default")
+        self.assertEqual(BotShard.objects.get(bot_id=BOT_ID).database, "default")
+
+        BotShard.objects.filter(bot_id=BOT_ID).update(database="elsewhere")
+        self.assertEqual(shard_for_bot(BOT_ID), "default")
+        forget_placement(BOT_ID)
+        self.assertEqual(shard_for_bot(BOT_ID), "elsewhere")
+
+    def test_router(self):
+        router = ShardRouter()
+        self.assertEqual(router.db_for_read(Message, instance=Message(bot_id=BOT_ID)), "default")
+        self.assertEqual(router.db_for_write(User), "default")
+        self.assertTrue(router.allow_migrate("default", "proxy", "message"))
+        self.assertTrue(router.allow_migrate("default", "admin"))
+        with override_settings(TG_SHARDS=["default", "shard_a"], TG_REPLICAS={"default": ["replica"]}):
+            self.assertTrue(router.allow_migrate("shard_a", "proxy", "message"))
+            self.assertTrue(router.allow_migrate("shard_a", "proxy", "changelog"))
+            self.assertFalse(router.allow_migrate("shard_a", "proxy", "user"))
+            self.assertFalse(router.allow_migrate("shard_a", "admin"))
+            self.assertFalse(router.allow_migrate("replica", "proxy", "message"))
+
+
+@override_settings(TG_REPLICAS={"default": ["replica_a", "replica_b"]}, TG_REPLICA_MAX_LAG=2.0)
+class ReplicaTests(ProxyTestCase):
+    def test_reads_go_to_replicas_that_keep_up(self):
+        lags = {"replica_a": 0.5, "replica_b": 10.0}
+        with mock.patch("proxy.routers.replica_lag", lags.get):
+            self.assertEqual({read_database("default") for _ in range(20)}, {"replica_a"})
+            lags["replica_a"] = 3.0
+            self.assertEqual(read_database("default"), "default")
+
+    def test_bots_read_their_own_writes(self):
+        with mock.patch("proxy.routers.replica_lag", return_value=0):
+            self.assertNotEqual(read_database_for_bot(BOT_ID), "default")
+            note_write(BOT_ID)
+            self.assertEqual(read_database_for_bot(BOT_ID), "default")
+            self.assertNotEqual(read_database("default", BOT_ID + 1), "default")
+
+
+@skipUnless(len(settings.TG_SHARDS) > 1, "needs a second shard, set SHARD_DATABASES")
+class ShardedBotTests(ProxyTestCase):
+    def setUp(self) -> None:
+        super().setUp()
+        self.shard = settings.TG_SHARDS[1]
+        BotShard.objects.create(bot_id=BOT_ID, database=self.shard)
+        # Patched away, every move would wait for the placement caches of other processes to expire
+        patcher = mock.patch("proxy.maintenance.sleep")
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_bot_data_is_written_to_its_shard(self):
+        self.receive(message(1))
+
+        self.assertEqual(Message.objects.using(self.shard).filter(bot_id=BOT_ID).count(), 1)
+        self.assertEqual(Chat.objects.using(self.shard).filter(bot_id=BOT_ID).count(), 1)
+        self.assertFalse(Message.objects.using("default").exists())
+        self.assertTrue(User.objects.using("default").filter(id=USER_ID).exists())
+        # Changes of unsharded users go to the change log of the bot's shard as well
+        self.assertEqual(set(ChangeLog.objects.using(self.shard).values_list("type", flat=True)),
+                         {"message", "chat", "user"})
+        self.assertFalse(ChangeLog.objects.using("default").exists())
+        response = self.call("getMessage", data={"chat_id": CHAT_ID, "message_id": 1})
+        self.assertEqual(response.json()["result"]["message_id"], 1)
+
+    def test_move_bot(self):
+        self.receive(message(1), message(2))
+        etag = self.call("getMessages", data={"chat_id": CHAT_ID})["ETag"]
+
+        stats = move_bot(BOT_ID, "default", batch_size=1)
+
+        self.assertEqual((stats["message"], stats["chat"]), (2, 1))
+        self.assertEqual(shard_for_bot(BOT_ID), "default")
+        self.assertEqual(BotShard.objects.get(bot_id=BOT_ID).database, "default")
+        for model in (Message, Chat, ChangeLog):
+            self.assertFalse(model.objects.using(self.shard).filter(bot_id=BOT_ID).exists())
+        response = self.call("getMessages", data={"chat_id": CHAT_ID}, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual([item["message_id"] for item in response.json()["result"]], [2, 1])
+        self.assertEqual(self.call("getChatStats", data={"chat_id": CHAT_ID}).json()["result"]["message_count"], 2)
+
+    def test_bots_with_running_broadcasts_are_not_moved(self):
+        create_broadcast(BOT_ID, TOKEN, "sendMessage", {"text": "hi"}, [CHAT_ID], False, 1, 1)
+
+        with self.assertRaises(ValueError):
+            move_bot(BOT_ID, "default")
+        with self.assertRaisesMessage(CommandError, "pending or running broadcasts"):
+            call_command("rebalancebot", BOT_ID, "default")
+        with self.assertRaisesMessage(CommandError, "Unknown shard"):
+            call_command("rebalancebot", BOT_ID, "missing")
+        self.assertEqual(shard_for_bot(BOT_ID), self.shard)
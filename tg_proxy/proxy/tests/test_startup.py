@@ -0,0 +1,55 @@
+import os
+import subprocess
+import sys
+from io import StringIO
+
+import httpx
+from django.conf import settings
+from django.core.management import CommandError, call_command
+
+from proxy.tests.base import ProxyTestCase
+from proxy.warmup import warm_up
+
+
+class ImportTimeTests(ProxyTestCase):
+    def test_views_do_not_import_pyrogram(self):
+        out = StringIO()
+        call_command("importtime", "--top", "1000", stdout=out)
+
+        packages = [line.split()[-1] for line in out.getvalue().splitlines()[1:-1]]
+        self.assertIn("proxy", packages)
+        self.assertIn("django", packages)
+        self.assertNotIn("pyrogram", packages)
+        self.assertNotIn("tgcrypto", packages)
+
+    def test_budget(self):
+        with self.assertRaisesMessage(CommandError, "above the budget"):
+            call_command("importtime", "--budget-ms", "0.001", stdout=StringIO())
+        with self.assertRaisesMessage(CommandError, "failed"):
+            call_command("importtime", "--module", "proxy.missing", stdout=StringIO())
+
+
+class MtprotoImportTests(ProxyTestCase):
+    def test_import_from_request_thread(self):
+        # A fresh interpreter, proxy.mtproto may be imported by other tests already
+        code = ("import threading, django; django.setup(); imported = []; "
+                "thread = threading.Thread(target=lambda: imported.append(__import__('proxy.mtproto'))); "
+                "thread.start(); thread.join(); assert imported")
+        result = subprocess.run([sys.executable, "-c", code], capture_output=True, text=True, cwd=settings.BASE_DIR,
+                                env={**os.environ, "DJANGO_SETTINGS_MODULE": "tg_proxy.settings"})
+        self.assertEqual(result.returncode, 0, result.stderr)
+        self.assertNotIn("RuntimeError", result.stderr)
+
+
+class WarmUpTests(ProxyTestCase):
+    def test_opens_connections(self):
+        self.assertEqual(set(warm_up()), {"imports", "databases", "upstream"})
+        self.assertEqual([request.method for request in self.api.requests], ["HEAD"])
+
+    def test_unreachable_server(self):
+        def fail(request):
+            raise httpx.ConnectError("connection refused")
+
+        self.api.responses[""] = fail
+        with self.assertLogs("proxy.warmup", "WARNING"):
+            warm_up()
@@ -0,0 +1,123 @@
+from io import StringIO
+from time import time
+
+from django.core.management import call_command
+from django.test import override_settings
+
+from proxy.archive import archive_messages
+from proxy.maintenance import apply_retention
+from proxy.models import ChatStats, ChatStatsDay, ChatStatsUser
+from proxy.stats import get_chat_stats, rebuild_chat_stats
+from proxy.tests.base import ProxyTestCase, BOT_ID, CHAT_ID, USER_ID, message
+
+NOW = int(time())
+YESTERDAY = NOW - 86400
+PHOTO = [{"file_id": "file", "file_unique_id": "unique", "width": 90, "height": 90}]
+
+
+def group_message(message_id: int, user_id: int, **fields) -> dict:
+    return message(message_id, chat_id=-100, chat={"id": -100, "type": "group", "title": "Group"}, user_id=user_id,
+                   **fields)
+
+
+class ChatStatsTests(ProxyTestCase):
+    def stats(self, chat_id: int = CHAT_ID, **params) -> dict:
+        response = self.call("getChatStats", data={"chat_id": chat_id, **params})
+        self.assertEqual(response.status_code, 200)
+        return response.json()["result"]
+
+    def test_counted_at_ingest(self):
+        self.receive(group_message(2, USER_ID, date=YESTERDAY), group_message(3, USER_ID + 1, date=NOW, photo=PHOTO))
+        self.receive(group_message(1, USER_ID + 2, date=YESTERDAY - 86400 * 40), group_message(4, USER_ID, date=NOW))
+
+        stats = self.stats(-100)
+        self.assertEqual({key: stats[key] for key in ("message_count", "media_count", "user_count",
+                                                      "first_message_id", "last_message_id", "last_date")},
+                         {"message_count": 4, "media_count": 1, "user_count": 3, "first_message_id": 1,
+                          "last_message_id": 4, "last_date": NOW})
+        # Users with a message in the last days, and the days themselves
+        self.assertEqual(stats["active_user_count"], 2)
+        self.assertEqual(stats["days"], [
+            {"date": YESTERDAY // 86400 * 86400, "message_count": 1, "media_count": 0},
+            {"date": NOW // 86400 * 86400, "message_count": 2, "media_count": 1},
+        ])
+        self.assertEqual(len(self.stats(-100, days=1000)["days"]), 3)
+        self.assertEqual(self.stats(-100, days=1)["active_user_count"], 2)
+
+    def test_rewritten_messages_are_counted_once(self):
+        self.receive(message(1, date=NOW), message(2, date=NOW))
+        self.receive(message(1, date=NOW), message(2, date=NOW, text="edited"))
+
+        stats = self.stats()
+        self.assertEqual((stats["message_count"], stats["user_count"]), (2, 1))
+        self.assertEqual(stats["days"][0]["message_count"], 2)
+
+    def test_chats_without_messages(self):
+        stats = self.stats(CHAT_ID + 1)
+        self.assertEqual((stats["message_count"], stats["active_user_count"], stats["days"]), (0, 0, []))
+        self.assertEqual(self.call("getChatStats").status_code, 400)
+
+    @override_settings(TG_RETENTION={"default": {"max_messages_per_chat": 2}})
+    def test_deleted_messages_are_forgotten(self):
+        self.receive(group_message(1, USER_ID + 1, date=YESTERDAY, photo=PHOTO), group_message(2, USER_ID, date=NOW),
+                     group_message(3, USER_ID, date=NOW))
+        apply_retention(pause=0)
+
+        stats = self.stats(-100)
+        self.assertEqual((stats["message_count"], stats["media_count"], stats["user_count"]), (2, 0, 1))
+        self.assertEqual((stats["first_message_id"], stats["first_date"]), (2, NOW))
+        self.assertEqual(stats["days"], [{"date": NOW // 86400 * 86400, "message_count": 2, "media_count": 0}])
+
+    @override_settings(TG_RETENTION={"default": {"max_age_days": 7}})
+    def test_chats_without_messages_left_are_removed(self):
+        self.receive(message(1, date=NOW - 86400 * 10))
+        apply_retention(pause=0)
+
+        for model in (ChatStats, ChatStatsDay, ChatStatsUser):
+            self.assertFalse(model.objects.exists())
+
+
+class RebuildTests(ProxyTestCase):
+    def setUp(self) -> None:
+        super().setUp()
+        self.use_archive()
+        self.receive(*(message(i, date=NOW - 86400 * (20 - i), user_id=USER_ID + i % 3) for i in range(1, 11)),
+                     group_message(1, USER_ID, date=NOW, photo=PHOTO))
+        self.expected = {chat_id: get_chat_stats("default", BOT_ID, chat_id, 30) for chat_id in (CHAT_ID, -100)}
+
+    def assertRebuilt(self) -> None:
+        for chat_id, stats in self.expected.items():
+            self.assertEqual(get_chat_stats("default", BOT_ID, chat_id, 30), stats)
+
+    def test_rebuild_matches_the_incremental_statistics(self):
+        for model in (ChatStats, ChatStatsDay, ChatStatsUser):
+            model.objects.all().delete()
+        ChatStats.objects.create(bot_id=BOT_ID, chat_id=CHAT_ID + 1, message_count=5, first_message_id=1,
+                                 first_date=0, last_message_id=5, last_date=0)
+
+        self.assertEqual(rebuild_chat_stats(BOT_ID, batch_size=3), {"chats": 2, "messages": 11})
+        self.assertRebuilt()
+        self.assertFalse(ChatStats.objects.filter(chat_id=CHAT_ID + 1).exists())
+
+    def test_archived_messages_are_counted(self):
+        archive_messages(14)
+        ChatStats.objects.filter(chat_id=CHAT_ID).update(message_count=0)
+
+        self.assertEqual(rebuild_chat_stats(BOT_ID, CHAT_ID, batch_size=4), {"chats": 1, "messages": 10})
+        self.assertRebuilt()
+
+    def test_messages_in_the_archive_and_the_database_are_counted_once(self):
+        archive_messages(14)
+        # Received again after it was archived
+        self.receive(message(1, date=NOW - 86400 * 19, user_id=USER_ID + 1))
+
+        self.assertEqual(rebuild_chat_stats(BOT_ID, CHAT_ID, batch_size=4), {"chats": 1, "messages": 10})
+        self.assertRebuilt()
+
+    def test_command(self):
+        ChatStats.objects.all().delete()
+        out = StringIO()
+        call_command("rebuildchatstats", BOT_ID, "--chat-id", -100, stdout=out)
+
+        self.assertIn("Rebuilt statistics of 1 chats from 1 messages", out.getvalue())
+        self.assertEqual(get_chat_stats("default", BOT_ID, -100, 30), self.expected[-100])
@@ -0,0 +1,52 @@
+from proxy.tests.base import ProxyTestCase, CHAT_ID, message
+
+
+def reply(message_id: int, parent: dict, **fields) -> dict:
+    return message(message_id, reply_to_message=parent, **fields)
+
+
+class ReplyTests(ProxyTestCase):
+    def setUp(self) -> None:
+        super().setUp()
+        # 1 <- 2 <- 3 <- 5, 1 <- 4
+        first = message(1)
+        second = reply(2, first)
+        third = reply(3, second)
+        self.receive(first, second, third, reply(4, first), reply(5, third), message(6))
+
+    def replies(self, message_id: int, **params) -> list[int]:
+        response = self.call("getReplies", data={"chat_id": CHAT_ID, "message_id": message_id, **params})
+        self.assertEqual(response.status_code, 200)
+        return [item["message_id"] for item in response.json()["result"]]
+
+    def test_reply_tree(self):
+        self.assertEqual(self.replies(1), [1, 2, 4, 3, 5])
+        self.assertEqual(self.replies(1, depth=1), [1, 2, 4])
+        self.assertEqual(self.replies(1, limit=2), [1, 2])
+        self.assertEqual(self.replies(3), [3, 5])
+        self.assertEqual(self.replies(6), [6])
+
+    def test_reply_chain(self):
+        self.assertEqual(self.replies(5, direction="chain"), [5, 3, 2, 1])
+        self.assertEqual(self.replies(5, direction="chain", depth=2), [5, 3, 2])
+        self.assertEqual(self.replies(9, direction="chain"), [])
+
+    def test_invalid_direction(self):
+        response = self.call("getReplies", data={"chat_id": CHAT_ID, "message_id": 1, "direction": "up"})
+        self.assertEqual(response.status_code, 400)
+
+
+class ThreadTests(ProxyTestCase):
+    def test_thread_includes_its_first_message(self):
+        self.receive(message(10, forum_topic_created={"name": "Topic", "icon_color": 0}),
+                     *(message(i, message_thread_id=10, is_topic_message=True) for i in (11, 12, 13)),
+                     message(14), message(15, message_thread_id=20))
+
+        def thread(**params) -> list[int]:
+            response = self.call("getThread", data={"chat_id": CHAT_ID, "message_thread_id": 10, **params})
+            return [item["message_id"] for item in response.json()["result"]]
+
+        self.assertEqual(thread(), [13, 12, 11, 10])
+        self.assertEqual(thread(limit=2), [13, 12])
+        self.assertEqual(thread(before=12), [11, 10])
+        self.assertEqual(thread(after=11), [13, 12])
@@ -0,0 +1,46 @@
+import httpx
+from django.test import override_settings
+
+from proxy.tests.base import ProxyTestCase, TOKEN, CHAT_ID
+
+
+class UpstreamTests(ProxyTestCase):
+    @override_settings(TG_API_URL="http://127.0.0.1:8081")
+    def test_requests_go_to_the_configured_server(self):
+        self.call("getMessage", data={"chat_id": CHAT_ID, "message_id": 1})
+        self.call("sendMessage", data={"chat_id": CHAT_ID, "text": "hi"})
+
+        self.assertEqual([str(request.url) for request in self.api.requests], [
+            f"http://127.0.0.1:8081/bot{TOKEN}/getMe",
+            f"http://127.0.0.1:8081/bot{TOKEN}/sendMessage?chat_id={CHAT_ID}&text=hi",
+        ])
+
+    def test_passes_requests_and_responses_through(self):
+        self.api.responses["sendMessage"] = {"_status": 400, "ok": False, "error_code": 400,
+                                             "description": "Bad Request: message text is empty"}
+        response = self.client.post(f"/bot{TOKEN}/sendMessage?chat_id={CHAT_ID}", b'{"text": ""}',
+                                    content_type="application/json", HTTP_USER_AGENT="bench")
+
+        request, = self.api.calls("sendMessage")
+        self.assertEqual(request.method, "POST")
+        self.assertEqual(request.content, b'{"text": ""}')
+        self.assertEqual(request.headers["user-agent"], "bench")
+        self.assertEqual(request.headers["content-type"], "application/json")
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(response.json()["description"], "Bad Request: message text is empty")
+
+    def test_errors(self):
+        self.assertEqual(self.client.put(f"/bot{TOKEN}/sendMessage").status_code, 405)
+
+        def fail(request):
+            raise httpx.ConnectError("connection refused")
+
+        self.api.responses["sendMessage"] = fail
+        response = self.call("sendMessage")
+        self.assertEqual(response.status_code, 500)
+        self.assertIn("connection refused", response.json()["description"])
+
+        self.api.responses["getMe"] = {"_status": 401, "ok": False, "error_code": 401, "description": "Unauthorized"}
+        response = self.call("getMessage", data={"chat_id": CHAT_ID, "message_id": 1})
+        self.assertEqual(response.status_code, 401)
+        self.assertEqual(response.json()["description"], "Telegram Bot Api server returned an error: Unauthorized")
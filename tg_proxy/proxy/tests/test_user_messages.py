@@ -0,0 +1,42 @@
+from proxy.tests.base import ProxyTestCase, CHAT_ID, USER_ID, DATE, message
+
+OTHER_CHAT_ID = CHAT_ID + 1
+OTHER_USER_ID = USER_ID + 1
+
+
+class UserMessagesTests(ProxyTestCase):
+    def setUp(self) -> None:
+        super().setUp()
+        self.receive(message(1, date=DATE), message(2, date=DATE + 1, user_id=OTHER_USER_ID),
+                     message(3, date=DATE + 2), message(1, chat_id=OTHER_CHAT_ID, date=DATE + 10),
+                     message(4, chat_id=OTHER_CHAT_ID, date=DATE + 20))
+
+    def user_messages(self, **params) -> dict:
+        response = self.call("getUserMessages", data={"user_id": USER_ID, **params})
+        self.assertEqual(response.status_code, 200)
+        result = response.json()["result"]
+        return {"messages": [(item["chat"]["id"], item["message_id"]) for item in result["messages"]],
+                "chats": result["chats"]}
+
+    def test_messages_and_activity(self):
+        result = self.user_messages()
+
+        self.assertEqual(result["messages"], [(OTHER_CHAT_ID, 4), (CHAT_ID, 3), (CHAT_ID, 1), (OTHER_CHAT_ID, 1)])
+        self.assertEqual(result["chats"], [
+            {"chat_id": OTHER_CHAT_ID, "message_count": 2, "first_message_id": 1, "last_message_id": 4,
+             "first_date": DATE + 10, "last_date": DATE + 20},
+            {"chat_id": CHAT_ID, "message_count": 2, "first_message_id": 1, "last_message_id": 3,
+             "first_date": DATE, "last_date": DATE + 2},
+        ])
+
+    def test_filters(self):
+        result = self.user_messages(chat_id=CHAT_ID)
+        self.assertEqual(result["messages"], [(CHAT_ID, 3), (CHAT_ID, 1)])
+        self.assertEqual([chat["chat_id"] for chat in result["chats"]], [CHAT_ID])
+
+        self.assertEqual(self.user_messages(before=4, after=1)["messages"], [(CHAT_ID, 3)])
+        self.assertEqual(self.user_messages(limit=1)["messages"], [(OTHER_CHAT_ID, 4)])
+        self.assertEqual(self.user_messages(user_id=OTHER_USER_ID)["messages"], [(CHAT_ID, 2)])
+
+    def test_user_id_is_required(self):
+        self.assertEqual(self.call("getUserMessages").status_code, 400)
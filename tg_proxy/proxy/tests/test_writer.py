@@ -0,0 +1,70 @@
+from concurrent.futures import ThreadPoolExecutor
+from threading import Event, current_thread
+
+from django.db import connection, transaction
+from django.test import TransactionTestCase, override_settings
+
+from proxy.db import Writer, configure_sqlite, serialized_write
+from proxy.models import Message
+from proxy.tests.base import BOT_ID, CHAT_ID
+
+
+class SqlitePragmaTests(TransactionTestCase):
+    @override_settings(TG_SQLITE_PRAGMAS={"synchronous": "OFF", "cache_size": -1234})
+    def test_pragmas_are_applied(self):
+        configure_sqlite(None, connection)
+        with connection.cursor() as cursor:
+            cursor.execute("PRAGMA synchronous")
+            self.assertEqual(cursor.fetchone()[0], 0)
+            cursor.execute("PRAGMA cache_size")
+            self.assertEqual(cursor.fetchone()[0], -1234)
+
+
+class WriterTests(TransactionTestCase):
+    def create(self, message_id: int):
+        def write():
+            Message.objects.create(bot_id=BOT_ID, chat_id=CHAT_ID, message_id=message_id, serialized_message="{}")
+            return current_thread().name
+        return write
+
+    @override_settings(TG_SERIALIZED_WRITES=True)
+    def test_writes_of_all_threads_run_on_the_writer(self):
+        with ThreadPoolExecutor(8) as executor:
+            threads = list(executor.map(lambda i: serialized_write(self.create(i)), range(32)))
+
+        self.assertEqual(set(threads), {"db-writer-default"})
+        self.assertEqual(Message.objects.count(), 32)
+
+    def test_failed_writes_do_not_roll_back_their_batch(self):
+        writer = Writer("default")
+        started, release = Event(), Event()
+
+        def block():
+            started.set()
+            release.wait()
+
+        def fail():
+            Message.objects.create(bot_id=BOT_ID, chat_id=CHAT_ID, message_id=2, serialized_message="{}")
+            raise ValueError("failed")
+
+        writer.submit(block)
+        started.wait()
+        # Queued while the writer is busy, so they are committed in one transaction
+        futures = [writer.submit(self.create(1)), writer.submit(fail), writer.submit(self.create(3))]
+        release.set()
+
+        self.assertEqual(futures[0].result(), "db-writer-default")
+        with self.assertRaisesMessage(ValueError, "failed"):
+            futures[1].result()
+        self.assertEqual(futures[2].result(), "db-writer-default")
+        self.assertEqual(sorted(Message.objects.values_list("message_id", flat=True)), [1, 3])
+
+    def test_runs_inline_in_transactions(self):
+        writer = Writer("default")
+        with transaction.atomic():
+            self.assertEqual(writer.run(self.create(1)), current_thread().name)
+        self.assertEqual(writer.run(self.create(2)), "db-writer-default")
+
+    @override_settings(TG_SERIALIZED_WRITES=False)
+    def test_can_be_disabled(self):
+        self.assertEqual(serialized_write(self.create(1)), current_thread().name)
@@ -27,8 +27,13 @@ from django.http import JsonResponse, HttpResponse
 from django.urls import path
 
 from proxy.exceptions import BaseProxyException
+from proxy.idempotency import idempotent
 from proxy.views import set_webhook_view, del_webhook_view, get_webhook_view, proxy_view, get_message_view, \
-    get_messages_view, get_chats_view, get_user_view
+    get_messages_view, get_chats_view, get_user_view, metrics_view, profile_view, export_messages_view, \
+    get_messages_batch_view, get_users_view, get_chats_by_id_view, get_thread_view, get_replies_view, \
+    get_user_messages_view, get_changes_view, get_undeliverable_chats_view, delete_undeliverable_chats_view, \
+    create_broadcast_view, get_broadcast_view, cancel_broadcast_view, get_chat_stats_view, \
+    get_message_history_view
 
 
 def handle_proxy_exception(view):
@@ -41,13 +46,35 @@ def handle_proxy_exception(view):
     return exc_handler
 
 
+BOT_API_VIEWS = {
+    "getMessage": get_message_view,
+    "getMessages": get_messages_view,
+    "getChats": get_chats_view,
+    "getUser": get_user_view,
+    "getMessagesBatch": get_messages_batch_view,
+    "getThread": get_thread_view,
+    "getReplies": get_replies_view,
+    "getUserMessages": get_user_messages_view,
+    "getChatStats": get_chat_stats_view,
+    "getMessageHistory": get_message_history_view,
+    "getUsers": get_users_view,
+    "getChatsById": get_chats_by_id_view,
+    "exportMessages": export_messages_view,
+    "getChanges": get_changes_view,
+    "getUndeliverableChats": get_undeliverable_chats_view,
+    "deleteUndeliverableChats": delete_undeliverable_chats_view,
+    "createBroadcast": create_broadcast_view,
+    "getBroadcast": get_broadcast_view,
+    "cancelBroadcast": cancel_broadcast_view,
+    "setWebhook": set_webhook_view,
+    "deleteWebhook": del_webhook_view,
+    "getWebhookInfo": get_webhook_view,
+}
+BOT_API_PROXY_VIEW = handle_proxy_exception(idempotent(proxy_view))
+
 urlpatterns = [
-    path("bot<str:bot_token>/getMessage", get_message_view),
-    path("bot<str:bot_token>/getMessages", get_messages_view),
-    path("bot<str:bot_token>/getChats", get_chats_view),
-    path("bot<str:bot_token>/getUser", get_user_view),
-    path("bot<str:bot_token>/setWebhook", set_webhook_view),
-    path("bot<str:bot_token>/deleteWebhook", del_webhook_view),
-    path("bot<str:bot_token>/getWebhookInfo", get_webhook_view),
-    path("bot<str:bot_token>/<str:method>", handle_proxy_exception(proxy_view)),
-]
\ No newline at end of file
+    path("metrics", metrics_view),
+    path("profiles/<int:profile_id>.<str:fmt>", profile_view),
+    *(path(f"bot<str:bot_token>/{method}", view) for method, view in BOT_API_VIEWS.items()),
+    path("bot<str:bot_token>/<str:method>", BOT_API_PROXY_VIEW),
+]
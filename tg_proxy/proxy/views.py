@@ -22,145 +22,568 @@ FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER
 DEALINGS IN THE SOFTWARE.
 """
 
-from json import JSONDecodeError, dumps, loads
+from hashlib import blake2b
+from json import loads
+from typing import Optional
 
-import httpx
 from django.conf import settings
-from django.http import HttpResponse, HttpRequest, JsonResponse
-from pydantic import ValidationError
+from django.contrib.admin.views.decorators import staff_member_required
+from django.db.models import Q
+from django.http import HttpResponse, HttpRequest, JsonResponse, StreamingHttpResponse
+from django.utils.cache import get_conditional_response, patch_vary_headers
 
 from . import pydantic_models
-from .models import Message, Chat, User
-from .pydantic_models import GetMessageParams, GetMessagesParams, GetChatsParams, GetUserParams
-from .utils import check_token, find_dict, PyrogramBot
+from .archive import archive
+from .broadcasts import create_broadcast, cancel_broadcast
+from .changes import check_cursor, load_changes
+from .delivery import SEND_METHOD_PREFIXES, request_chat_id, undeliverable_entry, undeliverable_response, \
+    record_send_error, clear_unblocked, delete_undeliverable
+from .compression import ENCODINGS, choose_encoding, decompress, json_response, json_list_response, \
+    parse_accept_encoding
+from .exceptions import ChangeLogTrimmedException
+from .export import export_messages, encode_ndjson
+from .history import get_message_history
+from .metrics import stage, cache_result, registry
+from .profiling import to_speedscope, to_pstats
+from .stats import get_chat_stats
+from .routers import GLOBAL_DATABASE, read_database, read_database_for_bot
+from .models import Message, Chat, User, RequestProfile, CacheVersion, UndeliverableChat, Broadcast
+from .params import GetMessageParams, GetMessagesParams, GetChatsParams, GetUserParams, GetMessagesBatchParams, \
+    GetUsersParams, GetChatsByIdParams, ExportMessagesParams, GetThreadParams, GetRepliesParams, GetUserMessagesParams, \
+    GetChangesParams, GetUndeliverableChatsParams, DeleteUndeliverableChatsParams, CreateBroadcastParams, \
+    BroadcastParams, GetChatStatsParams, GetMessageHistoryParams
+from .queries import get_replies, get_user_activity
+from .utils import check_token, find_dict, upstream, MTPROTO_METHODS, token_bot_id, invalid_token_response
+
+
+def _etag(request: HttpRequest, bot_id: int, version: int) -> str:
+    params = blake2b(f"{bot_id}?{'&'.join(sorted(request.GET.urlencode().split('&')))}".encode("utf8"),
+                     digest_size=8).hexdigest()
+    # Weak, compressed and uncompressed bodies share it
+    return f'W/"{version}-{params}"'
+
+
+def _not_modified(request: HttpRequest, etag: str) -> Optional[HttpResponse]:
+    if (response := get_conditional_response(request, etag=etag)) is not None:
+        response["ETag"] = etag
+        patch_vary_headers(response, ("Accept-Encoding",))
+    return response
 
 
 def get_message_view(request: HttpRequest, bot_token: str) -> HttpResponse:
     try:
-        args = GetMessageParams(**request.GET.dict())
-    except ValidationError:
+        args = GetMessageParams(request.GET)
+    except ValueError:
         return JsonResponse({"ok": False, "error_code": 400, "description": f"Bad Request: invalid parameters"}, status=400)
-    if (resp := check_token(bot_token)) is not None:
+    with stage("check_token"):
+        resp = check_token(bot_token)
+    if resp is not None:
         return resp
-    message = Message.objects.filter(message_id=args.message_id, bot_id=bot_token.split(":")[0]).first()
-    if message is None:
+    bot_id = int(bot_token.split(":")[0])
+    with stage("db_read"):
+        message = Message.objects.using(read_database_for_bot(bot_id)).filter(
+            message_id=args.message_id, bot_id=bot_id,
+            **{"chat_id": args.chat_id} if args.chat_id is not None else {}
+        ).order_by("-date", "-id").first()
+    cache_result(message is not None)
+    if message is not None:
+        return json_response(request, f'{{"ok": true, "result": {message.serialized_message}}}'.encode("utf8"))
+    # Without chat_id the archive would have to be searched chat by chat
+    serialized_message = None
+    if args.chat_id is not None:
+        with stage("archive_read"):
+            serialized_message = archive.get(bot_id, args.chat_id, args.message_id)
+    if serialized_message is None:
         return JsonResponse({"ok": False, "error_code": 400, "description": "Bad Request: message not found"},
                             status=404)
-    return JsonResponse({"ok": True, "result": loads(message.serialized_message)})
+    return json_response(request, f'{{"ok": true, "result": {serialized_message}}}'.encode("utf8"))
 
 
 def get_messages_view(request: HttpRequest, bot_token: str) -> HttpResponse:
     try:
-        args = GetMessagesParams(**request.GET.dict())
-    except ValidationError:
+        args = GetMessagesParams(request.GET)
+    except ValueError:
+        return JsonResponse({"ok": False, "error_code": 400, "description": f"Bad Request: invalid parameters"}, status=400)
+    with stage("check_token"):
+        resp = check_token(bot_token)
+    if resp is not None:
+        return resp
+    bot_id = int(bot_token.split(":")[0])
+    using = read_database_for_bot(bot_id)
+    # Read before the messages, a write in between can only make the ETag older than the body
+    with stage("version_read"):
+        etag = _etag(request, bot_id, CacheVersion.current(using, bot_id, args.chat_id))
+    if (response := _not_modified(request, etag)) is not None:
+        return response
+    messages = Message.objects.using(using).filter(
+        chat_id=args.chat_id, bot_id=bot_id, message_id__gt=args.after, message_id__lt=args.before
+    ).order_by("-message_id")[:args.limit]
+    with stage("db_read"):
+        messages = list(messages.values_list("message_id", "serialized_message"))
+    cache_result(bool(messages))
+    serialized_messages = [serialized_message for _, serialized_message in messages]
+    if len(messages) < args.limit:
+        # Archived messages are always older than the ones left in the hot table
+        with stage("archive_read"):
+            archived = archive.range(bot_id, args.chat_id, messages[-1][0] if messages else args.before, args.after,
+                                     args.limit - len(messages))
+        serialized_messages.extend(archived)
+    response = json_list_response(request, serialized_messages)
+    response["ETag"] = etag
+    return response
+
+
+def get_thread_view(request: HttpRequest, bot_token: str) -> HttpResponse:
+    try:
+        args = GetThreadParams(request.GET)
+    except ValueError:
         return JsonResponse({"ok": False, "error_code": 400, "description": f"Bad Request: invalid parameters"}, status=400)
-    if (resp := check_token(bot_token)) is not None:
+    with stage("check_token"):
+        resp = check_token(bot_token)
+    if resp is not None:
         return resp
-    messages = Message.objects.filter(
-        chat_id=args.chat_id, bot_id=bot_token.split(":")[0], message_id__gt=args.after, message_id__lt=args.before
+    bot_id = int(bot_token.split(":")[0])
+    # The message that created a forum topic is its first message, but does not have message_thread_id set
+    messages = Message.objects.using(read_database_for_bot(bot_id)).filter(
+        Q(message_thread_id=args.message_thread_id) | Q(message_id=args.message_thread_id),
+        bot_id=bot_id, chat_id=args.chat_id, message_id__gt=args.after, message_id__lt=args.before,
     ).order_by("-message_id")[:args.limit]
-    messages_json = [loads(message.serialized_message) for message in messages]
+    with stage("db_read"):
+        messages_json = [loads(serialized_message) for serialized_message in
+                         messages.values_list("serialized_message", flat=True)]
+    cache_result(bool(messages_json))
     return JsonResponse({"ok": True, "result": messages_json}, safe=False)
 
 
+def get_user_messages_view(request: HttpRequest, bot_token: str) -> HttpResponse:
+    try:
+        args = GetUserMessagesParams(request.GET)
+    except ValueError:
+        return JsonResponse({"ok": False, "error_code": 400, "description": f"Bad Request: invalid parameters"}, status=400)
+    with stage("check_token"):
+        resp = check_token(bot_token)
+    if resp is not None:
+        return resp
+    bot_id = int(bot_token.split(":")[0])
+    using = read_database_for_bot(bot_id)
+    messages = Message.objects.using(using).filter(
+        bot_id=bot_id, from_peer=args.user_id, message_id__gt=args.after, message_id__lt=args.before
+    )
+    if args.chat_id is not None:
+        messages = messages.filter(chat_id=args.chat_id)
+    messages = messages.order_by("-message_id", "chat_id")[:args.limit]
+    with stage("db_read"):
+        messages_json = [loads(serialized_message) for serialized_message in
+                         messages.values_list("serialized_message", flat=True)]
+        chats = get_user_activity(using, bot_id, args.user_id, args.chat_id)
+    cache_result(bool(messages_json))
+    return JsonResponse({"ok": True, "result": {"messages": messages_json, "chats": chats}})
+
+
+def get_message_history_view(request: HttpRequest, bot_token: str) -> HttpResponse:
+    try:
+        args = GetMessageHistoryParams(request.GET)
+    except ValueError:
+        return JsonResponse({"ok": False, "error_code": 400, "description": f"Bad Request: invalid parameters"}, status=400)
+    with stage("check_token"):
+        resp = check_token(bot_token)
+    if resp is not None:
+        return resp
+    bot_id = int(bot_token.split(":")[0])
+    with stage("db_read"):
+        versions = get_message_history(read_database_for_bot(bot_id), bot_id, args.chat_id, args.message_id,
+                                       args.after, args.limit, args.version)
+    cache_result(bool(versions))
+    if args.version is not None and not versions:
+        return JsonResponse({"ok": False, "error_code": 400, "description": "Bad Request: version not found"},
+                            status=404)
+    return JsonResponse({"ok": True, "result": versions})
+
+
+def get_chat_stats_view(request: HttpRequest, bot_token: str) -> HttpResponse:
+    try:
+        args = GetChatStatsParams(request.GET)
+    except ValueError:
+        return JsonResponse({"ok": False, "error_code": 400, "description": f"Bad Request: invalid parameters"}, status=400)
+    with stage("check_token"):
+        resp = check_token(bot_token)
+    if resp is not None:
+        return resp
+    bot_id = int(bot_token.split(":")[0])
+    with stage("db_read"):
+        result = get_chat_stats(read_database_for_bot(bot_id), bot_id, args.chat_id, args.days)
+    cache_result(result["message_count"] > 0)
+    return JsonResponse({"ok": True, "result": result})
+
+
+def get_changes_view(request: HttpRequest, bot_token: str) -> HttpResponse:
+    # Polling variant of the change feed, the streaming one is served by the ASGI application
+    try:
+        args = GetChangesParams(request.GET)
+    except ValueError:
+        return JsonResponse({"ok": False, "error_code": 400, "description": f"Bad Request: invalid parameters"}, status=400)
+    with stage("check_token"):
+        resp = check_token(bot_token)
+    if resp is not None:
+        return resp
+    bot_id = int(bot_token.split(":")[0])
+    with stage("db_read"):
+        try:
+            if args.after is not None:
+                check_cursor(bot_id, args.after)
+            changes = load_changes(bot_id, args.after or 0, args.chat_id, args.types, args.limit)
+        except ChangeLogTrimmedException as e:
+            return JsonResponse({"ok": False, "error_code": e.code, "description": e.message}, status=e.code)
+    cache_result(bool(changes))
+    return HttpResponse(f'{{"ok": true, "result": [{", ".join(change.to_json() for change in changes)}]}}',
+                        content_type="application/json")
+
+
+def get_replies_view(request: HttpRequest, bot_token: str) -> HttpResponse:
+    try:
+        args = GetRepliesParams(request.GET)
+    except ValueError:
+        return JsonResponse({"ok": False, "error_code": 400, "description": f"Bad Request: invalid parameters"}, status=400)
+    with stage("check_token"):
+        resp = check_token(bot_token)
+    if resp is not None:
+        return resp
+    bot_id = int(bot_token.split(":")[0])
+    with stage("db_read"):
+        messages = get_replies(read_database_for_bot(bot_id), bot_id, args.chat_id, args.message_id, args.direction,
+                               args.depth, args.limit)
+    cache_result(bool(messages))
+    return JsonResponse({"ok": True, "result": [loads(serialized_message) for serialized_message in messages]})
+
+
 def get_chats_view(request: HttpRequest, bot_token: str) -> HttpResponse:
     try:
-        args = GetChatsParams(**request.GET.dict())
-    except ValidationError:
+        args = GetChatsParams(request.GET)
+    except ValueError:
         return JsonResponse({"ok": False, "error_code": 400, "description": f"Bad Request: invalid parameters"}, status=400)
-    if (resp := check_token(bot_token)) is not None:
+    with stage("check_token"):
+        resp = check_token(bot_token)
+    if resp is not None:
         return resp
-    chats = Chat.objects.filter(
-        bot_id=bot_token.split(":")[0], id__gt=args.after, id__lt=args.before, **{"type": args.type} if args.type else {}
+    bot_id = int(bot_token.split(":")[0])
+    using = read_database_for_bot(bot_id)
+    with stage("version_read"):
+        etag = _etag(request, bot_id, CacheVersion.current(using, bot_id, CacheVersion.BOT_CHATS))
+    if (response := _not_modified(request, etag)) is not None:
+        return response
+    chats = Chat.objects.using(using).filter(
+        bot_id=bot_id, id__gt=args.after, id__lt=args.before, **{"type": args.type} if args.type else {}
     ).order_by("-id")[:args.limit]
-    chats_json = [loads(chat.serialized_chat) for chat in chats]
-    return JsonResponse({"ok": True, "result": chats_json}, safe=False)
+    with stage("db_read"):
+        serialized_chats = list(chats.values_list("serialized_chat", flat=True))
+    cache_result(bool(serialized_chats))
+    response = json_list_response(request, serialized_chats)
+    response["ETag"] = etag
+    return response
 
 
 def get_user_view(request: HttpRequest, bot_token: str) -> HttpResponse:
     try:
-        args = GetUserParams(**request.GET.dict())
-    except ValidationError:
+        args = GetUserParams(request.GET)
+    except ValueError:
+        return JsonResponse({"ok": False, "error_code": 400, "description": f"Bad Request: invalid parameters"}, status=400)
+    with stage("check_token"):
+        resp = check_token(bot_token)
+    if resp is not None:
+        return resp
+    with stage("db_read"):
+        user = User.objects.using(read_database(GLOBAL_DATABASE)).filter(id=args.user_id).first()
+    cache_result(user is not None)
+    return json_response(request, f'{{"ok": true, "result": {user.serialized_user if user is not None else "null"}}}'
+                         .encode("utf8"))
+
+
+def _request_data(request: HttpRequest) -> dict:
+    if request.method == "POST" and request.content_type == "application/json":
+        data = loads(request.body)
+        if not isinstance(data, dict):
+            raise ValueError("Expected a JSON object")
+        return data
+    return {**request.GET.dict(), **request.POST.dict()}
+
+
+def get_messages_batch_view(request: HttpRequest, bot_token: str) -> HttpResponse:
+    try:
+        args = GetMessagesBatchParams(_request_data(request))
+    except ValueError:
+        return JsonResponse({"ok": False, "error_code": 400, "description": f"Bad Request: invalid parameters"}, status=400)
+    with stage("check_token"):
+        resp = check_token(bot_token)
+    if resp is not None:
+        return resp
+    bot_id = int(bot_token.split(":")[0])
+    # One query for the cross product of the requested chats and message ids, the unneeded rows are dropped here
+    with stage("db_read"):
+        found = dict(((chat_id, message_id), serialized_message) for chat_id, message_id, serialized_message in
+                     Message.objects.using(read_database_for_bot(bot_id)).filter(
+                         bot_id=bot_id, chat_id__in={key[0] for key in args.messages},
+                         message_id__in={key[1] for key in args.messages},
+                     ).values_list("chat_id", "message_id", "serialized_message"))
+    cache_result(bool(found))
+    result = []
+    for chat_id, message_id in args.messages:
+        if (serialized_message := found.get((chat_id, message_id))) is None:
+            with stage("archive_read"):
+                serialized_message = archive.get(bot_id, chat_id, message_id)
+        result.append(loads(serialized_message) if serialized_message is not None else None)
+    return JsonResponse({"ok": True, "result": result})
+
+
+def get_users_view(request: HttpRequest, bot_token: str) -> HttpResponse:
+    try:
+        args = GetUsersParams(_request_data(request))
+    except ValueError:
+        return JsonResponse({"ok": False, "error_code": 400, "description": f"Bad Request: invalid parameters"}, status=400)
+    with stage("check_token"):
+        resp = check_token(bot_token)
+    if resp is not None:
+        return resp
+    with stage("db_read"):
+        found = dict(User.objects.using(read_database(GLOBAL_DATABASE)).filter(id__in=set(args.user_ids))
+                     .values_list("id", "serialized_user"))
+    cache_result(bool(found))
+    return JsonResponse({"ok": True, "result": [loads(found[user_id]) if user_id in found else None
+                                                for user_id in args.user_ids]})
+
+
+def get_chats_by_id_view(request: HttpRequest, bot_token: str) -> HttpResponse:
+    try:
+        args = GetChatsByIdParams(_request_data(request))
+    except ValueError:
         return JsonResponse({"ok": False, "error_code": 400, "description": f"Bad Request: invalid parameters"}, status=400)
-    if (resp := check_token(bot_token)) is not None:
+    with stage("check_token"):
+        resp = check_token(bot_token)
+    if resp is not None:
         return resp
-    user = User.objects.filter(id=args.user_id).first()
-    return JsonResponse({"ok": True, "result": loads(user.serialized_user) if user is not None else None}, safe=False)
+    bot_id = int(bot_token.split(":")[0])
+    with stage("db_read"):
+        found = dict(Chat.objects.using(read_database_for_bot(bot_id)).filter(bot_id=bot_id, id__in=set(args.chat_ids))
+                     .values_list("id", "serialized_chat"))
+    cache_result(bool(found))
+    return JsonResponse({"ok": True, "result": [loads(found[chat_id]) if chat_id in found else None
+                                                for chat_id in args.chat_ids]})
+
+
+def export_messages_view(request: HttpRequest, bot_token: str) -> HttpResponse:
+    try:
+        args = ExportMessagesParams(request.GET)
+    except ValueError:
+        return JsonResponse({"ok": False, "error_code": 400, "description": f"Bad Request: invalid parameters"}, status=400)
+    with stage("check_token"):
+        resp = check_token(bot_token)
+    if resp is not None:
+        return resp
+    bot_id = int(bot_token.split(":")[0])
+    encoding = choose_encoding(request.headers.get("Accept-Encoding", ""))
+    messages = export_messages(bot_id, args.chat_id, args.cursor, read_database_for_bot(bot_id))
+    response = StreamingHttpResponse(encode_ndjson(messages, encoding), content_type="application/x-ndjson")
+    response["Vary"] = "Accept-Encoding"
+    if encoding is not None:
+        response["Content-Encoding"] = encoding
+    return response
+
+
+def get_undeliverable_chats_view(request: HttpRequest, bot_token: str) -> HttpResponse:
+    try:
+        args = GetUndeliverableChatsParams(request.GET)
+    except ValueError:
+        return JsonResponse({"ok": False, "error_code": 400, "description": f"Bad Request: invalid parameters"}, status=400)
+    with stage("check_token"):
+        resp = check_token(bot_token)
+    if resp is not None:
+        return resp
+    bot_id = int(bot_token.split(":")[0])
+    entries = UndeliverableChat.objects.using(read_database_for_bot(bot_id)).filter(
+        bot_id=bot_id, **{"chat_id__gt": args.after} if args.after is not None else {}
+    ).order_by("chat_id")[:args.limit]
+    with stage("db_read"):
+        result = list(entries.values("chat_id", "error_code", "description", "date", "expires_at"))
+    return JsonResponse({"ok": True, "result": result})
+
+
+def delete_undeliverable_chats_view(request: HttpRequest, bot_token: str) -> HttpResponse:
+    try:
+        args = DeleteUndeliverableChatsParams(_request_data(request))
+    except ValueError:
+        return JsonResponse({"ok": False, "error_code": 400, "description": f"Bad Request: invalid parameters"}, status=400)
+    with stage("check_token"):
+        resp = check_token(bot_token)
+    if resp is not None:
+        return resp
+    return JsonResponse({"ok": True, "result": delete_undeliverable(int(bot_token.split(":")[0]), args.chat_ids)})
+
+
+def create_broadcast_view(request: HttpRequest, bot_token: str) -> HttpResponse:
+    try:
+        args = CreateBroadcastParams(_request_data(request))
+    except ValueError:
+        return JsonResponse({"ok": False, "error_code": 400, "description": f"Bad Request: invalid parameters"}, status=400)
+    with stage("check_token"):
+        resp = check_token(bot_token)
+    if resp is not None:
+        return resp
+    broadcast = create_broadcast(int(bot_token.split(":")[0]), bot_token, args.method, args.params, args.chat_ids,
+                                 args.all_private_chats, args.concurrency, args.rate)
+    return JsonResponse({"ok": True, "result": broadcast.to_json()})
+
+
+def get_broadcast_view(request: HttpRequest, bot_token: str) -> HttpResponse:
+    try:
+        args = BroadcastParams(request.GET)
+    except ValueError:
+        return JsonResponse({"ok": False, "error_code": 400, "description": f"Bad Request: invalid parameters"}, status=400)
+    with stage("check_token"):
+        resp = check_token(bot_token)
+    if resp is not None:
+        return resp
+    bot_id = int(bot_token.split(":")[0])
+    with stage("db_read"):
+        broadcast = Broadcast.objects.using(read_database_for_bot(bot_id)).filter(
+            id=args.broadcast_id, bot_id=bot_id
+        ).first()
+    if broadcast is None:
+        return JsonResponse({"ok": False, "error_code": 400, "description": "Bad Request: broadcast not found"},
+                            status=404)
+    return JsonResponse({"ok": True, "result": broadcast.to_json()})
+
+
+def cancel_broadcast_view(request: HttpRequest, bot_token: str) -> HttpResponse:
+    try:
+        args = BroadcastParams(_request_data(request))
+    except ValueError:
+        return JsonResponse({"ok": False, "error_code": 400, "description": f"Bad Request: invalid parameters"}, status=400)
+    with stage("check_token"):
+        resp = check_token(bot_token)
+    if resp is not None:
+        return resp
+    if (broadcast := cancel_broadcast(int(bot_token.split(":")[0]), args.broadcast_id)) is None:
+        return JsonResponse({"ok": False, "error_code": 400, "description": "Bad Request: broadcast not found"},
+                            status=404)
+    return JsonResponse({"ok": True, "result": broadcast.to_json()})
 
 
 def set_webhook_view(request: HttpRequest, bot_token: str) -> HttpResponse:
     return JsonResponse({"ok": False, "error_code": 501, "description": "This method is not implemented yet."}, status=501)
 
 
-def get_webhook_view(request: HttpRequest) -> HttpResponse:
+def get_webhook_view(request: HttpRequest, bot_token: str) -> HttpResponse:
     return JsonResponse({"ok": False, "error_code": 501, "description": "This method is not implemented yet."}, status=501)
 
 
-def del_webhook_view(request: HttpRequest) -> HttpResponse:
+def del_webhook_view(request: HttpRequest, bot_token: str) -> HttpResponse:
     return JsonResponse({"ok": False, "error_code": 501, "description": "This method is not implemented yet."}, status=501)
 
 
 def proxy_view(request: HttpRequest, bot_token: str, method: str) -> HttpResponse:
-    bot_id = int(bot_token.split(":")[0])
-    if method.startswith("send") and hasattr(PyrogramBot, method) and (api_id := getattr(settings, "TG_API_ID", None)) \
+    if (bot_id := token_bot_id(bot_token)) is None:
+        return invalid_token_response()
+    chat_id = request_chat_id(request) if method.startswith(SEND_METHOD_PREFIXES) else None
+    if chat_id is not None:
+        with stage("undeliverable_read"):
+            entry = undeliverable_entry(bot_id, chat_id)
+        if entry is not None:
+            # Answered without forwarding the call, so the token is checked first like the Bot API server would
+            with stage("check_token"):
+                resp = check_token(bot_token)
+            return resp if resp is not None else undeliverable_response(entry)
+    if method in MTPROTO_METHODS and (api_id := getattr(settings, "TG_API_ID", None)) \
             and (api_hash := getattr(settings, "TG_API_HASH", None)) and request.GET.get("is_big", "false") == "true":
+        from .mtproto import PyrogramBot
+
         bot = PyrogramBot(bot_token, api_id, api_hash)
         func = getattr(bot, method)
-        if message := func(request):
-            raw_message = message["raw_message"]
-            del message["raw_message"]
-            Message.update_or_create_objects("message_id", bot_id, [message], lambda d: {
-                "chat_id": d["chat"]["id"], "bot_id": bot_token.split(":")[0],
-                "message_thread_id": d.get("message_thread_id", None),
-                "reply_to_message_id": d.get("reply_to_message", {}).get("message_id"),
-                "from_peer": d.get("from", {}).get("id"), "serialized_message": dumps(d),
-            })
-            response = {"ok": True, "result": message}
+        with stage("pyrogram_upload"):
+            result = func(request)
+        if result:
+            messages = result if isinstance(result, list) else [result]
+            raw_messages = [message.pop("raw_message") for message in messages]
+            with stage("upsert_message"):
+                Message.update_or_create_objects("message_id", bot_id, messages,
+                                                 lambda d: Message.fields_from_dict(bot_id, d))
+            response = {"ok": True, "result": result}
             if request.GET.get("with_raw", "false") == "true":
-                response["raw"] = raw_message
+                response["raw"] = raw_messages if isinstance(result, list) else raw_messages[0]
             return JsonResponse(response)
 
+    if request.method not in ("GET", "POST"):
+        return JsonResponse({"ok": False, "error_code": 405, "description": f"Method {request.method} is not allowed."}, status=405)
     headers = {}
     for header in ("User-Agent", "Content-Type", "Accept"):
         if header in request.headers:
             headers[header] = request.headers[header]
+    # The response is passed through compressed as it is, if the client accepts an encoding that can be decoded here
+    accepted = parse_accept_encoding(request.headers.get("Accept-Encoding", ""))
+    headers["Accept-Encoding"] = ", ".join(encoding for encoding in ENCODINGS if accepted.get(encoding, 0) > 0) \
+        or "identity"
     try:
-        if request.method == "GET":
-            resp = httpx.get(f"https://api.telegram.org/bot{bot_token}/{method}", params=request.GET,
-                             headers=headers)
-        elif request.method == "POST":
-            resp = httpx.post(f"https://api.telegram.org/bot{bot_token}/{method}", params=request.GET, data=request.body,
-                              headers=headers)
-        else:
-            return JsonResponse({"ok": False, "error_code": 405, "description": f"Method {request.method} is not allowed."}, status=405)
+        with stage("upstream"):
+            with upstream.stream(request.method, f"{settings.TG_API_URL}/bot{bot_token}/{method}",
+                                 params=request.GET, content=request.body if request.method == "POST" else None,
+                                 headers=headers) as resp:
+                body = b"".join(resp.iter_raw())
     except Exception as e:
         return JsonResponse({"ok": False, "error_code": 500, "description": f"Failed to make request to origin server: {e}"}, status=500)
 
     headers = dict(resp.headers)
     found = {}
+    data = None
     try:
-        find_dict(resp.json(), found, pydantic_models.Message, pydantic_models.Chat, pydantic_models.User)
-    except JSONDecodeError:
+        with stage("find_dict"):
+            content_encoding = headers.get("content-encoding", "identity").lower()
+            content = body if content_encoding == "identity" else decompress(body, content_encoding)
+            data = loads(content)
+            find_dict(data, found, pydantic_models.Message, pydantic_models.Chat, pydantic_models.User)
+    except ValueError:
         pass
+    if chat_id is not None and resp.status_code in (400, 403):
+        record_send_error(bot_id, chat_id, method, data)
+    elif method == "getUpdates":
+        clear_unblocked(bot_id, data)
     for model, dicts in found.items():
+        if not dicts:
+            continue
         if model is pydantic_models.Message:
-            Message.update_or_create_objects("message_id", bot_id, dicts, lambda d: {
-                "chat_id": d["chat"]["id"], "bot_id": bot_id,
-                "message_thread_id": d.get("message_thread_id", None),
-                "reply_to_message_id": d.get("reply_to_message", {}).get("message_id"),
-                "from_peer": d.get("from", {}).get("id"), "serialized_message": dumps(d),
-            })
+            with stage("upsert_message"):
+                Message.update_or_create_objects("message_id", bot_id, dicts,
+                                                 lambda d: Message.fields_from_dict(bot_id, d))
         elif model is pydantic_models.Chat:
-            Chat.update_or_create_objects("id", bot_id, dicts, lambda d: {
-                "bot_id": bot_id, "type": d["type"], "serialized_chat": dumps(d),
-            })
+            with stage("upsert_chat"):
+                Chat.update_or_create_objects("id", bot_id, dicts, lambda d: Chat.fields_from_dict(bot_id, d))
         elif model is pydantic_models.User:
-            User.update_or_create_objects("id", bot_id, dicts, lambda d: {
-                "username": d.get("username", None), "first_name": d["first_name"],
-                "last_name": d.get("last_name", None), "serialized_user": dumps(d),
-            })
+            with stage("upsert_user"):
+                User.update_or_create_objects("id", bot_id, dicts, lambda d: User.fields_from_dict(bot_id, d))
 
     for hbh_header in ("connection", "keep-alive", "proxy-authenticate", "proxy-authorization", "te", "trailers",
                        "transfer-encoding", "upgrade"):  # Remove hop-by-hop headers
         if hbh_header in headers: del headers[hbh_header]
-    return HttpResponse(resp.content, status=resp.status_code, headers=headers)
+    return HttpResponse(body, status=resp.status_code, headers=headers)
+
+
+def metrics_view(request: HttpRequest) -> HttpResponse:
+    return HttpResponse(registry.render(), content_type="text/plain; version=0.0.4; charset=utf-8")
+
+
+@staff_member_required
+def profile_view(request: HttpRequest, profile_id: int, fmt: str) -> HttpResponse:
+    profile = RequestProfile.objects.filter(id=profile_id).first()
+    if profile is None:
+        return JsonResponse({"ok": False, "error_code": 404, "description": "Not Found: profile not found"},
+                            status=404)
+    filename = f"profile-{profile.id}-{profile.method}"
+    if fmt == "speedscope":
+        response = JsonResponse(to_speedscope(profile))
+        response["Content-Disposition"] = f'attachment; filename="{filename}.speedscope.json"'
+    elif fmt == "pstats":
+        response = HttpResponse(to_pstats(profile), content_type="application/octet-stream")
+        response["Content-Disposition"] = f'attachment; filename="{filename}.pstats"'
+    elif fmt == "queries":
+        response = HttpResponse(profile.queries, content_type="application/json")
+    else:
+        return JsonResponse({"ok": False, "error_code": 400, "description": "Bad Request: unknown profile format"},
+                            status=400)
+    return response
@@ -0,0 +1,62 @@
+"""
+The MIT License (MIT)
+
+Copyright (c) 2023-present RuslanUC
+
+Permission is hereby granted, free of charge, to any person obtaining a
+copy of this software and associated documentation files (the "Software"),
+to deal in the Software without restriction, including without limitation
+the rights to use, copy, modify, merge, publish, distribute, sublicense,
+and/or sell copies of the Software, and to permit persons to whom the
+Software is furnished to do so, subject to the following conditions:
+
+The above copyright notice and this permission notice shall be included in
+all copies or substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS
+OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING
+FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER
+DEALINGS IN THE SOFTWARE.
+"""
+
+import logging
+from importlib import import_module
+from time import perf_counter
+
+import httpx
+from django.conf import settings
+from django.db import connections, DatabaseError
+
+from proxy.utils import upstream
+
+log = logging.getLogger(__name__)
+
+
+def warm_up() -> dict[str, float]:
+    # Loads everything the first request would and opens database connections (of this thread) and a connection
+    # to the Bot API server, so the first requests of a new worker are not slower than the rest.
+    timings = {}
+    start = perf_counter()
+    import_module(settings.ROOT_URLCONF)
+    timings["imports"] = perf_counter() - start
+
+    start = perf_counter()
+    for alias in connections:
+        try:
+            connections[alias].ensure_connection()
+        except DatabaseError:
+            log.warning("Could not connect to database %r during warm-up", alias, exc_info=True)
+    timings["databases"] = perf_counter() - start
+
+    start = perf_counter()
+    try:
+        upstream.head(settings.TG_API_URL)
+    except httpx.HTTPError:
+        log.warning("Could not connect to %s during warm-up", settings.TG_API_URL, exc_info=True)
+    timings["upstream"] = perf_counter() - start
+
+    log.info("Warm-up finished: %s", ", ".join(f"{name} {seconds * 1000:.0f}ms" for name, seconds in timings.items()))
+    return timings
@@ -13,4 +13,19 @@ from django.core.asgi import get_asgi_application
 
 os.environ.setdefault("DJANGO_SETTINGS_MODULE", "tg_proxy.settings")
 
-application = get_asgi_application()
+django_application = get_asgi_application()
+
+from django.conf import settings  # noqa: E402
+from proxy.asgi import ChangeFeedApplication  # noqa: E402 (needs the apps loaded)
+
+if getattr(settings, "TG_WARMUP", False):
+    from proxy.warmup import warm_up
+
+    warm_up()
+
+if getattr(settings, "TG_BROADCASTS", False):
+    from proxy.broadcasts import broadcast_scheduler
+
+    broadcast_scheduler.start()
+
+application = ChangeFeedApplication(django_application)
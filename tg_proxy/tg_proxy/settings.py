@@ -23,9 +23,10 @@ BASE_DIR = Path(__file__).resolve().parent.parent
 SECRET_KEY = environ.get("SECRET_KEY") or "django-insecure-_zcn0-iz_mhxxec!jo^_cre*bo9+d-@t43o7!or#jhl0c!6j^1"
 
 # SECURITY WARNING: don't run with debug turned on in production!
-DEBUG = True
+# Debug mode keeps every executed query in connection.queries, development opts in with DEBUG=true
+DEBUG = environ.get("DEBUG", "false").lower() in ("1", "true", "yes")
 
-ALLOWED_HOSTS = []
+ALLOWED_HOSTS = [host for host in environ.get("ALLOWED_HOSTS", "localhost,127.0.0.1,[::1]").split(",") if host]
 
 
 # Application definition
@@ -41,6 +42,9 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    "proxy.metrics.MetricsMiddleware",
+    "proxy.profiling.ProfilingMiddleware",
+    "proxy.dispatch.BotApiDispatcherMiddleware",
     "django.middleware.security.SecurityMiddleware",
     "django.contrib.sessions.middleware.SessionMiddleware",
     "django.middleware.common.CommonMiddleware",
@@ -76,9 +80,26 @@ WSGI_APPLICATION = "tg_proxy.wsgi.application"
 DATABASES = {
     "default": {
         "ENGINE": "django.db.backends.sqlite3",
-        "NAME": BASE_DIR / "db.sqlite3",
+        "NAME": environ.get("DATABASE_PATH") or BASE_DIR / "db.sqlite3",
+        "CONN_MAX_AGE": int(environ.get("CONN_MAX_AGE", 600)),
+        "CONN_HEALTH_CHECKS": True,
     }
 }
+DATABASE_ROUTERS = ["proxy.routers.ShardRouter"]
+
+# Cached data of every bot lives on one of TG_SHARDS, the shard is picked when a bot is first seen and can be changed
+# with the "rebalancebot" command. Users, shard placements and Django's own tables always live in "default".
+# SHARD_DATABASES adds SQLite shards, other database configurations can be added to DATABASES and TG_SHARDS here.
+TG_SHARDS = ["default"]
+for _i, _path in enumerate(path for path in environ.get("SHARD_DATABASES", "").split(",") if path):
+    DATABASES[f"shard{_i + 1}"] = {**DATABASES["default"], "NAME": _path}
+    TG_SHARDS.append(f"shard{_i + 1}")
+TG_SHARD_CACHE_TTL = 5
+# Read replicas of databases, e.g. {"default": ["default_replica"]}. Replicas lagging by more than TG_REPLICA_MAX_LAG
+# seconds are skipped, and bots written to by this process in the last TG_REPLICA_MAX_LAG seconds are read from the
+# primary.
+TG_REPLICAS = {}
+TG_REPLICA_MAX_LAG = 2.0
 
 
 # Password validation
@@ -125,3 +146,75 @@ DEFAULT_AUTO_FIELD = "django.db.models.BigAutoField"
 DATA_UPLOAD_MAX_MEMORY_SIZE = 101 * 1024 * 1024
 TG_API_ID = int(environ.get("API_ID", 0)) or None
 TG_API_HASH = environ.get("API_HASH", None)
+TG_API_URL = environ.get("API_URL", "https://api.telegram.org").rstrip("/")
+
+# Message retention, policies are merged in order: "default", then by chat type, then by bot id. Supported keys are
+# "max_age_days", "max_messages_per_chat" and "max_bytes" (per bot, only from "default" and "bots").
+TG_RETENTION = {
+    "default": {},
+    "chat_types": {},
+    "bots": {},
+}
+# Applied to every new SQLite connection. WAL lets readers run concurrently with the writer, the other values trade
+# durability of the last transactions on power loss (not on process crash) and memory for throughput.
+TG_SQLITE_PRAGMAS = {
+    "journal_mode": "WAL",
+    "synchronous": "NORMAL",
+    "busy_timeout": 5000,
+    "cache_size": -64 * 1024,
+    "mmap_size": 256 * 1024 * 1024,
+    "temp_store": "MEMORY",
+}
+# Import the views and open database and Bot API server connections when a worker loads the application, before it
+# accepts requests.
+TG_WARMUP = environ.get("WARMUP", "false").lower() in ("1", "true", "yes")
+# Run all cache writes of a process on one writer thread, batching concurrent writes into one transaction.
+TG_SERIALIZED_WRITES = environ.get("SERIALIZED_WRITES", "true").lower() in ("1", "true", "yes")
+# Rows with unchanged content are not written, digests of recently written rows are kept in memory per process (and
+# are not invalidated by writes of other tools, such as "importhistory --overwrite").
+TG_DIGEST_CACHE_SIZE = 100000
+
+# Messages older than TG_ARCHIVE_AFTER_DAYS are moved out of the database into compressed segment files
+# in TG_ARCHIVE_DIR by the compaction job or the "archivemessages" command. Segments of the last
+# TG_ARCHIVE_OPEN_CHATS chats read are kept mapped.
+TG_ARCHIVE_DIR = environ.get("ARCHIVE_DIR") or BASE_DIR / "archive"
+TG_ARCHIVE_AFTER_DAYS = int(environ.get("ARCHIVE_AFTER_DAYS", 0)) or None
+TG_ARCHIVE_OPEN_CHATS = 1024
+TG_COMPACTION_INTERVAL = int(environ.get("COMPACTION_INTERVAL", 0)) or None
+
+# Written users, chats and messages are appended to a change log of their shard keeping the last TG_CHANGE_LOG_SIZE
+# entries (0 disables it) for getChanges. Every process keeps the last TG_CHANGE_FEED_BUFFER_SIZE entries in memory
+# while anyone is subscribed and polls the log for writes of other processes every TG_CHANGE_FEED_POLL_INTERVAL
+# seconds. Changes after a sequence number that is not committed yet are held back for up to
+# TG_CHANGE_LOG_COMMIT_WINDOW seconds, so changes committed out of order are not skipped.
+TG_CHANGE_LOG_SIZE = int(environ.get("CHANGE_LOG_SIZE", 100000))
+TG_CHANGE_LOG_COMMIT_WINDOW = 5
+TG_CHANGE_FEED_BUFFER_SIZE = 10000
+TG_CHANGE_FEED_POLL_INTERVAL = 1.0
+
+# Sends to chats the Bot API reported as blocked, deleted or left are answered with the same error for
+# TG_UNDELIVERABLE_TTL seconds (0 disables it), or until a my_chat_member update shows the bot is back.
+TG_UNDELIVERABLE_TTL = int(environ.get("UNDELIVERABLE_TTL", 86400))
+
+# Responses of proxied methods called with an Idempotency-Key are stored for TG_IDEMPOTENCY_TTL seconds (0 disables
+# it) and replayed to retries with the same key. Retries arriving while the first request is running wait for it up to
+# TG_IDEMPOTENCY_WAIT seconds, a request that did not finish in TG_IDEMPOTENCY_LOCK seconds is considered dead.
+TG_IDEMPOTENCY_TTL = int(environ.get("IDEMPOTENCY_TTL", 86400))
+TG_IDEMPOTENCY_WAIT = 60
+TG_IDEMPOTENCY_LOCK = 600
+
+# Broadcasts are sent by a scheduler thread of every server process (unless BROADCASTS is false) or of the
+# "runbroadcasts" command. The process sending a broadcast holds a lease on it and renews it every third of
+# TG_BROADCAST_LEASE seconds, another one resumes the broadcast when the lease was not renewed for TG_BROADCAST_LEASE
+# seconds. Sent targets of broadcasts finished more than TG_BROADCAST_KEEP_DAYS ago are deleted by compaction.
+TG_BROADCASTS = environ.get("BROADCASTS", "true").lower() in ("1", "true", "yes")
+TG_BROADCAST_LEASE = 120
+TG_BROADCAST_POLL_INTERVAL = 5
+TG_BROADCAST_MAX_CONCURRENCY = 32
+TG_BROADCAST_MAX_RATE = 30
+TG_BROADCAST_KEEP_DAYS = 7
+
+# getMessage/getUser bodies of at least TG_COMPRESSION_MIN_SIZE bytes are compressed once per encoding and kept in a
+# TG_COMPRESSED_CACHE_SIZE bytes LRU per process, getMessages/getChats pages are compressed while being sent.
+TG_COMPRESSION_MIN_SIZE = 512
+TG_COMPRESSED_CACHE_SIZE = 32 * 1024 * 1024
@@ -14,3 +14,15 @@ from django.core.wsgi import get_wsgi_application
 os.environ.setdefault("DJANGO_SETTINGS_MODULE", "tg_proxy.settings")
 
 application = get_wsgi_application()
+
+from django.conf import settings  # noqa: E402
+
+if getattr(settings, "TG_WARMUP", False):
+    from proxy.warmup import warm_up
+
+    warm_up()
+
+if getattr(settings, "TG_BROADCASTS", False):
+    from proxy.broadcasts import broadcast_scheduler
+
+    broadcast_scheduler.start()